@@ -0,0 +1,30 @@
+# alembic/script.py.mako
+"""Add document versions and chunk manifests
+
+Revision ID: 4e9a7c2b5d61
+Revises: d17e5b3a9f28
+Create Date: 2026-10-17 09:41:12.318520
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '4e9a7c2b5d61'
+down_revision: Union[str, None] = 'd17e5b3a9f28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('documents', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('documents', sa.Column('chunks_json', sa.Text(), nullable=True))
+    op.add_column('documents', sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('documents', 'updated_at')
+    op.drop_column('documents', 'chunks_json')
+    op.drop_column('documents', 'version')
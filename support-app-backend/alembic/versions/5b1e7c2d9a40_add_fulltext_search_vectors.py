@@ -0,0 +1,51 @@
+# alembic/script.py.mako
+"""Add full-text search vectors to tickets and KB articles
+
+Revision ID: 5b1e7c2d9a40
+Revises: 3982b8d89036
+Create Date: 2026-10-16 19:40:12.118503
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1e7c2d9a40'
+down_revision: Union[str, None] = '3982b8d89036'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TICKETS_SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(subject, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+KBARTICLES_SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(summary, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(content, '')), 'C')"
+)
+
+
+def upgrade() -> None:
+    op.add_column('tickets', sa.Column(
+        'search_vector', postgresql.TSVECTOR(),
+        sa.Computed(TICKETS_SEARCH_VECTOR, persisted=True), nullable=True
+    ))
+    op.create_index('ix_tickets_search_vector', 'tickets', ['search_vector'], unique=False, postgresql_using='gin')
+    op.add_column('kbarticles', sa.Column(
+        'search_vector', postgresql.TSVECTOR(),
+        sa.Computed(KBARTICLES_SEARCH_VECTOR, persisted=True), nullable=True
+    ))
+    op.create_index('ix_kbarticles_search_vector', 'kbarticles', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_kbarticles_search_vector', table_name='kbarticles', postgresql_using='gin')
+    op.drop_column('kbarticles', 'search_vector')
+    op.drop_index('ix_tickets_search_vector', table_name='tickets', postgresql_using='gin')
+    op.drop_column('tickets', 'search_vector')
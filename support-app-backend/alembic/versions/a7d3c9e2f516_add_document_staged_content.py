@@ -0,0 +1,26 @@
+# alembic/script.py.mako
+"""Add staged content for document updates
+
+Revision ID: a7d3c9e2f516
+Revises: e4b19d7c6a25
+Create Date: 2026-10-19 11:02:47.905113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d3c9e2f516'
+down_revision: Union[str, None] = 'e4b19d7c6a25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('documents', sa.Column('staged_content', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('documents', 'staged_content')
@@ -0,0 +1,63 @@
+# alembic/script.py.mako
+"""Add chunk fingerprints and references
+
+Revision ID: b62d0f4e8a17
+Revises: 4e9a7c2b5d61
+Create Date: 2026-10-17 14:05:33.671204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'b62d0f4e8a17'
+down_revision: Union[str, None] = '4e9a7c2b5d61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('chunk_fingerprints',
+    sa.Column('vector_id', sa.String(length=100), nullable=False),
+    sa.Column('doc_id', sa.Integer(), nullable=False),
+    sa.Column('simhash', sa.BigInteger(), nullable=False),
+    sa.Column('band_0', sa.Integer(), nullable=False),
+    sa.Column('band_1', sa.Integer(), nullable=False),
+    sa.Column('band_2', sa.Integer(), nullable=False),
+    sa.Column('band_3', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['doc_id'], ['documents.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('vector_id')
+    )
+    op.create_index(op.f('ix_chunk_fingerprints_doc_id'), 'chunk_fingerprints', ['doc_id'], unique=False)
+    for band in range(4):
+        op.create_index(op.f(f'ix_chunk_fingerprints_band_{band}'), 'chunk_fingerprints', [f'band_{band}'], unique=False)
+
+    op.create_table('chunk_references',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('vector_id', sa.String(length=100), nullable=False),
+    sa.Column('doc_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('chunk_index', sa.Integer(), nullable=False),
+    sa.Column('metadata_json', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['doc_id'], ['documents.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('doc_id', 'version', 'chunk_index', name='uq_chunk_references_chunk')
+    )
+    op.create_index(op.f('ix_chunk_references_id'), 'chunk_references', ['id'], unique=False)
+    op.create_index(op.f('ix_chunk_references_vector_id'), 'chunk_references', ['vector_id'], unique=False)
+    op.create_index(op.f('ix_chunk_references_doc_id'), 'chunk_references', ['doc_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_chunk_references_doc_id'), table_name='chunk_references')
+    op.drop_index(op.f('ix_chunk_references_vector_id'), table_name='chunk_references')
+    op.drop_index(op.f('ix_chunk_references_id'), table_name='chunk_references')
+    op.drop_table('chunk_references')
+    for band in range(4):
+        op.drop_index(op.f(f'ix_chunk_fingerprints_band_{band}'), table_name='chunk_fingerprints')
+    op.drop_index(op.f('ix_chunk_fingerprints_doc_id'), table_name='chunk_fingerprints')
+    op.drop_table('chunk_fingerprints')
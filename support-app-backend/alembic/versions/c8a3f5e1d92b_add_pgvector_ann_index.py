@@ -0,0 +1,47 @@
+# alembic/script.py.mako
+"""Add HNSW index on PGVector embeddings
+
+Revision ID: c8a3f5e1d92b
+Revises: b62d0f4e8a17
+Create Date: 2026-10-18 10:12:47.215830
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8a3f5e1d92b'
+down_revision: Union[str, None] = 'b62d0f4e8a17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    column_type = bind.execute(sa.text(
+        "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+        "WHERE attrelid = to_regclass('langchain_pg_embedding') AND attname = 'embedding'"
+    )).scalar()
+    if column_type is None:
+        # PGVector creates its tables on first use; build with POST /rag/vector-index once vectors exist
+        return
+    if column_type == 'vector':
+        # HNSW needs a fixed dimension; PGVector creates the column without one
+        dimensions = bind.execute(sa.text(
+            "SELECT DISTINCT vector_dims(embedding) FROM langchain_pg_embedding"
+        )).scalars().all()
+        if len(dimensions) != 1:
+            return
+        op.execute(f"ALTER TABLE langchain_pg_embedding ALTER COLUMN embedding TYPE vector({dimensions[0]})")
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_langchain_pg_embedding_embedding_ann "
+            "ON langchain_pg_embedding USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_langchain_pg_embedding_embedding_ann")
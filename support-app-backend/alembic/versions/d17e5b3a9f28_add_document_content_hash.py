@@ -0,0 +1,28 @@
+# alembic/script.py.mako
+"""Add content hash to documents
+
+Revision ID: d17e5b3a9f28
+Revises: 8c4f2a6d1e73
+Create Date: 2026-10-16 23:12:47.905184
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'd17e5b3a9f28'
+down_revision: Union[str, None] = '8c4f2a6d1e73'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('documents', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_documents_content_hash'), 'documents', ['content_hash'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_documents_content_hash'), table_name='documents')
+    op.drop_column('documents', 'content_hash')
@@ -0,0 +1,35 @@
+# alembic/script.py.mako
+"""Add GIN index on PGVector embedding metadata
+
+Revision ID: e4b19d7c6a25
+Revises: c8a3f5e1d92b
+Create Date: 2026-10-18 16:40:09.583117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b19d7c6a25'
+down_revision: Union[str, None] = 'c8a3f5e1d92b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # PGVector creates ix_cmetadata_gin only with a new table; 3982b8d89036 dropped it
+    exists = op.get_bind().execute(sa.text("SELECT to_regclass('langchain_pg_embedding')")).scalar()
+    if exists is None:
+        return
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_cmetadata_gin "
+            "ON langchain_pg_embedding USING gin (cmetadata jsonb_path_ops)"
+        )
+
+
+def downgrade() -> None:
+    # ix_cmetadata_gin is part of PGVector's own schema; leave it in place
+    pass
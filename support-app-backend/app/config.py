@@ -25,6 +25,76 @@ class Settings(BaseSettings):
     # Redis Configuration
     REDIS_URL: str = "redis://localhost:6379/0"
     
+    # RAG Ingestion Configuration
+    CHUNK_SIZE: int = 1000  # Characters per chunk
+    CHUNK_OVERLAP: int = 150  # Characters shared between neighbouring chunks
+    EMBEDDING_BATCH_SIZE: int = 64  # Texts per embedding API call
+    EMBEDDING_MAX_CONCURRENCY: int = 4  # Embedding API calls in flight
+    PARSE_WORKERS: int = 2  # Processes for PDF/DOCX/Excel parsing and OCR
+    PARSE_MAX_CONCURRENT: int = 4  # Parse tasks in flight per API worker (others wait)
+    PARSE_TIMEOUT: float = 120.0  # Seconds to parse one uploaded file
+    PARSE_MEMORY_LIMIT_MB: int = 1024  # Address-space limit per parse process, 0 = none
+    PARSE_PDF_PAGES_PER_TASK: int = 20  # Large PDFs are split into page ranges of this size
+    OCR_MAX_CONCURRENT: int = 2  # Images OCR'd at once per API worker (single-threaded tesseract each)
+    OCR_MAX_DIMENSION: int = 2500  # Larger images are downscaled and binarized before OCR, 0 = never
+    OCR_CACHE_ENABLED: bool = True  # Reuse OCR text for identical images (Redis)
+    INGEST_SPOOL_DIR: str = "data/ingest_spool"  # Uploads waiting for an ingest worker (shared with worker processes)
+    INGEST_WORKERS: int = 2  # In-process ingest workers per API worker, 0 = only scripts/ingest_worker.py
+    INGEST_MAX_ATTEMPTS: int = 3  # Attempts per ingest job before it is marked failed
+    INGEST_RETRY_BACKOFF: float = 10.0  # Seconds before the first retry, doubled for each later one
+    INGEST_POLL_INTERVAL: float = 2.0  # Seconds an idle worker waits before checking the queue again
+    INGEST_STALE_AFTER: float = 900.0  # Seconds without a worker heartbeat before a running job is requeued
+    BULK_INGEST_CONCURRENCY: int = 4  # Archive files parsed at once per bulk ingest
+    BULK_INGEST_GROUP_CHUNKS: int = 512  # Chunks from several files inserted and embedded together
+    BULK_INGEST_MAX_FILE_MB: int = 200  # Larger files in an archive are skipped
+    
+    # RAG Retrieval Configuration
+    VECTOR_BACKEND: str = "pgvector"  # "pgvector" or "local_ann"
+    LOCAL_INDEX_DIR: str = "data/vector_index"  # Memory-mapped index files (local_ann)
+    LOCAL_INDEX_DTYPE: str = "float32"  # "float32" or "float16"
+    LOCAL_INDEX_NLIST: int = 0  # IVF lists, 0 = 4 * sqrt(vectors)
+    LOCAL_INDEX_NPROBE: int = 16  # IVF lists scanned per query
+    PGVECTOR_INDEX_TYPE: str = "hnsw"  # ANN index on the embedding column: "hnsw" or "ivfflat"
+    PGVECTOR_HNSW_M: int = 16  # HNSW links per node
+    PGVECTOR_HNSW_EF_CONSTRUCTION: int = 64  # HNSW candidate list while building (>= 2 * m)
+    PGVECTOR_IVFFLAT_LISTS: int = 0  # IVFFlat lists, 0 = rows / 1000 (sqrt(rows) above 1M rows)
+    PGVECTOR_EF_SEARCH: int = 0  # hnsw.ef_search per query, 0 = 40; always at least the rows the search fetches
+    PGVECTOR_ITERATIVE_SCAN: str = "strict_order"  # hnsw.iterative_scan (pgvector >= 0.8) so filtered searches still fill k: "off", "strict_order" or "relaxed_order"
+    PGVECTOR_PROBES: int = 0  # ivfflat.probes per query, 0 = server default (1)
+    PGVECTOR_INDEX_BUILD_MEMORY: str = "1GB"  # maintenance_work_mem for index builds
+    PGVECTOR_QUANTIZATION: str = "none"  # ANN index storage: "none" (float32), "halfvec" or "binary"; results rescored exactly
+    PGVECTOR_RESCORE_FACTOR: int = 4  # Quantized candidates per result re-ranked by exact distance (binary: ~10)
+    EMBEDDING_DIMENSIONS: int = 0  # Keep the leading N dimensions of each embedding (Matryoshka), 0 = all
+    TICKET_INDEX_COLLECTION: str = "support_tickets"  # Vector collection of closed tickets
+    KB_INDEX_COLLECTION: str = "support_kb_articles"  # Vector collection of KB articles
+    RAG_KB_TOP_K: int = 3  # KB articles passed to the prompt
+    VECTOR_SEARCH_WORKERS: int = 8  # Threads for blocking vector store calls
+    HYBRID_RRF_K: int = 60  # Reciprocal-rank fusion damping constant
+    HYBRID_CANDIDATES: int = 20  # Candidates fetched per retrieval leg before fusion
+    RAG_VECTOR_STAGE_TIMEOUT: float = 3.0  # Seconds before the answer goes out without vector documents
+    RAG_TICKETS_STAGE_TIMEOUT: float = 2.0  # Seconds for the similar-tickets stage
+    RAG_KB_STAGE_TIMEOUT: float = 2.0  # Seconds for the KB articles stage
+    RAG_CATEGORIES_STAGE_TIMEOUT: float = 1.0  # Seconds for category suggestions
+    RAG_RERANK_STAGE_TIMEOUT: float = 1.5  # Seconds before fused order is used instead of reranked
+    RERANK_ENABLED: bool = False  # Rescore document candidates before context packing
+    RERANK_MODEL_DIR: str = ""  # Cross-encoder ONNX export (model.onnx + tokenizer.json); empty = lexical scorer
+    RERANK_CANDIDATES: int = 50  # Fused document candidates rescored per query
+    RERANK_BATCH_SIZE: int = 16  # (query, passage) pairs per scoring call
+    RERANK_WORKERS: int = 2  # Threads for reranker scoring
+    RERANK_CACHE_SIZE: int = 8192  # Cached (query, passage) scores per worker
+    CONTEXT_TOKEN_BUDGET: int = 3000  # Max estimated tokens of retrieved context in the prompt
+    CONTEXT_TICKET_MAX_TOKENS: int = 300  # Longer tickets are truncated
+    CONTEXT_DEDUP_MAX_DISTANCE: int = 6  # SimHash bits; closer passages count as duplicates
+    INGEST_DEDUP_ENABLED: bool = True  # Index one vector per cluster of near-duplicate chunks
+    INGEST_DEDUP_MAX_DISTANCE: int = 3  # SimHash bits, at most 3 (looked up by four 16-bit bands)
+    INGEST_DEDUP_MIN_CHARS: int = 200  # Shorter chunks are always indexed
+    QUERY_EMBEDDING_CACHE_SIZE: int = 2048  # In-process LRU entries (Redis is the shared level)
+    SEMANTIC_CACHE_ENABLED: bool = True  # Reuse answers for paraphrased queries
+    SEMANTIC_CACHE_THRESHOLD: float = 0.92  # Min cosine similarity to reuse an answer
+    SEMANTIC_CACHE_TTL: int = 3600  # Seconds a cached answer stays valid
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 1000  # Cached answers per worker
+    LOOP_MONITOR_INTERVAL: float = 0.1  # Seconds between event loop lag probes
+    
     # FastAPI Configuration
     DEBUG: bool = True
     HOST: str = "0.0.0.0"
@@ -35,10 +35,12 @@ class SimpleGraphStore:
 # Initialize graph store
 graph_store = SimpleGraphStore()
 
-def ingest_document_as_nodes(doc):
+def ingest_document_as_nodes(doc, content_length=None):
     """Add a document as a node to the graph"""
+    if content_length is None:
+        content_length = len(doc.content)
     graph_store.add_node(
         node_id=str(doc.id),
         label="Document",
-        properties={"title": doc.title, "content_length": len(doc.content)}
+        properties={"title": doc.title, "content_length": content_length}
     )
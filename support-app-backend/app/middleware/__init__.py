@@ -1,5 +1,6 @@
 # app/middleware/__init__.py
 """Middleware package for request processing."""
 from .logging import LoggingMiddleware, correlation_id_context
+from .compression import StreamingGZipMiddleware
 
-__all__ = ["LoggingMiddleware", "correlation_id_context"]
+__all__ = ["LoggingMiddleware", "StreamingGZipMiddleware", "correlation_id_context"]
@@ -0,0 +1,38 @@
+# app/middleware/compression.py
+"""
+GZip middleware that leaves server-sent event streams uncompressed.
+
+Starlette's GZipMiddleware (0.41) compresses streaming responses too, and
+the gzip writer holds small SSE frames back until enough data piles up, so
+clients would receive tokens in bursts instead of as they are generated.
+"""
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+from starlette.types import Message, Receive, Scope, Send
+
+# Content types that must reach the client unbuffered
+UNCOMPRESSED_CONTENT_TYPES = ("text/event-stream",)
+
+
+class StreamingGZipResponder(GZipResponder):
+    async def send_with_gzip(self, message: Message) -> None:
+        await super().send_with_gzip(message)
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            if content_type.startswith(UNCOMPRESSED_CONTENT_TYPES):
+                # The responder passes bodies through untouched when the
+                # response already has an encoding; reuse that path
+                self.content_encoding_set = True
+
+
+class StreamingGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that passes text/event-stream responses through"""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            headers = Headers(scope=scope)
+            if "gzip" in headers.get("Accept-Encoding", ""):
+                responder = StreamingGZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
@@ -1,5 +1,6 @@
 # app/models.py
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, SmallInteger, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Boolean, SmallInteger, ForeignKey, Computed, Index, UniqueConstraint
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -13,12 +14,69 @@ class Document(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
     content = Column(Text)
+    staged_content = Column(Text)  # Text of a new version being ingested, swapped into content when complete
+    content_hash = Column(String(64), index=True)  # sha256 of the source file
+    version = Column(Integer, default=1, nullable=False)  # Bumped when a changed file is re-ingested
+    chunks_json = Column(Text)  # JSON: [chunk hash, version it was indexed in, ...] per chunk, in order (see ingestion.is_reference)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True))
     
     def __repr__(self):
         return f"<Document(id={self.id}, title='{self.title}')>"
 
+class IngestJob(Base):
+    """Queued document ingest, processed by ingest workers"""
+    __tablename__ = "ingest_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    filename = Column(String(255), nullable=False)
+    file_path = Column(String(500), nullable=False)  # Spooled upload
+    status = Column(String(20), default="queued", nullable=False)  # queued, running, succeeded, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=3, nullable=False)
+    run_after = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    worker_id = Column(String(100))
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="SET NULL"))
+    progress_json = Column(Text)  # JSON: current stage, stage durations, counts
+    result_json = Column(Text)  # JSON: ingest result once succeeded
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    started_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    
+    __table_args__ = (
+        Index("ix_ingest_jobs_status_run_after", "status", "run_after"),
+    )
+
 # Support System Models
+class ChunkFingerprint(Base):
+    """SimHash of an indexed (canonical) chunk vector, for near-duplicate lookup at ingest"""
+    __tablename__ = "chunk_fingerprints"
+    
+    vector_id = Column(String(100), primary_key=True)
+    doc_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    simhash = Column(BigInteger, nullable=False)  # 64-bit fingerprint, stored signed
+    # 16-bit slices of the fingerprint; a fingerprint within 3 bits matches at least one exactly
+    band_0 = Column(Integer, nullable=False, index=True)
+    band_1 = Column(Integer, nullable=False, index=True)
+    band_2 = Column(Integer, nullable=False, index=True)
+    band_3 = Column(Integer, nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ChunkReference(Base):
+    """A document chunk that was not indexed because a near-duplicate vector already was"""
+    __tablename__ = "chunk_references"
+    __table_args__ = (UniqueConstraint("doc_id", "version", "chunk_index", name="uq_chunk_references_chunk"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    vector_id = Column(String(100), nullable=False, index=True)  # Canonical vector
+    doc_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    version = Column(Integer, default=1, nullable=False)  # Document version that made the reference
+    chunk_index = Column(Integer, nullable=False)
+    metadata_json = Column(Text)  # JSON: the chunk's own metadata, used if it takes over the vector
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class Users(Base):
     __tablename__ = "users"
     
@@ -58,6 +116,17 @@ class KBArticles(Base):
     updated_at = Column(DateTime(timezone=True))
     auto_generated = Column(Boolean, default=False)  # True if generated from ticket
     source_ticket_id = Column(Integer, ForeignKey("tickets.ticket_id"), nullable=True)
+    # Full-text search document (title weighted above summary above content)
+    search_vector = Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(summary, '')), 'B') || "
+        "setweight(to_tsvector('english', coalesce(content, '')), 'C')",
+        persisted=True
+    ))
+    
+    __table_args__ = (
+        Index("ix_kbarticles_search_vector", "search_vector", postgresql_using="gin"),
+    )
     
     # Relationships
     creator = relationship("Users", back_populates="created_kb_articles")
@@ -99,6 +168,16 @@ class Tickets(Base):
     sla_due_at = Column(DateTime(timezone=True), index=True)  # Added index for SLA queries
     subject = Column(String(200))
     description = Column(Text)
+    # Full-text search document (subject weighted above description)
+    search_vector = Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('english', coalesce(subject, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B')",
+        persisted=True
+    ))
+    
+    __table_args__ = (
+        Index("ix_tickets_search_vector", "search_vector", postgresql_using="gin"),
+    )
     
     # Relationships
     requester = relationship("Users", foreign_keys=[requester_id], back_populates="requested_tickets")
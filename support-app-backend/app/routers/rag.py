@@ -1,17 +1,32 @@
 # app/routers/rag.py
 from fastapi import APIRouter, UploadFile, Depends, HTTPException, Form, File
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Dict, Any, Optional
-from pydantic import BaseModel
+from typing import Dict, Any, List, Optional
+from pydantic import BaseModel, Field
+from ..config import settings
 from ..database import get_db
-from ..models import Document
-from ..services.vectorstore import vectordb
+from ..services.vectorstore import vectordb, run_in_vector_executor
+from ..services.vector_index import vector_index_manager
+from ..services.loop_monitor import loop_monitor
 from ..services.agents import qa_chain
 from ..services.enhanced_rag import enhanced_rag_service
 from ..services.elevenlabs_service import elevenlabs_service
-from ..services.document_processors import DocumentProcessor, get_supported_extensions
-from ..langgraph_setup import ingest_document_as_nodes
+from ..services.document_processors import DocumentProcessor, get_supported_extensions, spool_upload, remove_file
+from ..services.embedding_cache import embedding_service
+from ..services.answer_cache import answer_cache
+from ..services.ocr_cache import ocr_service
+from ..services.chunk_dedup import chunk_dedup
+from ..services.ticket_cards import ticket_cards
+from ..services.reranker import reranker
+from ..services.ingest_jobs import ingest_queue
+from ..services.bulk_ingest import ARCHIVE_EXTENSIONS, is_archive
+import asyncio
 import base64
+import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/rag", tags=["rag"])
 
@@ -20,8 +35,24 @@ class EnhancedQueryRequest(BaseModel):
     query: str
     include_tickets: bool = True
     include_kb: bool = True
-    category_filter: Optional[str] = None
+    category_filter: Optional[str] = None  # Ticket category name
+    file_type_filter: Optional[str] = None  # Document chunks of one file type: pdf, docx, excel, image, text
+    doc_id_filter: Optional[List[int]] = Field(None, max_length=100)  # Document chunks of these documents
     include_voice: bool = False
+    # Vector search recall/latency trade-off (HNSW ef_search, IVFFlat probes)
+    ef_search: Optional[int] = Field(None, ge=1, le=1000)
+    probes: Optional[int] = Field(None, ge=1, le=32768)
+
+    def search_params(self) -> Dict[str, int]:
+        return {name: value for name, value in (("ef_search", self.ef_search), ("probes", self.probes)) if value}
+
+class VectorIndexRequest(BaseModel):
+    # Unset options use the PGVECTOR_* settings
+    index_type: Optional[str] = None  # "hnsw" or "ivfflat"
+    m: Optional[int] = None
+    ef_construction: Optional[int] = None
+    lists: Optional[int] = None
+    truncate: bool = False  # Allow cutting stored vectors to EMBEDDING_DIMENSIONS
 
 class VoiceQueryRequest(BaseModel):
     audio_data: str  # Base64 encoded audio
@@ -37,62 +68,104 @@ async def get_supported_formats() -> Dict[str, Any]:
         "message": "Upload files in any of these formats for processing"
     }
 
-@router.post("/ingest")
-async def ingest(file: UploadFile, db: AsyncSession = Depends(get_db)) -> Dict[str, Any]:
-    """Ingest a document into the RAG system"""
+@router.post("/ingest", status_code=202)
+async def ingest(file: UploadFile) -> Dict[str, Any]:
+    """
+    Queue a document for ingestion into the RAG system. The upload is spooled
+    to disk and an ingest worker parses, chunks, embeds and indexes it in the
+    background; poll GET /rag/jobs/{job_id} for progress.
+    """
     if vectordb is None:
         raise HTTPException(status_code=503, detail="RAG system not available - OpenAI API key not configured")
     
+    # Reject unsupported file types before spooling
+    DocumentProcessor.get_processor(file)
+    
+    path = ingest_queue.spool_path(file.filename)
     try:
-        # Get appropriate processor for file type
-        processor = DocumentProcessor.get_processor(file)
-        
-        # Process the file to extract text
-        processed_data = await processor.process(file)
-        text = processed_data['text']
-        metadata = processed_data['metadata']
-        
-        # Create database record with enhanced metadata
-        doc = Document(
-            title=file.filename, 
-            content=text,
-            # Store processing metadata as JSON in a metadata field if available
-        )
-        db.add(doc)
-        await db.commit()
-        await db.refresh(doc)
-        
-        # Enhanced metadata for vector store
-        vector_metadata = {
-            "doc_id": doc.id, 
-            "title": file.filename,
-            "file_type": metadata.get('file_type', 'unknown'),
-            **metadata
-        }
-        
-        # Add to vector store
-        vectordb.add_texts(
-            texts=[text], 
-            metadatas=[vector_metadata]
+        await spool_upload(file, path)
+        job = await ingest_queue.enqueue(file.filename, path)
+    except Exception as e:
+        await asyncio.to_thread(remove_file, path)
+        raise HTTPException(status_code=500, detail=f"Error queueing document: {str(e)}")
+    
+    return {
+        "job_id": job["id"],
+        "title": file.filename,
+        "status": job["status"],
+        "status_url": f"/rag/jobs/{job['id']}"
+    }
+
+@router.post("/ingest/bulk", status_code=202)
+async def ingest_bulk(file: UploadFile) -> Dict[str, Any]:
+    """
+    Queue a zip/tar archive of documents (e.g. a KB export) for ingestion.
+    Every supported file becomes a document; the job result reports
+    skipped files and throughput.
+    """
+    if vectordb is None:
+        raise HTTPException(status_code=503, detail="RAG system not available - OpenAI API key not configured")
+    
+    if not is_archive(file.filename):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported archive type: {file.filename}. Supported formats: {', '.join(ARCHIVE_EXTENSIONS)}"
         )
-        
-        # Add to graph
-        ingest_document_as_nodes(doc)
-        
-        return {
-            "id": doc.id,
-            "title": file.filename,
-            "status": "ingested",
-            "content_length": len(text),
-            "file_type": metadata.get('file_type', 'unknown'),
-            "processing_metadata": metadata
-        }
-    except HTTPException:
-        # Re-raise HTTP exceptions (like unsupported file type)
-        raise
+    
+    path = ingest_queue.spool_path(file.filename)
+    try:
+        await spool_upload(file, path)
+        job = await ingest_queue.enqueue(file.filename, path)
+    except Exception as e:
+        await asyncio.to_thread(remove_file, path)
+        raise HTTPException(status_code=500, detail=f"Error queueing archive: {str(e)}")
+    
+    return {
+        "job_id": job["id"],
+        "title": file.filename,
+        "status": job["status"],
+        "status_url": f"/rag/jobs/{job['id']}"
+    }
+
+@router.get("/jobs/{job_id}")
+async def get_ingest_job(job_id: int) -> Dict[str, Any]:
+    """Ingest job status, current stage, per-stage durations and progress"""
+    try:
+        job = await ingest_queue.get(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting ingest job: {str(e)}")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingest job not found")
+    return job
+
+@router.get("/vector-index")
+async def get_vector_index() -> Dict[str, Any]:
+    """ANN indexes on the PGVector embeddings, build progress and search defaults"""
+    if settings.VECTOR_BACKEND != "pgvector":
+        raise HTTPException(status_code=400, detail=f"Vector index management needs the pgvector backend, not {settings.VECTOR_BACKEND}")
+    try:
+        return await vector_index_manager.status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting vector index status: {str(e)}")
+
+@router.post("/vector-index", status_code=202)
+async def build_vector_index(request: VectorIndexRequest) -> Dict[str, Any]:
+    """
+    Build or rebuild the HNSW/IVFFlat index on the PGVector embeddings in
+    the background (CREATE INDEX CONCURRENTLY, then swapped in for the old
+    index). Poll GET /rag/vector-index for progress.
+    """
+    if settings.VECTOR_BACKEND != "pgvector":
+        raise HTTPException(status_code=400, detail=f"Vector index management needs the pgvector backend, not {settings.VECTOR_BACKEND}")
+    try:
+        build = await vector_index_manager.start_build(**request.model_dump())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
-        await db.rollback()
-        raise HTTPException(status_code=500, detail=f"Error ingesting document: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error starting vector index build: {str(e)}")
+    return {**build, "status_url": "/rag/vector-index"}
 
 @router.post("/query-enhanced")
 async def query_enhanced(
@@ -107,7 +180,10 @@ async def query_enhanced(
             db=db,
             include_tickets=request.include_tickets,
             include_kb=request.include_kb,
-            category_filter=request.category_filter
+            category_filter=request.category_filter,
+            search_params=request.search_params(),
+            file_type_filter=request.file_type_filter,
+            doc_id_filter=request.doc_id_filter
         )
         
         # Add voice response if requested
@@ -126,6 +202,47 @@ async def query_enhanced(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error in enhanced query: {str(e)}")
 
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Format one server-sent event frame"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@router.post("/query-enhanced/stream")
+async def query_enhanced_stream(request: EnhancedQueryRequest) -> StreamingResponse:
+    """
+    Enhanced RAG query streamed as server-sent events: a "sources" event once
+    retrieval finishes, "token" events while the answer is generated, then
+    "done" (or "error").
+    """
+    if not vectordb or not qa_chain:
+        raise HTTPException(status_code=503, detail="RAG system not available - AI configuration incomplete")
+    
+    async def event_stream():
+        try:
+            async for event in enhanced_rag_service.stream_with_context(
+                query=request.query,
+                include_tickets=request.include_tickets,
+                include_kb=request.include_kb,
+                category_filter=request.category_filter,
+                search_params=request.search_params(),
+                file_type_filter=request.file_type_filter,
+                doc_id_filter=request.doc_id_filter
+            ):
+                yield format_sse(event["event"], event["data"])
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            logger.error(f"Error in streamed enhanced query: {str(e)}")
+            yield format_sse("error", {"detail": f"Error in enhanced query: {str(e)}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Stop nginx-style proxies from buffering the stream
+            "X-Accel-Buffering": "no"
+        }
+    )
+
 @router.post("/query-voice")
 async def query_voice(
     request: VoiceQueryRequest,
@@ -213,6 +330,23 @@ async def text_to_speech(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error in text-to-speech: {str(e)}")
 
+@router.get("/cache-stats")
+async def get_cache_stats() -> Dict[str, Any]:
+    """Query-embedding, semantic answer, ticket card, rerank score and OCR cache hit rates, and ingest dedup rate, for this worker"""
+    return {
+        "query_embedding": embedding_service.query_cache_stats(),
+        "semantic_answers": answer_cache.cache_stats(),
+        "ticket_cards": ticket_cards.cache_stats(),
+        "reranker": reranker.cache_stats(),
+        "ocr": ocr_service.cache_stats(),
+        "ingest_dedup": chunk_dedup.cache_stats()
+    }
+
+@router.get("/loop-stats")
+async def get_loop_stats() -> Dict[str, Any]:
+    """Event loop lag statistics (time the worker's loop was blocked)"""
+    return loop_monitor.stats()
+
 @router.get("/query")
 async def query(q: str) -> Dict[str, Any]:
     """Query the RAG system (legacy endpoint)"""
@@ -220,7 +354,7 @@ async def query(q: str) -> Dict[str, Any]:
         raise HTTPException(status_code=503, detail="RAG system not available - OpenAI API key not configured")
     
     try:
-        result = qa_chain.invoke({"query": q})
+        result = await run_in_vector_executor(qa_chain.invoke, {"query": q})
         return {
             "query": q,
             "answer": result["result"],
@@ -1,5 +1,5 @@
 # app/routers/support.py
-from fastapi import APIRouter, Depends, HTTPException, Query, File, UploadFile
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, File, UploadFile
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, and_, or_, text
 from sqlalchemy.orm import selectinload
@@ -8,6 +8,10 @@ from datetime import datetime, timedelta
 from pydantic import BaseModel
 
 from ..database import get_db
+from ..services.answer_cache import answer_cache
+from ..services.record_index import ticket_index, kb_index
+from ..services.ticket_cards import ticket_cards
+from ..services.embedding_cache import embedding_service
 from ..models import Users, Tickets, TicketCategories, KBArticles, ResolutionSteps, TicketRootCauses, TicketKBLinks, Attachments
 
 router = APIRouter(prefix="/support", tags=["support"])
@@ -512,6 +516,7 @@ async def get_ticket(ticket_id: int, db: AsyncSession = Depends(get_db)):
 async def update_ticket(
     ticket_id: int,
     updates: TicketUpdate,
+    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db)
 ):
     """Update a ticket"""
@@ -522,6 +527,9 @@ async def update_ticket(
         if not ticket:
             raise HTTPException(status_code=404, detail="Ticket not found")
         
+        # Closing or reopening a ticket adds it to / removes it from the ticket index
+        status_changed = updates.status is not None and (updates.status == "Closed") != (ticket.status == "Closed")
+        
         # Apply updates
         if updates.status is not None:
             ticket.status = updates.status
@@ -535,6 +543,9 @@ async def update_ticket(
             ticket.priority = updates.priority
         
         await db.commit()
+        if status_changed:
+            await ticket_cards.invalidate(ticket_id)
+            background_tasks.add_task(ticket_index.index_record, ticket_id)
         return {"message": "Ticket updated successfully"}
     except HTTPException:
         raise
@@ -547,6 +558,7 @@ async def update_ticket(
 @router.post("/kb-articles", response_model=KBArticleResponse)
 async def create_kb_article(
     article: KBArticleCreate,
+    background_tasks: BackgroundTasks,
     created_by: int = Query(..., description="User ID of the creator"),
     db: AsyncSession = Depends(get_db)
 ):
@@ -564,6 +576,8 @@ async def create_kb_article(
         db.add(new_article)
         await db.commit()
         await db.refresh(new_article)
+        await answer_cache.invalidate(f"KB article {new_article.kb_id} created")
+        background_tasks.add_task(kb_index.index_record, new_article.kb_id)
         
         # Get creator info
         creator_result = await db.execute(
@@ -691,6 +705,7 @@ async def get_kb_article(kb_id: int, db: AsyncSession = Depends(get_db)):
 async def update_kb_article(
     kb_id: int,
     updates: KBArticleUpdate,
+    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db)
 ):
     """Update a knowledge base article"""
@@ -718,6 +733,8 @@ async def update_kb_article(
         
         await db.commit()
         await db.refresh(article)
+        await answer_cache.invalidate(f"KB article {kb_id} updated")
+        background_tasks.add_task(kb_index.index_record, kb_id)
         
         # Get creator info
         creator_result = await db.execute(
@@ -743,7 +760,7 @@ async def update_kb_article(
         raise HTTPException(status_code=500, detail=f"Error updating KB article: {str(e)}")
 
 @router.delete("/kb-articles/{kb_id}")
-async def delete_kb_article(kb_id: int, db: AsyncSession = Depends(get_db)):
+async def delete_kb_article(kb_id: int, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_db)):
     """Delete a knowledge base article"""
     try:
         # Check if article exists
@@ -764,6 +781,8 @@ async def delete_kb_article(kb_id: int, db: AsyncSession = Depends(get_db)):
         # Delete the article
         await db.delete(article)
         await db.commit()
+        await answer_cache.invalidate(f"KB article {kb_id} deleted")
+        background_tasks.add_task(kb_index.index_record, kb_id)
         
         return {"message": "KB article deleted successfully"}
         
@@ -787,22 +806,40 @@ async def search_ticket_suggestions(
         # Search similar tickets
         ticket_query = select(Tickets, Users.display_name.label('requester_name')).join(
             Users, Tickets.requester_id == Users.user_id
-        ).where(
-            or_(
-                Tickets.subject.ilike(search_pattern),
-                Tickets.description.ilike(search_pattern)
-            )
         )
         
-        if search_request.category_id:
-            ticket_query = ticket_query.where(Tickets.category_id == search_request.category_id)
+        if ticket_index.available:
+            # Closed tickets nearest to the query in the ticket index
+            embedded = await embedding_service.embed_query(search_request.query)
+            matches = await ticket_index.search(
+                embedded["vector"],
+                k=search_request.limit,
+                filter={"category_id": search_request.category_id} if search_request.category_id else None
+            )
+            match_order = {match["id"]: position for position, match in enumerate(matches)}
+            ticket_query = ticket_query.where(Tickets.ticket_id.in_(list(match_order)))
+        else:
+            match_order = None
+            ticket_query = ticket_query.where(
+                or_(
+                    Tickets.subject.ilike(search_pattern),
+                    Tickets.description.ilike(search_pattern)
+                )
+            )
             
+            if search_request.category_id:
+                ticket_query = ticket_query.where(Tickets.category_id == search_request.category_id)
+        
         ticket_query = ticket_query.limit(search_request.limit)
         
         ticket_results = await db.execute(ticket_query)
+        ticket_rows = ticket_results.fetchall()
+        if match_order is not None:
+            # Keep similarity order
+            ticket_rows.sort(key=lambda row: match_order[row[0].ticket_id])
         similar_tickets = []
         
-        for row in ticket_results.fetchall():
+        for row in ticket_rows:
             ticket = row[0]
             requester_name = row[1]
             
@@ -864,6 +901,7 @@ async def search_ticket_suggestions(
 @router.post("/tickets/{ticket_id}/generate-kb", response_model=KBArticleResponse)
 async def generate_kb_from_ticket(
     ticket_id: int,
+    background_tasks: BackgroundTasks,
     created_by: int = Query(..., description="User ID creating the KB article"),
     db: AsyncSession = Depends(get_db)
 ):
@@ -936,6 +974,10 @@ Resolved on: {ticket.closed_at.strftime('%Y-%m-%d') if ticket.closed_at else 'Un
         kb_link = TicketKBLinks(ticket_id=ticket_id, kb_id=new_kb.kb_id)
         db.add(kb_link)
         await db.commit()
+        await answer_cache.invalidate(f"KB article {new_kb.kb_id} generated")
+        background_tasks.add_task(kb_index.index_record, new_kb.kb_id)
+        # Re-index the source ticket with its documented resolution
+        background_tasks.add_task(ticket_index.index_record, ticket_id)
         
         # Get creator info
         creator_result = await db.execute(
@@ -1104,6 +1146,7 @@ async def revert_kb_version(
 @router.post("/kb/generate-from-ticket/{ticket_id}")
 async def generate_kb_from_ticket(
     ticket_id: int,
+    background_tasks: BackgroundTasks,
     user_id: int = Query(...),
     db: AsyncSession = Depends(get_db)
 ) -> Dict[str, Any]:
@@ -1116,4 +1159,6 @@ async def generate_kb_from_ticket(
     result = await kb_generator.generate_from_ticket(ticket_id, db, user_id)
     if not result.get("success"):
         raise HTTPException(status_code=400, detail=result.get("error"))
+    # Re-index the source ticket with its documented resolution
+    background_tasks.add_task(ticket_index.index_record, ticket_id)
     return result
@@ -0,0 +1,628 @@
+# app/services/ann_index.py
+"""
+In-process approximate nearest neighbour (ANN) vector store.
+An IVF-flat index over a memory-mapped NumPy matrix, persisted on local disk,
+so a worker can open the collection without reading it into RAM first.
+Selected with VECTOR_BACKEND=local_ann as an alternative to PGVector.
+
+Several processes (API workers, scripts/ingest_worker.py) may open the same
+index directory: writes take an exclusive lock on index.lock, and readers
+pick up other processes' writes when index.json changes.
+"""
+import json
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows: one writing process only
+    fcntl = None
+
+# Rows scored per block when scanning, bounds temporary memory use
+SCAN_BLOCK_ROWS = 65536
+# Vectors sampled to train the coarse quantizer
+TRAIN_SAMPLE_SIZE = 65536
+KMEANS_ITERATIONS = 10
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so inner product equals cosine similarity"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class IVFIndex:
+    """
+    IVF-flat index over an append-only, memory-mapped vector matrix.
+
+    Files in index_dir:
+    - vectors.bin: raw row-major matrix (float32 or float16), normalized rows
+    - documents.jsonl: one {"id", "text", "metadata"} line per row
+    - centroids.npy / assignments.npy / deleted.npy: IVF lists and tombstones
+    - index.json: dimension, dtype and committed row count
+    - index.lock: flock()ed by writers (exclusive) and reloads (shared)
+
+    Rows are only ever appended, and the other files are replaced
+    atomically, so a search never waits for a writer in another process.
+    """
+
+    def __init__(
+        self,
+        index_dir: str,
+        dtype: str = "float32",
+        nlist: int = 0,
+        nprobe: int = 16,
+        min_train_size: int = 2048
+    ):
+        self.index_dir = index_dir
+        self.dtype = np.dtype(dtype)
+        self.nlist_setting = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+
+        self.dim: Optional[int] = None
+        self.count = 0
+        self.trained_size = 0
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.deleted = np.zeros(0, dtype=bool)
+        self.row_by_id: Dict[str, int] = {}
+        self.row_ids: List[str] = []
+        self.doc_offsets: List[int] = []
+
+        self._vectors: Optional[np.memmap] = None
+        self._lists: List[np.ndarray] = []
+        self._lock = threading.RLock()
+        self._writing = False
+        # index.json as last loaded or written by this process, and the end of documents.jsonl read so far
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._docs_end = 0
+
+        os.makedirs(index_dir, exist_ok=True)
+        with self._write_lock():
+            pass
+        if self.count:
+            logger.info(f"Opened local vector index at {self.index_dir} ({self.count} rows)")
+
+    # ----- persistence -------------------------------------------------
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def _disk_stamp(self) -> Optional[Tuple[int, int]]:
+        """Identity of index.json; every write replaces it"""
+        try:
+            stat = os.stat(self._path("index.json"))
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    @contextmanager
+    def _file_lock(self, mode: int):
+        if fcntl is None:
+            yield
+            return
+        with open(self._path("index.lock"), "a") as f:
+            fcntl.flock(f, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _write_lock(self):
+        """
+        Exclusive across threads and processes (re-entrant). Loads other
+        processes' writes and drops partial writes of a crashed one, so
+        appends start at the committed end of the files.
+        """
+        with self._lock:
+            if self._writing:
+                yield
+                return
+            with self._file_lock(fcntl.LOCK_EX if fcntl else 0):
+                self._writing = True
+                try:
+                    if self._disk_stamp() != self._stamp:
+                        self._load()
+                    committed = {
+                        "documents.jsonl": self._docs_end,
+                        "vectors.bin": self.count * (self.dim or 0) * self.dtype.itemsize
+                    }
+                    for name, size in committed.items():
+                        if os.path.exists(self._path(name)):
+                            os.truncate(self._path(name), size)
+                    yield
+                finally:
+                    self._writing = False
+
+    def _refresh(self):
+        """Pick up rows, deletes and retraining written by other processes"""
+        if self._disk_stamp() == self._stamp:
+            return
+        with self._lock:
+            if self._writing or self._disk_stamp() == self._stamp:
+                return
+            with self._file_lock(fcntl.LOCK_SH if fcntl else 0):
+                self._load()
+
+    def _load(self):
+        """
+        Read the committed state. Rows only ever get appended, so just the
+        documents added since the last load are read.
+        """
+        stamp = self._disk_stamp()
+        if stamp is None:
+            return
+
+        with open(self._path("index.json")) as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.dtype = np.dtype(meta["dtype"])
+        count = meta["count"]
+        self.trained_size = meta.get("trained_size", 0)
+
+        with open(self._path("documents.jsonl"), "rb") as f:
+            f.seek(self._docs_end)
+            offset = self._docs_end
+            for line in f:
+                if len(self.doc_offsets) == count:
+                    break  # Ignore rows written after the last committed count
+                row_id = json.loads(line)["id"]
+                self.row_by_id[row_id] = len(self.doc_offsets)
+                self.row_ids.append(row_id)
+                self.doc_offsets.append(offset)
+                offset += len(line)
+        self._docs_end = offset
+        self.count = count
+
+        deleted = np.zeros(count, dtype=bool)
+        if os.path.exists(self._path("deleted.npy")):
+            stored = np.load(self._path("deleted.npy"))
+            deleted[:min(len(stored), count)] = stored[:count]
+        known = np.zeros(count, dtype=bool)
+        known[:len(self.deleted)] = self.deleted[:count]
+        for row in np.flatnonzero(deleted & ~known):
+            if self.row_by_id.get(self.row_ids[row]) == row:
+                del self.row_by_id[self.row_ids[row]]
+        self.deleted = deleted
+
+        if os.path.exists(self._path("centroids.npy")):
+            self.centroids = np.load(self._path("centroids.npy"))
+            self.assignments = np.full(count, -1, dtype=np.int32)
+            stored = np.load(self._path("assignments.npy"))
+            self.assignments[:min(len(stored), count)] = stored[:count]
+        self._build_lists()
+
+        self._remap()
+        self._stamp = stamp
+
+    def _remap(self):
+        """(Re)open the vector file as a read-only memory map"""
+        if self.count and self.dim:
+            self._vectors = np.memmap(
+                self._path("vectors.bin"), dtype=self.dtype, mode="r", shape=(self.count, self.dim)
+            )
+        else:
+            self._vectors = None
+
+    def _save_meta(self):
+        meta = {
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "count": self.count,
+            "trained_size": self.trained_size
+        }
+        tmp_path = self._path("index.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._path("index.json"))
+        self._stamp = self._disk_stamp()
+
+    def _save_array(self, name: str, array: np.ndarray):
+        # Replaced atomically: readers in other processes may load it at any time
+        tmp_path = self._path(f"{name}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, self._path(name))
+
+    def _save_lists(self):
+        self._save_array("deleted.npy", self.deleted)
+        if self.centroids is not None:
+            self._save_array("centroids.npy", self.centroids)
+            self._save_array("assignments.npy", self.assignments)
+
+    # ----- writes ------------------------------------------------------
+
+    def add(
+        self,
+        vectors: List[List[float]],
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        ids: List[str]
+    ):
+        """Append rows; existing ids are replaced (old row tombstoned)"""
+        matrix = _normalize(np.asarray(vectors, dtype=np.float32))
+        with self._write_lock():
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+            if matrix.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional vectors, got {matrix.shape[1]}")
+
+            for row_id in ids:
+                if row_id in self.row_by_id:
+                    self.deleted[self.row_by_id.pop(row_id)] = True
+
+            # Documents first, then vectors, then the committed count
+            offset = self._docs_end
+            with open(self._path("documents.jsonl"), "ab") as f:
+                for row_id, text, metadata in zip(ids, texts, metadatas):
+                    line = (json.dumps({"id": row_id, "text": text, "metadata": metadata}, default=str) + "\n").encode("utf-8")
+                    f.write(line)
+                    self.row_by_id[row_id] = len(self.doc_offsets)
+                    self.row_ids.append(row_id)
+                    self.doc_offsets.append(offset)
+                    offset += len(line)
+            self._docs_end = offset
+
+            with open(self._path("vectors.bin"), "ab") as f:
+                f.write(matrix.astype(self.dtype).tobytes())
+
+            self.count += len(ids)
+            self.deleted = np.concatenate([self.deleted, np.zeros(len(ids), dtype=bool)])
+            if self.centroids is not None:
+                new_assignments = self._assign(matrix)
+                self.assignments = np.concatenate([self.assignments, new_assignments])
+
+            self._remap()
+            live = self.live_count()
+            if self.centroids is None and live >= self.min_train_size:
+                self.train()
+            elif self.centroids is not None and live > 4 * self.trained_size:
+                self.train()  # Collection outgrew its lists, retrain the quantizer
+            else:
+                self._build_lists()
+                self._save_lists()
+            self._save_meta()
+
+    def delete(self, ids: List[str]) -> int:
+        """Tombstone rows by id"""
+        removed = 0
+        with self._write_lock():
+            for row_id in ids:
+                row = self.row_by_id.pop(row_id, None)
+                if row is not None:
+                    self.deleted[row] = True
+                    removed += 1
+            if removed:
+                self._build_lists()
+                self._save_lists()
+                self._save_meta()
+        return removed
+
+    def live_count(self) -> int:
+        return int(self.count - self.deleted[:self.count].sum())
+
+    # ----- IVF training ------------------------------------------------
+
+    def train(self):
+        """Train the coarse quantizer (spherical k-means) and assign all rows"""
+        with self._write_lock():
+            live_rows = np.flatnonzero(~self.deleted[:self.count])
+            if len(live_rows) == 0:
+                return
+            rng = np.random.default_rng(0)
+            sample_rows = np.sort(rng.choice(live_rows, size=min(TRAIN_SAMPLE_SIZE, len(live_rows)), replace=False))
+            sample = np.asarray(self._vectors[sample_rows], dtype=np.float32)
+
+            nlist = self.nlist_setting or int(4 * np.sqrt(len(live_rows)))
+            # Keep enough training points per list for stable centroids
+            nlist = max(1, min(nlist, len(sample) // 39 or 1))
+
+            centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+            for _ in range(KMEANS_ITERATIONS):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                order = np.argsort(labels, kind="stable")
+                present, starts = np.unique(labels[order], return_index=True)
+                # Empty lists keep their previous centroid
+                sums = centroids.copy()
+                sums[present] = np.add.reduceat(sample[order], starts, axis=0)
+                centroids = _normalize(sums)
+
+            self.centroids = centroids.astype(np.float32)
+            self.assignments = np.empty(self.count, dtype=np.int32)
+            for start in range(0, self.count, SCAN_BLOCK_ROWS):
+                block = np.asarray(self._vectors[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+                self.assignments[start:start + len(block)] = self._assign(block)
+
+            self.trained_size = len(live_rows)
+            self._build_lists()
+            self._save_lists()
+            self._save_meta()
+            logger.info(f"Trained IVF index with {nlist} lists over {len(live_rows)} vectors")
+
+    def _assign(self, matrix: np.ndarray) -> np.ndarray:
+        return np.argmax(matrix @ self.centroids.T, axis=1).astype(np.int32)
+
+    def _build_lists(self):
+        """Group live row numbers by IVF list"""
+        if self.centroids is None:
+            self._lists = []
+            return
+        live_rows = np.flatnonzero(~self.deleted[:self.count])
+        labels = self.assignments[live_rows]
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(len(self.centroids) + 1))
+        self._lists = [live_rows[order[bounds[i]:bounds[i + 1]]] for i in range(len(self.centroids))]
+
+    # ----- reads -------------------------------------------------------
+
+    def search(self, query: List[float], k: int, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Return up to k (row, cosine similarity) pairs, best first"""
+        self._refresh()
+        with self._lock:
+            vectors = self._vectors
+            centroids = self.centroids
+            lists = self._lists
+            count = self.count
+            deleted = self.deleted
+        if vectors is None or count == 0:
+            return []
+
+        q = _normalize(np.asarray(query, dtype=np.float32))
+
+        if centroids is None:
+            # Exact scan in blocks (small collections, before training)
+            best_rows, best_scores = [], []
+            for start in range(0, count, SCAN_BLOCK_ROWS):
+                block = np.asarray(vectors[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+                scores = block @ q
+                scores[deleted[start:start + len(block)]] = -np.inf
+                top = np.argsort(-scores)[:k]
+                best_rows.append(top + start)
+                best_scores.append(scores[top])
+            rows = np.concatenate(best_rows)
+            scores = np.concatenate(best_scores)
+        else:
+            nprobe = min(nprobe or self.nprobe, len(centroids))
+            probe = np.argpartition(-(centroids @ q), nprobe - 1)[:nprobe]
+            rows = np.sort(np.concatenate([lists[c] for c in probe]))
+            if len(rows) == 0:
+                return []
+            scores = np.asarray(vectors[rows], dtype=np.float32) @ q
+
+        keep = np.isfinite(scores)
+        rows, scores = rows[keep], scores[keep]
+        top = np.argsort(-scores)[:k]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+    def list_count(self) -> int:
+        """IVF lists searched by nprobe (0 before training: searches are exact)"""
+        centroids = self.centroids
+        return 0 if centroids is None else len(centroids)
+
+    def get_document(self, row: int) -> Dict[str, Any]:
+        """Read one stored document (id, text, metadata) from disk"""
+        with open(self._path("documents.jsonl"), "rb") as f:
+            f.seek(self.doc_offsets[row])
+            return json.loads(f.readline())
+
+    def update_metadata(self, updates: Dict[str, Dict[str, Any]], merge: bool = True) -> int:
+        """Merge into (or replace) the metadata of existing rows; rows are re-appended with their vectors"""
+        vectors, texts, metadatas, ids = [], [], [], []
+        with self._write_lock():
+            for row_id, metadata in updates.items():
+                row = self.row_by_id.get(row_id)
+                if row is None:
+                    continue
+                stored = self.get_document(row)
+                vectors.append(np.asarray(self._vectors[row], dtype=np.float32))
+                texts.append(stored["text"])
+                metadatas.append({**stored["metadata"], **metadata} if merge else metadata)
+                ids.append(row_id)
+            if ids:
+                self.add(vectors, texts, metadatas, ids)
+        return len(ids)
+
+    def ids_matching(self, filter: Optional[dict]) -> List[str]:
+        """Ids of live rows whose metadata match a filter (reads every stored document)"""
+        self._refresh()
+        with self._lock:
+            rows = sorted((row, row_id) for row_id, row in self.row_by_id.items())
+        ids = []
+        with open(self._path("documents.jsonl"), "rb") as f:
+            for row, row_id in rows:
+                f.seek(self.doc_offsets[row])
+                if _matches_filter(json.loads(f.readline())["metadata"], filter):
+                    ids.append(row_id)
+        return ids
+
+    def stats(self) -> Dict[str, Any]:
+        self._refresh()
+        return {
+            "rows": self.count,
+            "live_rows": self.live_count(),
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "lists": 0 if self.centroids is None else len(self.centroids),
+            "nprobe": self.nprobe
+        }
+
+
+def _contains(value: Any, expected: Any) -> bool:
+    """JSONB @> semantics: objects by key, arrays by element, scalars by equality"""
+    if isinstance(expected, dict):
+        return isinstance(value, dict) and all(k in value and _contains(value[k], v) for k, v in expected.items())
+    if isinstance(expected, list):
+        return isinstance(value, list) and all(any(_contains(item, e) for item in value) for e in expected)
+    return value == expected
+
+
+def _matches_filter(metadata: Dict[str, Any], filter: Optional[dict]) -> bool:
+    """
+    Evaluate a simple PGVector-style metadata filter ({key: value}, $eq,
+    $in, $contains, $and, $or)
+    """
+    if not filter:
+        return True
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(_matches_filter(metadata, f) for f in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(_matches_filter(metadata, f) for f in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        if isinstance(condition, dict):
+            if "$eq" in condition and value != condition["$eq"]:
+                return False
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+            if "$contains" in condition and not _contains(value, condition["$contains"]):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class LocalANNVectorStore(VectorStore):
+    """LangChain VectorStore backed by a local IVFIndex (same interface as PGVector)"""
+
+    # Candidates fetched per requested result when a metadata filter is applied
+    FILTER_OVERSAMPLE = 10
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        index_dir: str,
+        dtype: str = "float32",
+        nlist: int = 0,
+        nprobe: int = 16
+    ):
+        self._embeddings = embeddings
+        self.index = IVFIndex(index_dir, dtype=dtype, nlist=nlist, nprobe=nprobe)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embeddings
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any
+    ) -> List[str]:
+        texts = list(texts)
+        vectors = self._embeddings.embed_documents(texts)
+        return self.add_embeddings(texts, vectors, metadatas=metadatas, ids=ids)
+
+    def add_embeddings(
+        self,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any
+    ) -> List[str]:
+        if not texts:
+            return []
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        self.index.add(embeddings, list(texts), metadatas, ids)
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        return self.index.delete(ids) > 0
+
+    def update_metadata(self, updates: Dict[str, dict], merge: bool = True) -> int:
+        return self.index.update_metadata(updates, merge=merge)
+
+    def delete_by_filter(self, filter: dict, keep_ids: Iterable[str] = ()) -> bool:
+        """Delete rows whose metadata match filter, except keep_ids"""
+        keep = set(keep_ids)
+        ids = [row_id for row_id in self.index.ids_matching(filter) if row_id not in keep]
+        return self.index.delete(ids) > 0 if ids else False
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None) -> List[Tuple[Document, float]]:
+        embedding = self._embeddings.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k=k, filter=filter)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, filter=filter)]
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[dict] = None,
+        nprobe: Optional[int] = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        Returns (Document, cosine distance) pairs, like PGVector with COSINE.
+        Filters apply to the candidates; while fewer than k match, the search
+        widens (nprobe, then candidates) until the index is exhausted.
+        """
+        if k <= 0:
+            return []
+        fetch_k = k * self.FILTER_OVERSAMPLE if filter else k
+        nprobe = nprobe or self.index.nprobe
+        stored_by_row: Dict[int, Dict[str, Any]] = {}
+        while True:
+            candidates = self.index.search(embedding, fetch_k, nprobe=nprobe)
+            results = []
+            for row, similarity in candidates:
+                if row not in stored_by_row:
+                    stored_by_row[row] = self.index.get_document(row)
+                stored = stored_by_row[row]
+                if not _matches_filter(stored["metadata"], filter):
+                    continue
+                results.append((
+                    Document(id=stored["id"], page_content=stored["text"], metadata=stored["metadata"]),
+                    1.0 - similarity
+                ))
+                if len(results) == k:
+                    return results
+            lists = self.index.list_count()
+            if nprobe < lists:
+                nprobe = min(nprobe * 2, lists)
+            elif len(candidates) == fetch_k:
+                fetch_k *= 2
+            else:
+                return results  # Every live row in the probed lists was considered
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        index_dir: str = "data/vector_index",
+        **kwargs: Any
+    ) -> "LocalANNVectorStore":
+        store = cls(embedding, index_dir=index_dir, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -0,0 +1,158 @@
+# app/services/answer_cache.py
+"""
+Semantic answer cache for enhanced RAG queries.
+Reuses a full query_with_context result when a new query's embedding is
+close enough to a cached query's embedding, so paraphrases of the same
+issue skip retrieval and the Gemini call.
+"""
+import copy
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .cache import cache_get, cache_incr, CacheKeys
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticAnswerCache:
+    """
+    Per-worker cache of answers matched by embedding similarity.
+
+    Entries are scoped by the retrieval options (include_tickets,
+    include_kb and the category, file type and document filters), so an
+    answer is only reused for requests
+    that would have seen the same sources. Invalidation bumps a generation
+    counter in Redis, which every worker checks before serving a hit.
+    """
+
+    def __init__(
+        self,
+        threshold: Optional[float] = None,
+        ttl: Optional[int] = None,
+        max_entries: Optional[int] = None
+    ):
+        self.enabled = settings.SEMANTIC_CACHE_ENABLED
+        self.threshold = threshold if threshold is not None else settings.SEMANTIC_CACHE_THRESHOLD
+        self.ttl = ttl if ttl is not None else settings.SEMANTIC_CACHE_TTL
+        self.max_entries = max_entries or settings.SEMANTIC_CACHE_MAX_ENTRIES
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.generation = 0
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    @staticmethod
+    def scope_key(
+        include_tickets: bool,
+        include_kb: bool,
+        category_filter: Optional[str],
+        file_type_filter: Optional[str] = None,
+        doc_id_filter: Optional[List[int]] = None
+    ) -> str:
+        """Identify which sources a cached answer was built from"""
+        key = f"tickets={int(include_tickets)}|kb={int(include_kb)}|category={(category_filter or '').lower()}"
+        if file_type_filter:
+            key += f"|file_type={file_type_filter}"
+        if doc_id_filter:
+            key += f"|docs={','.join(str(doc_id) for doc_id in sorted(set(doc_id_filter)))}"
+        return key
+
+    async def _sync_generation(self) -> int:
+        """Drop local entries if another worker invalidated the cache"""
+        value = await cache_get(CacheKeys.SEMANTIC_ANSWER_GENERATION)
+        generation = int(value or 0)
+        if generation != self.generation:
+            self.entries.clear()
+            self.generation = generation
+        return generation
+
+    def _evict_expired(self):
+        now = time.time()
+        for entry_id in [i for i, e in self.entries.items() if e["expires_at"] <= now]:
+            del self.entries[entry_id]
+
+    async def lookup(self, vector: List[float], scope: str) -> Optional[Dict[str, Any]]:
+        """
+        Find the most similar cached answer in the same scope.
+
+        Returns:
+            Dict with "result", "similarity" and "matched_query", or None
+        """
+        if not self.enabled:
+            return None
+
+        await self._sync_generation()
+        self._evict_expired()
+
+        candidates = [e for e in self.entries.values() if e["scope"] == scope]
+        if not candidates:
+            self.stats["misses"] += 1
+            return None
+
+        query = np.asarray(vector, dtype=np.float32)
+        query /= (np.linalg.norm(query) or 1.0)
+        similarities = np.stack([e["vector"] for e in candidates]) @ query
+        best = int(np.argmax(similarities))
+
+        if similarities[best] < self.threshold:
+            self.stats["misses"] += 1
+            return None
+
+        entry = candidates[best]
+        self.entries.move_to_end(entry["id"])
+        self.stats["hits"] += 1
+        return {
+            # Callers add per-request fields (voice, timings), so hand out a copy
+            "result": copy.deepcopy(entry["result"]),
+            "similarity": float(similarities[best]),
+            "matched_query": entry["query"]
+        }
+
+    async def store(self, vector: List[float], scope: str, query: str, result: Dict[str, Any]):
+        """Cache a freshly generated answer"""
+        if not self.enabled:
+            return
+
+        normalized = np.asarray(vector, dtype=np.float32)
+        normalized /= (np.linalg.norm(normalized) or 1.0)
+        entry_id = str(uuid.uuid4())
+        self.entries[entry_id] = {
+            "id": entry_id,
+            "scope": scope,
+            "query": query,
+            "vector": normalized,
+            "result": copy.deepcopy(result),
+            "expires_at": time.time() + self.ttl
+        }
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def invalidate(self, reason: str = ""):
+        """Invalidate cached answers on every worker (documents or KB changed)"""
+        generation = await cache_incr(CacheKeys.SEMANTIC_ANSWER_GENERATION)
+        self.entries.clear()
+        if generation is not None:
+            self.generation = generation
+        self.stats["invalidations"] += 1
+        logger.info(f"Semantic answer cache invalidated{': ' + reason if reason else ''}")
+
+    def cache_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.entries),
+            "threshold": self.threshold,
+            "hits": self.stats["hits"],
+            "misses": self.stats["misses"],
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "invalidations": self.stats["invalidations"],
+            "generation": self.generation
+        }
+
+
+# Global instance
+answer_cache = SemanticAnswerCache()
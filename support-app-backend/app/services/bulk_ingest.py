@@ -0,0 +1,380 @@
+# app/services/bulk_ingest.py
+"""
+Bulk ingest of zip/tar archives (e.g. a whole KB export).
+Members are unpacked one at a time as the archive is read and parsed in
+parallel. Parsed files are grouped: each group's Document rows are
+written with one multi-row insert, and the group's chunks from all its
+files are embedded and indexed together, so embedding batches stay full
+however small the files are. A changed file that is already a document
+is ingested on its own as that document's next version.
+"""
+import asyncio
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import logging
+import zipfile
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..database import AsyncSessionLocal
+from ..models import Document
+from .vectorstore import vectordb, run_in_vector_executor
+from .document_processors import (
+    SPOOL_BLOCK_SIZE, DocumentProcessor, get_all_supported_extensions, remove_file
+)
+from .parse_pool import ParseTimeoutError
+from .parsers import file_sha256
+from .chunking import text_chunker
+from .embedding_cache import embedding_service
+from .answer_cache import answer_cache
+from .chunk_dedup import chunk_dedup
+from .ingestion import IngestProgress, discard_document, document_vector_id, find_document, ingest_file
+from ..langgraph_setup import ingest_document_as_nodes
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+
+def is_archive(filename: str) -> bool:
+    return (filename or '').lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+@dataclass
+class ArchiveMember:
+    name: str
+    size: int
+    path: Optional[str] = None  # Extracted copy, None if skipped
+    skip_reason: Optional[str] = None
+
+
+def _skip_reason(name: str, size: int, max_bytes: int) -> Optional[str]:
+    basename = os.path.basename(name)
+    if name.startswith('__MACOSX/') or basename.startswith('.'):
+        return "hidden file"
+    if not basename.lower().endswith(tuple(get_all_supported_extensions())):
+        return "unsupported file type"
+    if size > max_bytes:
+        return f"larger than {max_bytes // (1024 * 1024)} MB"
+    return None
+
+
+def _extract(source, work_dir: str, name: str) -> str:
+    suffix = os.path.splitext(name)[1].lower()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=work_dir) as target:
+        shutil.copyfileobj(source, target, SPOOL_BLOCK_SIZE)
+    return target.name
+
+
+def iter_archive_members(path: str, filename: str, work_dir: str, max_bytes: int) -> Iterator[ArchiveMember]:
+    """
+    Yield each file in the archive in archive order, extracting supported
+    ones into work_dir as they are reached. Tar archives are read as a
+    stream; only one member is extracted at a time. Extracted names never
+    come from the archive, so member paths cannot escape work_dir.
+    """
+    if filename.lower().endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                reason = _skip_reason(info.filename, info.file_size, max_bytes)
+                if reason is None and info.flag_bits & 0x1:
+                    reason = "encrypted"
+                if reason is not None:
+                    yield ArchiveMember(info.filename, info.file_size, skip_reason=reason)
+                    continue
+                with archive.open(info) as source:
+                    yield ArchiveMember(info.filename, info.file_size, path=_extract(source, work_dir, info.filename))
+    else:
+        with tarfile.open(path, mode='r|*') as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                reason = _skip_reason(member.name, member.size, max_bytes)
+                if reason is not None:
+                    yield ArchiveMember(member.name, member.size, skip_reason=reason)
+                    continue
+                source = archive.extractfile(member)
+                yield ArchiveMember(member.name, member.size, path=_extract(source, work_dir, member.name))
+
+
+@dataclass
+class ParsedFile:
+    name: str
+    size: int
+    content_hash: str
+    text: str
+    file_type: str
+    chunks: List[Dict[str, Any]]
+
+
+class ArchiveIngest:
+    """State of one archive ingest"""
+
+    def __init__(
+        self,
+        db: AsyncSession,
+        filename: str,
+        on_progress: Optional[Callable[[IngestProgress], Awaitable[None]]] = None,
+        session_factory=None
+    ):
+        self.db = db
+        self.filename = filename
+        self.on_progress = on_progress
+        # Title lookups and updates run beside the group inserts, each in a session of its own
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.concurrency = settings.BULK_INGEST_CONCURRENCY
+        self.group_chunks = settings.BULK_INGEST_GROUP_CHUNKS
+        self.progress = IngestProgress(counts={
+            "files": 0, "documents": 0, "updated": 0, "skipped": 0, "chunks": 0, "duplicate_chunks": 0, "bytes": 0
+        })
+        self.skipped: List[Dict[str, str]] = []
+        self.updated: List[int] = []
+        self.pending: List[ParsedFile] = []
+        self.pending_chunks = 0
+        self.embedding_cache_hits = 0
+        self._flush_lock = asyncio.Lock()
+
+    async def report(self):
+        if self.on_progress is not None:
+            await self.on_progress(self.progress)
+
+    def skip(self, name: str, reason: str):
+        self.skipped.append({"file": name, "reason": reason})
+        self.progress.counts["skipped"] += 1
+
+    async def parse_member(self, member: ArchiveMember):
+        """Parse and chunk one extracted file, then flush if a group is full"""
+        try:
+            processor = DocumentProcessor.for_filename(member.name)
+            with self.progress.timed("parse"):
+                content_hash = await asyncio.to_thread(file_sha256, member.path)
+            async with self.session_factory() as db:
+                doc = await find_document(db, member.name)
+            if doc is not None:
+                if doc.content_hash == content_hash:
+                    self.skip(member.name, "already ingested")
+                else:
+                    await self.update_document(member)
+                return
+            with self.progress.timed("parse"):
+                parsed = await processor.process_path(member.path)
+        except (HTTPException, ParseTimeoutError) as e:
+            # One bad (or too slow) file does not fail the archive
+            self.skip(member.name, e.detail if isinstance(e, HTTPException) else str(e))
+            return
+        finally:
+            await asyncio.to_thread(remove_file, member.path)
+
+        with self.progress.timed("chunk"):
+            # doc_id is filled in once the group's rows are inserted
+            chunks = text_chunker.split_segments(parsed['segments'], base_metadata={
+                "title": member.name,
+                "file_type": processor.metadata.get('file_type', 'unknown'),
+                **processor.metadata
+            })
+        self.pending.append(ParsedFile(
+            name=member.name,
+            size=member.size,
+            content_hash=content_hash,
+            text=parsed['text'],
+            file_type=processor.metadata.get('file_type', 'unknown'),
+            chunks=chunks
+        ))
+        self.pending_chunks += len(chunks)
+        if self.pending_chunks >= self.group_chunks:
+            await self.flush()
+
+    async def update_document(self, member: ArchiveMember):
+        """Store a changed file as the next version of its document"""
+        with self.progress.timed("update"):
+            async with self.session_factory() as db:
+                result = await ingest_file(db, member.path, member.name)
+        if result["status"] == "unchanged":
+            # Another ingest stored this content first
+            self.skip(member.name, "already ingested")
+            return
+        # Not in progress.documents: a failed archive must not remove an existing document
+        self.updated.append(result["id"])
+        self.progress.counts["updated"] += 1
+        self.progress.counts["bytes"] += member.size
+        await self.report()
+
+    async def flush(self):
+        """Insert the pending files' rows in one statement, then embed and index their chunks together"""
+        async with self._flush_lock:
+            files, self.pending, self.pending_chunks = self.pending, [], 0
+            if not files:
+                return
+
+            with self.progress.timed("store"):
+                # Content already indexed (an earlier upload, or twice in this archive) is skipped
+                result = await self.db.execute(
+                    select(Document.content_hash).where(Document.content_hash.in_([f.content_hash for f in files]))
+                )
+                known = set(result.scalars().all())
+                unique: Dict[str, ParsedFile] = {}
+                for f in files:
+                    if f.content_hash in known or f.content_hash in unique:
+                        self.skip(f.name, "already ingested")
+                    else:
+                        unique[f.content_hash] = f
+                files = list(unique.values())
+                if not files:
+                    return
+
+                result = await self.db.execute(
+                    insert(Document).returning(Document.id, sort_by_parameter_order=True),
+                    [{"title": f.name, "content": f.text, "content_hash": f.content_hash} for f in files]
+                )
+                doc_ids = list(result.scalars().all())
+                await self.db.commit()
+
+            chunks = []
+            for doc_id, parsed in zip(doc_ids, files):
+                for chunk in parsed.chunks:
+                    chunk["metadata"]["doc_id"] = doc_id
+                chunks.extend(parsed.chunks)
+                self.progress.documents.append([doc_id, len(parsed.chunks)])
+            self.progress.counts["documents"] += len(files)
+            self.progress.counts["chunks"] += len(chunks)
+            self.progress.counts["bytes"] += sum(f.size for f in files)
+            # Written ids are recorded before indexing, so a crashed ingest can clean up
+            await self.report()
+
+            if chunks:
+                # Boilerplate repeated across the archive is embedded once
+                with self.progress.timed("dedup"):
+                    plan = await chunk_dedup.plan(self.db, chunks, [
+                        document_vector_id(chunk["metadata"]["doc_id"], chunk["metadata"]["chunk_index"])
+                        for chunk in chunks
+                    ])
+                self.progress.counts["duplicate_chunks"] += len(plan.duplicate_of)
+                unique = [chunks[position] for position in plan.unique]
+
+                if unique:
+                    chunk_texts = [chunk["text"] for chunk in unique]
+                    with self.progress.timed("embed"):
+                        embedding_stats = await embedding_service.embed_documents(chunk_texts)
+                    self.embedding_cache_hits += embedding_stats["cache_hits"]
+
+                    with self.progress.timed("index"):
+                        await run_in_vector_executor(
+                            vectordb.add_embeddings,
+                            texts=chunk_texts,
+                            embeddings=embedding_stats["vectors"],
+                            metadatas=[chunk["metadata"] for chunk in unique],
+                            ids=[plan.vector_ids[position] for position in plan.unique]
+                        )
+                with self.progress.timed("dedup"):
+                    await chunk_dedup.record(self.db, plan, vectordb)
+
+            with self.progress.timed("graph"):
+                for doc_id, parsed in zip(doc_ids, files):
+                    ingest_document_as_nodes(
+                        Document(id=doc_id, title=parsed.name), content_length=len(parsed.text)
+                    )
+
+    async def run(self, path: str):
+        os.makedirs(settings.INGEST_SPOOL_DIR, exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix="bulk-", dir=settings.INGEST_SPOOL_DIR)
+        members = iter_archive_members(
+            path, self.filename, work_dir, settings.BULK_INGEST_MAX_FILE_MB * 1024 * 1024
+        )
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks: List[asyncio.Task] = []
+
+        async def handle(member: ArchiveMember):
+            try:
+                await self.parse_member(member)
+            finally:
+                slots.release()
+
+        try:
+            while not any(task.done() and not task.cancelled() and task.exception() for task in tasks):
+                # At most `concurrency` files are extracted and in flight at once
+                await slots.acquire()
+                with self.progress.timed("extract"):
+                    member = await asyncio.to_thread(next, members, None)
+                if member is None:
+                    slots.release()
+                    break
+                self.progress.counts["files"] += 1
+                if member.skip_reason is not None:
+                    self.skip(member.name, member.skip_reason)
+                    slots.release()
+                    continue
+                tasks.append(asyncio.create_task(handle(member)))
+
+            await asyncio.gather(*tasks)
+            await self.flush()
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            await asyncio.to_thread(members.close)
+            await asyncio.to_thread(shutil.rmtree, work_dir, True)
+
+
+async def ingest_archive(
+    db: AsyncSession,
+    path: str,
+    filename: str,
+    on_progress: Optional[Callable[[IngestProgress], Awaitable[None]]] = None
+) -> Dict[str, Any]:
+    """
+    Ingest every supported file in a zip/tar archive. Files that cannot be
+    parsed or whose content is already ingested are skipped and listed;
+    changed files under a known title update that document. Any other
+    failure removes the new documents written so far and is re-raised.
+    """
+    if vectordb is None:
+        raise RuntimeError("RAG system not available - OpenAI API key not configured")
+
+    started = time.perf_counter()
+    ingest = ArchiveIngest(db, filename, on_progress=on_progress)
+    try:
+        await ingest.run(path)
+    except Exception:
+        await db.rollback()
+        for doc_id, chunk_count in ingest.progress.documents:
+            await discard_document(db, doc_id, chunk_count)
+        raise
+
+    if ingest.progress.counts["documents"]:
+        # Cached answers may now be missing these documents
+        await answer_cache.invalidate(f"{ingest.progress.counts['documents']} documents ingested from {filename}")
+    ingest.progress.stage = None
+    await ingest.report()
+
+    elapsed = time.perf_counter() - started
+    counts = ingest.progress.counts
+    result = {
+        "archive": filename,
+        "status": "ingested",
+        **counts,
+        "skipped_files": ingest.skipped,
+        "document_ids": [doc_id for doc_id, _ in ingest.progress.documents],
+        "updated_document_ids": ingest.updated,
+        "embedding_cache_hits": ingest.embedding_cache_hits,
+        "elapsed_s": round(elapsed, 2),
+        "docs_per_s": round(counts["documents"] / elapsed, 2) if elapsed else 0.0,
+        "mb_per_s": round(counts["bytes"] / (1024 * 1024) / elapsed, 2) if elapsed else 0.0,
+        "stages_ms": dict(ingest.progress.stages)
+    }
+    logger.info(
+        f"Bulk ingest of {filename}: {counts['documents']} documents, {counts['chunks']} chunks "
+        f"in {result['elapsed_s']}s ({result['docs_per_s']} docs/s, {result['mb_per_s']} MB/s)"
+    )
+    return result
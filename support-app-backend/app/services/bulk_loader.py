@@ -0,0 +1,287 @@
+# app/services/bulk_loader.py
+"""
+Offline bulk loader for initial loads of large document trees.
+Files are taken in a fixed (sorted) order and loaded in batches: rows go
+in with Postgres COPY under ids reserved from the documents sequence,
+and each batch's chunks are embedded in shared batches. A JSON checkpoint
+records the last loaded file, so an interrupted run resumes after it;
+files whose content hash is already in documents are skipped, and a
+changed file under a known title is ingested as that document's next
+version instead of a second document.
+"""
+import asyncio
+import json
+import os
+import time
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import select, text
+
+from ..database import AsyncSessionLocal
+from ..models import Document
+from .vectorstore import vectordb, run_in_vector_executor
+from .document_processors import DocumentProcessor, get_all_supported_extensions
+from .parse_pool import ParseTimeoutError
+from .parsers import file_sha256
+from .chunking import text_chunker
+from .embedding_cache import embedding_service
+from .answer_cache import answer_cache
+from .chunk_dedup import chunk_dedup
+from .ingestion import discard_document, document_vector_id, find_document, ingest_file
+
+logger = logging.getLogger(__name__)
+
+
+def iter_files(root: str) -> Iterator[Tuple[Tuple[str, ...], str]]:
+    """
+    Yield (path parts relative to root, absolute path) for supported files,
+    in sorted order of their parts, skipping hidden files and directories.
+    """
+    extensions = tuple(get_all_supported_extensions())
+
+    def walk(directory: str, parts: Tuple[str, ...]):
+        with os.scandir(directory) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    yield from walk(entry.path, parts + (entry.name,))
+                elif entry.is_file() and entry.name.lower().endswith(extensions):
+                    yield parts + (entry.name,), entry.path
+
+    yield from walk(root, ())
+
+
+@dataclass
+class Checkpoint:
+    """Resume point of a bulk load, saved as JSON after every batch"""
+    path: str
+    root: str
+    last: Optional[List[str]] = None  # Parts of the last file handled
+    # Documents written by a batch that did not finish
+    pending: List[List[int]] = field(default_factory=list)
+    stats: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: str, root: str) -> "Checkpoint":
+        if not os.path.exists(path):
+            return cls(path=path, root=root)
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("root") != root:
+            raise ValueError(f"Checkpoint {path} is for {data.get('root')}, not {root}")
+        return cls(path=path, root=root, last=data.get("last"), pending=data.get("pending", []), stats=data.get("stats", {}))
+
+    def save(self):
+        # Written to a temporary file and renamed, so a crash never leaves half a checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"root": self.root, "last": self.last, "pending": self.pending, "stats": self.stats}, f)
+        os.replace(tmp_path, self.path)
+
+
+@dataclass
+class LoadedFile:
+    title: str
+    size: int
+    content_hash: str
+    text: str
+    chunks: List[Dict[str, Any]]
+
+
+class BulkLoader:
+    """Loads a directory tree into documents and the vector collection"""
+
+    def __init__(
+        self,
+        root: str,
+        checkpoint_path: str,
+        batch_files: int = 200,
+        concurrency: int = 4,
+        session_factory=None,
+        store=None
+    ):
+        self.root = os.path.abspath(root)
+        self.checkpoint = Checkpoint.load(checkpoint_path, self.root)
+        self.batch_files = batch_files
+        self.concurrency = concurrency
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.store = store if store is not None else vectordb
+        self.stats = {
+            "files": 0, "documents": 0, "updated": 0, "duplicates": 0, "failed": 0, "chunks": 0, "duplicate_chunks": 0, "bytes": 0,
+            **self.checkpoint.stats
+        }
+
+    def remaining_files(self) -> Iterator[Tuple[Tuple[str, ...], str]]:
+        last = tuple(self.checkpoint.last) if self.checkpoint.last else None
+        for parts, path in iter_files(self.root):
+            if last is None or parts > last:
+                yield parts, path
+
+    async def recover(self, db):
+        """Remove documents of a batch that was interrupted before it finished"""
+        for doc_id, chunk_count in self.checkpoint.pending:
+            await discard_document(db, doc_id, chunk_count)
+        if self.checkpoint.pending:
+            logger.info(f"Removed {len(self.checkpoint.pending)} documents of an interrupted batch")
+        self.checkpoint.pending = []
+        self.checkpoint.save()
+
+    async def load_file(self, parts: Tuple[str, ...], path: str, semaphore: asyncio.Semaphore) -> Optional[LoadedFile]:
+        title = "/".join(parts)
+        async with semaphore:
+            try:
+                processor = DocumentProcessor.for_filename(path)
+                content_hash = await asyncio.to_thread(file_sha256, path)
+                async with self.session_factory() as db:
+                    doc = await find_document(db, title)
+                if doc is not None:
+                    if doc.content_hash == content_hash:
+                        self.stats["duplicates"] += 1
+                    else:
+                        await self.update_document(path, title)
+                    return None
+                parsed = await processor.process_path(path)
+            except (HTTPException, ParseTimeoutError) as e:
+                logger.warning(f"Skipping {title}: {e.detail if isinstance(e, HTTPException) else str(e)}")
+                self.stats["failed"] += 1
+                return None
+        chunks = text_chunker.split_segments(parsed['segments'], base_metadata={
+            "title": title,
+            "file_type": processor.metadata.get('file_type', 'unknown'),
+            **processor.metadata
+        })
+        return LoadedFile(title, os.path.getsize(path), content_hash, parsed['text'], chunks)
+
+    async def update_document(self, path: str, title: str):
+        """
+        Store a changed file as the next version of its document. This goes
+        through the upload pipeline (one file at a time, indexed into the
+        app's vector store) and is committed when it returns, so it is not
+        part of the batch a resume would remove.
+        """
+        async with self.session_factory() as db:
+            result = await ingest_file(db, path, title)
+        if result["status"] == "unchanged":
+            self.stats["duplicates"] += 1
+        else:
+            self.stats["updated"] += 1
+            self.stats["bytes"] += os.path.getsize(path)
+
+    async def existing_hashes(self, db, hashes: List[str]) -> set:
+        result = await db.execute(
+            select(Document.content_hash).where(Document.content_hash.in_(hashes))
+        )
+        return set(result.scalars().all())
+
+    async def copy_documents(self, db, files: List[LoadedFile]) -> List[int]:
+        """COPY the rows under ids reserved from the documents id sequence"""
+        result = await db.execute(
+            text("SELECT nextval(pg_get_serial_sequence('documents', 'id')) FROM generate_series(1, :n)"),
+            {"n": len(files)}
+        )
+        doc_ids = [row[0] for row in result.all()]
+        connection = await db.connection()
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            "documents",
+            records=[(doc_id, f.title, f.text, f.content_hash) for doc_id, f in zip(doc_ids, files)],
+            columns=["id", "title", "content", "content_hash"]
+        )
+        return doc_ids
+
+    async def load_batch(self, db, batch: List[Tuple[Tuple[str, ...], str]]):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        loaded = await asyncio.gather(*[self.load_file(parts, path, semaphore) for parts, path in batch])
+        self.stats["files"] += len(batch)
+
+        # Skip content already indexed (earlier runs, the HTTP ingest, or twice in this batch)
+        files = [f for f in loaded if f is not None]
+        known = await self.existing_hashes(db, [f.content_hash for f in files]) if files else set()
+        unique: Dict[str, LoadedFile] = {}
+        for f in files:
+            if f.content_hash in known or f.content_hash in unique:
+                self.stats["duplicates"] += 1
+            else:
+                unique[f.content_hash] = f
+        files = list(unique.values())
+
+        if files:
+            doc_ids = await self.copy_documents(db, files)
+            chunks = []
+            for doc_id, f in zip(doc_ids, files):
+                for chunk in f.chunks:
+                    chunk["metadata"]["doc_id"] = doc_id
+                chunks.extend(f.chunks)
+
+            # Recorded before the rows are committed: a crash from here on is undone on resume
+            self.checkpoint.pending = [[doc_id, len(f.chunks)] for doc_id, f in zip(doc_ids, files)]
+            self.checkpoint.save()
+            await db.commit()
+
+            if chunks:
+                # Boilerplate repeated across the tree is embedded once
+                plan = await chunk_dedup.plan(
+                    db, chunks, [document_vector_id(c["metadata"]["doc_id"], c["metadata"]["chunk_index"]) for c in chunks]
+                )
+                unique = [chunks[position] for position in plan.unique]
+                if unique:
+                    chunk_texts = [chunk["text"] for chunk in unique]
+                    embedding_stats = await embedding_service.embed_documents(chunk_texts)
+                    await run_in_vector_executor(
+                        self.store.add_embeddings,
+                        texts=chunk_texts,
+                        embeddings=embedding_stats["vectors"],
+                        metadatas=[chunk["metadata"] for chunk in unique],
+                        ids=[plan.vector_ids[position] for position in plan.unique]
+                    )
+                await chunk_dedup.record(db, plan, self.store)
+                self.stats["duplicate_chunks"] += len(plan.duplicate_of)
+
+            self.stats["documents"] += len(files)
+            self.stats["chunks"] += len(chunks)
+            self.stats["bytes"] += sum(f.size for f in files)
+
+        self.checkpoint.last = list(batch[-1][0])
+        self.checkpoint.pending = []
+        self.checkpoint.stats = self.stats
+        self.checkpoint.save()
+
+    async def run(self, limit: Optional[int] = None) -> Dict[str, Any]:
+        """Load remaining files (at most limit); returns totals across all runs and this run's throughput"""
+        if self.store is None:
+            raise RuntimeError("Vector store not available (check embeddings and vector backend)")
+
+        started = time.perf_counter()
+        documents_before, bytes_before = self.stats["documents"], self.stats["bytes"]
+        async with self.session_factory() as db:
+            await self.recover(db)
+            batch = []
+            handled = 0
+            for item in self.remaining_files():
+                if limit is not None and handled >= limit:
+                    break
+                batch.append(item)
+                handled += 1
+                if len(batch) >= self.batch_files:
+                    await self.load_batch(db, batch)
+                    batch = []
+                    logger.info(f"Bulk load: {self.stats['documents']} documents, last {self.checkpoint.last}")
+            if batch:
+                await self.load_batch(db, batch)
+
+        documents = self.stats["documents"] - documents_before
+        if documents:
+            # Cached answers may now be missing these documents
+            await answer_cache.invalidate(f"bulk load of {documents} documents")
+
+        elapsed = time.perf_counter() - started
+        return {
+            **self.stats,
+            "elapsed_s": round(elapsed, 2),
+            "docs_per_s": round(documents / elapsed, 2) if elapsed else 0.0,
+            "mb_per_s": round((self.stats["bytes"] - bytes_before) / (1024 * 1024) / elapsed, 2) if elapsed else 0.0
+        }
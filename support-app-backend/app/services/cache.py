@@ -5,13 +5,16 @@ Provides async caching for frequently accessed data.
 """
 import json
 import hashlib
-from typing import Optional, Any, Callable
+from typing import Optional, Any, Callable, Dict, List
 from functools import wraps
+import redis as redis_sync
 import redis.asyncio as redis
 from ..config import settings
 
 # Redis client (initialized lazily)
 _redis_client: Optional[redis.Redis] = None
+# Synchronous client for code running in worker threads (initialized lazily)
+_sync_redis_client: Optional[redis_sync.Redis] = None
 
 
 async def get_redis() -> Optional[redis.Redis]:
@@ -39,14 +42,43 @@ async def get_redis() -> Optional[redis.Redis]:
     return _redis_client
 
 
+def get_sync_redis() -> Optional[redis_sync.Redis]:
+    """
+    Get or create the synchronous Redis connection, for callers in worker
+    threads that cannot await the async client (it belongs to the event loop).
+    """
+    global _sync_redis_client
+    
+    if _sync_redis_client is None:
+        redis_url = getattr(settings, "REDIS_URL", None)
+        if redis_url:
+            try:
+                client = redis_sync.from_url(
+                    redis_url,
+                    encoding="utf-8",
+                    decode_responses=True
+                )
+                client.ping()
+                _sync_redis_client = client
+            except Exception as e:
+                print(f"⚠️ Redis connection failed: {e}")
+    
+    return _sync_redis_client
+
+
 class CacheKeys:
     """Cache key prefixes for different data types."""
     KB_ARTICLE = "kb:article:"
     KB_LIST = "kb:list:"
     TICKET = "ticket:"
+    TICKET_CARD = "ticket:card:"
     ANALYTICS = "analytics:"
     VECTOR_SEARCH = "vector:search:"
     USER = "user:"
+    EMBEDDING = "embedding:"
+    QUERY_EMBEDDING = "embedding:query:"
+    OCR = "ocr:"
+    SEMANTIC_ANSWER_GENERATION = "rag:answer:generation"
 
 
 class CacheTTL:
@@ -56,6 +88,10 @@ class CacheTTL:
     ANALYTICS = 60        # 1 minute
     VECTOR_SEARCH = 60    # 1 minute
     USER = 600            # 10 minutes
+    TICKET_CARD = 3600    # 1 hour (closed tickets rarely change)
+    EMBEDDING = 2592000   # 30 days (embeddings only change with the model)
+    QUERY_EMBEDDING = 604800  # 7 days
+    OCR = 2592000         # 30 days (same image, same text)
 
 
 async def cache_get(key: str) -> Optional[Any]:
@@ -87,6 +123,66 @@ async def cache_set(key: str, value: Any, ttl: int = 300) -> bool:
         return False
 
 
+def cache_get_sync(key: str) -> Optional[Any]:
+    """Get value from cache, from a worker thread."""
+    client = get_sync_redis()
+    if client is None:
+        return None
+    
+    try:
+        value = client.get(key)
+        if value:
+            return json.loads(value)
+    except Exception as e:
+        print(f"Cache get error: {e}")
+    return None
+
+
+def cache_set_sync(key: str, value: Any, ttl: int = 300) -> bool:
+    """Set value in cache with TTL, from a worker thread."""
+    client = get_sync_redis()
+    if client is None:
+        return False
+    
+    try:
+        client.setex(key, ttl, json.dumps(value, default=str))
+        return True
+    except Exception as e:
+        print(f"Cache set error: {e}")
+        return False
+
+
+async def cache_get_many(keys: List[str]) -> List[Optional[Any]]:
+    """Get several values from cache in one round trip."""
+    client = await get_redis()
+    if client is None or not keys:
+        return [None] * len(keys)
+    
+    try:
+        values = await client.mget(keys)
+        return [json.loads(value) if value else None for value in values]
+    except Exception as e:
+        print(f"Cache get many error: {e}")
+    return [None] * len(keys)
+
+
+async def cache_set_many(items: Dict[str, Any], ttl: int = 300) -> bool:
+    """Set several values in cache with TTL using a pipeline."""
+    client = await get_redis()
+    if client is None or not items:
+        return False
+    
+    try:
+        async with client.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.setex(key, ttl, json.dumps(value, default=str))
+            await pipe.execute()
+        return True
+    except Exception as e:
+        print(f"Cache set many error: {e}")
+        return False
+
+
 async def cache_delete(key: str) -> bool:
     """Delete key from cache."""
     client = await get_redis()
@@ -101,6 +197,19 @@ async def cache_delete(key: str) -> bool:
         return False
 
 
+async def cache_incr(key: str) -> Optional[int]:
+    """Atomically increment an integer counter, returning the new value."""
+    client = await get_redis()
+    if client is None:
+        return None
+    
+    try:
+        return await client.incr(key)
+    except Exception as e:
+        print(f"Cache incr error: {e}")
+        return None
+
+
 async def cache_delete_pattern(pattern: str) -> int:
     """Delete all keys matching pattern."""
     client = await get_redis()
@@ -0,0 +1,275 @@
+# app/services/chunk_dedup.py
+"""
+Near-duplicate chunk detection at ingest time.
+Support documents repeat the same disclaimers, headers and steps. Before a
+batch of chunks is embedded, each chunk's SimHash is looked up among the
+chunks already indexed (chunk_fingerprints, by four 16-bit bands). A chunk
+within INGEST_DEDUP_MAX_DISTANCE bits of an indexed chunk of another
+document is not embedded: it is stored as a reference to that canonical
+vector, and the canonical vector's metadata lists the documents that also
+contain it. When a document's vectors are removed, canonical vectors that
+other documents still reference are handed over to one of them.
+"""
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..models import ChunkFingerprint, ChunkReference
+from .dedup import hamming_distance, simhash
+from .vectorstore import run_in_vector_executor, update_metadata
+
+logger = logging.getLogger(__name__)
+
+BANDS = 4
+BAND_BITS = 16
+BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def fingerprint_bands(fingerprint: int) -> List[int]:
+    return [(fingerprint >> (band * BAND_BITS)) & BAND_MASK for band in range(BANDS)]
+
+
+def to_signed(fingerprint: int) -> int:
+    # BIGINT is signed; fingerprints are unsigned 64-bit
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+@dataclass
+class DedupPlan:
+    """Which chunks of a batch to index, and which are near-duplicates of an indexed vector"""
+    chunks: List[Dict[str, Any]]
+    vector_ids: List[str]
+    version: int = 1
+    fingerprints: List[Optional[int]] = field(default_factory=list)
+    # Chunk position -> canonical vector id
+    duplicate_of: Dict[int, str] = field(default_factory=dict)
+
+    @property
+    def unique(self) -> List[int]:
+        return [i for i in range(len(self.chunks)) if i not in self.duplicate_of]
+
+
+def match_duplicates(
+    fingerprints: List[Optional[int]],
+    doc_ids: List[int],
+    vector_ids: List[str],
+    candidates: List[Tuple[str, int, int]],
+    max_distance: int
+) -> Dict[int, str]:
+    """
+    Map each chunk position to the closest candidate (vector id, doc id,
+    fingerprint) within max_distance bits. Chunks are never matched to
+    their own document (an edited paragraph must not resolve to its old
+    text), and unmatched chunks become candidates for later ones.
+    """
+    candidates = list(candidates)
+    duplicate_of = {}
+    for position, fingerprint in enumerate(fingerprints):
+        if fingerprint is None:
+            continue
+        best = None
+        for vector_id, doc_id, other in candidates:
+            if doc_id == doc_ids[position]:
+                continue
+            distance = hamming_distance(fingerprint, other)
+            if distance <= max_distance and (best is None or distance < best[0]):
+                best = (distance, vector_id)
+        if best is not None:
+            duplicate_of[position] = best[1]
+        else:
+            candidates.append((vector_ids[position], doc_ids[position], fingerprint))
+    return duplicate_of
+
+
+class ChunkDeduplicator:
+    """Fingerprints, canonical vectors and references of near-duplicate chunks"""
+
+    def __init__(self):
+        self.enabled = settings.INGEST_DEDUP_ENABLED
+        self.max_distance = min(settings.INGEST_DEDUP_MAX_DISTANCE, BANDS - 1)
+        self.min_chars = settings.INGEST_DEDUP_MIN_CHARS
+        self.stats = {"chunks": 0, "duplicates": 0}
+
+    def _fingerprints(self, texts: List[str]) -> List[Optional[int]]:
+        return [simhash(text) if len(text.strip()) >= self.min_chars else None for text in texts]
+
+    async def _candidates(self, db: AsyncSession, fingerprints: List[int]) -> List[Tuple[str, int, int]]:
+        """Indexed fingerprints sharing at least one band with any of fingerprints"""
+        if not fingerprints:
+            return []
+        bands: List[Set[int]] = [set() for _ in range(BANDS)]
+        for fingerprint in fingerprints:
+            for band, value in enumerate(fingerprint_bands(fingerprint)):
+                bands[band].add(value)
+        columns = [ChunkFingerprint.band_0, ChunkFingerprint.band_1, ChunkFingerprint.band_2, ChunkFingerprint.band_3]
+        result = await db.execute(
+            select(ChunkFingerprint.vector_id, ChunkFingerprint.doc_id, ChunkFingerprint.simhash)
+            .where(or_(*(column.in_(sorted(values)) for column, values in zip(columns, bands))))
+        )
+        return [(vector_id, doc_id, to_unsigned(value)) for vector_id, doc_id, value in result.all()]
+
+    async def plan(
+        self,
+        db: AsyncSession,
+        chunks: List[Dict[str, Any]],
+        vector_ids: List[str],
+        version: int = 1
+    ) -> DedupPlan:
+        """Find the chunks of a batch (with doc_id in their metadata) that need not be indexed"""
+        plan = DedupPlan(chunks, vector_ids, version)
+        if not self.enabled:
+            plan.fingerprints = [None] * len(chunks)
+            return plan
+        # SimHash is pure Python/NumPy work; keep it off the event loop
+        plan.fingerprints = await asyncio.to_thread(self._fingerprints, [chunk["text"] for chunk in chunks])
+        candidates = await self._candidates(db, [f for f in plan.fingerprints if f is not None])
+        plan.duplicate_of = match_duplicates(
+            plan.fingerprints,
+            [chunk["metadata"]["doc_id"] for chunk in chunks],
+            vector_ids,
+            candidates,
+            self.max_distance
+        )
+        self.stats["chunks"] += len(chunks)
+        self.stats["duplicates"] += len(plan.duplicate_of)
+        return plan
+
+    async def record(self, db: AsyncSession, plan: DedupPlan, store):
+        """After the plan's unique chunks are indexed: store their fingerprints and the references"""
+        rows = [
+            {
+                "vector_id": plan.vector_ids[i],
+                "doc_id": plan.chunks[i]["metadata"]["doc_id"],
+                "simhash": to_signed(plan.fingerprints[i]),
+                **{f"band_{band}": value for band, value in enumerate(fingerprint_bands(plan.fingerprints[i]))}
+            }
+            for i in plan.unique
+            if plan.fingerprints[i] is not None
+        ]
+        references = [
+            {
+                "vector_id": canonical,
+                "doc_id": plan.chunks[i]["metadata"]["doc_id"],
+                "version": plan.version,
+                "chunk_index": plan.chunks[i]["metadata"]["chunk_index"],
+                "metadata_json": json.dumps(plan.chunks[i]["metadata"], default=str)
+            }
+            for i, canonical in plan.duplicate_of.items()
+        ]
+        # A retried ingest writes the same vector ids and chunks again
+        if rows:
+            statement = insert(ChunkFingerprint)
+            await db.execute(
+                statement.on_conflict_do_update(
+                    index_elements=["vector_id"],
+                    set_={key: statement.excluded[key] for key in ("doc_id", "simhash", "band_0", "band_1", "band_2", "band_3")}
+                ),
+                rows
+            )
+        if references:
+            await db.execute(insert(ChunkReference).on_conflict_do_nothing(), references)
+        if rows or references:
+            await db.commit()
+        if references:
+            await self.refresh_references(db, {ref["vector_id"] for ref in references}, store)
+
+    async def release(
+        self,
+        db: AsyncSession,
+        doc_id: int,
+        store,
+        keep_vector_ids: Iterable[str] = (),
+        keep_references: Iterable[Tuple[str, int, int]] = ()
+    ) -> Set[str]:
+        """
+        Forget a document's fingerprints and references before its vectors
+        are deleted, except the vectors and (vector id, chunk index, version)
+        references it keeps. Canonical vectors that other documents still
+        reference are handed to the first of them; their ids are returned
+        and must not be deleted.
+        """
+        keep_vector_ids, keep_references = set(keep_vector_ids), set(keep_references)
+        result = await db.execute(select(ChunkReference).where(ChunkReference.doc_id == doc_id))
+        dropped = [
+            ref for ref in result.scalars().all()
+            if (ref.vector_id, ref.chunk_index, ref.version) not in keep_references
+        ]
+        result = await db.execute(select(ChunkFingerprint).where(ChunkFingerprint.doc_id == doc_id))
+        released = [fp.vector_id for fp in result.scalars().all() if fp.vector_id not in keep_vector_ids]
+
+        heirs: Dict[str, ChunkReference] = {}
+        if released:
+            result = await db.execute(
+                select(ChunkReference)
+                .where(ChunkReference.vector_id.in_(released), ChunkReference.doc_id != doc_id)
+                .order_by(ChunkReference.doc_id, ChunkReference.version, ChunkReference.chunk_index)
+            )
+            for ref in result.scalars().all():
+                heirs.setdefault(ref.vector_id, ref)
+
+        if dropped:
+            await db.execute(delete(ChunkReference).where(ChunkReference.id.in_([ref.id for ref in dropped])))
+        for vector_id, heir in heirs.items():
+            await db.execute(
+                update(ChunkFingerprint).where(ChunkFingerprint.vector_id == vector_id).values(doc_id=heir.doc_id)
+            )
+            await db.execute(delete(ChunkReference).where(ChunkReference.id == heir.id))
+        orphaned = [vector_id for vector_id in released if vector_id not in heirs]
+        if orphaned:
+            await db.execute(delete(ChunkFingerprint).where(ChunkFingerprint.vector_id.in_(orphaned)))
+        await db.commit()
+
+        if heirs:
+            # The vector now belongs to the heir's chunk: same text, the heir's provenance
+            await run_in_vector_executor(
+                update_metadata,
+                store,
+                {vector_id: json.loads(heir.metadata_json) for vector_id, heir in heirs.items()},
+                merge=False
+            )
+        affected = ({ref.vector_id for ref in dropped} - set(orphaned)) | set(heirs)
+        if affected:
+            await self.refresh_references(db, affected, store)
+        return set(heirs)
+
+    async def refresh_references(self, db: AsyncSession, vector_ids: Set[str], store):
+        """Write the documents referencing each canonical vector into its metadata"""
+        result = await db.execute(
+            select(ChunkReference).where(ChunkReference.vector_id.in_(sorted(vector_ids)))
+            .order_by(ChunkReference.doc_id, ChunkReference.chunk_index)
+        )
+        references: Dict[str, List[Dict[str, Any]]] = {vector_id: [] for vector_id in vector_ids}
+        for ref in result.scalars().all():
+            listed = references[ref.vector_id]
+            if all(entry["doc_id"] != ref.doc_id for entry in listed):
+                listed.append({"doc_id": ref.doc_id, "title": json.loads(ref.metadata_json or "{}").get("title")})
+        try:
+            await run_in_vector_executor(
+                update_metadata, store, {vector_id: {"references": refs} for vector_id, refs in references.items()}
+            )
+        except Exception as e:
+            # Metadata is informational; the reference rows stay correct
+            logger.warning(f"Could not update references of {len(vector_ids)} vectors: {str(e)}")
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "max_distance": self.max_distance,
+            **self.stats,
+            "duplicate_rate": round(self.stats["duplicates"] / self.stats["chunks"], 3) if self.stats["chunks"] else 0.0
+        }
+
+
+# Global instance
+chunk_dedup = ChunkDeduplicator()
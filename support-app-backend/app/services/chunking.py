@@ -0,0 +1,145 @@
+# app/services/chunking.py
+"""
+Chunking stage for the RAG ingestion pipeline.
+Splits processor output into small, overlapping chunks that carry
+provenance metadata (doc_id, page, sheet, section, offset).
+"""
+import re
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from ..config import settings
+
+# Markdown-style headings ("# Title", "## Steps") start a new section
+HEADING_PATTERN = re.compile(r"^\s{0,3}#{1,6}\s+(.+?)\s*#*\s*$")
+
+# Provenance keys copied from a segment onto each of its chunks
+SEGMENT_METADATA_KEYS = ("page", "sheet", "section")
+
+
+def iter_markdown_sections(lines: Iterable[str], max_chars: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Group lines into segments at heading lines. With max_chars, a longer
+    section is yielded in parts that keep the section name, so lines can be
+    streamed from a file without holding the whole text.
+    """
+    current_lines: List[str] = []
+    current_chars = 0
+    current_section: Optional[str] = None
+
+    for line in lines:
+        line = line.rstrip("\n")
+        match = HEADING_PATTERN.match(line)
+        too_long = max_chars is not None and current_chars + len(line) > max_chars
+        if current_lines and (match or too_long):
+            yield {"text": "\n".join(current_lines), "section": current_section}
+            current_lines = []
+            current_chars = 0
+        if match:
+            current_section = match.group(1)
+        current_lines.append(line)
+        current_chars += len(line) + 1
+
+    if current_lines:
+        yield {"text": "\n".join(current_lines), "section": current_section}
+
+
+def split_markdown_sections(text: str) -> List[Dict[str, Any]]:
+    """Split markdown/plain text into segments at heading lines"""
+    return list(iter_markdown_sections(text.splitlines()))
+
+
+class TextChunker:
+    """Splits document segments into overlapping chunks with provenance metadata"""
+
+    def __init__(self, chunk_size: Optional[int] = None, chunk_overlap: Optional[int] = None):
+        self.chunk_size = chunk_size or settings.CHUNK_SIZE
+        self.chunk_overlap = settings.CHUNK_OVERLAP if chunk_overlap is None else chunk_overlap
+        if self.chunk_overlap >= self.chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            add_start_index=True
+        )
+
+    def split_segments(
+        self,
+        segments: List[Dict[str, Any]],
+        base_metadata: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Split processor segments into chunks.
+
+        Chunks never cross a segment boundary, so a chunk always belongs to
+        exactly one page, sheet or section. Offsets are character positions
+        in the full document text (segments joined with newlines).
+
+        Returns:
+            List of {"text": ..., "metadata": {...}} dicts
+        """
+        chunks = self.stream(base_metadata).add(segments)
+        for chunk in chunks:
+            chunk["metadata"]["chunk_count"] = len(chunks)
+        return chunks
+
+    def stream(self, base_metadata: Optional[Dict[str, Any]] = None) -> "ChunkStream":
+        """Chunker for a document whose segments arrive in batches"""
+        return ChunkStream(self, base_metadata)
+
+
+class ChunkStream:
+    """
+    Chunks one document batch by batch, carrying offsets and chunk indexes
+    across batches. The total chunk count is unknown until the end, so
+    streamed chunks have no chunk_count.
+    """
+
+    def __init__(self, chunker: TextChunker, base_metadata: Optional[Dict[str, Any]] = None):
+        self.chunker = chunker
+        self.base_metadata = base_metadata or {}
+        self.offset = 0
+        self.chunk_count = 0
+
+    def add(self, segments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        chunks = []
+        for segment in segments:
+            segment_text = segment.get("text") or ""
+            provenance = {
+                key: segment[key]
+                for key in SEGMENT_METADATA_KEYS
+                if segment.get(key) is not None
+            }
+
+            if segment_text.strip():
+                for piece in self.chunker.splitter.create_documents([segment_text]):
+                    chunks.append({
+                        "text": piece.page_content,
+                        "metadata": {
+                            **self.base_metadata,
+                            **provenance,
+                            "offset": self.offset + piece.metadata.get("start_index", 0),
+                            "chunk_index": self.chunk_count
+                        }
+                    })
+                    self.chunk_count += 1
+
+            self.offset += len(segment_text) + 1  # newline separator
+
+        return chunks
+
+
+def format_provenance(metadata: Dict[str, Any]) -> str:
+    """Short human-readable source label for a chunk, e.g. 'guide.pdf, p. 3'"""
+    parts = [str(metadata.get("title") or "document")]
+    if metadata.get("page") is not None:
+        parts.append(f"p. {metadata['page']}")
+    if metadata.get("sheet"):
+        parts.append(f"sheet {metadata['sheet']}")
+    if metadata.get("section"):
+        parts.append(str(metadata["section"]))
+    return ", ".join(parts)
+
+
+# Global instance
+text_chunker = TextChunker()
@@ -0,0 +1,105 @@
+# app/services/context_packer.py
+"""
+Token-budgeted context packing for the enhanced RAG prompt.
+Passages from every retrieval source are taken in relevance order and
+added greedily while they fit the budget. Near-identical passages
+(SimHash) are dropped and long passages such as tickets are truncated, so
+prompt size, and with it Gemini latency and cost, stays bounded.
+"""
+import math
+import logging
+from typing import Any, Dict, List, Optional
+
+from .dedup import simhash, is_near_duplicate
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# Rough Gemini/SentencePiece ratio for English text
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count without a tokenizer round trip"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to about max_tokens, at a word boundary"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars - 1]
+    if " " in cut:
+        cut = cut[:cut.rfind(" ")]
+    return cut.rstrip() + "…"
+
+
+class ContextPacker:
+    """Selects prompt passages under a token budget"""
+
+    def __init__(
+        self,
+        token_budget: Optional[int] = None,
+        max_distance: Optional[int] = None
+    ):
+        self.token_budget = token_budget or settings.CONTEXT_TOKEN_BUDGET
+        self.max_distance = max_distance if max_distance is not None else settings.CONTEXT_DEDUP_MAX_DISTANCE
+
+    def pack(self, passages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Greedily pack passages by descending score.
+
+        Args:
+            passages: Dicts with "text" (as it will appear in the prompt),
+                "score" (higher is more relevant), optional "max_tokens"
+                (truncation cap) and optional "fingerprint_text" (text used
+                for duplicate detection, default "text")
+
+        Returns:
+            Dict with "passages" (selected, most relevant first, text possibly
+            truncated), "tokens", "budget", "dropped_duplicates",
+            "dropped_over_budget" and "truncated"
+        """
+        selected: List[Dict[str, Any]] = []
+        fingerprints: List[int] = []
+        used = 0
+        stats = {"dropped_duplicates": 0, "dropped_over_budget": 0, "truncated": 0}
+
+        for passage in sorted(passages, key=lambda p: p.get("score", 0.0), reverse=True):
+            text = passage["text"]
+            if passage.get("max_tokens") and estimate_tokens(text) > passage["max_tokens"]:
+                text = truncate_to_tokens(text, passage["max_tokens"])
+                stats["truncated"] += 1
+
+            fingerprint = simhash(passage.get("fingerprint_text") or text)
+            if any(is_near_duplicate(fingerprint, seen, self.max_distance) for seen in fingerprints):
+                stats["dropped_duplicates"] += 1
+                continue
+
+            tokens = estimate_tokens(text)
+            if used + tokens > self.token_budget:
+                # Keep going: a shorter, less relevant passage may still fit
+                stats["dropped_over_budget"] += 1
+                continue
+
+            selected.append({**passage, "text": text, "tokens": tokens})
+            fingerprints.append(fingerprint)
+            used += tokens
+
+        if stats["dropped_duplicates"] or stats["dropped_over_budget"]:
+            logger.debug(
+                f"Context packed {len(selected)}/{len(passages)} passages ({used} tokens), "
+                f"{stats['dropped_duplicates']} duplicates, {stats['dropped_over_budget']} over budget"
+            )
+
+        return {
+            "passages": selected,
+            "tokens": used,
+            "budget": self.token_budget,
+            **stats
+        }
+
+
+# Global instance
+context_packer = ContextPacker()
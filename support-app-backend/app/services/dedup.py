@@ -0,0 +1,62 @@
+# app/services/dedup.py
+"""
+Near-duplicate detection with SimHash.
+A 64-bit SimHash is built from hashed character shingles of the normalized
+text; texts whose fingerprints differ in only a few bits share most of
+their shingles, so copies of the same paragraph (different punctuation,
+spacing or a changed word) are caught without comparing the texts.
+"""
+import hashlib
+import re
+from typing import Iterable, List
+
+import numpy as np
+
+SIMHASH_BITS = 64
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_for_fingerprint(text: str) -> str:
+    """Lower-case words separated by single spaces (punctuation dropped)"""
+    return " ".join(_WORD_RE.findall(text.lower()))
+
+
+def shingles(text: str, size: int = 4) -> List[str]:
+    """
+    Character n-grams of the normalized text. Character shingles are more
+    stable than word shingles on short passages, where one changed word
+    would otherwise flip a large share of the grams.
+    """
+    normalized = normalize_for_fingerprint(text)
+    if len(normalized) <= size:
+        return [normalized] if normalized else []
+    return [normalized[i:i + size] for i in range(len(normalized) - size + 1)]
+
+
+def _hash64(values: Iterable[str]) -> np.ndarray:
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(v.encode("utf-8"), digest_size=8).digest(), "little") for v in values],
+        dtype=np.uint64
+    )
+
+
+def simhash(text: str, shingle_size: int = 4) -> int:
+    """64-bit SimHash fingerprint of a text (0 for text without words)"""
+    grams = shingles(text, shingle_size)
+    if not grams:
+        return 0
+    hashes = _hash64(grams)
+    # One row of 64 bits per shingle; each bit votes +1/-1
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(grams)
+    return int.from_bytes(np.packbits(votes > 0, bitorder="little").tobytes(), "little")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def is_near_duplicate(a: int, b: int, max_distance: int = 6) -> bool:
+    """True when two SimHash fingerprints differ in at most max_distance bits"""
+    return hamming_distance(a, b) <= max_distance
@@ -1,23 +1,80 @@
 # app/services/document_processors.py
-import io
+"""
+Document processors. An upload is spooled to a temporary file and read
+from there in bounded pieces (PDF page ranges, sheet row blocks, text
+sections), so a processor's stream() yields segment batches that can be
+chunked and embedded before the rest of the file is read.
+"""
+import asyncio
 import logging
-from typing import Dict, Any, Optional
+import os
+import shutil
+import tempfile
+from typing import Dict, Any, AsyncIterator, List, Optional
 from fastapi import UploadFile, HTTPException
-from PIL import Image
-import pytesseract
-import openpyxl
-from docx import Document as DocxDocument
-import PyPDF2
+from . import parsers
+from .chunking import iter_markdown_sections
+from .parse_pool import RETRYABLE_ERRORS, parse_pool
+from .ocr_cache import ocr_service
+from ..config import settings
 
 logger = logging.getLogger(__name__)
 
+SPOOL_BLOCK_SIZE = 1024 * 1024
+# Text is read in sections of at most this many characters, and sections are
+# yielded in batches of about this size
+TEXT_SECTION_MAX_CHARS = 20000
+TEXT_BATCH_CHARS = 200000
+
+
+async def spool_upload(file: UploadFile, path: Optional[str] = None) -> str:
+    """
+    Copy an upload to path (default: a new temporary file) in fixed-size
+    blocks, so the whole file is never held in memory. The caller removes
+    the file.
+    """
+    suffix = os.path.splitext(file.filename or '')[1].lower()
+
+    def copy() -> str:
+        if path is None:
+            spool = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+        else:
+            spool = open(path, 'wb')
+        with spool:
+            try:
+                file.file.seek(0)
+                shutil.copyfileobj(file.file, spool, SPOOL_BLOCK_SIZE)
+            except BaseException:
+                os.unlink(spool.name)
+                raise
+        return spool.name
+
+    return await asyncio.to_thread(copy)
+
+
+def remove_file(path: str):
+    """Delete a spooled file if it still exists"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _remaining(deadline: float) -> float:
+    return max(deadline - asyncio.get_running_loop().time(), 0.001)
+
+
 class DocumentProcessor:
     """Base class for document processors"""
     
+    def __init__(self):
+        # Filled in by stream() before its first batch
+        self.metadata: Dict[str, Any] = {}
+    
     @staticmethod
-    def get_processor(file: UploadFile) -> 'DocumentProcessor':
-        """Factory method to get appropriate processor based on file type"""
-        filename = file.filename.lower()
+    def for_filename(filename: str) -> 'DocumentProcessor':
+        """Factory method to get appropriate processor based on file name"""
+        filename = filename.lower()
         
         if filename.endswith(('.jpg', '.jpeg', '.png')):
             return ImageProcessor()
@@ -35,27 +92,58 @@ class DocumentProcessor:
                 detail=f"Unsupported file type: {filename}. Supported formats: PDF, TXT, DOC, DOCX, MD, XLSX, XLS, JPG, JPEG, PNG"
             )
     
-    async def process(self, file: UploadFile) -> Dict[str, Any]:
-        """Process the file and extract text content"""
+    @staticmethod
+    def get_processor(file: UploadFile) -> 'DocumentProcessor':
+        """Factory method to get appropriate processor based on file type"""
+        return DocumentProcessor.for_filename(file.filename)
+    
+    def stream(self, path: str) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield segment batches, in document order, from a spooled file"""
         raise NotImplementedError
+    
+    async def process(self, file: UploadFile) -> Dict[str, Any]:
+        """Process the whole file and return its text, segments and metadata"""
+        path = await spool_upload(file)
+        try:
+            return await self.process_path(path)
+        finally:
+            os.unlink(path)
+    
+    async def process_path(self, path: str) -> Dict[str, Any]:
+        """Process a file on disk and return its text, segments and metadata"""
+        segments = []
+        async for batch in self.stream(path):
+            segments.extend(batch)
+        
+        text = '\n'.join(segment['text'] for segment in segments)
+        return {
+            'text': text,
+            'segments': segments,
+            'metadata': {**self.metadata, 'length': len(text)}
+        }
 
 
 class TextProcessor(DocumentProcessor):
     """Processor for text and markdown files"""
     
-    async def process(self, file: UploadFile) -> Dict[str, Any]:
+    async def stream(self, path: str) -> AsyncIterator[List[Dict[str, Any]]]:
+        self.metadata = {'file_type': 'text', 'encoding': 'utf-8'}
         try:
-            content = await file.read()
-            text = content.decode('utf-8')
-            
-            return {
-                'text': text,
-                'metadata': {
-                    'file_type': 'text',
-                    'encoding': 'utf-8',
-                    'length': len(text)
-                }
-            }
+            with open(path, encoding='utf-8') as text_file:
+                sections = iter_markdown_sections(text_file, max_chars=TEXT_SECTION_MAX_CHARS)
+                batch, batch_chars = [], 0
+                while True:
+                    # File reads happen off the event loop
+                    section = await asyncio.to_thread(next, sections, None)
+                    if section is None:
+                        break
+                    batch.append(section)
+                    batch_chars += len(section['text'])
+                    if batch_chars >= TEXT_BATCH_CHARS:
+                        yield batch
+                        batch, batch_chars = [], 0
+                if batch:
+                    yield batch
         except UnicodeDecodeError:
             raise HTTPException(status_code=400, detail="Unable to decode text file as UTF-8")
 
@@ -63,26 +151,25 @@ class TextProcessor(DocumentProcessor):
 class PDFProcessor(DocumentProcessor):
     """Processor for PDF files"""
     
-    async def process(self, file: UploadFile) -> Dict[str, Any]:
+    async def stream(self, path: str) -> AsyncIterator[List[Dict[str, Any]]]:
         try:
-            content = await file.read()
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
-            
-            text_parts = []
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text_parts.append(page.extract_text())
+            deadline = asyncio.get_running_loop().time() + parse_pool.timeout
+            page_count = await parse_pool.run(parsers.count_pdf_pages, path)
+            self.metadata = {'file_type': 'pdf', 'pages': page_count}
             
-            text = '\n'.join(text_parts)
-            
-            return {
-                'text': text,
-                'metadata': {
-                    'file_type': 'pdf',
-                    'pages': len(pdf_reader.pages),
-                    'length': len(text)
-                }
-            }
+            # Page ranges are extracted in parallel, one wave of ranges at a
+            # time, so only a wave's text is in memory
+            pages_per_task = settings.PARSE_PDF_PAGES_PER_TASK
+            ranges = [(path, start, start + pages_per_task) for start in range(0, page_count, pages_per_task)]
+            for i in range(0, len(ranges), parse_pool.max_concurrent):
+                parts = await parse_pool.run_many(
+                    parsers.parse_pdf_pages,
+                    ranges[i:i + parse_pool.max_concurrent],
+                    timeout=_remaining(deadline)
+                )
+                yield [segment for part in parts for segment in part['segments']]
+        except RETRYABLE_ERRORS:
+            raise
         except Exception as e:
             logger.error(f"Error processing PDF: {str(e)}")
             raise HTTPException(status_code=400, detail=f"Error processing PDF file: {str(e)}")
@@ -91,25 +178,14 @@ class PDFProcessor(DocumentProcessor):
 class DocxProcessor(DocumentProcessor):
     """Processor for DOCX files"""
     
-    async def process(self, file: UploadFile) -> Dict[str, Any]:
+    async def stream(self, path: str) -> AsyncIterator[List[Dict[str, Any]]]:
         try:
-            content = await file.read()
-            doc = DocxDocument(io.BytesIO(content))
-            
-            text_parts = []
-            for paragraph in doc.paragraphs:
-                text_parts.append(paragraph.text)
-            
-            text = '\n'.join(text_parts)
-            
-            return {
-                'text': text,
-                'metadata': {
-                    'file_type': 'docx',
-                    'paragraphs': len(doc.paragraphs),
-                    'length': len(text)
-                }
-            }
+            # python-docx reads the whole document part, so DOCX is parsed in one task
+            parsed = await parse_pool.run(parsers.parse_docx, path)
+            self.metadata = {'file_type': 'docx', 'paragraphs': parsed['paragraphs']}
+            yield parsed['segments']
+        except RETRYABLE_ERRORS:
+            raise
         except Exception as e:
             logger.error(f"Error processing DOCX: {str(e)}")
             raise HTTPException(status_code=400, detail=f"Error processing DOCX file: {str(e)}")
@@ -118,53 +194,30 @@ class DocxProcessor(DocumentProcessor):
 class ExcelProcessor(DocumentProcessor):
     """Processor for Excel files (XLSX, XLS)"""
     
-    async def process(self, file: UploadFile) -> Dict[str, Any]:
+    async def stream(self, path: str) -> AsyncIterator[List[Dict[str, Any]]]:
         try:
-            content = await file.read()
-            workbook = openpyxl.load_workbook(io.BytesIO(content), data_only=True)
-            
-            text_parts = []
-            sheet_info = []
-            
-            for sheet_name in workbook.sheetnames:
-                worksheet = workbook[sheet_name]
-                sheet_text = []
-                row_count = 0
-                
-                # Add sheet name as header
-                sheet_text.append(f"=== Sheet: {sheet_name} ===")
-                
-                for row in worksheet.iter_rows(values_only=True):
-                    if any(cell is not None for cell in row):  # Skip empty rows
-                        row_text = '\t'.join(str(cell) if cell is not None else '' for cell in row)
-                        sheet_text.append(row_text)
-                        row_count += 1
-                
-                sheet_content = '\n'.join(sheet_text)
-                text_parts.append(sheet_content)
-                
-                sheet_info.append({
-                    'name': sheet_name,
-                    'rows': row_count,
-                    'columns': worksheet.max_column
-                })
-            
-            text = '\n\n'.join(text_parts)
+            deadline = asyncio.get_running_loop().time() + parse_pool.timeout
+            sheet_names = await parse_pool.run(parsers.list_excel_sheets, path)
             
             # Flatten sheet info for ChromaDB compatibility
-            sheet_names = ', '.join([info['name'] for info in sheet_info])
-            total_rows = sum([info['rows'] for info in sheet_info])
-            
-            return {
-                'text': text,
-                'metadata': {
-                    'file_type': 'excel',
-                    'sheet_names': sheet_names,
-                    'total_sheets': len(workbook.sheetnames),
-                    'total_rows': total_rows,
-                    'length': len(text)
-                }
+            self.metadata = {
+                'file_type': 'excel',
+                'sheet_names': ', '.join(sheet_names),
+                'total_sheets': len(sheet_names)
             }
+            
+            # One sheet at a time, streamed in row blocks; the row total is
+            # only known once every sheet has been read
+            total_rows = 0
+            for sheet_name in sheet_names:
+                parsed = await parse_pool.run(
+                    parsers.parse_excel_sheet, path, sheet_name, timeout=_remaining(deadline)
+                )
+                total_rows += parsed['rows']
+                yield parsed['segments']
+            self.metadata['total_rows'] = total_rows
+        except RETRYABLE_ERRORS:
+            raise
         except Exception as e:
             logger.error(f"Error processing Excel file: {str(e)}")
             raise HTTPException(status_code=400, detail=f"Error processing Excel file: {str(e)}")
@@ -173,37 +226,29 @@ class ExcelProcessor(DocumentProcessor):
 class ImageProcessor(DocumentProcessor):
     """Processor for image files using OCR"""
     
-    async def process(self, file: UploadFile) -> Dict[str, Any]:
+    async def stream(self, path: str) -> AsyncIterator[List[Dict[str, Any]]]:
         try:
-            content = await file.read()
-            
-            # Open image with Pillow
-            image = Image.open(io.BytesIO(content))
-            
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Use pytesseract to extract text
-            text = pytesseract.image_to_string(image)
+            # Cached by image content; OCR runs in the parse pool with its own concurrency limit
+            parsed = await ocr_service.extract(path)
             
             # Clean up extracted text
-            text = text.strip()
+            text = parsed['text']
             if not text:
                 text = "[No text detected in image]"
             
-            return {
-                'text': text,
-                'metadata': {
-                    'file_type': 'image',
-                    'image_format': image.format or 'unknown',
-                    'image_width': image.size[0],
-                    'image_height': image.size[1],
-                    'image_mode': image.mode,
-                    'length': len(text),
-                    'ocr_confidence': 'basic'  # pytesseract basic extraction
-                }
+            self.metadata = {
+                'file_type': 'image',
+                'image_format': parsed['image_format'],
+                'image_width': parsed['image_width'],
+                'image_height': parsed['image_height'],
+                'image_mode': parsed['image_mode'],
+                'ocr_confidence': 'basic',  # pytesseract basic extraction
+                'ocr_downscaled': parsed.get('ocr_downscaled', False),
+                'ocr_cache': parsed['ocr_cache']
             }
+            yield [{'text': text}]
+        except RETRYABLE_ERRORS:
+            raise
         except Exception as e:
             logger.error(f"Error processing image: {str(e)}")
             raise HTTPException(status_code=400, detail=f"Error processing image file: {str(e)}. Make sure tesseract is installed on the system.")
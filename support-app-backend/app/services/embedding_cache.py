@@ -0,0 +1,268 @@
+# app/services/embedding_cache.py
+"""
+Cached, batched embedding service.
+Embeddings are cached in Redis keyed by (model name, normalized text hash),
+so re-ingesting the same content does not call the embedding backend again.
+Cache misses are embedded in sized batches with bounded concurrency.
+Query embeddings use a two-level cache: an in-process LRU in front of Redis.
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import time
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from .embeddings import embeddings
+from .cache import (
+    cache_get, cache_set, cache_get_sync, cache_set_sync, cache_get_many, cache_set_many, CacheKeys, CacheTTL
+)
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text for cache keys (unicode form and whitespace)"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def embedding_cache_key(text: str, model_name: Optional[str] = None) -> str:
+    """Cache key for the embedding of a text under a given model"""
+    model_name = model_name or settings.GEMINI_EMBEDDING_MODEL
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{CacheKeys.EMBEDDING}{model_name}:{digest}"
+
+
+def query_embedding_cache_key(query: str, model_name: Optional[str] = None) -> str:
+    """
+    Cache key for a query embedding. Queries are case-folded as well, since
+    "Reset password" and "reset password" should share one entry.
+    """
+    model_name = model_name or settings.GEMINI_EMBEDDING_MODEL
+    digest = hashlib.sha256(normalize_text(query).casefold().encode("utf-8")).hexdigest()
+    return f"{CacheKeys.QUERY_EMBEDDING}{model_name}:{digest}"
+
+
+def encode_vector(vector: List[float]) -> str:
+    """Pack a vector as base64 float32 (about 4x smaller than JSON floats)"""
+    return base64.b64encode(array("f", vector).tobytes()).decode("ascii")
+
+
+def decode_vector(payload: str) -> List[float]:
+    """Unpack a base64 float32 vector"""
+    values = array("f")
+    values.frombytes(base64.b64decode(payload))
+    return values.tolist()
+
+
+class EmbeddingService:
+    """Embeds texts through the configured backend with a shared Redis cache"""
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else embeddings
+        self.batch_size = settings.EMBEDDING_BATCH_SIZE
+        self.max_concurrency = settings.EMBEDDING_MAX_CONCURRENCY
+
+        # Level 1 query cache (per worker); level 2 is Redis (shared)
+        self.query_cache_size = settings.QUERY_EMBEDDING_CACHE_SIZE
+        self._query_lru: "OrderedDict[str, List[float]]" = OrderedDict()
+        # The LRU and query_stats are also used from worker threads (see CachedQueryEmbeddings)
+        self._lru_lock = threading.Lock()
+        self.query_stats = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "miss_ms_total": 0.0
+        }
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.backend, "model_name", None) or settings.GEMINI_EMBEDDING_MODEL
+
+    async def embed_documents(self, texts: List[str]) -> Dict[str, Any]:
+        """
+        Embed a list of texts, sending only cache misses to the backend.
+
+        Returns:
+            Dict with "vectors" (aligned with texts), "cache_hits" and "embedded"
+        """
+        if self.backend is None:
+            raise RuntimeError("Embedding backend not configured")
+
+        keys = [embedding_cache_key(text, self.model_name) for text in texts]
+
+        # Identical texts within one call share a key and are embedded once
+        unique_keys = list(dict.fromkeys(keys))
+        cached = await cache_get_many(unique_keys)
+        vectors_by_key = {
+            key: decode_vector(payload)
+            for key, payload in zip(unique_keys, cached)
+            if payload
+        }
+
+        misses: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors_by_key and key not in misses:
+                misses[key] = text
+
+        if misses:
+            new_vectors = await self._embed_in_batches(list(misses.values()))
+            fresh = dict(zip(misses.keys(), new_vectors))
+            vectors_by_key.update(fresh)
+            await cache_set_many(
+                {key: encode_vector(vector) for key, vector in fresh.items()},
+                ttl=CacheTTL.EMBEDDING
+            )
+
+        return {
+            "vectors": [vectors_by_key[key] for key in keys],
+            "cache_hits": len(unique_keys) - len(misses),
+            "embedded": len(misses)
+        }
+
+    async def embed_query(self, query: str) -> Dict[str, Any]:
+        """
+        Embed a search query through the LRU -> Redis -> backend chain.
+
+        Returns:
+            Dict with "vector", "cache" ("local", "redis" or "miss") and "ms"
+        """
+        started = time.perf_counter()
+        key = query_embedding_cache_key(query, self.model_name)
+
+        vector = self._lookup_query(key)
+        if vector is not None:
+            return {"vector": vector, "cache": "local", "ms": (time.perf_counter() - started) * 1000}
+
+        payload = await cache_get(key)
+        if payload:
+            vector = decode_vector(payload)
+            self._remember_query(key, vector)
+            self._count_query("redis_hits")
+            return {"vector": vector, "cache": "redis", "ms": (time.perf_counter() - started) * 1000}
+
+        if self.backend is None:
+            raise RuntimeError("Embedding backend not configured")
+
+        # The Vertex AI client is synchronous, so run it in a thread
+        vector = await asyncio.to_thread(self.backend.embed_query, query)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._count_query("misses", elapsed_ms)
+
+        self._remember_query(key, vector)
+        await cache_set(key, encode_vector(vector), ttl=CacheTTL.QUERY_EMBEDDING)
+        return {"vector": vector, "cache": "miss", "ms": elapsed_ms}
+
+    def embed_query_sync(self, query: str) -> List[float]:
+        """
+        Synchronous query embedding through the same LRU -> Redis -> backend
+        chain, for callers that run in worker threads (e.g. the RetrievalQA
+        chain behind /rag/query).
+        """
+        started = time.perf_counter()
+        key = query_embedding_cache_key(query, self.model_name)
+        vector = self._lookup_query(key)
+        if vector is not None:
+            return vector
+
+        payload = cache_get_sync(key)
+        if payload:
+            vector = decode_vector(payload)
+            self._remember_query(key, vector)
+            self._count_query("redis_hits")
+            return vector
+
+        if self.backend is None:
+            raise RuntimeError("Embedding backend not configured")
+
+        vector = self.backend.embed_query(query)
+        self._count_query("misses", (time.perf_counter() - started) * 1000)
+        self._remember_query(key, vector)
+        cache_set_sync(key, encode_vector(vector), ttl=CacheTTL.QUERY_EMBEDDING)
+        return vector
+
+    def _count_query(self, outcome: str, miss_ms: float = 0.0):
+        with self._lru_lock:
+            self.query_stats[outcome] += 1
+            self.query_stats["miss_ms_total"] += miss_ms
+
+    def _lookup_query(self, key: str) -> Optional[List[float]]:
+        with self._lru_lock:
+            vector = self._query_lru.get(key)
+            if vector is not None:
+                self._query_lru.move_to_end(key)
+                self.query_stats["local_hits"] += 1
+            return vector
+
+    def _remember_query(self, key: str, vector: List[float]):
+        with self._lru_lock:
+            self._query_lru[key] = vector
+            self._query_lru.move_to_end(key)
+            while len(self._query_lru) > self.query_cache_size:
+                self._query_lru.popitem(last=False)
+
+    def query_cache_stats(self) -> Dict[str, Any]:
+        """Hit rates and estimated backend latency saved by the query cache"""
+        with self._lru_lock:
+            stats = dict(self.query_stats)
+            lru_entries = len(self._query_lru)
+        hits = stats["local_hits"] + stats["redis_hits"]
+        lookups = hits + stats["misses"]
+        avg_miss_ms = stats["miss_ms_total"] / stats["misses"] if stats["misses"] else 0.0
+        return {
+            "lookups": lookups,
+            "local_hits": stats["local_hits"],
+            "redis_hits": stats["redis_hits"],
+            "misses": stats["misses"],
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "avg_miss_ms": round(avg_miss_ms, 2),
+            # Every hit avoided roughly one average backend call
+            "estimated_saved_ms": round(hits * avg_miss_ms, 2),
+            "lru_entries": lru_entries,
+            "lru_capacity": self.query_cache_size
+        }
+
+    async def _embed_in_batches(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts in batches of batch_size, at most max_concurrency at a time"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+        async def embed_batch(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                # The Vertex AI client is synchronous, so run it in a thread
+                return await asyncio.to_thread(self.backend.embed_documents, batch)
+
+        results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+        logger.info(f"Embedded {len(texts)} texts in {len(batches)} batches")
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    LangChain Embeddings wrapper handed to the vector store, so retrievers
+    that embed queries synchronously still hit the query cache.
+    """
+
+    def __init__(self, service: EmbeddingService):
+        self.service = service
+
+    @property
+    def model_name(self) -> str:
+        return self.service.model_name
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.service.backend.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.service.embed_query_sync(text)
+
+
+# Global instance
+embedding_service = EmbeddingService()
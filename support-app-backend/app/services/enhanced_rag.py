@@ -1,11 +1,17 @@
 # app/services/enhanced_rag.py
 import asyncio
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from typing import AsyncIterator, List, Dict, Any, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from ..models import Tickets, KBArticles, TicketCategories, ResolutionSteps, TicketRootCauses
-from ..services.vectorstore import vectordb
+from ..services.vectorstore import vectordb, run_in_vector_executor
+from ..services.hybrid_retriever import RetrievalFilters, hybrid_retriever
+from ..services.embedding_cache import embedding_service
+from ..services.answer_cache import answer_cache
+from ..services.loop_monitor import loop_monitor
 from ..services.agents import qa_chain
+from ..services.chunking import format_provenance
+from ..services.context_packer import context_packer, estimate_tokens
 import vertexai
 from vertexai.generative_models import GenerativeModel, GenerationConfig
 from ..config import settings
@@ -36,147 +42,354 @@ class EnhancedRAGService:
         db: AsyncSession,
         include_tickets: bool = True,
         include_kb: bool = True,
-        category_filter: Optional[str] = None
+        category_filter: Optional[str] = None,
+        search_params: Optional[Dict[str, int]] = None,
+        file_type_filter: Optional[str] = None,
+        doc_id_filter: Optional[List[int]] = None
     ) -> Dict[str, Any]:
-        """Enhanced RAG query that includes ticketing system context"""
+        """
+        Enhanced RAG query that includes ticketing system context.
+        Retrieval stages open their own sessions so they can run concurrently;
+        db is kept for callers and is not shared with them. search_params
+        (ef_search / probes) tune the vector search; tuned queries bypass the
+        semantic answer cache. category_filter scopes tickets to a category,
+        file_type_filter and doc_id_filter scope document chunks.
+        """
         
         if not vectordb or not qa_chain:
             raise Exception("RAG system not available - AI configuration incomplete")
         
         try:
-            # Step 1: Get vector similarity results
-            vector_results = vectordb.similarity_search_with_score(query, k=5)
+            started = time.perf_counter()
             
-            # Step 2: Get relevant tickets and KB articles from database
-            context_data = await self._get_contextual_data(query, db, include_tickets, include_kb, category_filter)
+            # Step 1: Embed the query (cached; the backend call runs off the event loop)
+            query_embedding = await embedding_service.embed_query(query)
             
-            # Step 3: Combine all context for enhanced prompt
-            enhanced_context = self._build_enhanced_context(vector_results, context_data)
+            # Reuse the answer of a near-identical earlier query, if any
+            cache_scope = answer_cache.scope_key(
+                include_tickets, include_kb, category_filter, file_type_filter, doc_id_filter
+            )
+            cached = None if search_params else await answer_cache.lookup(query_embedding["vector"], cache_scope)
+            if cached:
+                result = cached["result"]
+                result["query"] = query
+                result["cache"] = {
+                    "hit": True,
+                    "similarity": round(cached["similarity"], 4),
+                    "matched_query": cached["matched_query"]
+                }
+                result["timings"] = {
+                    "query_embedding_ms": round(query_embedding["ms"], 2),
+                    "query_embedding_cache": query_embedding["cache"],
+                    "total_ms": round((time.perf_counter() - started) * 1000, 2),
+                    "loop_blocked_ms": round(loop_monitor.max_lag_since(started) * 1000, 2)
+                }
+                return result
+            
+            # Steps 2-3: Retrieval and prompt context
+            prepared = await self._prepare_context(
+                query, query_embedding, include_tickets, include_kb, search_params,
+                RetrievalFilters(category_filter, file_type_filter, tuple(doc_id_filter or ()))
+            )
             
             # Step 4: Generate response with enhanced context
+            generation_started = time.perf_counter()
             if self.model:
-                response = await self._generate_enhanced_response(query, enhanced_context)
+                response = await self._generate_enhanced_response(query, prepared["enhanced_context"])
             else:
                 # Fallback to basic RAG
-                basic_result = qa_chain.invoke({"query": query})
+                basic_result = await run_in_vector_executor(qa_chain.invoke, {"query": query})
                 response = {
                     "answer": basic_result["result"],
                     "confidence": 0.7
                 }
+            generation_ms = (time.perf_counter() - generation_started) * 1000
             
-            return {
-                "query": query,
-                "answer": response["answer"],
-                "confidence": response.get("confidence", 0.8),
-                "sources": {
-                    "vector_documents": [
-                        {
-                            "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
-                            "metadata": doc.metadata,
-                            "score": float(score)
-                        }
-                        for doc, score in vector_results
-                    ],
-                    "related_tickets": context_data.get("tickets", []),
-                    "kb_articles": context_data.get("kb_articles", [])
-                },
-                "suggested_actions": self._generate_suggested_actions(query, context_data),
-                "category_suggestions": context_data.get("suggested_categories", [])
-            }
+            result = self._assemble_result(
+                query, prepared, response["answer"], response.get("confidence", 0.8),
+                query_embedding, started, generation_ms
+            )
+            
+            # Partial answers are not reused for later queries
+            if not result["degraded_sources"] and not search_params:
+                await answer_cache.store(query_embedding["vector"], cache_scope, query, result)
+            return result
             
         except Exception as e:
             logger.error(f"Error in enhanced RAG query: {str(e)}")
             raise
     
-    async def _get_contextual_data(
-        self, 
-        query: str, 
-        db: AsyncSession, 
-        include_tickets: bool, 
+    async def stream_with_context(
+        self,
+        query: str,
+        include_tickets: bool = True,
+        include_kb: bool = True,
+        category_filter: Optional[str] = None,
+        search_params: Optional[Dict[str, int]] = None,
+        file_type_filter: Optional[str] = None,
+        doc_id_filter: Optional[List[int]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of query_with_context.
+        Yields a "sources" event as soon as retrieval finishes, then one
+        "token" event per generated text chunk, then a "done" event with
+        confidence and timings.
+        """
+        if not vectordb or not qa_chain:
+            raise Exception("RAG system not available - AI configuration incomplete")
+        
+        started = time.perf_counter()
+        query_embedding = await embedding_service.embed_query(query)
+        
+        cache_scope = answer_cache.scope_key(
+            include_tickets, include_kb, category_filter, file_type_filter, doc_id_filter
+        )
+        cached = None if search_params else await answer_cache.lookup(query_embedding["vector"], cache_scope)
+        if cached:
+            result = cached["result"]
+            yield {"event": "sources", "data": {
+                "query": query,
+                "sources": result["sources"],
+                "suggested_actions": result["suggested_actions"],
+                "category_suggestions": result["category_suggestions"],
+                "degraded_sources": []
+            }}
+            yield {"event": "token", "data": {"text": result["answer"]}}
+            yield {"event": "done", "data": {
+                "confidence": result["confidence"],
+                "cache": {
+                    "hit": True,
+                    "similarity": round(cached["similarity"], 4),
+                    "matched_query": cached["matched_query"]
+                },
+                "timings": {
+                    "query_embedding_ms": round(query_embedding["ms"], 2),
+                    "query_embedding_cache": query_embedding["cache"],
+                    "total_ms": round((time.perf_counter() - started) * 1000, 2)
+                }
+            }}
+            return
+        
+        prepared = await self._prepare_context(
+            query, query_embedding, include_tickets, include_kb, search_params,
+            RetrievalFilters(category_filter, file_type_filter, tuple(doc_id_filter or ()))
+        )
+        yield {"event": "sources", "data": {
+            "query": query,
+            "sources": self._format_sources(prepared["vector_results"], prepared["context_data"]),
+            "suggested_actions": self._generate_suggested_actions(query, prepared["context_data"]),
+            "category_suggestions": prepared["context_data"]["suggested_categories"],
+            "degraded_sources": prepared["retrieval"]["degraded"]
+        }}
+        
+        generation_started = time.perf_counter()
+        first_token_ms = None
+        if self.model:
+            parts = []
+            async for text in self._stream_enhanced_response(query, prepared["enhanced_context"]):
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - started) * 1000
+                parts.append(text)
+                yield {"event": "token", "data": {"text": text}}
+            answer = "".join(parts)
+            confidence = self._calculate_confidence(prepared["enhanced_context"], answer)
+        else:
+            # Fallback to basic RAG, sent as a single chunk
+            basic_result = await run_in_vector_executor(qa_chain.invoke, {"query": query})
+            answer = basic_result["result"]
+            confidence = 0.7
+            first_token_ms = (time.perf_counter() - started) * 1000
+            yield {"event": "token", "data": {"text": answer}}
+        generation_ms = (time.perf_counter() - generation_started) * 1000
+        
+        result = self._assemble_result(
+            query, prepared, answer, confidence, query_embedding, started, generation_ms
+        )
+        result["timings"]["first_token_ms"] = round(first_token_ms or 0.0, 2)
+        
+        if not result["degraded_sources"] and not search_params:
+            await answer_cache.store(query_embedding["vector"], cache_scope, query, result)
+        
+        yield {"event": "done", "data": {
+            "confidence": result["confidence"],
+            "cache": result["cache"],
+            "context_packing": result["context_packing"],
+            "timings": result["timings"]
+        }}
+    
+    async def _prepare_context(
+        self,
+        query: str,
+        query_embedding: Dict[str, Any],
+        include_tickets: bool,
         include_kb: bool,
-        category_filter: Optional[str]
+        search_params: Optional[Dict[str, int]] = None,
+        filters: Optional[RetrievalFilters] = None
     ) -> Dict[str, Any]:
-        """Retrieve contextual data from the ticketing system"""
+        """Run hybrid retrieval and build the prompt context"""
+        # Vector documents, similar tickets, KB articles and category
+        # suggestions are fetched concurrently, each with a timeout
+        retrieval_started = time.perf_counter()
+        retrieval = await hybrid_retriever.retrieve(
+            query,
+            query_embedding["vector"],
+            include_tickets=include_tickets,
+            include_kb=include_kb,
+            k=5,
+            search_params=search_params,
+            filters=filters
+        )
+        retrieval_ms = (time.perf_counter() - retrieval_started) * 1000
         context_data = {
-            "tickets": [],
-            "kb_articles": [],
-            "suggested_categories": []
+            "tickets": retrieval["tickets"],
+            "kb_articles": retrieval["kb_articles"],
+            "suggested_categories": retrieval["suggested_categories"]
         }
         
-        # Extract keywords for deeper search
-        keywords = self._extract_keywords(query)
+        context_started = time.perf_counter()
+        context = self._build_enhanced_context(
+            retrieval["documents"], context_data, retrieval["document_scores"]
+        )
+        context_ms = (time.perf_counter() - context_started) * 1000
         
-        if include_tickets:
-            # Search resolved tickets with similar keywords
-            ticket_query = select(Tickets).where(
-                Tickets.status == "Closed",
-                Tickets.description.ilike(f"%{keywords[0]}%") if keywords else True
-            ).limit(5)
-            
-            if category_filter:
-                pass # TODO: Add category join if needed
-                
-            result = await db.execute(ticket_query)
-            tickets = result.scalars().all()
-            
-            for t in tickets:
-                # Fetch resolution steps and root cause
-                # In a real app, you'd use joinedload or selectinload
-                # For this implementation, we'll assume they're loaded or we'd fetch them
-                context_data["tickets"].append({
-                    "id": t.ticket_id,
-                    "subject": t.subject,
-                    "description": t.description,
-                    "resolution_steps": [], # Simplified for this example
-                    "root_cause": {"description": "See ticket details"} # Simplified
-                })
+        return {
+            "retrieval": retrieval,
+            "vector_results": retrieval["documents"],
+            "context_data": context_data,
+            "enhanced_context": context["text"],
+            "context_packing": context["packing"],
+            "retrieval_ms": retrieval_ms,
+            "context_ms": context_ms
+        }
+    
+    def _format_sources(self, vector_results: List, context_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Sources block returned to the client"""
+        return {
+            "vector_documents": [
+                {
+                    "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
+                    "metadata": doc.metadata,
+                    "score": float(score)
+                }
+                for doc, score in vector_results
+            ],
+            "related_tickets": context_data.get("tickets", []),
+            "kb_articles": context_data.get("kb_articles", [])
+        }
+    
+    def _assemble_result(
+        self,
+        query: str,
+        prepared: Dict[str, Any],
+        answer: str,
+        confidence: float,
+        query_embedding: Dict[str, Any],
+        started: float,
+        generation_ms: float
+    ) -> Dict[str, Any]:
+        """Full query_with_context response (also what the answer cache stores)"""
+        context_data = prepared["context_data"]
+        return {
+            "query": query,
+            "answer": answer,
+            "confidence": confidence,
+            "sources": self._format_sources(prepared["vector_results"], context_data),
+            "suggested_actions": self._generate_suggested_actions(query, context_data),
+            "category_suggestions": context_data.get("suggested_categories", []),
+            "timings": {
+                "query_embedding_ms": round(query_embedding["ms"], 2),
+                "query_embedding_cache": query_embedding["cache"],
+                "retrieval_ms": round(prepared["retrieval_ms"], 2),
+                "stages": prepared["retrieval"]["stages"],
+                "context_ms": round(prepared["context_ms"], 2),
+                "generation_ms": round(generation_ms, 2),
+                "total_ms": round((time.perf_counter() - started) * 1000, 2),
+                # Worst event loop stall seen while this request was in flight
+                "loop_blocked_ms": round(loop_monitor.max_lag_since(started) * 1000, 2)
+            },
+            # Size of the prompt context after budgeted packing
+            "context_packing": prepared["context_packing"],
+            # Sources left out because their stage timed out or failed
+            "degraded_sources": prepared["retrieval"]["degraded"],
+            "cache": {"hit": False}
+        }
+    
+    def _build_enhanced_context(
+        self,
+        vector_results: List,
+        context_data: Dict[str, Any],
+        document_scores: Optional[List[float]] = None
+    ) -> Dict[str, Any]:
+        """
+        Build enhanced context from all sources, packed under the token budget.
+        Returns the prompt context "text" and "packing" statistics.
+        """
+        passages = []
         
-        if include_kb:
-            # KB search logic would go here
-            pass
-            
-        return context_data
-
-    def _extract_keywords(self, query: str) -> List[str]:
-        """Extract relevant keywords from the query"""
-        # Simple stopword removal for now
-        stopwords = ['the', 'a', 'an', 'is', 'are', 'how', 'to', 'what', 'why', 'when', 'does', 'it', 'work', 'my', 'is', 'not']
-        words = query.lower().replace('?', '').split()
-        return [w for w in words if w not in stopwords]
-
-    def _build_enhanced_context(self, vector_results: List, context_data: Dict[str, Any]) -> str:
-        """Build enhanced context from all sources"""
-        context_parts = []
+        # Vector search results (matched chunks only, labelled with their source)
+        for position, (doc, _) in enumerate(vector_results):
+            passages.append({
+                "section": "documents",
+                "text": f"- [{format_provenance(doc.metadata)}] {doc.page_content}",
+                "fingerprint_text": doc.page_content,
+                "score": document_scores[position] if document_scores else 0.0
+            })
         
-        # Add vector search results
-        context_parts.append("DOCUMENTATION:")
-        for doc, _ in vector_results:
-            context_parts.append(f"- {doc.page_content}")
-            
-        # Add KB articles
-        if context_data["kb_articles"]:
+        for kb in context_data["kb_articles"]:
+            passages.append({
+                "section": "kb_articles",
+                "text": f"- {kb['title']}: {kb['summary']}",
+                "score": kb.get("score", 0.0)
+            })
+        
+        for ticket in context_data["tickets"]:
+            lines = [f"Ticket #{ticket['id']}: {ticket['subject']}"]
+            if ticket.get("description"):
+                lines.append(f"Description: {ticket['description']}")
+            if ticket.get("root_cause"):
+                lines.append(f"Root Cause: {ticket['root_cause'].get('description')}")
+            if ticket.get("resolution_steps"):
+                lines.append("Resolution Steps:")
+                for step in ticket["resolution_steps"]:
+                    lines.append(f"  - {step.get('instructions')}")
+            passages.append({
+                "section": "tickets",
+                "text": "\n".join(lines),
+                "score": ticket.get("score", 0.0),
+                "max_tokens": settings.CONTEXT_TICKET_MAX_TOKENS
+            })
+        
+        packed = context_packer.pack(passages)
+        by_section = {"documents": [], "kb_articles": [], "tickets": []}
+        for passage in packed["passages"]:
+            by_section[passage["section"]].append(passage["text"])
+        
+        context_parts = ["DOCUMENTATION:"]
+        context_parts.extend(by_section["documents"])
+        if by_section["kb_articles"]:
             context_parts.append("\nKNOWLEDGE BASE ARTICLES:")
-            for kb in context_data["kb_articles"]:
-                context_parts.append(f"- {kb['title']}: {kb['summary']}")
-                
-        # Add resolved tickets
-        if context_data["tickets"]:
+            context_parts.extend(by_section["kb_articles"])
+        if by_section["tickets"]:
             context_parts.append("\nSIMILAR RESOLVED TICKETS:")
-            for ticket in context_data["tickets"]:
-                context_parts.append(f"Ticket #{ticket['id']}: {ticket['subject']}")
-                if ticket.get("root_cause"):
-                    context_parts.append(f"Root Cause: {ticket['root_cause'].get('description')}")
-                if ticket.get("resolution_steps"):
-                    context_parts.append("Resolution Steps:")
-                    for step in ticket["resolution_steps"]:
-                        context_parts.append(f"  - {step.get('instructions')}")
+            context_parts.extend(by_section["tickets"])
+        text = "\n".join(context_parts)
         
-        return "\n".join(context_parts)
+        return {
+            "text": text,
+            "packing": {
+                "packed_tokens": estimate_tokens(text),
+                "budget": packed["budget"],
+                "passages": len(packed["passages"]),
+                "candidates": len(passages),
+                "dropped_duplicates": packed["dropped_duplicates"],
+                "dropped_over_budget": packed["dropped_over_budget"],
+                "truncated": packed["truncated"]
+            }
+        }
     
-    async def _generate_enhanced_response(self, query: str, context: str) -> Dict[str, Any]:
-        """Generate response using Vertex AI Gemini with enhanced context"""
-        
-        prompt = f"""You are an intelligent IT support assistant with access to comprehensive knowledge including:
+    def _build_prompt(self, query: str, context: str) -> str:
+        """Prompt shared by the blocking and streaming generation paths"""
+        return f"""You are an intelligent IT support assistant with access to comprehensive knowledge including:
 - Technical documentation
 - Knowledge base articles
 - Previously resolved support tickets
@@ -200,6 +413,11 @@ USER QUESTION: {query}
 
 Please provide a helpful, accurate response. Include references to specific KB articles or tickets if they're relevant to the solution.
 """
+    
+    async def _generate_enhanced_response(self, query: str, context: str) -> Dict[str, Any]:
+        """Generate response using Vertex AI Gemini with enhanced context"""
+        
+        prompt = self._build_prompt(query, context)
 
         try:
             # Run Vertex AI generation in async context
@@ -227,6 +445,58 @@ Please provide a helpful, accurate response. Include references to specific KB a
             logger.error(f"Error generating Vertex AI response: {str(e)}")
             raise
     
+    async def _stream_enhanced_response(self, query: str, context: str) -> AsyncIterator[str]:
+        """
+        Stream answer text from Vertex AI Gemini as it is generated.
+        The SDK iterator is synchronous, so a worker thread drains it into an
+        asyncio queue; closing this generator (client disconnect) stops it.
+        """
+        prompt = self._build_prompt(query, context)
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        finished = object()
+        stop = threading.Event()
+        
+        def publish(item: Any):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # Event loop already closed
+                stop.set()
+        
+        def produce():
+            try:
+                responses = self.model.generate_content(
+                    prompt,
+                    generation_config=GenerationConfig(
+                        temperature=0.3,
+                        max_output_tokens=800
+                    ),
+                    stream=True
+                )
+                for chunk in responses:
+                    if stop.is_set():
+                        break
+                    if chunk.text:
+                        publish(chunk.text)
+            except Exception as e:
+                publish(e)
+            finally:
+                publish(finished)
+        
+        loop.run_in_executor(None, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is finished:
+                    break
+                if isinstance(item, Exception):
+                    logger.error(f"Error streaming Vertex AI response: {str(item)}")
+                    raise item
+                yield item
+        finally:
+            stop.set()
+    
     def _calculate_confidence(self, context: str, answer: str) -> float:
         """Calculate confidence score for the response"""
         confidence = 0.5  # Base confidence
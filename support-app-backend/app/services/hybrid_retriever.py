@@ -0,0 +1,485 @@
+# app/services/hybrid_retriever.py
+"""
+Hybrid lexical + vector retrieval for the enhanced RAG pipeline.
+The lexical leg runs Postgres full-text search over tickets and KB articles
+(generated tsvector columns with GIN indexes); the vector legs search the
+document store and the closed-ticket and KB article indexes. Ranked lists
+from every leg are merged with reciprocal-rank fusion (RRF), which only
+needs ranks, so FTS and cosine scores never have to be put on the same
+scale. Stages run concurrently, each on its own DB session and with its
+own timeout. With reranking enabled, more document candidates are fused
+and the reranker picks the few that go into the prompt. The tickets that
+make the cut are then completed with their resolution cards in one batched
+lookup. A scoped query (RetrievalFilters) is filtered inside each leg's
+query: JSONB metadata filters in the vector searches, a category join in
+the ticket searches.
+"""
+import asyncio
+import re
+import time
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from sqlalchemy import select, func, cast
+from sqlalchemy.dialects.postgresql import REGCONFIG
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models import Tickets, KBArticles, TicketCategories
+from ..database import AsyncSessionLocal
+from ..config import settings
+from .vectorstore import asimilarity_search_with_score_by_vector
+from .record_index import ticket_index as default_ticket_index, kb_index as default_kb_index
+from .ticket_cards import ticket_cards as default_ticket_cards, empty_card
+from .reranker import reranker as default_reranker
+
+logger = logging.getLogger(__name__)
+
+# Text search configuration used by the generated search_vector columns
+FTS_CONFIG = "english"
+
+
+def reciprocal_rank_fusion(ranked_lists: Dict[str, List[Hashable]], k: int = 60) -> Dict[Hashable, Dict[str, Any]]:
+    """
+    Fuse ranked lists with RRF: score(item) = sum over lists of 1 / (k + rank).
+
+    Args:
+        ranked_lists: List name -> item keys, best first
+        k: Damping constant (60 in the original RRF paper)
+
+    Returns:
+        Item key -> {"score", "ranks": {list name: 1-based rank}}
+    """
+    fused: Dict[Hashable, Dict[str, Any]] = {}
+    for name, items in ranked_lists.items():
+        for rank, key in enumerate(items, start=1):
+            entry = fused.setdefault(key, {"score": 0.0, "ranks": {}})
+            if name in entry["ranks"]:
+                continue
+            entry["score"] += 1.0 / (k + rank)
+            entry["ranks"][name] = rank
+    return fused
+
+
+def build_search_query(query: str) -> str:
+    """
+    Turn a natural-language question into an OR query for websearch_to_tsquery.
+    websearch_to_tsquery ANDs bare words, so a long question would only match
+    rows containing every term; OR-ing them lets ts_rank_cd reward overlap.
+    """
+    terms = re.findall(r"[\w']+", query.lower())
+    return " or ".join(dict.fromkeys(t.strip("'") for t in terms if t.strip("'")))
+
+
+@dataclass(frozen=True)
+class RetrievalFilters:
+    """Scope of a query: ticket category (name), document file type and document ids"""
+    category: Optional[str] = None
+    file_type: Optional[str] = None
+    doc_ids: Tuple[int, ...] = ()
+
+    def document_filter(self) -> Optional[dict]:
+        """Metadata filter for document chunks, or None for all documents"""
+        conditions = []
+        if self.file_type:
+            conditions.append({"file_type": {"$eq": self.file_type}})
+        if self.doc_ids:
+            # A deduplicated chunk's vector belongs to another document and
+            # lists this one in its references
+            conditions.append({"$or": [{"doc_id": {"$in": list(self.doc_ids)}}] + [
+                {"references": {"$contains": [{"doc_id": doc_id}]}} for doc_id in self.doc_ids
+            ]})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+class HybridRetriever:
+    """Single retrieval entry point for query_with_context"""
+
+    def __init__(
+        self,
+        rrf_k: Optional[int] = None,
+        candidates: Optional[int] = None,
+        session_factory: Optional[Callable[[], AsyncSession]] = None,
+        ticket_index=None,
+        kb_index=None,
+        kb_top_k: Optional[int] = None,
+        ticket_cards=None,
+        reranker=None
+    ):
+        self.rrf_k = rrf_k or settings.HYBRID_RRF_K
+        self.candidates = candidates or settings.HYBRID_CANDIDATES
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.ticket_index = ticket_index or default_ticket_index
+        self.kb_index = kb_index or default_kb_index
+        self.ticket_cards = ticket_cards or default_ticket_cards
+        self.reranker = reranker or default_reranker
+        # KB articles are long; fewer of them go into the prompt
+        self.kb_top_k = kb_top_k or settings.RAG_KB_TOP_K
+        # Seconds each stage may take before the answer goes out without it
+        self.timeouts = {
+            "vector": settings.RAG_VECTOR_STAGE_TIMEOUT,
+            "tickets": settings.RAG_TICKETS_STAGE_TIMEOUT,
+            "kb": settings.RAG_KB_STAGE_TIMEOUT,
+            "categories": settings.RAG_CATEGORIES_STAGE_TIMEOUT,
+            "rerank": settings.RAG_RERANK_STAGE_TIMEOUT
+        }
+
+    async def search_documents(
+        self,
+        query_vector: List[float],
+        limit: int,
+        search_params: Optional[Dict[str, int]] = None,
+        filter: Optional[dict] = None
+    ) -> List[Tuple[Any, float]]:
+        """Vector leg: document chunks from the vector store (search_params: ef_search / probes)"""
+        return await asimilarity_search_with_score_by_vector(query_vector, k=limit, filter=filter, **(search_params or {}))
+
+    async def category_id(self, db: AsyncSession, name: str) -> Optional[int]:
+        result = await db.execute(
+            select(TicketCategories.category_id).where(func.lower(TicketCategories.name) == name.lower())
+        )
+        return result.scalar()
+
+    async def search_ticket_vectors(
+        self,
+        db: AsyncSession,
+        query_vector: List[float],
+        limit: int,
+        category: Optional[str] = None
+    ) -> List[Tuple[Tickets, float]]:
+        """Vector leg: closed tickets nearest in the ticket index (of one category), closest first"""
+        filter = None
+        if category:
+            # Ticket vectors carry category_id in their metadata
+            category_id = await self.category_id(db, category)
+            if category_id is None:
+                return []
+            filter = {"category_id": {"$eq": category_id}}
+        matches = await self.ticket_index.search(query_vector, k=limit, filter=filter)
+        if not matches:
+            return []
+        result = await db.execute(select(Tickets).where(Tickets.ticket_id.in_([m["id"] for m in matches])))
+        tickets = {ticket.ticket_id: ticket for ticket in result.scalars().all()}
+        # Vectors of tickets deleted since indexing are skipped
+        return [(tickets[m["id"]], m["distance"]) for m in matches if m["id"] in tickets]
+
+    async def search_tickets(
+        self,
+        db: AsyncSession,
+        query: str,
+        limit: int,
+        category: Optional[str] = None
+    ) -> List[Tuple[Tickets, float]]:
+        """Lexical leg: closed tickets (of one category) ranked by ts_rank_cd"""
+        search_query = build_search_query(query)
+        if not search_query:
+            return []
+
+        ts_query = func.websearch_to_tsquery(cast(FTS_CONFIG, REGCONFIG), search_query)
+        rank = func.ts_rank_cd(Tickets.search_vector, ts_query)
+        statement = (
+            select(Tickets, rank.label("rank"))
+            .where(Tickets.status == "Closed", Tickets.search_vector.op("@@")(ts_query))
+        )
+        if category:
+            statement = statement.join(TicketCategories, Tickets.category_id == TicketCategories.category_id).where(
+                func.lower(TicketCategories.name) == category.lower()
+            )
+        statement = statement.order_by(rank.desc()).limit(limit)
+        result = await db.execute(statement)
+        return [(row.Tickets, float(row.rank)) for row in result]
+
+    async def search_kb_vectors(
+        self,
+        db: AsyncSession,
+        query_vector: List[float],
+        limit: int
+    ) -> List[Tuple[KBArticles, float]]:
+        """Vector leg: KB articles nearest in the KB index, closest first"""
+        matches = await self.kb_index.search(query_vector, k=limit)
+        if not matches:
+            return []
+        result = await db.execute(select(KBArticles).where(KBArticles.kb_id.in_([m["id"] for m in matches])))
+        articles = {article.kb_id: article for article in result.scalars().all()}
+        return [(articles[m["id"]], m["distance"]) for m in matches if m["id"] in articles]
+
+    async def search_kb_articles(self, db: AsyncSession, query: str, limit: int) -> List[Tuple[KBArticles, float]]:
+        """Lexical leg: KB articles ranked by ts_rank_cd"""
+        search_query = build_search_query(query)
+        if not search_query:
+            return []
+
+        ts_query = func.websearch_to_tsquery(cast(FTS_CONFIG, REGCONFIG), search_query)
+        rank = func.ts_rank_cd(KBArticles.search_vector, ts_query)
+        statement = (
+            select(KBArticles, rank.label("rank"))
+            .where(KBArticles.search_vector.op("@@")(ts_query))
+            .order_by(rank.desc())
+            .limit(limit)
+        )
+        result = await db.execute(statement)
+        return [(row.KBArticles, float(row.rank)) for row in result]
+
+    async def suggest_categories(self, db: AsyncSession, query: str, limit: int = 3) -> List[Dict[str, Any]]:
+        """Categories of the closed tickets that best match the query"""
+        search_query = build_search_query(query)
+        if not search_query:
+            return []
+
+        ts_query = func.websearch_to_tsquery(cast(FTS_CONFIG, REGCONFIG), search_query)
+        relevance = func.sum(func.ts_rank_cd(Tickets.search_vector, ts_query))
+        statement = (
+            select(
+                TicketCategories.category_id,
+                TicketCategories.name,
+                func.count(Tickets.ticket_id).label("matches"),
+                relevance.label("relevance")
+            )
+            .join(Tickets, Tickets.category_id == TicketCategories.category_id)
+            .where(Tickets.status == "Closed", Tickets.search_vector.op("@@")(ts_query))
+            .group_by(TicketCategories.category_id, TicketCategories.name)
+            .order_by(relevance.desc())
+            .limit(limit)
+        )
+        result = await db.execute(statement)
+        return [
+            {"category_id": row.category_id, "name": row.name, "matches": row.matches}
+            for row in result
+        ]
+
+    async def _with_session(self, leg: Callable[..., Awaitable[Any]], *args) -> Any:
+        """Run a DB leg on its own session (an AsyncSession is not safe to share across tasks)"""
+        async with self.session_factory() as session:
+            return await leg(session, *args)
+
+    async def _run_stage(self, name: str, stage: Awaitable[Any], timeout: float) -> Dict[str, Any]:
+        """
+        Await one retrieval stage with a timeout. A slow or failing stage
+        yields an empty result instead of failing the whole query.
+        """
+        started = time.perf_counter()
+        try:
+            items = await asyncio.wait_for(stage, timeout=timeout)
+            status = "ok"
+        except asyncio.TimeoutError:
+            # Vector searches already running in the executor thread finish
+            # in the background; only the wait is abandoned
+            logger.warning(f"Retrieval stage '{name}' timed out after {timeout}s")
+            items, status = [], "timeout"
+        except Exception as e:
+            logger.error(f"Retrieval stage '{name}' failed: {str(e)}")
+            items, status = [], "error"
+        return {
+            "items": items,
+            "status": status,
+            "ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    async def retrieve(
+        self,
+        query: str,
+        query_vector: List[float],
+        include_tickets: bool = True,
+        include_kb: bool = True,
+        k: int = 5,
+        search_params: Optional[Dict[str, int]] = None,
+        filters: Optional[RetrievalFilters] = None
+    ) -> Dict[str, Any]:
+        """
+        Run every retrieval stage concurrently and fuse the results.
+
+        Returns:
+            Dict with "documents" ([(doc, distance)]) and their fused
+            "document_scores", "tickets", "kb_articles" (each at most k, KB
+            articles at most kb_top_k, best fused rank first),
+            "suggested_categories",
+            "ranking" (all fused items across sources), "stages" (per-stage
+            status, item count and ms) and "degraded" (stages that timed out
+            or failed). Tickets carry their resolution steps and root cause.
+            search_params (ef_search / probes) tune the document vector search.
+            filters scope documents by file type and id and tickets by
+            category; KB articles have no category and are not scoped.
+        """
+        filters = filters or RetrievalFilters()
+        rerank = self.reranker.enabled
+        # Over-fetch documents when the reranker will pick the final few
+        document_candidates = max(self.candidates, self.reranker.candidates) if rerank else self.candidates
+        stages: Dict[str, Awaitable[Any]] = {
+            "vector": self._run_stage(
+                "vector",
+                self.search_documents(
+                    query_vector, document_candidates, search_params=search_params, filter=filters.document_filter()
+                ),
+                self.timeouts["vector"]
+            )
+        }
+        if include_tickets:
+            stages["tickets"] = self._run_stage(
+                "tickets",
+                self._with_session(self.search_tickets, query, self.candidates, filters.category),
+                self.timeouts["tickets"]
+            )
+            if self.ticket_index.available:
+                stages["ticket_vectors"] = self._run_stage(
+                    "ticket_vectors",
+                    self._with_session(self.search_ticket_vectors, query_vector, self.candidates, filters.category),
+                    self.timeouts["tickets"]
+                )
+            stages["categories"] = self._run_stage(
+                "categories", self._with_session(self.suggest_categories, query), self.timeouts["categories"]
+            )
+        if include_kb:
+            stages["kb"] = self._run_stage(
+                "kb", self._with_session(self.search_kb_articles, query, self.candidates), self.timeouts["kb"]
+            )
+            if self.kb_index.available:
+                stages["kb_vectors"] = self._run_stage(
+                    "kb_vectors",
+                    self._with_session(self.search_kb_vectors, query_vector, self.candidates),
+                    self.timeouts["kb"]
+                )
+
+        outcomes = dict(zip(stages.keys(), await asyncio.gather(*stages.values())))
+
+        ranked_lists: Dict[str, List[Hashable]] = {}
+        items: Dict[Hashable, Any] = {}
+
+        ranked_lists["vector"] = []
+        for position, (doc, distance) in enumerate(outcomes["vector"]["items"]):
+            key = ("document", doc.id or f"{doc.metadata.get('doc_id')}:{doc.metadata.get('chunk_index', position)}")
+            ranked_lists["vector"].append(key)
+            items[key] = (doc, distance)
+
+        if "tickets" in outcomes:
+            ranked_lists["lexical_tickets"] = []
+            for ticket, rank in outcomes["tickets"]["items"]:
+                key = ("ticket", ticket.ticket_id)
+                ranked_lists["lexical_tickets"].append(key)
+                items[key] = ticket
+
+        if "ticket_vectors" in outcomes:
+            ranked_lists["vector_tickets"] = []
+            for ticket, distance in outcomes["ticket_vectors"]["items"]:
+                key = ("ticket", ticket.ticket_id)
+                ranked_lists["vector_tickets"].append(key)
+                items.setdefault(key, ticket)
+
+        if "kb" in outcomes:
+            ranked_lists["lexical_kb"] = []
+            for article, rank in outcomes["kb"]["items"]:
+                key = ("kb", article.kb_id)
+                ranked_lists["lexical_kb"].append(key)
+                items[key] = article
+
+        if "kb_vectors" in outcomes:
+            ranked_lists["vector_kb"] = []
+            for article, distance in outcomes["kb_vectors"]["items"]:
+                key = ("kb", article.kb_id)
+                ranked_lists["vector_kb"].append(key)
+                items.setdefault(key, article)
+
+        fused = reciprocal_rank_fusion(ranked_lists, k=self.rrf_k)
+        ranking = sorted(fused.items(), key=lambda pair: pair[1]["score"], reverse=True)
+
+        result: Dict[str, Any] = {
+            "documents": [],
+            "document_scores": [],
+            "tickets": [],
+            "kb_articles": [],
+            "suggested_categories": outcomes["categories"]["items"] if "categories" in outcomes else [],
+            "ranking": [],
+            "stages": {
+                name: {"status": outcome["status"], "count": len(outcome["items"]), "ms": outcome["ms"]}
+                for name, outcome in outcomes.items()
+            },
+            "degraded": [name for name, outcome in outcomes.items() if outcome["status"] != "ok"]
+        }
+        selected_tickets = []
+        document_limit = self.reranker.candidates if rerank else k
+        for (source, item_id), entry in ranking:
+            result["ranking"].append({
+                "source": source,
+                "id": item_id,
+                "score": round(entry["score"], 6),
+                "ranks": entry["ranks"]
+            })
+            item = items[(source, item_id)]
+            if source == "document" and len(result["documents"]) < document_limit:
+                result["documents"].append(item)
+                result["document_scores"].append(entry["score"])
+            elif source == "ticket" and len(selected_tickets) < k:
+                selected_tickets.append((item, entry["score"]))
+            elif source == "kb" and len(result["kb_articles"]) < min(k, self.kb_top_k):
+                result["kb_articles"].append(self._kb_to_dict(item, entry["score"]))
+
+        if rerank and result["documents"]:
+            await self._rerank_documents(query, result, k)
+
+        if selected_tickets:
+            # One cache round trip (and at most two queries) for all tickets
+            cards = await self._run_stage(
+                "ticket_cards",
+                self.ticket_cards.get_cards([ticket.ticket_id for ticket, _ in selected_tickets]),
+                self.timeouts["tickets"]
+            )
+            result["stages"]["ticket_cards"] = {
+                "status": cards["status"], "count": len(cards["items"]), "ms": cards["ms"]
+            }
+            if cards["status"] != "ok":
+                result["degraded"].append("ticket_cards")
+            result["tickets"] = [
+                self._ticket_to_dict(ticket, score, (cards["items"] or {}).get(ticket.ticket_id))
+                for ticket, score in selected_tickets
+            ]
+
+        return result
+
+    async def _rerank_documents(self, query: str, result: Dict[str, Any], k: int):
+        """
+        Keep the k best document candidates by reranker score. Kept documents
+        get RRF-scale scores by their new rank, so the context packer can still
+        weigh them against tickets and KB articles. If the reranker is slow or
+        fails, the fused order is kept.
+        """
+        candidates = result["documents"]
+        outcome = await self._run_stage(
+            "rerank",
+            self.reranker.rerank(query, [doc.page_content for doc, _ in candidates], top_n=k),
+            self.timeouts["rerank"]
+        )
+        result["stages"]["rerank"] = {
+            "status": outcome["status"], "count": len(candidates), "ms": outcome["ms"]
+        }
+        if outcome["status"] != "ok":
+            result["documents"] = candidates[:k]
+            result["document_scores"] = result["document_scores"][:k]
+            return
+        result["documents"] = [candidates[i] for i, _ in outcome["items"]]
+        result["document_scores"] = [1.0 / (self.rrf_k + rank) for rank in range(1, len(outcome["items"]) + 1)]
+        result["rerank_scores"] = [round(score, 4) for _, score in outcome["items"]]
+
+    def _ticket_to_dict(self, ticket: Tickets, score: float, card: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        card = card or empty_card()
+        return {
+            "id": ticket.ticket_id,
+            "subject": ticket.subject,
+            "description": ticket.description,
+            "resolution_steps": card["resolution_steps"],
+            "root_cause": card["root_cause"],
+            "score": round(score, 6)
+        }
+
+    def _kb_to_dict(self, article: KBArticles, score: float) -> Dict[str, Any]:
+        return {
+            "id": article.kb_id,
+            "title": article.title,
+            "summary": article.summary,
+            "url": article.url,
+            "score": round(score, 6)
+        }
+
+
+# Global instance
+hybrid_retriever = HybridRetriever()
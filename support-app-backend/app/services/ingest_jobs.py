@@ -0,0 +1,373 @@
+# app/services/ingest_jobs.py
+"""
+Background ingest jobs. /rag/ingest spools the upload and queues a job in
+the ingest_jobs table; ingest workers (in the API process, or
+scripts/ingest_worker.py) claim jobs with FOR UPDATE SKIP LOCKED, run the
+ingest pipeline and record stage durations and progress on the job row.
+Failed jobs are retried with exponential backoff; running jobs whose
+worker stopped sending heartbeats are requeued.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select, update
+
+from ..config import settings
+from ..database import AsyncSessionLocal
+from ..models import IngestJob
+from .document_processors import remove_file
+from .parse_pool import RETRYABLE_ERRORS
+from .ingestion import IngestProgress, discard_document, ingest_file
+from .bulk_ingest import ingest_archive, is_archive
+
+logger = logging.getLogger(__name__)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class JobLostError(Exception):
+    """The job was requeued as stale while this worker was still running it"""
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Client errors (unsupported or unparseable files) fail the same way every
+    time. Parse pool failures are retried: a pool recycled for another
+    file's timeout, or a worker killed by the OS, says nothing about this file.
+    """
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return not (isinstance(error, HTTPException) and error.status_code < 500)
+
+
+async def run_ingest(db, path: str, filename: str, on_progress=None) -> Dict[str, Any]:
+    """Ingest one spooled upload: a single document, or every file in an archive"""
+    ingest = ingest_archive if is_archive(filename) else ingest_file
+    return await ingest(db, path, filename, on_progress=on_progress)
+
+
+def job_to_dict(job: IngestJob) -> Dict[str, Any]:
+    progress = json.loads(job.progress_json) if job.progress_json else {}
+    return {
+        "id": job.id,
+        "filename": job.filename,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "stage": progress.get("stage"),
+        "stages_ms": progress.get("stages_ms", {}),
+        "progress": progress.get("counts", {}),
+        "document_id": job.document_id,
+        "result": json.loads(job.result_json) if job.result_json else None,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "updated_at": job.updated_at,
+        "finished_at": job.finished_at,
+        "next_attempt_at": job.run_after if job.status == "queued" and job.attempts else None
+    }
+
+
+class IngestJobQueue:
+    """Ingest jobs stored in Postgres; every method uses its own session"""
+
+    def __init__(self, session_factory=None):
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.spool_dir = settings.INGEST_SPOOL_DIR
+        self.stale_after = settings.INGEST_STALE_AFTER
+        # Set when a job is queued, so in-process workers start without waiting a poll
+        self.wakeup = asyncio.Event()
+
+    def spool_path(self, filename: str) -> str:
+        os.makedirs(self.spool_dir, exist_ok=True)
+        suffix = os.path.splitext(filename or '')[1].lower()
+        return os.path.join(self.spool_dir, f"{uuid.uuid4().hex}{suffix}")
+
+    async def enqueue(self, filename: str, file_path: str) -> Dict[str, Any]:
+        async with self.session_factory() as db:
+            job = IngestJob(
+                filename=filename,
+                file_path=file_path,
+                status="queued",
+                attempts=0,
+                max_attempts=settings.INGEST_MAX_ATTEMPTS
+            )
+            db.add(job)
+            await db.commit()
+            await db.refresh(job)
+        self.wakeup.set()
+        return job_to_dict(job)
+
+    async def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        async with self.session_factory() as db:
+            job = await db.get(IngestJob, job_id)
+            return job_to_dict(job) if job is not None else None
+
+    async def claim(self, worker_id: str) -> Optional[IngestJob]:
+        """Take the oldest due job; concurrent workers skip rows already locked"""
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(IngestJob)
+                .where(IngestJob.status == "queued", IngestJob.run_after <= _now())
+                .order_by(IngestJob.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            job = result.scalar_one_or_none()
+            if job is None:
+                await db.rollback()
+                return None
+            now = _now()
+            job.status = "running"
+            job.attempts += 1
+            job.worker_id = worker_id
+            job.started_at = now
+            job.updated_at = now
+            job.error = None
+            await db.commit()
+            return job
+
+    async def _update_claimed(self, job: IngestJob, **values) -> bool:
+        """
+        Update the job row while it is still this claim's: running, on the
+        claiming worker, same attempt. False once it was requeued as stale.
+        """
+        async with self.session_factory() as db:
+            result = await db.execute(
+                update(IngestJob)
+                .where(
+                    IngestJob.id == job.id,
+                    IngestJob.status == "running",
+                    IngestJob.worker_id == job.worker_id,
+                    IngestJob.attempts == job.attempts
+                )
+                .values(updated_at=_now(), **values)
+            )
+            await db.commit()
+            return result.rowcount > 0
+
+    async def heartbeat(self, job: IngestJob) -> bool:
+        return await self._update_claimed(job)
+
+    async def record_progress(self, job: IngestJob, progress: IngestProgress) -> bool:
+        return await self._update_claimed(
+            job,
+            progress_json=json.dumps(progress.to_dict()),
+            document_id=progress.document_id
+        )
+
+    async def complete(self, job: IngestJob, result: Dict[str, Any]) -> bool:
+        return await self._update_claimed(
+            job, status="succeeded", result_json=json.dumps(result, default=str), finished_at=_now()
+        )
+
+    async def fail(self, job: IngestJob, error: str, retry_delay: Optional[float] = None) -> bool:
+        """Mark a job failed, or queue it again after retry_delay seconds"""
+        if retry_delay is None:
+            return await self._update_claimed(job, status="failed", error=error, finished_at=_now())
+        return await self._update_claimed(
+            job,
+            status="queued",
+            error=error,
+            # The failed attempt already removed what it wrote
+            document_id=None,
+            progress_json=None,
+            run_after=_now() + timedelta(seconds=retry_delay)
+        )
+
+    async def requeue_stale(self) -> List[IngestJob]:
+        """
+        Requeue running jobs without a heartbeat within stale_after (their
+        worker died). Returns them so the caller can discard their partly
+        ingested documents.
+        """
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(IngestJob)
+                .where(
+                    IngestJob.status == "running",
+                    IngestJob.updated_at < _now() - timedelta(seconds=self.stale_after)
+                )
+                .with_for_update(skip_locked=True)
+            )
+            jobs = list(result.scalars().all())
+            for job in jobs:
+                job.status = "queued" if job.attempts < job.max_attempts else "failed"
+                job.error = f"Worker {job.worker_id} stopped responding"
+                job.updated_at = _now()
+                if job.status == "failed":
+                    job.finished_at = _now()
+            await db.commit()
+            return jobs
+
+
+class IngestWorker:
+    """Claims and runs ingest jobs with a fixed number of concurrent tasks"""
+
+    def __init__(
+        self,
+        queue: IngestJobQueue,
+        concurrency: Optional[int] = None,
+        ingest: Optional[Callable[..., Awaitable[Dict[str, Any]]]] = None,
+        session_factory=None
+    ):
+        self.queue = queue
+        self.concurrency = settings.INGEST_WORKERS if concurrency is None else concurrency
+        self.ingest = ingest or run_ingest
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.poll_interval = settings.INGEST_POLL_INTERVAL
+        self.retry_backoff = settings.INGEST_RETRY_BACKOFF
+        # Several heartbeats per stale_after, so one slow database round trip is not fatal
+        self.heartbeat_interval = max(1.0, settings.INGEST_STALE_AFTER / 3)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {"succeeded": 0, "failed": 0, "retried": 0, "requeued_stale": 0, "lost": 0}
+
+    def retry_delay(self, attempts: int) -> float:
+        return self.retry_backoff * 2 ** (attempts - 1)
+
+    async def run_job(self, job: IngestJob):
+        """Run one claimed job and record its outcome; never raises"""
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            await self._run_claimed(job)
+        finally:
+            heartbeat.cancel()
+
+    async def _run_claimed(self, job: IngestJob):
+        # A previous attempt may have died part-way; remove what it wrote
+        await self._discard_partial(job)
+
+        async def on_progress(progress: IngestProgress):
+            try:
+                recorded = await self.queue.record_progress(job, progress)
+            except Exception as e:
+                logger.warning(f"Could not record progress for ingest job {job.id}: {e}")
+                return
+            if not recorded:
+                # Stop writing: the next claim discards what this attempt recorded
+                raise JobLostError(f"Ingest job {job.id} was requeued while worker {job.worker_id} was running it")
+
+        try:
+            async with self.session_factory() as db:
+                result = await self.ingest(db, job.file_path, job.filename, on_progress=on_progress)
+        except JobLostError as e:
+            logger.warning(str(e))
+            self.stats["lost"] += 1
+            return
+        except Exception as e:
+            error = e.detail if isinstance(e, HTTPException) else str(e)
+            if is_retryable(e) and job.attempts < job.max_attempts:
+                delay = self.retry_delay(job.attempts)
+                logger.warning(f"Ingest job {job.id} attempt {job.attempts} failed, retrying in {delay:g}s: {error}")
+                self.stats["retried"] += 1
+                await self._record_outcome(job, self.queue.fail(job, error, retry_delay=delay))
+                return
+            logger.error(f"Ingest job {job.id} failed: {error}")
+            self.stats["failed"] += 1
+            recorded = await self._record_outcome(job, self.queue.fail(job, error))
+        else:
+            self.stats["succeeded"] += 1
+            recorded = await self._record_outcome(job, self.queue.complete(job, result))
+        # A requeued job still needs its spooled file
+        if recorded:
+            remove_file(job.file_path)
+
+    async def _record_outcome(self, job: IngestJob, outcome: Awaitable[bool]) -> bool:
+        if await outcome:
+            return True
+        logger.warning(f"Ingest job {job.id} was requeued while worker {job.worker_id} was running it; outcome dropped")
+        self.stats["lost"] += 1
+        return False
+
+    async def _heartbeat(self, job: IngestJob):
+        """
+        Keep the running job's updated_at fresh, so a job waiting on a title
+        lock or parsing a large file before its first progress report is
+        not requeued as stale
+        """
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                if not await self.queue.heartbeat(job):
+                    return
+            except Exception as e:
+                logger.warning(f"Could not send heartbeat for ingest job {job.id}: {e}")
+
+    async def _discard_partial(self, job: IngestJob):
+        progress = json.loads(job.progress_json) if job.progress_json else {}
+        written = progress.get("documents") or []
+        if job.document_id is not None and not written:
+            written = [[job.document_id, progress.get("counts", {}).get("chunks", 0)]]
+        if not written:
+            return
+        async with self.session_factory() as db:
+            for doc_id, chunk_count in written:
+                await discard_document(db, doc_id, chunk_count)
+
+    async def run_once(self) -> bool:
+        """Claim and run one job; False if none was due"""
+        job = await self.queue.claim(self.worker_id)
+        if job is None:
+            return False
+        await self.run_job(job)
+        return True
+
+    async def requeue_stale(self):
+        for job in await self.queue.requeue_stale():
+            self.stats["requeued_stale"] += 1
+            logger.warning(f"Requeued ingest job {job.id} from unresponsive worker {job.worker_id}")
+            if job.status == "failed":
+                await self._discard_partial(job)
+                remove_file(job.file_path)
+
+    async def _loop(self):
+        while True:
+            try:
+                if await self.run_once():
+                    continue
+                await self.requeue_stale()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Database unreachable and similar; keep polling
+                logger.error(f"Ingest worker error: {e}")
+            self.queue.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.queue.wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._tasks or self.concurrency <= 0:
+            return
+        self._tasks = [asyncio.create_task(self._loop()) for _ in range(self.concurrency)]
+        print(f"✅ Ingest worker started ({self.concurrency} concurrent jobs)")
+
+    async def run_forever(self):
+        """Process jobs until cancelled (standalone worker process)"""
+        self.start()
+        try:
+            await asyncio.gather(*self._tasks)
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Global instances
+ingest_queue = IngestJobQueue()
+ingest_worker = IngestWorker(ingest_queue)
@@ -0,0 +1,473 @@
+# app/services/ingestion.py
+"""
+Document ingest pipeline: parse a spooled upload in batches, store its
+text, chunk, embed and index each batch, then add the document to the
+graph. Re-ingesting a file under the same name updates that document,
+re-indexing only the chunks that changed. Runs in ingest workers; stage
+durations and counts are reported through a progress callback as the
+ingest goes.
+"""
+import asyncio
+import hashlib
+import json
+import time
+import logging
+import os
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import engine
+from ..models import Document
+from .vectorstore import vectordb, run_in_vector_executor, delete_by_filter, update_metadata
+from .document_processors import DocumentProcessor
+from .parsers import file_sha256
+from .chunking import SEGMENT_METADATA_KEYS, text_chunker
+from .embedding_cache import embedding_service
+from .answer_cache import answer_cache
+from .chunk_dedup import chunk_dedup
+from ..langgraph_setup import ingest_document_as_nodes
+
+logger = logging.getLogger(__name__)
+
+# First pg_advisory_lock key of per-title ingest locks; the second is hashtext(file name)
+TITLE_LOCK_KEY = 0x696E6773
+
+
+def document_vector_id(doc_id: int, chunk_index: int, version: int = 1) -> str:
+    # Later versions get their own ids, so the previous version's vectors stay until replaced
+    if version == 1:
+        return f"doc-{doc_id}-{chunk_index}"
+    return f"doc-{doc_id}-v{version}-{chunk_index}"
+
+
+def is_reference(entry: List[Any]) -> bool:
+    """
+    Manifest entries are [chunk hash, version] for a chunk's own vector,
+    [chunk hash, version, chunk index] when the chunk has moved since its
+    vector was written at that index, and [chunk hash, version, vector id]
+    for a near-duplicate that references another document's vector.
+    """
+    return len(entry) > 2 and isinstance(entry[2], str)
+
+
+def entry_vector_id(doc_id: int, index: int, entry: List[Any]) -> str:
+    if is_reference(entry):
+        return entry[2]
+    return document_vector_id(doc_id, entry[2] if len(entry) > 2 else index, entry[1])
+
+
+def manifest_vector_ids(doc_id: int, manifest: List[List[Any]]) -> List[str]:
+    """Vector of each chunk in a manifest: its own, or the canonical vector of a near-duplicate"""
+    return [entry_vector_id(doc_id, index, entry) for index, entry in enumerate(manifest)]
+
+
+def manifest_references(manifest: List[List[Any]]) -> Set[Tuple[str, int, int]]:
+    return {(entry[2], index, entry[1]) for index, entry in enumerate(manifest) if is_reference(entry)}
+
+
+def moved_entry(entry: List[Any], previous_index: int, index: int) -> List[Any]:
+    """Entry for an own-vector chunk now at index that was at previous_index in the previous version"""
+    written = entry[2] if len(entry) > 2 else previous_index
+    return entry[:2] if written == index else [entry[0], entry[1], written]
+
+
+def chunk_hash(chunk: Dict[str, Any]) -> str:
+    """
+    Hash of a chunk's text and page/sheet/section. Document-wide metadata
+    (page counts, offsets) is left out, so an edit elsewhere in the file
+    does not mark every chunk as changed.
+    """
+    metadata = chunk["metadata"]
+    provenance = {key: metadata[key] for key in SEGMENT_METADATA_KEYS if metadata.get(key) is not None}
+    return hashlib.sha256(json.dumps([chunk["text"], provenance], sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IngestProgress:
+    """Current stage, accumulated stage durations and counts for one ingest"""
+
+    def __init__(self, counts: Optional[Dict[str, int]] = None):
+        self.stage: Optional[str] = None
+        self.stages: Dict[str, float] = {}
+        self.counts = counts or {"batches": 0, "chunks": 0, "chunks_indexed": 0, "duplicate_chunks": 0, "content_length": 0}
+        self.document_id: Optional[int] = None
+        # [document id, chunk count] of each document written (bulk ingests)
+        self.documents: List[List[int]] = []
+
+    @contextmanager
+    def timed(self, stage: str):
+        # Batches pass through each stage many times; durations add up
+        self.stage = stage
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage] = round(self.stages.get(stage, 0.0) + (time.perf_counter() - started) * 1000, 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "stage": self.stage,
+            "stages_ms": dict(self.stages),
+            "counts": dict(self.counts),
+            "document_id": self.document_id
+        }
+        if self.documents:
+            data["documents"] = [list(entry) for entry in self.documents]
+        return data
+
+
+@asynccontextmanager
+async def title_lock(title: str):
+    """
+    Session advisory lock on a document title, held on a connection of its
+    own: an ingest commits after every batch, so a transaction lock would
+    not last until the new version is stored. It is keyed on the file name
+    without folders, since find_document matches an upload with a bulk
+    loaded path of the same name.
+    """
+    name = os.path.basename(title)
+    conn = await engine.connect()
+    try:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(
+            text("SELECT pg_advisory_lock(:key, hashtext(:title))"), {"key": TITLE_LOCK_KEY, "title": name}
+        )
+    except BaseException:
+        await conn.close()
+        raise
+    try:
+        yield
+    finally:
+        try:
+            await conn.execute(
+                text("SELECT pg_advisory_unlock(:key, hashtext(:title))"), {"key": TITLE_LOCK_KEY, "title": name}
+            )
+        finally:
+            await conn.close()
+
+
+async def find_document(db: AsyncSession, title: str) -> Optional[Document]:
+    """
+    Latest document ingested under a title. Uploads are titled by file
+    name and bulk loads by path, so without an exact match a file name
+    also finds the one path ending in it, and a path finds a document
+    titled by its file name.
+    """
+    result = await db.execute(
+        select(Document).where(Document.title == title).order_by(Document.id.desc()).limit(1)
+    )
+    doc = result.scalars().first()
+    if doc is not None:
+        return doc
+
+    name = os.path.basename(title)
+    if name != title:
+        match = Document.title == name
+    else:
+        result = await db.execute(
+            select(Document.title).where(Document.title.endswith(f"/{name}", autoescape=True)).distinct().limit(2)
+        )
+        paths = result.scalars().all()
+        if len(paths) != 1:
+            # The same name in several folders: not this document's
+            return None
+        match = Document.title == paths[0]
+    result = await db.execute(select(Document).where(match).order_by(Document.id.desc()).limit(1))
+    return result.scalars().first()
+
+
+
+async def ingest_file(
+    db: AsyncSession,
+    path: str,
+    filename: str,
+    on_progress: Optional[Callable[[IngestProgress], Awaitable[None]]] = None
+) -> Dict[str, Any]:
+    """
+    Ingest a spooled upload. Each segment batch is stored, chunked, embedded
+    and indexed before the next is read.
+
+    A file whose name matches an existing document (see find_document) is
+    a new version of it: if the content hash is unchanged nothing is done,
+    otherwise only chunks that differ from the previous version are
+    embedded and indexed, and the previous version's other vectors are
+    deleted once the new one is stored.
+    Chunks that nearly duplicate an indexed chunk of another document are
+    not embedded; they reference that vector instead (see chunk_dedup).
+
+    Ingests of one file name run one at a time (title_lock), so two
+    uploads of a document cannot both become the same new version.
+
+    On failure, a new document's row and vectors are removed; for a new
+    version, the text and vectors it wrote are removed and the previous
+    version stays current. The error is re-raised.
+    """
+    if vectordb is None:
+        raise RuntimeError("RAG system not available - OpenAI API key not configured")
+
+    async with title_lock(filename):
+        return await _ingest_version(db, path, filename, on_progress)
+
+
+async def _ingest_version(
+    db: AsyncSession,
+    path: str,
+    filename: str,
+    on_progress: Optional[Callable[[IngestProgress], Awaitable[None]]]
+) -> Dict[str, Any]:
+    """ingest_file, under the title lock"""
+    processor = DocumentProcessor.for_filename(filename)
+    progress = IngestProgress()
+    doc_id = None
+    version = 1
+    written_ids: List[str] = []
+
+    async def report():
+        if on_progress is not None:
+            await on_progress(progress)
+
+    with progress.timed("store"):
+        content_hash = await asyncio.to_thread(file_sha256, path)
+        doc = await find_document(db, filename)
+    # A new version keeps a path title over a bare file name
+    title = doc.title if doc is not None and "/" in doc.title and "/" not in filename else filename
+    if doc is not None and doc.content_hash == content_hash:
+        # Same file again; it is already indexed
+        progress.stage = None
+        await report()
+        return {
+            "id": doc.id,
+            "title": doc.title,
+            "status": "unchanged",
+            "version": doc.version,
+            "content_length": len(doc.content or ""),
+            "chunks": len(json.loads(doc.chunks_json)) if doc.chunks_json else 0,
+            "chunks_indexed": 0,
+            "stages_ms": dict(progress.stages)
+        }
+
+    try:
+        previous: List[List[Any]] = []
+        with progress.timed("store"):
+            if doc is None:
+                # Create the database record first; content is appended batch by batch
+                doc = Document(title=title, content="", content_hash=content_hash)
+                db.add(doc)
+                await db.commit()
+                await db.refresh(doc)
+                doc_id = progress.document_id = doc.id
+            else:
+                # The previous version stays readable until the new one is complete;
+                # its text is staged batch by batch and swapped in at the end
+                doc_id, version = doc.id, doc.version + 1
+                previous = json.loads(doc.chunks_json) if doc.chunks_json else []
+                await db.execute(update(Document).where(Document.id == doc_id).values(staged_content=""))
+                await db.commit()
+        # Previous chunks with their own vector, by hash: moved chunks keep their vectors
+        reusable: Dict[str, List[int]] = {}
+        for index, entry in enumerate(previous):
+            if not is_reference(entry):
+                reusable.setdefault(entry[0], []).append(index)
+        reused: Set[int] = set()
+        await report()
+
+        chunk_stream = None
+        manifest: List[List[Any]] = []
+        embedding_cache_hits = 0
+        batches = processor.stream(path)
+
+        while True:
+            with progress.timed("parse"):
+                segments = await anext(batches, None)
+            if segments is None:
+                break
+
+            if chunk_stream is None:
+                # Enhanced metadata for vector store
+                chunk_stream = text_chunker.stream(base_metadata={
+                    "doc_id": doc_id,
+                    "title": title,
+                    "file_type": processor.metadata.get('file_type', 'unknown'),
+                    **processor.metadata
+                })
+
+            with progress.timed("store"):
+                part = '\n'.join(segment['text'] for segment in segments)
+                if progress.counts["content_length"]:
+                    part = '\n' + part
+                if version == 1:
+                    values = {"content": Document.content + part}
+                else:
+                    values = {"staged_content": Document.staged_content + part}
+                await db.execute(update(Document).where(Document.id == doc_id).values(**values))
+                await db.commit()
+                progress.counts["content_length"] += len(part)
+
+            # Split into page/sheet/section-aware chunks with provenance metadata
+            with progress.timed("chunk"):
+                chunks = chunk_stream.add(segments)
+                changed = []
+                moved: Dict[str, Dict[str, Any]] = {}
+                for chunk in chunks:
+                    # Chunks equal to one of the previous version's keep its vector, wherever it was
+                    index, digest = chunk["metadata"]["chunk_index"], chunk_hash(chunk)
+                    if index < len(previous) and previous[index][0] == digest and index not in reused:
+                        reused.add(index)
+                        manifest.append(previous[index])
+                        continue
+                    candidates = [i for i in reusable.get(digest, ()) if i not in reused]
+                    if candidates:
+                        reused.add(candidates[0])
+                        entry = moved_entry(previous[candidates[0]], candidates[0], index)
+                        manifest.append(entry)
+                        moved[entry_vector_id(doc_id, index, entry)] = chunk["metadata"]
+                    else:
+                        manifest.append([digest, version])
+                        changed.append(chunk)
+            progress.counts["batches"] += 1
+            # Counted before indexing, so a crashed ingest knows which ids to clean up
+            progress.counts["chunks"] += len(chunks)
+            await report()
+
+            if moved:
+                # Only the position changed: rewrite chunk_index (and document-wide metadata)
+                with progress.timed("index"):
+                    await run_in_vector_executor(update_metadata, vectordb, moved)
+
+            if changed:
+                # Near-duplicates of chunks already indexed only reference them
+                with progress.timed("dedup"):
+                    plan = await chunk_dedup.plan(
+                        db, changed,
+                        [document_vector_id(doc_id, chunk["metadata"]["chunk_index"], version) for chunk in changed],
+                        version
+                    )
+                for position, canonical in plan.duplicate_of.items():
+                    manifest[changed[position]["metadata"]["chunk_index"]].append(canonical)
+                unique = [changed[position] for position in plan.unique]
+                ids = [plan.vector_ids[position] for position in plan.unique]
+
+                if unique:
+                    # Embed (cache misses only, in batches) and add to vector store
+                    chunk_texts = [chunk["text"] for chunk in unique]
+                    with progress.timed("embed"):
+                        embedding_stats = await embedding_service.embed_documents(chunk_texts)
+                    embedding_cache_hits += embedding_stats["cache_hits"]
+
+                    written_ids.extend(ids)
+                    with progress.timed("index"):
+                        await run_in_vector_executor(
+                            vectordb.add_embeddings,
+                            texts=chunk_texts,
+                            embeddings=embedding_stats["vectors"],
+                            metadatas=[chunk["metadata"] for chunk in unique],
+                            ids=ids
+                        )
+                with progress.timed("dedup"):
+                    await chunk_dedup.record(db, plan, vectordb)
+                progress.counts["chunks_indexed"] += len(unique)
+                progress.counts["duplicate_chunks"] += len(plan.duplicate_of)
+
+        with progress.timed("store"):
+            values: Dict[str, Any] = {"chunks_json": json.dumps(manifest)}
+            if version > 1:
+                values.update(
+                    title=title,
+                    content=Document.staged_content,
+                    staged_content=None,
+                    content_hash=content_hash,
+                    version=version,
+                    updated_at=func.now()
+                )
+            await db.execute(update(Document).where(Document.id == doc_id).values(**values))
+            await db.commit()
+            # The new version is stored; its vectors are no longer partial
+            written_ids = []
+
+        if version > 1:
+            with progress.timed("index"):
+                await delete_superseded_vectors(db, doc_id, manifest)
+
+        with progress.timed("graph"):
+            ingest_document_as_nodes(doc, content_length=progress.counts["content_length"])
+
+        # Cached answers may now be missing this document, or quote its previous version
+        await answer_cache.invalidate(f"document {doc_id} ingested (version {version})")
+        progress.stage = None
+        await report()
+    except Exception:
+        # Leave nothing half-ingested behind
+        await db.rollback()
+        if version == 1:
+            await discard_document(db, doc_id, progress.counts["chunks"])
+        else:
+            await discard_update(db, doc_id, previous, written_ids)
+        raise
+
+    metadata = {**processor.metadata, 'length': progress.counts["content_length"]}
+    return {
+        "id": doc_id,
+        "title": title,
+        "status": "ingested" if version == 1 else "updated",
+        "version": version,
+        "content_length": progress.counts["content_length"],
+        "chunks": progress.counts["chunks"],
+        "chunks_indexed": progress.counts["chunks_indexed"],
+        "duplicate_chunks": progress.counts["duplicate_chunks"],
+        "embedding_cache_hits": embedding_cache_hits,
+        "file_type": metadata.get('file_type', 'unknown'),
+        "processing_metadata": metadata,
+        "stages_ms": dict(progress.stages)
+    }
+
+
+async def delete_superseded_vectors(db: AsyncSession, doc_id: int, manifest: List[List[Any]]):
+    """
+    Delete a document's vectors that are not in its current chunk manifest:
+    previous versions' chunks, leftovers of failed updates, and vectors
+    indexed before documents had manifests. A failure is only logged; the
+    next update of the document tries again.
+    """
+    keep_ids = manifest_vector_ids(doc_id, manifest)
+    try:
+        # Superseded vectors that other documents reference are handed over, not deleted
+        transferred = await chunk_dedup.release(db, doc_id, vectordb, keep_ids, manifest_references(manifest))
+        await run_in_vector_executor(
+            delete_by_filter, vectordb, {"doc_id": {"$eq": doc_id}}, keep_ids + sorted(transferred)
+        )
+    except Exception as e:
+        await db.rollback()
+        logger.warning(f"Could not delete superseded vectors of document {doc_id}: {str(e)}")
+
+
+async def discard_update(db: AsyncSession, doc_id: int, previous: List[List[Any]], ids: List[str]):
+    """Remove the staged text and vectors a failed update wrote; the previous version stays current"""
+    try:
+        await db.execute(update(Document).where(Document.id == doc_id).values(staged_content=None))
+        await db.commit()
+        if ids:
+            transferred = await chunk_dedup.release(
+                db, doc_id, vectordb, manifest_vector_ids(doc_id, previous), manifest_references(previous)
+            )
+            await run_in_vector_executor(vectordb.delete, ids=[i for i in ids if i not in transferred])
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error discarding {len(ids)} vectors of a failed update: {str(e)}")
+
+
+async def discard_document(db: AsyncSession, doc_id: Optional[int], chunk_count: int):
+    """Remove a partly ingested document: vectors for its first chunk_count chunks and its row"""
+    if doc_id is None:
+        return
+    try:
+        if chunk_count and vectordb is not None:
+            transferred = await chunk_dedup.release(db, doc_id, vectordb)
+            ids: List[str] = [document_vector_id(doc_id, i) for i in range(chunk_count)]
+            await run_in_vector_executor(vectordb.delete, ids=[i for i in ids if i not in transferred])
+        await db.execute(delete(Document).where(Document.id == doc_id))
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error discarding partial ingest of document {doc_id}: {str(e)}")
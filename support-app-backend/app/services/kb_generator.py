@@ -12,6 +12,8 @@ import logging
 
 from ..models import Tickets, KBArticles, KBArticleVersion, ResolutionSteps, TicketRootCauses
 from ..config import settings
+from .answer_cache import answer_cache
+from .record_index import kb_index
 
 logger = logging.getLogger(__name__)
 
@@ -108,6 +110,8 @@ class KBGeneratorService:
         db.add(kb_article)
         await db.commit()
         await db.refresh(kb_article)
+        await answer_cache.invalidate(f"KB article {kb_article.kb_id} generated")
+        await kb_index.index_record(kb_article.kb_id)
         
         return {
             "success": True,
@@ -249,6 +253,7 @@ Respond in JSON format:
         article.updated_at = datetime.utcnow()
         
         await db.commit()
+        await kb_index.index_record(kb_id)
         
         return {
             "success": True,
@@ -296,6 +301,8 @@ Respond in JSON format:
         article.updated_at = datetime.utcnow()
         
         await db.commit()
+        await answer_cache.invalidate(f"KB article {kb_id} reverted to v{target_version}")
+        await kb_index.index_record(kb_id)
         
         return {
             "success": True,
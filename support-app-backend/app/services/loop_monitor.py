@@ -0,0 +1,82 @@
+# app/services/loop_monitor.py
+"""
+Event loop lag monitor.
+Measures how long the asyncio event loop is blocked by synchronous work,
+so slow blocking calls in async handlers show up in metrics.
+"""
+import asyncio
+import time
+import logging
+from collections import deque
+from typing import Deque, Dict, Any, Optional, Tuple
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """
+    Periodically schedules a short sleep and records how late it wakes up.
+    The overshoot is time the loop spent running other (blocking) code.
+    """
+
+    def __init__(self, interval: Optional[float] = None, window: int = 600):
+        self.interval = interval or settings.LOOP_MONITOR_INTERVAL
+        # (monotonic timestamp, lag in seconds)
+        self.samples: Deque[Tuple[float, float]] = deque(maxlen=window)
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.sample_count = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start sampling on the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop sampling."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.record(lag)
+
+    def record(self, lag: float):
+        """Record one lag sample (seconds)."""
+        self.samples.append((time.perf_counter(), lag))
+        self.max_lag = max(self.max_lag, lag)
+        self.total_lag += lag
+        self.sample_count += 1
+        if lag > 0.1:
+            logger.warning(f"Event loop blocked for {lag * 1000:.1f} ms")
+
+    def max_lag_since(self, since: float) -> float:
+        """Largest lag (seconds) recorded after a perf_counter timestamp."""
+        return max((lag for ts, lag in self.samples if ts >= since), default=0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        """Summary of observed loop lag."""
+        recent = [lag for _, lag in self.samples]
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval_ms": round(self.interval * 1000, 2),
+            "samples": self.sample_count,
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "avg_lag_ms": round(self.total_lag / self.sample_count * 1000, 2) if self.sample_count else 0.0,
+            "recent_max_lag_ms": round(max(recent, default=0.0) * 1000, 2),
+            "recent_blocked_ms": round(sum(recent) * 1000, 2)
+        }
+
+
+# Global instance
+loop_monitor = LoopLagMonitor()
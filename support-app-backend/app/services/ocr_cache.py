@@ -0,0 +1,87 @@
+# app/services/ocr_cache.py
+"""
+Cached, concurrency-limited OCR for uploaded images.
+Users upload the same error dialogs over and over, so OCR text is cached
+in Redis under two keys: the sha256 of the file, and a hash of the decoded
+pixels (the same screenshot re-saved with different file bytes). OCR runs
+in the parse pool, but at most OCR_MAX_CONCURRENT images at a time, so a
+burst of screenshots cannot take every parse slot.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from ..config import settings
+from . import parsers
+from .cache import CacheKeys, CacheTTL, cache_get, cache_set_many
+from .parse_pool import ParsePool, parse_pool
+
+logger = logging.getLogger(__name__)
+
+
+class OCRService:
+    """OCR through the parse pool with a result cache and its own concurrency limit"""
+
+    def __init__(self, pool: Optional[ParsePool] = None, max_concurrent: Optional[int] = None):
+        self.pool = pool or parse_pool
+        self.max_concurrent = max_concurrent or settings.OCR_MAX_CONCURRENT
+        self.max_dimension = settings.OCR_MAX_DIMENSION
+        self.cache_enabled = settings.OCR_CACHE_ENABLED
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.stats = {"images": 0, "file_hits": 0, "pixel_hits": 0, "ocr_runs": 0}
+
+    def _cache_key(self, kind: str, digest: str) -> str:
+        # Downscaling changes the text tesseract sees, so it is part of the key
+        return f"{CacheKeys.OCR}{kind}:{self.max_dimension}:{digest}"
+
+    async def _ocr(self, path: str, timeout: float) -> Dict[str, Any]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        async with self._semaphore:
+            self.stats["ocr_runs"] += 1
+            # tesseract itself is stopped at the same deadline
+            return await self.pool.run(parsers.parse_image, path, timeout, self.max_dimension, timeout=timeout)
+
+    async def extract(self, path: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        OCR text and image info for an image file.
+
+        Returns:
+            parse_image's result plus "ocr_cache": "file", "pixels" or "miss"
+        """
+        timeout = timeout or self.pool.timeout
+        self.stats["images"] += 1
+        if not self.cache_enabled:
+            return {**await self._ocr(path, timeout), "ocr_cache": "miss"}
+
+        file_key = self._cache_key("file", await asyncio.to_thread(parsers.file_sha256, path))
+        cached = await cache_get(file_key)
+        if cached is not None:
+            self.stats["file_hits"] += 1
+            return {**cached, "ocr_cache": "file"}
+
+        fingerprint = await self.pool.run(parsers.image_fingerprint, path, timeout=timeout)
+        pixel_key = self._cache_key("pixels", fingerprint["pixel_hash"])
+        cached = await cache_get(pixel_key)
+        if cached is not None:
+            self.stats["pixel_hits"] += 1
+            # Remember the new file bytes too, so the next copy skips decoding
+            await cache_set_many({file_key: cached}, ttl=CacheTTL.OCR)
+            return {**cached, "ocr_cache": "pixels"}
+
+        result = await self._ocr(path, timeout)
+        await cache_set_many({file_key: result, pixel_key: result}, ttl=CacheTTL.OCR)
+        return {**result, "ocr_cache": "miss"}
+
+    def cache_stats(self) -> Dict[str, Any]:
+        hits = self.stats["file_hits"] + self.stats["pixel_hits"]
+        return {
+            "enabled": self.cache_enabled,
+            "max_concurrent": self.max_concurrent,
+            **self.stats,
+            "hit_rate": round(hits / self.stats["images"], 3) if self.stats["images"] else 0.0
+        }
+
+
+# Global instance
+ocr_service = OCRService()
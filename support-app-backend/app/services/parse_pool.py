@@ -0,0 +1,174 @@
+# app/services/parse_pool.py
+"""
+Process pool for CPU-heavy document parsing (PDF, DOCX, Excel, OCR).
+Parsing holds the GIL for seconds on large files, so it runs in separate
+processes instead of the event loop or a thread. Each worker process has
+an address-space limit, each file a deadline, and a semaphore caps how many
+parse tasks are in flight. A worker stuck past its deadline is killed by
+replacing the pool; other files' parses caught in that pool are resubmitted
+to the new one.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+class ParseError(Exception):
+    """A file could not be parsed within the pool's limits"""
+
+
+class ParseTimeoutError(ParseError):
+    pass
+
+
+class ParseMemoryError(ParseError):
+    pass
+
+
+class ParsePoolError(ParseError):
+    """The pool failed (a worker died), not necessarily the file; worth retrying"""
+
+
+# Failures of the pool or the deadline rather than of the file's content;
+# callers let them propagate so ingest jobs are retried
+RETRYABLE_ERRORS = (ParsePoolError, ParseTimeoutError)
+
+# Times a parse is resubmitted after another file's timeout recycled its pool
+MAX_RESUBMITS = 2
+
+
+def _init_worker(memory_limit_mb: int):
+    """Runs once in each worker process before any parse"""
+    # tesseract otherwise starts one OpenMP thread per core for every image
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    if memory_limit_mb and resource is not None:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+class ParsePool:
+    """Bounded process pool with per-file timeouts"""
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        max_concurrent: Optional[int] = None,
+        timeout: Optional[float] = None,
+        memory_limit_mb: Optional[int] = None
+    ):
+        self.workers = workers or settings.PARSE_WORKERS
+        self.max_concurrent = max_concurrent or settings.PARSE_MAX_CONCURRENT
+        self.timeout = timeout or settings.PARSE_TIMEOUT
+        self.memory_limit_mb = memory_limit_mb if memory_limit_mb is not None else settings.PARSE_MEMORY_LIMIT_MB
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.stats = {"tasks": 0, "timeouts": 0, "memory_errors": 0, "recycles": 0, "resubmits": 0}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # forkserver: workers do not inherit the server's threads, sockets or loop
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["app.services.parsers"])
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(self.memory_limit_mb,)
+            )
+        return self._pool
+
+    def _recycle(self, pool: Optional[ProcessPoolExecutor] = None):
+        """Kill every worker (a stuck parse cannot be cancelled) and start a fresh pool"""
+        if pool is not None and pool is not self._pool:
+            return  # Already replaced
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        self.stats["recycles"] += 1
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _submit(self, func: Callable, *args) -> Any:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        async with self._semaphore:
+            self.stats["tasks"] += 1
+            loop = asyncio.get_running_loop()
+            for attempt in range(MAX_RESUBMITS + 1):
+                pool = self._get_pool()
+                try:
+                    return await loop.run_in_executor(pool, func, *args)
+                except MemoryError:
+                    self.stats["memory_errors"] += 1
+                    raise ParseMemoryError(f"Parsing needed more than the {self.memory_limit_mb} MB memory limit")
+                except BrokenProcessPool:
+                    if pool is self._pool:
+                        # A worker died under this pool (killed by the OS); start over next time
+                        self._recycle(pool)
+                        raise ParsePoolError("Parser process stopped unexpectedly")
+                except asyncio.CancelledError:
+                    # Our own cancellation (e.g. the deadline), or a queued task
+                    # cancelled when another file's timeout recycled the pool
+                    if asyncio.current_task().cancelling() or pool is self._pool:
+                        raise
+                if attempt < MAX_RESUBMITS:
+                    self.stats["resubmits"] += 1
+                    logger.info(f"Resubmitting {getattr(func, '__name__', func)} after a parse pool recycle")
+            raise ParsePoolError("Parse pool was recycled repeatedly while this file was parsed")
+
+    async def run_many(self, func: Callable, arg_list: Iterable[Tuple], timeout: Optional[float] = None) -> List[Any]:
+        """
+        Run func once per argument tuple in the pool, all under one deadline.
+
+        Raises:
+            ParseTimeoutError: The deadline passed (the pool is recycled)
+            ParseMemoryError: A worker hit the memory limit
+            ParsePoolError: A worker died, or the pool kept being recycled
+        """
+        timeout = timeout or self.timeout
+        try:
+            return await asyncio.wait_for(
+                asyncio.gather(*[self._submit(func, *args) for args in arg_list]),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            logger.warning(f"Parse of {getattr(func, '__name__', func)} exceeded {timeout}s; recycling parse pool")
+            self._recycle()
+            raise ParseTimeoutError(f"Parsing took longer than {timeout:g}s")
+
+    async def run(self, func: Callable, *args, timeout: Optional[float] = None) -> Any:
+        """Run one parse function in the pool under the per-file deadline"""
+        return (await self.run_many(func, [args], timeout=timeout))[0]
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def pool_stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_concurrent": self.max_concurrent,
+            "timeout": self.timeout,
+            "memory_limit_mb": self.memory_limit_mb,
+            **self.stats
+        }
+
+
+# Global instance
+parse_pool = ParsePool()
@@ -0,0 +1,170 @@
+# app/services/parsers.py
+"""
+CPU-bound document parsing, run in the parse process pool.
+Functions here read a spooled upload from its path and return plain dicts
+so they can be pickled back from worker processes. Each call covers a
+bounded part of the file (a page range, one sheet), so results stay small
+however large the file is. The module only imports the parsing libraries,
+which keeps worker start-up and memory small.
+"""
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import PyPDF2
+import openpyxl
+import pytesseract
+from PIL import Image
+from docx import Document as DocxDocument
+
+
+def file_sha256(path: str) -> str:
+    """Hash of a file's bytes, read in 1 MB blocks (blocking; run in a thread)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def count_pdf_pages(path: str) -> int:
+    return len(PyPDF2.PdfReader(path).pages)
+
+
+def parse_pdf_pages(path: str, start: int = 0, end: Optional[int] = None) -> Dict[str, Any]:
+    """Extract text from pages [start, end) of a PDF; segments carry 1-based page numbers"""
+    pdf_reader = PyPDF2.PdfReader(path)
+    end = len(pdf_reader.pages) if end is None else min(end, len(pdf_reader.pages))
+    segments = []
+    for page_num in range(start, end):
+        page_text = pdf_reader.pages[page_num].extract_text() or ''
+        segments.append({'text': page_text, 'page': page_num + 1})
+    return {'segments': segments, 'pages': len(pdf_reader.pages)}
+
+
+def parse_docx(path: str) -> Dict[str, Any]:
+    # python-docx always loads the whole document part, so DOCX is one task
+    doc = DocxDocument(path)
+
+    segments = []
+    section = None
+    section_parts = []
+    for paragraph in doc.paragraphs:
+        # Heading styles start a new section
+        style_name = paragraph.style.name if paragraph.style is not None else ''
+        if style_name.startswith('Heading') and paragraph.text.strip():
+            if section_parts:
+                segments.append({'text': '\n'.join(section_parts), 'section': section})
+            section = paragraph.text.strip()
+            section_parts = []
+        section_parts.append(paragraph.text)
+
+    if section_parts:
+        segments.append({'text': '\n'.join(section_parts), 'section': section})
+
+    return {'segments': segments, 'paragraphs': len(doc.paragraphs)}
+
+
+def list_excel_sheets(path: str) -> List[str]:
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+
+def parse_excel_sheet(path: str, sheet_name: str, block_rows: int = 500) -> Dict[str, Any]:
+    """
+    Stream one sheet's rows (read-only mode never loads the whole sheet)
+    into segments of at most block_rows rows, each headed by the sheet name.
+    """
+    workbook = openpyxl.load_workbook(path, data_only=True, read_only=True)
+    try:
+        worksheet = workbook[sheet_name]
+        header = f"=== Sheet: {sheet_name} ==="
+        segments = []
+        block = [header]
+        row_count = 0
+
+        for row in worksheet.iter_rows(values_only=True):
+            if any(cell is not None for cell in row):  # Skip empty rows
+                block.append('\t'.join(str(cell) if cell is not None else '' for cell in row))
+                row_count += 1
+                if len(block) > block_rows:
+                    segments.append({'text': '\n'.join(block), 'sheet': sheet_name})
+                    block = [header]
+
+        if len(block) > 1 or not segments:
+            segments.append({'text': '\n'.join(block), 'sheet': sheet_name})
+        return {'segments': segments, 'rows': row_count}
+    finally:
+        workbook.close()
+
+
+def image_fingerprint(path: str) -> Dict[str, Any]:
+    """
+    Hash of the decoded pixels, so the same screenshot saved again (other
+    PNG settings, stripped metadata, another lossless format) is
+    recognised although its file bytes differ.
+    """
+    image = Image.open(path)
+    info = {
+        'image_format': image.format or 'unknown',
+        'image_width': image.size[0],
+        'image_height': image.size[1],
+        'image_mode': image.mode
+    }
+    pixels = image.convert('RGB')
+    digest = hashlib.sha256(f"{pixels.size[0]}x{pixels.size[1]}".encode())
+    digest.update(pixels.tobytes())
+    return {**info, 'pixel_hash': digest.hexdigest()}
+
+
+def _otsu_threshold(gray: np.ndarray) -> int:
+    """Gray level that best separates text from background"""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    cum_count = np.cumsum(hist)
+    cum_sum = np.cumsum(hist * np.arange(256))
+    background = cum_count / gray.size
+    mean_low = cum_sum / np.maximum(cum_count, 1)
+    mean_high = (cum_sum[-1] - cum_sum) / np.maximum(gray.size - cum_count, 1)
+    return int(np.argmax(background * (1 - background) * (mean_low - mean_high) ** 2))
+
+
+def prepare_for_ocr(image: Image.Image, max_dimension: int = 0) -> Tuple[Image.Image, bool]:
+    """
+    Downscale images whose longest side exceeds max_dimension and binarize
+    them, which makes tesseract much faster on huge scans and photos.
+    Returns the image and whether it was reduced.
+    """
+    if not max_dimension or max(image.size) <= max_dimension:
+        return image, False
+    image.draft('L', (max_dimension, max_dimension))
+    image = image.convert('L')
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    gray = np.asarray(image)
+    binary = np.where(gray > _otsu_threshold(gray), 255, 0).astype(np.uint8)
+    return Image.fromarray(binary, mode='L'), True
+
+
+def parse_image(path: str, timeout: float = 0, max_dimension: int = 0) -> Dict[str, Any]:
+    """OCR an image; timeout (seconds, 0 = none) is passed on to the tesseract subprocess"""
+    # Open image with Pillow
+    image = Image.open(path)
+    info = {
+        'image_format': image.format or 'unknown',
+        'image_width': image.size[0],
+        'image_height': image.size[1],
+        'image_mode': image.mode
+    }
+
+    image, downscaled = prepare_for_ocr(image, max_dimension)
+
+    # Convert to RGB if necessary
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    # Use pytesseract to extract text
+    text = pytesseract.image_to_string(image, timeout=timeout)
+
+    return {'text': text.strip(), **info, 'ocr_downscaled': downscaled}
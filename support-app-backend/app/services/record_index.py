@@ -0,0 +1,277 @@
+# app/services/record_index.py
+"""
+Vector indexes over database records (closed tickets, KB articles).
+Each record is stored as one vector under a stable id, so re-indexing a
+record is an upsert; records are indexed incrementally when they change
+instead of rebuilding the whole index on a schedule.
+"""
+import logging
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from ..models import Tickets, KBArticles
+from ..database import AsyncSessionLocal
+from ..config import settings
+from .embedding_cache import embedding_service
+from .vectorstore import create_vector_store, run_in_vector_executor, similarity_search_with_params
+
+logger = logging.getLogger(__name__)
+
+# Article content beyond this is not embedded (embedding input limit)
+KB_CONTENT_MAX_CHARS = 6000
+
+
+class RecordIndex:
+    """
+    One vector per database record, keyed by "<prefix>-<record id>".
+    Subclasses say how records are loaded, which are indexed and what text
+    is embedded for each.
+    """
+
+    def __init__(self, name: str, id_prefix: str, store=None, embedder=None):
+        self.name = name
+        self.id_prefix = id_prefix
+        self.store = store
+        self.embedder = embedder or embedding_service
+        self.stats = {"indexed": 0, "removed": 0, "errors": 0}
+
+    @property
+    def available(self) -> bool:
+        return self.store is not None
+
+    def vector_id(self, record_id: int) -> str:
+        return f"{self.id_prefix}-{record_id}"
+
+    def record_id(self, record) -> int:
+        raise NotImplementedError
+
+    def build_text(self, record) -> str:
+        raise NotImplementedError
+
+    def build_metadata(self, record) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def should_index(self, record) -> bool:
+        return True
+
+    async def _load(self, db, record_ids: List[int]) -> list:
+        raise NotImplementedError
+
+    async def _page_ids(self, db, after_id: int, limit: int) -> List[int]:
+        """Ids of indexable records after after_id, ascending"""
+        raise NotImplementedError
+
+    async def upsert(self, record_id: int, text: str, metadata: Dict[str, Any]):
+        """Embed a record (through the embedding cache) and upsert its vector"""
+        embedded = await self.embedder.embed_documents([text])
+        await run_in_vector_executor(
+            self.store.add_embeddings,
+            texts=[text],
+            embeddings=embedded["vectors"],
+            metadatas=[metadata],
+            ids=[self.vector_id(record_id)]
+        )
+        self.stats["indexed"] += 1
+
+    async def remove(self, record_ids: List[int]):
+        await run_in_vector_executor(self.store.delete, [self.vector_id(i) for i in record_ids])
+        self.stats["removed"] += len(record_ids)
+
+    async def index_record(self, record_id: int) -> bool:
+        """
+        Bring one record's vector up to date: index it if it exists and is
+        indexable, remove it otherwise. Uses its own session so it can run
+        after the request that triggered it has finished. Never raises.
+        """
+        if not self.available:
+            return False
+        try:
+            async with AsyncSessionLocal() as db:
+                records = await self._load(db, [record_id])
+            if not records or not self.should_index(records[0]):
+                await self.remove([record_id])
+                return False
+            record = records[0]
+            await self.upsert(record_id, self.build_text(record), self.build_metadata(record))
+            return True
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Could not index {self.id_prefix} {record_id}: {str(e)}")
+            return False
+
+    async def backfill(self, batch_size: int = 100) -> int:
+        """
+        Index every indexable record once (initial load of an existing
+        database). Returns the number of records indexed.
+        """
+        if not self.available:
+            return 0
+        indexed = 0
+        last_id = 0
+        async with AsyncSessionLocal() as db:
+            while True:
+                record_ids = await self._page_ids(db, last_id, batch_size)
+                if not record_ids:
+                    break
+                records = await self._load(db, record_ids)
+                texts = [self.build_text(r) for r in records]
+                # One batched embedding call per page of records
+                embedded = await self.embedder.embed_documents(texts)
+                await run_in_vector_executor(
+                    self.store.add_embeddings,
+                    texts=texts,
+                    embeddings=embedded["vectors"],
+                    metadatas=[self.build_metadata(r) for r in records],
+                    ids=[self.vector_id(self.record_id(r)) for r in records]
+                )
+                indexed += len(records)
+                self.stats["indexed"] += len(records)
+                last_id = record_ids[-1]
+                # Keep the identity map from growing across pages
+                db.expunge_all()
+        logger.info(f"Backfilled {indexed} records into the {self.name} index")
+        return indexed
+
+    async def search(
+        self,
+        query_vector: List[float],
+        k: int = 5,
+        filter: Optional[dict] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Nearest records to an embedded query.
+
+        Returns:
+            List of {"id" (record id), "distance", "metadata"}, closest first
+        """
+        if not self.available:
+            return []
+        # With the search-time settings: the ANN index spans every collection
+        results = await run_in_vector_executor(
+            similarity_search_with_params,
+            self.store,
+            query_vector,
+            k=k,
+            filter=filter
+        )
+        return [
+            {"id": doc.metadata["record_id"], "distance": float(distance), "metadata": doc.metadata}
+            for doc, distance in results
+        ]
+
+    def index_stats(self) -> Dict[str, Any]:
+        return {"name": self.name, "available": self.available, **self.stats}
+
+
+class TicketIndex(RecordIndex):
+    """Closed tickets with their root causes and resolution steps"""
+
+    def record_id(self, ticket: Tickets) -> int:
+        return ticket.ticket_id
+
+    @staticmethod
+    def build_text(ticket: Tickets) -> str:
+        """Text embedded for a ticket: what it was about and how it was fixed"""
+        parts = [f"Subject: {ticket.subject or ''}"]
+        if ticket.description:
+            parts.append(f"Description: {ticket.description}")
+        causes = [rc.description for rc in ticket.root_causes if rc.description]
+        if causes:
+            parts.append("Root causes: " + "; ".join(causes))
+        steps = sorted(ticket.resolution_steps, key=lambda step: step.step_order)
+        if steps:
+            parts.append("Resolution steps:")
+            parts.extend(f"{step.step_order}. {step.instructions}" for step in steps)
+        return "\n".join(parts)
+
+    @staticmethod
+    def build_metadata(ticket: Tickets) -> Dict[str, Any]:
+        # category_id is stored for filtered search
+        return {
+            "record_id": ticket.ticket_id,
+            "category_id": ticket.category_id,
+            "subject": ticket.subject,
+            "closed_at": ticket.closed_at.isoformat() if ticket.closed_at else None
+        }
+
+    def should_index(self, ticket: Tickets) -> bool:
+        return ticket.status == "Closed"
+
+    async def _load(self, db, ticket_ids: List[int]) -> List[Tickets]:
+        result = await db.execute(
+            select(Tickets)
+            .options(selectinload(Tickets.root_causes), selectinload(Tickets.resolution_steps))
+            .where(Tickets.ticket_id.in_(ticket_ids))
+        )
+        return list(result.scalars().all())
+
+    async def _page_ids(self, db, after_id: int, limit: int) -> List[int]:
+        result = await db.execute(
+            select(Tickets.ticket_id)
+            .where(Tickets.status == "Closed", Tickets.ticket_id > after_id)
+            .order_by(Tickets.ticket_id)
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+
+class KBIndex(RecordIndex):
+    """KB articles: title, summary and the start of the content"""
+
+    def record_id(self, article: KBArticles) -> int:
+        return article.kb_id
+
+    @staticmethod
+    def build_text(article: KBArticles) -> str:
+        """Text embedded for an article; long content is cut to the embedding input limit"""
+        parts = [f"Title: {article.title or ''}"]
+        if article.summary:
+            parts.append(f"Summary: {article.summary}")
+        if article.content:
+            parts.append(article.content[:KB_CONTENT_MAX_CHARS])
+        return "\n".join(parts)
+
+    @staticmethod
+    def build_metadata(article: KBArticles) -> Dict[str, Any]:
+        return {
+            "record_id": article.kb_id,
+            "title": article.title,
+            "version": article.version
+        }
+
+    async def _load(self, db, kb_ids: List[int]) -> List[KBArticles]:
+        result = await db.execute(select(KBArticles).where(KBArticles.kb_id.in_(kb_ids)))
+        return list(result.scalars().all())
+
+    async def _page_ids(self, db, after_id: int, limit: int) -> List[int]:
+        result = await db.execute(
+            select(KBArticles.kb_id)
+            .where(KBArticles.kb_id > after_id)
+            .order_by(KBArticles.kb_id)
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+
+# Global instances
+ticket_index = TicketIndex(
+    "tickets",
+    id_prefix="ticket",
+    store=create_vector_store(
+        settings.TICKET_INDEX_COLLECTION,
+        f"{settings.LOCAL_INDEX_DIR}_tickets",
+        label="ticket index"
+    )
+)
+
+kb_index = KBIndex(
+    "kb_articles",
+    id_prefix="kb",
+    store=create_vector_store(
+        settings.KB_INDEX_COLLECTION,
+        f"{settings.LOCAL_INDEX_DIR}_kb",
+        label="KB index"
+    )
+)
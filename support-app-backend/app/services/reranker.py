@@ -0,0 +1,223 @@
+# app/services/reranker.py
+"""
+CPU-only reranking of retrieved document chunks.
+The hybrid retriever over-fetches document candidates; the reranker
+rescores each (query, chunk) pair and only the best few go into the prompt.
+Scoring uses a small cross-encoder exported to ONNX when RERANK_MODEL_DIR
+is set, otherwise a BM25-style lexical scorer. Pairs are scored in batches
+on a dedicated thread pool and scores are cached per (query, chunk text).
+"""
+import asyncio
+import hashlib
+import os
+import re
+import time
+import logging
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# ONNX Runtime and the tokenizer are optional (only needed for a cross-encoder)
+try:
+    import onnxruntime
+    from tokenizers import Tokenizer
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+_TERM_RE = re.compile(r"\w+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it my not of on or "
+    "so that the this to was what when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TERM_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class LexicalScorer:
+    """
+    BM25-style scorer that needs no model weights. Term frequencies saturate
+    (k1) and are normalized by chunk length (b) against a fixed average, so
+    a pair's score does not depend on the other candidates and can be cached.
+    Chunks covering more of the query's terms, and its word pairs in order,
+    score higher.
+    """
+
+    name = "lexical"
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, avg_length: Optional[float] = None):
+        self.k1 = k1
+        self.b = b
+        # About one chunk's worth of words after stopword removal
+        self.avg_length = avg_length or max(settings.CHUNK_SIZE / 8, 1.0)
+
+    def score(self, query: str, passage: str) -> float:
+        query_terms = list(dict.fromkeys(tokenize(query)))
+        if not query_terms:
+            return 0.0
+        terms = tokenize(passage)
+        counts = Counter(terms)
+        norm = self.k1 * (1 - self.b + self.b * len(terms) / self.avg_length)
+
+        bm25 = sum(counts[t] * (self.k1 + 1) / (counts[t] + norm) for t in query_terms if counts[t])
+        coverage = sum(1 for t in query_terms if counts[t]) / len(query_terms)
+        query_pairs = set(zip(query_terms, query_terms[1:]))
+        phrase = len(query_pairs & set(zip(terms, terms[1:]))) / len(query_pairs) if query_pairs else 0.0
+        return bm25 / len(query_terms) + coverage + 0.5 * phrase
+
+    def score_batch(self, query: str, passages: List[str]) -> List[float]:
+        return [self.score(query, passage) for passage in passages]
+
+
+class ONNXCrossEncoder:
+    """
+    Cross-encoder (e.g. ms-marco-MiniLM-L-6-v2) exported to ONNX. Expects
+    model.onnx and tokenizer.json in model_dir and returns the relevance logit.
+    """
+
+    name = "cross_encoder"
+
+    def __init__(self, model_dir: str, max_length: int = 512):
+        options = onnxruntime.SessionOptions()
+        # Parallelism comes from the rerank thread pool, not intra-op threads
+        options.intra_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        # Tokenizers are not safe to use from several threads at once
+        self._tokenizer_lock = threading.Lock()
+
+    def score_batch(self, query: str, passages: List[str]) -> List[float]:
+        with self._tokenizer_lock:
+            encodings = self.tokenizer.encode_batch([(query, passage) for passage in passages])
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64)
+        }
+        logits = self.session.run(None, {k: v for k, v in inputs.items() if k in self.input_names})[0]
+        return np.asarray(logits, dtype=np.float32).reshape(len(passages), -1)[:, -1].tolist()
+
+
+def create_scorer(model_dir: Optional[str] = None):
+    """Cross-encoder if its weights and ONNX Runtime are available, else lexical"""
+    model_dir = model_dir if model_dir is not None else settings.RERANK_MODEL_DIR
+    if model_dir:
+        if not ONNX_AVAILABLE:
+            print("Warning: RERANK_MODEL_DIR is set but onnxruntime/tokenizers are not installed; using lexical reranker")
+        else:
+            try:
+                scorer = ONNXCrossEncoder(model_dir)
+                print(f"✅ Cross-encoder reranker loaded from {model_dir}")
+                return scorer
+            except Exception as e:
+                print(f"Warning: Could not load cross-encoder reranker: {e}")
+    return LexicalScorer()
+
+
+class Reranker:
+    """Batched, cached rescoring of (query, passage) pairs"""
+
+    def __init__(
+        self,
+        scorer=None,
+        batch_size: Optional[int] = None,
+        cache_size: Optional[int] = None,
+        workers: Optional[int] = None
+    ):
+        self.enabled = settings.RERANK_ENABLED
+        self.candidates = settings.RERANK_CANDIDATES
+        self._scorer = scorer
+        self.batch_size = batch_size or settings.RERANK_BATCH_SIZE
+        self.cache_size = cache_size or settings.RERANK_CACHE_SIZE
+        self._cache: "OrderedDict[str, float]" = OrderedDict()
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or settings.RERANK_WORKERS,
+            thread_name_prefix="rerank"
+        )
+        self.stats = {"pairs": 0, "cache_hits": 0, "batches": 0, "score_ms_total": 0.0}
+
+    @property
+    def scorer(self):
+        # Loaded on first use so the model is not read unless reranking runs
+        if self._scorer is None:
+            self._scorer = create_scorer()
+        return self._scorer
+
+    def _cache_key(self, query: str, passage: str) -> str:
+        digest = hashlib.sha1(f"{query.strip().lower()}\0{passage}".encode("utf-8")).hexdigest()
+        return f"{self.scorer.name}:{digest}"
+
+    async def score(self, query: str, passages: List[str]) -> List[float]:
+        """Scores for (query, passage) pairs, aligned with passages"""
+        keys = [self._cache_key(query, passage) for passage in passages]
+        scores: List[Optional[float]] = [self._cache.get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        self.stats["pairs"] += len(passages)
+        self.stats["cache_hits"] += len(passages) - len(missing)
+
+        if missing:
+            started = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            results = await asyncio.gather(*[
+                loop.run_in_executor(self.executor, self.scorer.score_batch, query, [passages[i] for i in batch])
+                for batch in batches
+            ])
+            for batch, batch_scores in zip(batches, results):
+                for i, value in zip(batch, batch_scores):
+                    scores[i] = float(value)
+                    self._remember(keys[i], float(value))
+            self.stats["batches"] += len(batches)
+            self.stats["score_ms_total"] += (time.perf_counter() - started) * 1000
+
+        return scores
+
+    def _remember(self, key: str, value: float):
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def rerank(self, query: str, passages: List[str], top_n: int) -> List[Tuple[int, float]]:
+        """
+        Rescore passages and keep the best.
+
+        Returns:
+            (index into passages, score) for the top_n passages, best first;
+            ties keep the original (first-stage) order
+        """
+        if not passages:
+            return []
+        scores = await self.score(query, passages)
+        order = sorted(range(len(passages)), key=lambda i: (-scores[i], i))
+        return [(i, scores[i]) for i in order[:top_n]]
+
+    def cache_stats(self) -> Dict[str, Any]:
+        scored = self.stats["pairs"] - self.stats["cache_hits"]
+        return {
+            "enabled": self.enabled,
+            "scorer": self._scorer.name if self._scorer is not None else None,
+            "entries": len(self._cache),
+            **{k: v for k, v in self.stats.items() if k != "score_ms_total"},
+            "hit_rate": round(self.stats["cache_hits"] / self.stats["pairs"], 3) if self.stats["pairs"] else 0.0,
+            "avg_pair_ms": round(self.stats["score_ms_total"] / scored, 3) if scored else 0.0
+        }
+
+
+# Global instance
+reranker = Reranker()
@@ -0,0 +1,116 @@
+# app/services/ticket_cards.py
+"""
+Resolution cards for retrieved tickets.
+A card holds a closed ticket's root causes and ordered resolution steps as
+they appear in the RAG prompt. Cards for all retrieved tickets are read
+from Redis in one round trip; misses are loaded with one query for steps
+and one for root causes (WHERE ticket_id IN ...), never per ticket.
+"""
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models import ResolutionSteps, TicketRootCauses
+from ..database import AsyncSessionLocal
+from .cache import cache_get_many, cache_set_many, cache_delete, CacheKeys, CacheTTL
+
+logger = logging.getLogger(__name__)
+
+
+def empty_card() -> Dict[str, Any]:
+    return {"root_cause": None, "resolution_steps": []}
+
+
+class TicketCardLoader:
+    """Batched, cached loading of ticket resolution cards"""
+
+    def __init__(self, session_factory: Optional[Callable[[], AsyncSession]] = None):
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def cache_key(ticket_id: int) -> str:
+        return f"{CacheKeys.TICKET_CARD}{ticket_id}"
+
+    async def _load_cards(self, db: AsyncSession, ticket_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Build cards for several tickets with two queries in total"""
+        cards = {ticket_id: empty_card() for ticket_id in ticket_ids}
+
+        steps = await db.execute(
+            select(ResolutionSteps)
+            .where(ResolutionSteps.ticket_id.in_(ticket_ids))
+            .order_by(ResolutionSteps.ticket_id, ResolutionSteps.step_order)
+        )
+        for step in steps.scalars().all():
+            cards[step.ticket_id]["resolution_steps"].append({
+                "step_order": step.step_order,
+                "instructions": step.instructions,
+                "success_flag": step.success_flag
+            })
+
+        causes = await db.execute(
+            select(TicketRootCauses)
+            .where(TicketRootCauses.ticket_id.in_(ticket_ids))
+            .order_by(TicketRootCauses.ticket_id, TicketRootCauses.rootcause_id)
+        )
+        descriptions: Dict[int, List[str]] = {}
+        codes: Dict[int, List[str]] = {}
+        for cause in causes.scalars().all():
+            if cause.description:
+                descriptions.setdefault(cause.ticket_id, []).append(cause.description)
+            if cause.cause_code:
+                codes.setdefault(cause.ticket_id, []).append(cause.cause_code)
+        for ticket_id in descriptions.keys() | codes.keys():
+            cards[ticket_id]["root_cause"] = {
+                # Fall back to the codes when no cause was written up
+                "description": "; ".join(descriptions.get(ticket_id, [])) or ", ".join(codes[ticket_id]),
+                "cause_codes": codes.get(ticket_id, [])
+            }
+
+        return cards
+
+    async def get_cards(self, ticket_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """
+        Resolution cards for the given (closed) tickets.
+
+        Returns:
+            Ticket id -> {"root_cause": {"description", "cause_codes"} or
+            None, "resolution_steps": [{"step_order", "instructions",
+            "success_flag"}]}
+        """
+        if not ticket_ids:
+            return {}
+
+        cached = await cache_get_many([self.cache_key(ticket_id) for ticket_id in ticket_ids])
+        cards = {ticket_id: card for ticket_id, card in zip(ticket_ids, cached) if card is not None}
+        missing = [ticket_id for ticket_id in ticket_ids if ticket_id not in cards]
+        self.stats["hits"] += len(cards)
+        self.stats["misses"] += len(missing)
+
+        if missing:
+            async with self.session_factory() as db:
+                loaded = await self._load_cards(db, missing)
+            cards.update(loaded)
+            await cache_set_many(
+                {self.cache_key(ticket_id): card for ticket_id, card in loaded.items()},
+                ttl=CacheTTL.TICKET_CARD
+            )
+
+        return cards
+
+    async def invalidate(self, ticket_id: int):
+        """Drop a ticket's card after its resolution data or status changed"""
+        await cache_delete(self.cache_key(ticket_id))
+
+    def cache_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0
+        }
+
+
+# Global instance
+ticket_cards = TicketCardLoader()
@@ -0,0 +1,261 @@
+# app/services/vector_index.py
+"""
+ANN index on the PGVector embedding table.
+langchain_postgres creates langchain_pg_embedding without an index on the
+embedding column, so every similarity search is an exact scan. This builds
+an HNSW or IVFFlat index with vector_cosine_ops (PGVector searches by
+cosine distance) using CREATE INDEX CONCURRENTLY, so searches and ingestion
+carry on during a build. A rebuild creates the new index next to the old
+one and swaps them. All collections share the table, and so the index.
+
+With PGVECTOR_QUANTIZATION the index is built on halfvec or binary
+quantized vectors (the expression IndexedFilterPGVector orders by), while
+the table keeps float32 for exact rescoring. EMBEDDING_DIMENSIONS below
+the stored size truncates the stored vectors in place.
+"""
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from ..config import settings
+from ..database import engine
+
+logger = logging.getLogger(__name__)
+
+TABLE = "langchain_pg_embedding"
+INDEX_NAME = "ix_langchain_pg_embedding_embedding_ann"
+BUILD_INDEX_NAME = f"{INDEX_NAME}_build"
+INDEX_TYPES = ("hnsw", "ivfflat")
+QUANTIZATIONS = ("none", "halfvec", "binary")
+# pg_try_advisory_lock key: one build at a time across workers
+BUILD_LOCK_KEY = 0x7665637472
+# pgvector limits
+MAX_HNSW_M = 100
+MAX_IVFFLAT_LISTS = 32768
+
+
+def ivfflat_lists(rows: int) -> int:
+    """pgvector's guideline: rows / 1000 lists up to 1M rows, sqrt(rows) above"""
+    if rows <= 1_000_000:
+        return max(1, rows // 1000)
+    return min(int(math.sqrt(rows)), MAX_IVFFLAT_LISTS)
+
+
+def index_expression(quantization: str, dimensions: Optional[int]) -> str:
+    """Indexed expression and operator class; must match the search's ORDER BY"""
+    if quantization == "halfvec":
+        return f"(embedding::halfvec({int(dimensions)})) halfvec_cosine_ops"
+    if quantization == "binary":
+        return f"(binary_quantize(embedding)::bit({int(dimensions)})) bit_hamming_ops"
+    return "embedding vector_cosine_ops"
+
+
+def index_statement(name: str, options: Dict[str, Any]) -> str:
+    """CREATE INDEX CONCURRENTLY for validated build options"""
+    expression = index_expression(options.get("quantization", "none"), options.get("dimensions"))
+    if options["index_type"] == "hnsw":
+        with_options = f"m = {int(options['m'])}, ef_construction = {int(options['ef_construction'])}"
+    else:
+        with_options = f"lists = {int(options['lists'])}"
+    return (
+        f"CREATE INDEX CONCURRENTLY {name} ON {TABLE} "
+        f"USING {options['index_type']} ({expression}) WITH ({with_options})"
+    )
+
+
+class VectorIndexManager:
+    """Builds, rebuilds and reports the ANN index of the PGVector table"""
+
+    def __init__(self, db_engine: Optional[AsyncEngine] = None):
+        self.engine = db_engine or engine
+        self._task: Optional[asyncio.Task] = None
+        self.last_build: Optional[Dict[str, Any]] = None
+
+    @property
+    def building(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def build_options(
+        self,
+        index_type: Optional[str] = None,
+        m: Optional[int] = None,
+        ef_construction: Optional[int] = None,
+        lists: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Fill in configured defaults and validate; raises ValueError"""
+        index_type = (index_type or settings.PGVECTOR_INDEX_TYPE).lower()
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index type: {index_type}. Supported types: {', '.join(INDEX_TYPES)}")
+        # Not a request option: the index has to match what searches order by
+        quantization = settings.PGVECTOR_QUANTIZATION.lower()
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unsupported PGVECTOR_QUANTIZATION: {quantization}. Supported: {', '.join(QUANTIZATIONS)}")
+        if index_type == "ivfflat":
+            lists = settings.PGVECTOR_IVFFLAT_LISTS if lists is None else lists
+            if not 0 <= lists <= MAX_IVFFLAT_LISTS:
+                raise ValueError(f"lists must be between 1 and {MAX_IVFFLAT_LISTS} (0 = from the row count)")
+            return {"index_type": index_type, "lists": lists, "quantization": quantization}
+        m = m or settings.PGVECTOR_HNSW_M
+        ef_construction = ef_construction or settings.PGVECTOR_HNSW_EF_CONSTRUCTION
+        if not 2 <= m <= MAX_HNSW_M:
+            raise ValueError(f"m must be between 2 and {MAX_HNSW_M}")
+        if ef_construction < 2 * m:
+            raise ValueError("ef_construction must be at least 2 * m")
+        return {"index_type": index_type, "m": m, "ef_construction": ef_construction, "quantization": quantization}
+
+    async def start_build(self, truncate: bool = False, **options) -> Dict[str, Any]:
+        """
+        Validate options and build (or rebuild) the index in the background.
+        truncate allows cutting stored vectors to EMBEDDING_DIMENSIONS.
+        Raises ValueError for bad options and RuntimeError if a build is
+        already running in any worker.
+        """
+        options = self.build_options(**options)
+        if self.building:
+            raise RuntimeError("An index build is already running")
+        conn = await self.engine.connect()
+        try:
+            # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction
+            await conn.execution_options(isolation_level="AUTOCOMMIT")
+            locked = (await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": BUILD_LOCK_KEY})).scalar()
+        except Exception:
+            await conn.close()
+            raise
+        if not locked:
+            await conn.close()
+            raise RuntimeError("An index build is already running")
+        self.last_build = {
+            "status": "running",
+            **options,
+            "started_at": datetime.now(timezone.utc).isoformat()
+        }
+        self._task = asyncio.create_task(self._build(conn, options, truncate))
+        return self.last_build
+
+    async def _build(self, conn: AsyncConnection, options: Dict[str, Any], truncate: bool = False):
+        started = time.perf_counter()
+        try:
+            options["dimensions"] = await self._ensure_fixed_dimensions(conn, truncate)
+            rows = (await conn.execute(text(f"SELECT count(*) FROM {TABLE}"))).scalar()
+            if options["index_type"] == "ivfflat" and not options["lists"]:
+                options["lists"] = ivfflat_lists(rows)
+            self.last_build.update(options, rows=rows)
+            await conn.execute(
+                text("SELECT set_config('maintenance_work_mem', :value, false)"),
+                {"value": settings.PGVECTOR_INDEX_BUILD_MEMORY}
+            )
+            # An interrupted build leaves an invalid index behind
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {BUILD_INDEX_NAME}"))
+            await conn.execute(text(index_statement(BUILD_INDEX_NAME, options)))
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}"))
+            await conn.execute(text(f"ALTER INDEX {BUILD_INDEX_NAME} RENAME TO {INDEX_NAME}"))
+            self.last_build.update(status="completed", seconds=round(time.perf_counter() - started, 1))
+            logger.info(f"Built {options['index_type']} index on {rows} vectors in {self.last_build['seconds']}s")
+        except Exception as e:
+            logger.error(f"Vector index build failed: {str(e)}")
+            self.last_build.update(status="failed", error=str(e), seconds=round(time.perf_counter() - started, 1))
+        finally:
+            try:
+                await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": BUILD_LOCK_KEY})
+            finally:
+                await conn.close()
+
+    async def _column_type(self, conn: AsyncConnection) -> Optional[str]:
+        result = await conn.execute(
+            text(
+                "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+                "WHERE attrelid = to_regclass(:table) AND attname = 'embedding'"
+            ),
+            {"table": TABLE}
+        )
+        return result.scalar()
+
+    async def _ensure_fixed_dimensions(self, conn: AsyncConnection, truncate: bool = False) -> int:
+        """
+        HNSW and IVFFlat need a column of fixed dimension; PGVector creates
+        it as plain "vector". Type it from the stored embeddings, cut to
+        EMBEDDING_DIMENSIONS if that is smaller and truncate is set (rewrites
+        the table once, under an exclusive lock).
+        """
+        column_type = await self._column_type(conn)
+        if column_type is None:
+            raise ValueError("No vectors stored yet: ingest documents before building the index")
+        if column_type != "vector":
+            stored = int(column_type[len("vector("):-1])
+        else:
+            result = await conn.execute(text(f"SELECT DISTINCT vector_dims(embedding) FROM {TABLE}"))
+            dimensions = result.scalars().all()
+            if not dimensions:
+                raise ValueError("No vectors stored yet: ingest documents before building the index")
+            if len(dimensions) > 1:
+                raise ValueError(f"Embeddings of different dimensions ({sorted(dimensions)}) cannot share one index")
+            stored = dimensions[0]
+        target = settings.EMBEDDING_DIMENSIONS or stored
+        if target > stored:
+            raise ValueError(f"EMBEDDING_DIMENSIONS ({target}) exceeds the {stored} stored dimensions: re-ingest instead")
+        if target < stored and not truncate:
+            raise ValueError(
+                f"Stored vectors have {stored} dimensions and EMBEDDING_DIMENSIONS is {target}: "
+                f"rebuild with truncate=true to cut them (undone only by re-ingesting)"
+            )
+        if column_type == f"vector({target})":
+            return target
+        # Matryoshka prefixes: no re-embedding needed
+        using = f" USING subvector(embedding, 1, {target})::vector({target})" if target < stored else ""
+        await conn.execute(text(f"ALTER TABLE {TABLE} ALTER COLUMN embedding TYPE vector({target}){using}"))
+        return target
+
+    async def status(self) -> Dict[str, Any]:
+        """ANN indexes on the table, progress of a running build and search defaults"""
+        async with self.engine.connect() as conn:
+            column_type = await self._column_type(conn)
+            table_size = (await conn.execute(
+                text("SELECT pg_table_size(to_regclass(:table))"), {"table": TABLE}
+            )).scalar()
+            result = await conn.execute(
+                text(
+                    "SELECT c.relname, am.amname, pg_relation_size(c.oid), i.indisvalid, pg_get_indexdef(c.oid) "
+                    "FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid JOIN pg_am am ON am.oid = c.relam "
+                    "WHERE i.indrelid = to_regclass(:table) AND am.amname IN ('hnsw', 'ivfflat')"
+                ),
+                {"table": TABLE}
+            )
+            indexes: List[Dict[str, Any]] = [
+                {"name": name, "type": index_type, "size_bytes": size, "valid": valid, "definition": definition}
+                for name, index_type, size, valid, definition in result.all()
+            ]
+            result = await conn.execute(
+                text(
+                    "SELECT phase, blocks_done, blocks_total, tuples_done, tuples_total "
+                    "FROM pg_stat_progress_create_index WHERE relid = to_regclass(:table)"
+                ),
+                {"table": TABLE}
+            )
+            progress = [dict(row._mapping) for row in result.all()]
+        return {
+            "table": TABLE,
+            "column_type": column_type,
+            "table_size_bytes": table_size,
+            "indexes": indexes,
+            "build_progress": progress,
+            "building": self.building,
+            "last_build": self.last_build,
+            "search_defaults": {
+                "ef_search": settings.PGVECTOR_EF_SEARCH or None,
+                "probes": settings.PGVECTOR_PROBES or None,
+                "iterative_scan": settings.PGVECTOR_ITERATIVE_SCAN,
+                "quantization": settings.PGVECTOR_QUANTIZATION,
+                "rescore_factor": settings.PGVECTOR_RESCORE_FACTOR,
+                "embedding_dimensions": settings.EMBEDDING_DIMENSIONS or None
+            }
+        }
+
+
+# Global instance
+vector_index_manager = VectorIndexManager()
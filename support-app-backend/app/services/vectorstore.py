@@ -1,8 +1,172 @@
 # app/services/vectorstore.py
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from langchain_core.documents import Document
 from langchain_postgres import PGVector
+from pgvector.sqlalchemy import BIT, HALFVEC, VECTOR
+from sqlalchemy import asc, cast, delete, event, func, literal, or_, select, text, type_coerce, update
+from sqlalchemy.dialects.postgresql import JSONB
 from .embeddings import embeddings
+from .embedding_cache import embedding_service, CachedQueryEmbeddings
 from ..config import settings
 
+# hnsw.ef_search / ivfflat.probes / hnsw.iterative_scan for the search running
+# on this thread. Applied with SET LOCAL when the search's transaction begins,
+# so pooled connections go back with the server defaults.
+_search_settings = threading.local()
+
+def _apply_search_settings(session, transaction, connection):
+    for name, value in (getattr(_search_settings, "values", None) or {}).items():
+        # Strings are ITERATIVE_SCANS modes, checked when the store is created
+        connection.exec_driver_sql(f"SET LOCAL {name} = {value if isinstance(value, str) else int(value)}")
+
+JSON_SCALARS = (str, int, float, bool, type(None))
+# PGVECTOR_QUANTIZATION modes: what the ANN index stores per vector
+QUANTIZATIONS = ("none", "halfvec", "binary")
+# PGVECTOR_ITERATIVE_SCAN modes (hnsw.iterative_scan, pgvector >= 0.8)
+ITERATIVE_SCANS = ("off", "strict_order", "relaxed_order")
+# pgvector's hnsw.ef_search default, used when none is configured
+DEFAULT_EF_SEARCH = 40
+
+def truncate_embedding(embedding: List[float], dimensions: int) -> List[float]:
+    """
+    Matryoshka truncation: keep the leading dimensions (0 = all).
+    text-embedding-004 is trained so prefixes remain usable embeddings;
+    cosine distance ignores length, so no re-normalisation is needed.
+    """
+    if dimensions and len(embedding) > dimensions:
+        return list(embedding[:dimensions])
+    return embedding
+
+class IndexedFilterPGVector(PGVector):
+    """
+    PGVector whose equality and $in metadata filters compile to JSONB
+    containment (cmetadata @> '{"file_type": "pdf"}'), which the GIN index
+    on cmetadata answers. PGVector's own jsonb_path_match / ->> comparisons
+    cannot use an index, so every filtered search read the whole collection
+    and filtered afterwards. Containment compares JSON types: 5 is not "5".
+    Adds {"field": {"$contains": value}} for JSON values (e.g. an entry of a
+    list field).
+
+    Storage: vectors are cut to dimensions on write and on query. With
+    quantization "halfvec" or "binary" the search orders candidates by the
+    quantized expression the ANN index is built on (vector_index), fetches
+    k * rescore_factor of them and re-ranks those by exact cosine distance
+    on the stored vectors, so the index shrinks without losing recall.
+
+    Every search filters on its collection, after the HNSW scan. With
+    iterative_scan the scan continues until enough rows pass the filters
+    (pgvector 0.8+; older servers are detected and left as they are).
+    """
+
+    def __init__(
+        self,
+        *args,
+        quantization: str = "none",
+        dimensions: int = 0,
+        rescore_factor: int = 4,
+        iterative_scan: str = "off",
+        **kwargs
+    ):
+        quantization = quantization.lower()
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unsupported quantization: {quantization}. Supported: {', '.join(QUANTIZATIONS)}")
+        iterative_scan = iterative_scan.lower()
+        if iterative_scan not in ITERATIVE_SCANS:
+            raise ValueError(f"Unsupported iterative scan: {iterative_scan}. Supported: {', '.join(ITERATIVE_SCANS)}")
+        super().__init__(*args, **kwargs)
+        self.quantization = quantization
+        self.dimensions = dimensions
+        self.rescore_factor = max(1, rescore_factor)
+        self.iterative_scan = iterative_scan
+        self._iterative_scan_supported: Optional[bool] = None
+
+    def candidate_count(self, k: int) -> int:
+        """Rows the index has to return for a search of k results"""
+        return k if self.quantization == "none" else k * self.rescore_factor
+
+    def iterative_scan_mode(self) -> Optional[str]:
+        """hnsw.iterative_scan for searches; None when off or the server's pgvector is older than 0.8"""
+        if self.iterative_scan == "off":
+            return None
+        if self._iterative_scan_supported is None:
+            with self._make_sync_session() as session:
+                version = session.execute(
+                    text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+                ).scalar()
+            parts = [int(p) if p.isdigit() else 0 for p in (version or "0").split(".")[:2]]
+            self._iterative_scan_supported = tuple(parts) >= (0, 8)
+        return self.iterative_scan if self._iterative_scan_supported else None
+
+    def add_embeddings(self, texts, embeddings: List[List[float]], *args, **kwargs) -> List[str]:
+        embeddings = [truncate_embedding(e, self.dimensions) for e in embeddings]
+        return super().add_embeddings(texts, embeddings, *args, **kwargs)
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[dict] = None
+    ) -> List[Tuple[Document, float]]:
+        embedding = truncate_embedding(embedding, self.dimensions)
+        if self.quantization == "none":
+            return super().similarity_search_with_score_by_vector(embedding, k=k, filter=filter)
+        return self._results_to_docs_and_scores(self._rescored_query(embedding, k, filter))
+
+    def _quantized_distance(self, embedding: List[float]):
+        """Distance on the same expression the ANN index is built on"""
+        dimensions = len(embedding)
+        column = self.EmbeddingStore.embedding
+        if self.quantization == "halfvec":
+            return cast(column, HALFVEC(dimensions)).cosine_distance(embedding)
+        query = func.binary_quantize(cast(literal(embedding, VECTOR(dimensions)), VECTOR(dimensions)))
+        return cast(func.binary_quantize(column), BIT(dimensions)).hamming_distance(cast(query, BIT(dimensions)))
+
+    def _rescored_query(self, embedding: List[float], k: int, filter: Optional[dict]):
+        store = self.EmbeddingStore
+        with self._make_sync_session() as session:
+            collection = self.get_collection(session)
+            if not collection:
+                raise ValueError("Collection not found")
+            filter_by = [store.collection_id == collection.uuid]
+            if filter:
+                clause = self._create_filter_clause(filter)
+                if clause is not None:
+                    filter_by.append(clause)
+            candidates = (
+                select(store.id)
+                .where(*filter_by)
+                .order_by(self._quantized_distance(embedding))
+                .limit(self.candidate_count(k))
+                .subquery()
+            )
+            return (
+                session.query(store, store.embedding.cosine_distance(embedding).label("distance"))
+                .join(candidates, store.id == candidates.c.id)
+                .order_by(asc("distance"))
+                .limit(k)
+                .all()
+            )
+
+    def _handle_field_filter(self, field: str, value: Any):
+        if isinstance(value, dict) and len(value) == 1:
+            operator, operand = next(iter(value.items()))
+        else:
+            operator, operand = "$eq", value
+        if field.isidentifier() and not field.startswith("$"):
+            contains = self.EmbeddingStore.cmetadata.contains
+            if (operator == "$eq" and isinstance(operand, JSON_SCALARS)) or operator == "$contains":
+                return contains({field: operand})
+            if (
+                operator == "$in" and operand
+                and all(isinstance(v, (str, int, float)) and not isinstance(v, bool) for v in operand)
+            ):
+                return or_(*[contains({field: v}) for v in operand])
+        return super()._handle_field_filter(field, value)
+
 # Use synchronous connection for PGVector (uses psycopg internally)
 # Convert asyncpg URL to psycopg format
 def get_sync_connection_string():
@@ -12,21 +176,171 @@ def get_sync_connection_string():
         return db_url.replace("postgresql+asyncpg://", "postgresql+psycopg://")
     return db_url
 
-# Initialize vector database only if embeddings are available
-vectordb = None
-if embeddings is not None:
+def create_vector_store(collection_name: str, index_dir: str, label: str = "vector database"):
+    """
+    Create a vector store for one collection on the configured backend
+    (a PGVector collection, or a memory-mapped local index directory).
+    Returns None if embeddings or the backend are unavailable.
+    """
+    if embeddings is None:
+        print(f"Warning: {label} not initialized due to missing embeddings.")
+        return None
+    
+    if settings.VECTOR_BACKEND == "local_ann":
+        try:
+            from .ann_index import LocalANNVectorStore
+            store = LocalANNVectorStore(
+                embeddings=CachedQueryEmbeddings(embedding_service),
+                index_dir=index_dir,
+                dtype=settings.LOCAL_INDEX_DTYPE,
+                nlist=settings.LOCAL_INDEX_NLIST,
+                nprobe=settings.LOCAL_INDEX_NPROBE
+            )
+            print(f"✅ Local ANN {label} index initialized at {index_dir}")
+            return store
+        except Exception as e:
+            print(f"Warning: Could not initialize local {label} index: {e}")
+            return None
+    
     try:
-        connection_string = get_sync_connection_string()
-        vectordb = PGVector(
-            embeddings=embeddings,
-            collection_name="support_system_docs",
-            connection=connection_string,
-            use_jsonb=True
+        store = IndexedFilterPGVector(
+            embeddings=CachedQueryEmbeddings(embedding_service),
+            collection_name=collection_name,
+            connection=get_sync_connection_string(),
+            use_jsonb=True,
+            quantization=settings.PGVECTOR_QUANTIZATION,
+            dimensions=settings.EMBEDDING_DIMENSIONS,
+            rescore_factor=settings.PGVECTOR_RESCORE_FACTOR,
+            iterative_scan=settings.PGVECTOR_ITERATIVE_SCAN
         )
-        print("✅ PGVector initialized successfully")
+        event.listen(store.session_maker, "after_begin", _apply_search_settings)
+        print(f"✅ PGVector {label} initialized successfully")
+        return store
     except Exception as e:
-        print(f"Warning: Could not initialize vector database: {e}")
-        vectordb = None
-else:
-    print("Warning: Vector database not initialized due to missing embeddings.")
+        print(f"Warning: Could not initialize {label}: {e}")
+        return None
+
+# Initialize vector database only if embeddings are available
+vectordb = create_vector_store("support_system_docs", settings.LOCAL_INDEX_DIR)
+
+
+# PGVector and the Vertex AI embedding client are synchronous (psycopg + HTTP).
+# Run them on a dedicated, bounded pool so they never block the event loop and
+# cannot exhaust the default executor used by other asyncio.to_thread calls.
+vector_executor = ThreadPoolExecutor(
+    max_workers=settings.VECTOR_SEARCH_WORKERS,
+    thread_name_prefix="vector-search"
+)
+
+async def run_in_vector_executor(func: Callable, *args, **kwargs) -> Any:
+    """Run a blocking vector store / embedding call on the vector executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(vector_executor, partial(func, *args, **kwargs))
+
+def delete_by_filter(store, filter: dict, keep_ids: Iterable[str] = ()) -> None:
+    """
+    Delete vectors whose metadata match filter (e.g. every chunk of one
+    document), except keep_ids. Blocking; run it on the vector executor.
+    """
+    if not isinstance(store, PGVector):
+        store.delete_by_filter(filter, keep_ids=keep_ids)
+        return
+    # PGVector.delete only takes ids; build the same statement with its metadata filter
+    keep_ids = list(keep_ids)
+    with store._make_sync_session() as session:
+        collection = store.get_collection(session)
+        if collection is None:
+            return
+        statement = delete(store.EmbeddingStore).where(
+            store.EmbeddingStore.collection_id == collection.uuid,
+            store._create_filter_clause(filter)
+        )
+        if keep_ids:
+            statement = statement.where(store.EmbeddingStore.id.not_in(keep_ids))
+        session.execute(statement)
+        session.commit()
+
+def update_metadata(store, updates: Dict[str, dict], merge: bool = True) -> None:
+    """
+    Merge into (or, with merge=False, replace) the metadata of vectors by
+    id, without re-embedding. Blocking; run it on the vector executor.
+    """
+    if not isinstance(store, PGVector):
+        store.update_metadata(updates, merge=merge)
+        return
+    embedding = store.EmbeddingStore
+    with store._make_sync_session() as session:
+        for vector_id, metadata in updates.items():
+            value = type_coerce(metadata, JSONB)
+            session.execute(
+                update(embedding)
+                .where(embedding.id == vector_id)
+                .values(cmetadata=embedding.cmetadata.op("||")(value) if merge else value)
+            )
+        session.commit()
+
+def similarity_search_with_params(
+    store,
+    embedding: List[float],
+    k: int = 5,
+    filter: Optional[dict] = None,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None
+) -> List[Tuple[Any, float]]:
+    """
+    Similarity search with the ANN index's search-time settings: HNSW
+    ef_search and IVFFlat probes for PGVector (unset = PGVECTOR_EF_SEARCH /
+    PGVECTOR_PROBES; probes 0 = server default), probes as nprobe for the
+    local index. Blocking; run it on the vector executor.
+    """
+    if not isinstance(store, PGVector):
+        return store.similarity_search_with_score_by_vector(embedding, k=k, filter=filter, nprobe=probes)
+    ef_search = ef_search or settings.PGVECTOR_EF_SEARCH or DEFAULT_EF_SEARCH
+    probes = probes or settings.PGVECTOR_PROBES
+    values = {}
+    candidates = k
+    if isinstance(store, IndexedFilterPGVector):
+        candidates = store.candidate_count(k)
+        iterative_scan = store.iterative_scan_mode()
+        if iterative_scan:
+            values["hnsw.iterative_scan"] = iterative_scan
+    # HNSW returns at most ef_search rows, including candidates for rescoring
+    values["hnsw.ef_search"] = max(ef_search, candidates)
+    if probes:
+        values["ivfflat.probes"] = probes
+    _search_settings.values = values
+    try:
+        return store.similarity_search_with_score_by_vector(embedding, k=k, filter=filter)
+    finally:
+        _search_settings.values = None
+
+async def asimilarity_search_with_score_by_vector(
+    embedding: List[float],
+    k: int = 5,
+    filter: Optional[dict] = None,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None
+) -> List[Tuple[Any, float]]:
+    """Non-blocking similarity search for an already embedded query"""
+    if vectordb is None:
+        return []
+    return await run_in_vector_executor(
+        similarity_search_with_params,
+        vectordb,
+        embedding,
+        k=k,
+        filter=filter,
+        ef_search=ef_search,
+        probes=probes
+    )
 
+async def asimilarity_search_with_score(
+    query: str,
+    k: int = 5,
+    filter: Optional[dict] = None
+) -> List[Tuple[Any, float]]:
+    """Non-blocking similarity search: embed the query (cached), then search by vector"""
+    if vectordb is None:
+        return []
+    query_embedding = await embedding_service.embed_query(query)
+    return await asimilarity_search_with_score_by_vector(query_embedding["vector"], k=k, filter=filter)
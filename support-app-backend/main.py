@@ -4,7 +4,6 @@ from pathlib import Path
 import uvicorn
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any
 from slowapi import _rate_limit_exceeded_handler
@@ -28,6 +27,10 @@ from app.models import Base
 from app.config import Settings
 from app.rate_limiter import limiter, rate_limit_exceeded_handler
 from app.middleware.logging import LoggingMiddleware, setup_structured_logging
+from app.middleware.compression import StreamingGZipMiddleware
+from app.services.loop_monitor import loop_monitor
+from app.services.parse_pool import parse_pool
+from app.services.ingest_jobs import ingest_worker
 
 # Initialize settings
 settings = Settings()
@@ -46,8 +49,8 @@ app = FastAPI(
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
 
-# Add GZip compression middleware (for responses > 1KB)
-app.add_middleware(GZipMiddleware, minimum_size=1000)
+# Add GZip compression middleware (for responses > 1KB; SSE streams pass through)
+app.add_middleware(StreamingGZipMiddleware, minimum_size=1000)
 
 # Add structured logging middleware
 app.add_middleware(LoggingMiddleware)
@@ -109,10 +112,19 @@ async def on_startup():
     except Exception as e:
         print(f"❌ Database initialization failed: {e}")
         raise
+    
+    # Track event loop blocking time
+    loop_monitor.start()
+    
+    # Process queued document ingests in the background
+    ingest_worker.start()
 
 @app.on_event("shutdown")
 async def on_shutdown():
     print("🛑 Shutting down RAG-Support-Agent Backend...")
+    await loop_monitor.stop()
+    await ingest_worker.stop()
+    parse_pool.shutdown()
 
 
 # Original endpoint for computer info
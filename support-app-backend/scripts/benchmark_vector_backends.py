@@ -0,0 +1,255 @@
+"""
+Recall/latency benchmark: local ANN index vs exact search vs PGVector.
+
+Generates clustered synthetic embeddings, builds a LocalANNVectorStore-style
+IVF index in a temporary directory and compares it with an exact scan (the
+plan PGVector runs without an ANN index). With --pgvector the same vectors
+are also loaded into a throwaway PGVector collection and timed end to end,
+as an exact scan and, with --pgvector-index, through an HNSW or IVFFlat
+index swept over ef_search / probes. --quantization and --dimensions
+store the collection the way PGVECTOR_QUANTIZATION / EMBEDDING_DIMENSIONS
+do (recall stays measured against full float32 vectors). Index builds
+cover the whole langchain_pg_embedding table: run this against a scratch
+database.
+
+Usage:
+    python scripts/benchmark_vector_backends.py --sizes 10000 50000 --dim 768
+    python scripts/benchmark_vector_backends.py --sizes 10000 --pgvector
+    python scripts/benchmark_vector_backends.py --sizes 10000 100000 1000000 --pgvector --pgvector-index hnsw
+    python scripts/benchmark_vector_backends.py --sizes 100000 --pgvector-index hnsw --quantization binary --rescore-factor 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.ann_index import IVFIndex, _normalize
+
+BENCHMARK_INDEX = "ix_benchmark_vectors_ann"
+
+
+def make_dataset(n: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors, roughly like topic-grouped support documents"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal(size=(clusters, dim), dtype=np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    # float32, filled in blocks: 1M x 768 is 3 GB, with no full-size temporaries
+    vectors = np.empty((n, dim), dtype=np.float32)
+    block = 100000
+    for start in range(0, n, block):
+        part = rng.standard_normal(size=(min(block, n - start), dim), dtype=np.float32)
+        part *= 0.6
+        part += centers[labels[start:start + block]]
+        vectors[start:start + block] = _normalize(part)
+    return vectors
+
+
+def exact_top_k(data: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    scores = data @ query
+    top = np.argpartition(-scores, k)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def percentile_ms(samples: List[float], pct: float) -> float:
+    return round(float(np.percentile(samples, pct)) * 1000, 3)
+
+
+def time_searches(search, queries: np.ndarray, truth: List[set], k: int) -> dict:
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        results = search(query.tolist())
+        latencies.append(time.perf_counter() - started)
+        hits += len({doc.metadata["row"] for doc, _ in results} & expected)
+    return {
+        "recall": round(hits / (k * len(queries)), 4),
+        "p50_ms": percentile_ms(latencies, 50),
+        "p95_ms": percentile_ms(latencies, 95)
+    }
+
+
+def print_row(label: str, result: dict) -> None:
+    print(f"{label:<28}{result['recall']:>10.4f}{result['p50_ms']:>10}{result['p95_ms']:>10}")
+
+
+def build_pgvector_index(store, args, n: int) -> float:
+    """Build the ANN index the app would build, under a benchmark name; returns seconds"""
+    from sqlalchemy import text
+    from app.services.vector_index import TABLE, index_statement, ivfflat_lists, vector_index_manager
+
+    options = vector_index_manager.build_options(
+        index_type=args.pgvector_index, m=args.hnsw_m, ef_construction=args.hnsw_ef_construction, lists=args.ivfflat_lists
+    )
+    dimensions = args.dimensions or args.dim
+    options.update(quantization=args.quantization, dimensions=dimensions)
+    if options["index_type"] == "ivfflat" and not options["lists"]:
+        options["lists"] = ivfflat_lists(n)
+    with store._engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        column_type = conn.execute(text(
+            "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+            "WHERE attrelid = to_regclass(:table) AND attname = 'embedding'"
+        ), {"table": TABLE}).scalar()
+        if column_type == "vector":
+            # Fails if other collections in this database hold other dimensions
+            conn.execute(text(f"ALTER TABLE {TABLE} ALTER COLUMN embedding TYPE vector({dimensions})"))
+        conn.execute(text("SELECT set_config('maintenance_work_mem', :value, false)"), {"value": args.build_memory})
+        conn.execute(text(f"DROP INDEX IF EXISTS {BENCHMARK_INDEX}"))
+        started = time.perf_counter()
+        conn.execute(text(index_statement(BENCHMARK_INDEX, options).replace(" CONCURRENTLY", "")))
+        build_s = time.perf_counter() - started
+        # Planner statistics for the new index
+        conn.execute(text(f"ANALYZE {TABLE}"))
+        size = conn.execute(text("SELECT pg_relation_size(to_regclass(:index))"), {"index": BENCHMARK_INDEX}).scalar()
+    print(f"({options['index_type']} index {options}, {size / 2**20:.1f} MB, built in {build_s:.1f}s)")
+    return build_s
+
+
+def drop_pgvector_index(store) -> None:
+    from sqlalchemy import text
+
+    with store._engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text(f"DROP INDEX IF EXISTS {BENCHMARK_INDEX}"))
+
+
+def run_pgvector(data: np.ndarray, queries: np.ndarray, truth: List[set], args) -> None:
+    """Load vectors into a temporary PGVector collection and time searches"""
+    from langchain_core.embeddings import Embeddings
+    from sqlalchemy import event
+    from app.services import vectorstore
+
+    class NoEmbeddings(Embeddings):
+        def embed_documents(self, texts):
+            raise RuntimeError("benchmark uses precomputed vectors")
+
+        def embed_query(self, text):
+            raise RuntimeError("benchmark uses precomputed vectors")
+
+    store = vectorstore.IndexedFilterPGVector(
+        embeddings=NoEmbeddings(),
+        collection_name="benchmark_vectors",
+        connection=vectorstore.get_sync_connection_string(),
+        pre_delete_collection=True,
+        use_jsonb=True,
+        quantization=args.quantization,
+        dimensions=args.dimensions,
+        rescore_factor=args.rescore_factor,
+        iterative_scan=args.iterative_scan
+    )
+    event.listen(store.session_maker, "after_begin", vectorstore._apply_search_settings)
+    try:
+        batch = 1000
+        for start in range(0, len(data), batch):
+            rows = range(start, min(start + batch, len(data)))
+            store.add_embeddings(
+                texts=[str(i) for i in rows],
+                embeddings=data[start:start + batch].tolist(),
+                metadatas=[{"row": i} for i in rows],
+                ids=[str(i) for i in rows]
+            )
+
+        def exact(query):
+            # Ignore any ANN index already in the database
+            vectorstore._search_settings.values = {"enable_indexscan": 0}
+            try:
+                return store.similarity_search_with_score_by_vector(query, k=args.k)
+            finally:
+                vectorstore._search_settings.values = None
+
+        label = "pgvector (exact scan)" if args.quantization == "none" else f"pgvector ({args.quantization} scan)"
+        print_row(label, time_searches(exact, queries, truth, args.k))
+        if not args.pgvector_index:
+            return
+
+        build_pgvector_index(store, args, len(data))
+        param = "ef_search" if args.pgvector_index == "hnsw" else "probes"
+        for value in (args.ef_search if param == "ef_search" else args.probes):
+            result = time_searches(
+                lambda query: vectorstore.similarity_search_with_params(store, query, k=args.k, **{param: value}),
+                queries, truth, args.k
+            )
+            print_row(f"pgvector {args.pgvector_index} {param}={value}", result)
+    finally:
+        if args.pgvector_index:
+            drop_pgvector_index(store)
+        store.delete_collection()
+
+
+def benchmark(n: int, args) -> None:
+    data = make_dataset(n, args.dim, clusters=max(10, n // 500))
+    rng = np.random.default_rng(1)
+    queries = _normalize(data[rng.choice(n, size=args.queries, replace=False)]
+                         + 0.05 * rng.normal(size=(args.queries, args.dim)).astype(np.float32))
+
+    truth, exact_latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        truth.append(set(exact_top_k(data, query, args.k).tolist()))
+        exact_latencies.append(time.perf_counter() - started)
+
+    print(f"\n=== {n:,} vectors x {args.dim} dims, k={args.k}, {args.queries} queries ===")
+    print(f"{'backend':<28}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    print(f"{'exact scan (in memory)':<28}{1.0:>10.4f}{percentile_ms(exact_latencies, 50):>10}{percentile_ms(exact_latencies, 95):>10}")
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        index = IVFIndex(index_dir, dtype=args.dtype, nprobe=args.nprobe, min_train_size=n + 1)
+        started = time.perf_counter()
+        batch = 10000
+        for start in range(0, n, batch):
+            rows = range(start, min(start + batch, n))
+            index.add(data[start:start + batch], [""] * len(rows), [{} for _ in rows], [str(i) for i in rows])
+        index.train()
+        build_s = time.perf_counter() - started
+
+        # Reopen from disk to measure the memory-mapped read path
+        index = IVFIndex(index_dir, nprobe=args.nprobe)
+        for nprobe in sorted({max(1, args.nprobe // 2), args.nprobe, args.nprobe * 2}):
+            latencies, hits = [], 0
+            for query, expected in zip(queries, truth):
+                started = time.perf_counter()
+                results = index.search(query, args.k, nprobe=nprobe)
+                latencies.append(time.perf_counter() - started)
+                hits += len({row for row, _ in results} & expected)
+            label = f"local IVF nprobe={nprobe}"
+            print(f"{label:<28}{hits / (args.k * len(queries)):>10.4f}{percentile_ms(latencies, 50):>10}{percentile_ms(latencies, 95):>10}")
+        print(f"(local index: {index.stats()['lists']} lists, {args.dtype}, built in {build_s:.1f}s)")
+
+    if args.pgvector or args.pgvector_index:
+        run_pgvector(data, queries, truth, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--pgvector", action="store_true", help="Also benchmark PGVector (needs DATABASE_URL)")
+    parser.add_argument("--pgvector-index", choices=["hnsw", "ivfflat"], help="Also time PGVector through this ANN index (implies --pgvector)")
+    parser.add_argument("--hnsw-m", type=int, default=None)
+    parser.add_argument("--hnsw-ef-construction", type=int, default=None)
+    parser.add_argument("--ivfflat-lists", type=int, default=None, help="Default: rows / 1000 (sqrt(rows) above 1M)")
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[10, 40, 100, 200])
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 5, 10, 20, 40])
+    parser.add_argument("--build-memory", default="1GB", help="maintenance_work_mem for the index build")
+    parser.add_argument("--quantization", choices=["none", "halfvec", "binary"], default="none")
+    parser.add_argument("--dimensions", type=int, default=0, help="Store the leading N dimensions (0 = --dim)")
+    parser.add_argument("--rescore-factor", type=int, default=4, help="Quantized candidates per result")
+    parser.add_argument("--iterative-scan", choices=["off", "strict_order", "relaxed_order"], default="strict_order")
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        benchmark(n, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Bulk loader for RAG Support Agent
+Loads a directory tree of documents (PDF, DOCX, Excel, text, images) into
+the documents table and the vector collection, for initial loads too large
+for /rag/ingest. Interrupted runs resume from the checkpoint file; files
+whose content is already loaded are skipped, and changed files under a
+known title update that document.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.bulk_loader import BulkLoader
+from app.services.parse_pool import parse_pool
+
+
+async def main(args):
+    loader = BulkLoader(
+        args.root,
+        checkpoint_path=args.checkpoint or os.path.join(args.root, ".bulk_load_checkpoint.json"),
+        batch_files=args.batch_files,
+        concurrency=args.concurrency
+    )
+    try:
+        stats = await loader.run(limit=args.limit)
+    finally:
+        parse_pool.shutdown()
+    print(
+        f"✅ Loaded {stats['documents']} documents ({stats['chunks']} chunks), updated {stats['updated']}; "
+        f"{stats['duplicates']} already loaded, {stats['failed']} could not be parsed"
+    )
+    print(f"📍 This run: {stats['elapsed_s']}s, {stats['docs_per_s']} docs/s, {stats['mb_per_s']} MB/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load a directory of documents into the RAG system")
+    parser.add_argument("root", help="Directory to load (searched recursively)")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <root>/.bulk_load_checkpoint.json)")
+    parser.add_argument("--batch-files", type=int, default=200, help="Files per COPY and checkpoint")
+    parser.add_argument("--concurrency", type=int, default=4, help="Files parsed at once")
+    parser.add_argument("--limit", type=int, help="Stop after this many files (resume later)")
+    asyncio.run(main(parser.parse_args()))
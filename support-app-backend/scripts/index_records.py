@@ -0,0 +1,35 @@
+"""
+Record index backfill script for RAG Support Agent
+Embeds every closed ticket and KB article into the record indexes. Run once
+after enabling the indexes on an existing database; afterwards records are
+indexed as they change.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.record_index import ticket_index, kb_index
+
+INDEXES = {"tickets": ticket_index, "kb": kb_index}
+
+
+async def main(names, batch_size: int):
+    for name in names:
+        index = INDEXES[name]
+        if not index.available:
+            print(f"❌ {name} index is not available (check embeddings and vector backend)")
+            continue
+        indexed = await index.backfill(batch_size=batch_size)
+        print(f"✅ Indexed {indexed} records into the {name} index")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill the closed-ticket and KB article vector indexes")
+    parser.add_argument("--index", choices=[*INDEXES, "all"], default="all", help="Index to backfill")
+    parser.add_argument("--batch-size", type=int, default=100, help="Records embedded per batch")
+    args = parser.parse_args()
+    asyncio.run(main(list(INDEXES) if args.index == "all" else [args.index], args.batch_size))
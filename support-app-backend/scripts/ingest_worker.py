@@ -0,0 +1,34 @@
+"""
+Ingest worker for RAG Support Agent
+Processes queued document ingests outside the API processes. Run as many
+as needed (on hosts that share INGEST_SPOOL_DIR with the API); set
+INGEST_WORKERS=0 on the API to leave all ingests to these workers.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.ingest_jobs import IngestWorker, ingest_queue
+from app.services.parse_pool import parse_pool
+
+
+async def main(concurrency: int):
+    worker = IngestWorker(ingest_queue, concurrency=concurrency)
+    try:
+        await worker.run_forever()
+    finally:
+        parse_pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process queued document ingest jobs")
+    parser.add_argument("--concurrency", type=int, default=2, help="Jobs processed at once")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.concurrency))
+    except KeyboardInterrupt:
+        print("🛑 Ingest worker stopped")
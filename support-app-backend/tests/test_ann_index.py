@@ -0,0 +1,181 @@
+"""
+Tests for the in-process ANN vector store.
+Tests search, persistence, deletes, metadata filters, and several
+processes writing to one index directory.
+"""
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from app.services.ann_index import IVFIndex, LocalANNVectorStore
+
+
+class FakeEmbeddings:
+    """Deterministic embeddings: one-hot-ish vectors per keyword."""
+
+    words = ["password", "vpn", "printer", "email"]
+
+    def _embed(self, text):
+        return [1.0 if w in text else 0.01 for w in self.words]
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LocalANNVectorStore(FakeEmbeddings(), index_dir=str(tmp_path))
+    store.add_texts(
+        ["reset your password", "vpn client setup", "printer jam fix"],
+        metadatas=[{"doc_id": 1, "file_type": "text"}, {"doc_id": 2, "file_type": "pdf"}, {"doc_id": 3, "file_type": "pdf"}],
+        ids=["a", "b", "c"]
+    )
+    return store
+
+
+class TestLocalANNVectorStore:
+    """Test the PGVector-compatible interface."""
+
+    def test_similarity_search_with_score(self, store):
+        """Test that the closest document comes first with a cosine distance."""
+        results = store.similarity_search_with_score("vpn not connecting", k=2)
+        assert results[0][0].page_content == "vpn client setup"
+        assert results[0][1] < results[1][1]
+        assert 0.0 <= results[0][1] < 0.01
+
+    def test_filter(self, store):
+        """Test metadata filtering."""
+        results = store.similarity_search_with_score("vpn", k=3, filter={"file_type": {"$eq": "pdf"}})
+        assert {doc.metadata["doc_id"] for doc, _ in results} == {2, 3}
+
+    def test_persistence(self, store, tmp_path):
+        """Test that a reopened index serves the same results from disk."""
+        reopened = LocalANNVectorStore(FakeEmbeddings(), index_dir=str(tmp_path))
+        results = reopened.similarity_search("printer", k=1)
+        assert results[0].metadata["doc_id"] == 3
+
+    def test_delete_and_upsert(self, store, tmp_path):
+        """Test that deleted and replaced rows are no longer returned."""
+        store.delete(["c"])
+        store.add_texts(["email quota full"], metadatas=[{"doc_id": 4}], ids=["a"])
+        texts = [doc.page_content for doc in store.similarity_search("password printer email", k=5)]
+        assert "printer jam fix" not in texts
+        assert "reset your password" not in texts
+        assert "email quota full" in texts
+
+        reopened = LocalANNVectorStore(FakeEmbeddings(), index_dir=str(tmp_path))
+        assert reopened.index.live_count() == 2
+
+    def test_or_and_contains_filters(self, store):
+        """Test the filter operators used by scoped retrieval."""
+        store.update_metadata({"c": {"references": [{"doc_id": 9, "title": "x.md"}]}})
+        scoped = {"$or": [{"doc_id": {"$in": [1]}}, {"references": {"$contains": [{"doc_id": 9}]}}]}
+        results = store.similarity_search_with_score("vpn", k=3, filter=scoped)
+        assert {doc.metadata["doc_id"] for doc, _ in results} == {1, 3}
+
+        results = store.similarity_search_with_score("vpn", k=3, filter={"$and": [scoped, {"file_type": "pdf"}]})
+        assert [doc.metadata["doc_id"] for doc, _ in results] == [3]
+
+    def test_delete_by_filter(self, store):
+        """Test that rows matching a metadata filter are deleted, except the kept ids."""
+        store.add_texts(["vpn client setup v2"], metadatas=[{"doc_id": 2, "file_type": "pdf"}], ids=["b2"])
+        store.delete_by_filter({"doc_id": {"$eq": 2}}, keep_ids=["b2"])
+        assert store.index.ids_matching({"file_type": "pdf"}) == ["c", "b2"]
+
+    def test_update_metadata(self, store, tmp_path):
+        """Test that metadata can be merged or replaced without changing search results."""
+        store.update_metadata({"b": {"references": [{"doc_id": 9}]}})
+        store.update_metadata({"c": {"doc_id": 7}}, merge=False)
+
+        reopened = LocalANNVectorStore(FakeEmbeddings(), index_dir=str(tmp_path))
+        vpn = reopened.similarity_search("vpn", k=1)[0]
+        assert vpn.metadata == {"doc_id": 2, "file_type": "pdf", "references": [{"doc_id": 9}]}
+        assert reopened.similarity_search("printer", k=1)[0].metadata == {"doc_id": 7}
+        assert reopened.index.live_count() == 3
+
+    def test_as_retriever(self, store):
+        """Test compatibility with make_qa_chain's retriever usage."""
+        docs = store.as_retriever(search_kwargs={"k": 1}).invoke("password help")
+        assert docs[0].metadata["doc_id"] == 1
+
+
+class TestIVFIndex:
+    """Test the trained IVF path."""
+
+    def test_ivf_recall(self, tmp_path):
+        """Test that probing enough lists finds the exact neighbours."""
+        rng = np.random.default_rng(0)
+        data = rng.normal(size=(3000, 16)).astype(np.float32)
+        index = IVFIndex(str(tmp_path), nlist=16, nprobe=16, min_train_size=1000)
+        index.add(data, [""] * len(data), [{} for _ in data], [str(i) for i in range(len(data))])
+        assert index.stats()["lists"] == 16
+
+        query = data[42]
+        rows = [row for row, _ in index.search(query, k=1)]
+        assert rows == [42]
+
+    def test_narrow_filter_widens_search(self, tmp_path):
+        """Test that a filter matching few rows far from the query still returns k of them."""
+        rng = np.random.default_rng(0)
+        data = rng.normal(size=(2000, 16)).astype(np.float32)
+        rare = {7, 400, 900, 1500, 1999}
+        store = LocalANNVectorStore(FakeEmbeddings(), index_dir=str(tmp_path))
+        store.index = IVFIndex(str(tmp_path), nlist=16, nprobe=1, min_train_size=1000)
+        store.add_embeddings(
+            [str(i) for i in range(len(data))],
+            data.tolist(),
+            metadatas=[{"category_id": 2 if i in rare else 1} for i in range(len(data))],
+            ids=[str(i) for i in range(len(data))]
+        )
+
+        results = store.similarity_search_with_score_by_vector(data[42].tolist(), k=5, filter={"category_id": 2})
+
+        assert {int(doc.id) for doc, _ in results} == rare
+        assert [d for _, d in results] == sorted(d for _, d in results)
+        assert store.similarity_search_with_score_by_vector(data[42].tolist(), k=5, filter={"category_id": 3}) == []
+
+
+def append_rows(index_dir, prefix, batches):
+    """Writer process: appends batches of 10 rows through its own IVFIndex."""
+    index = IVFIndex(index_dir, min_train_size=10 ** 6)
+    rng = np.random.default_rng(len(prefix))
+    for batch in range(batches):
+        ids = [f"{prefix}-{batch}-{i}" for i in range(10)]
+        index.add(rng.normal(size=(10, 8)), ids, [{"writer": prefix} for _ in ids], ids)
+
+
+class TestSharedIndexDirectory:
+    """Test several processes (API workers, the ingest worker) on one index."""
+
+    def test_other_instances_see_writes(self, tmp_path):
+        """Test that rows and deletes from one instance reach an instance opened earlier."""
+        first = IVFIndex(str(tmp_path))
+        second = IVFIndex(str(tmp_path))
+        first.add([[1.0, 0.0]], ["a"], [{}], ["a"])
+        second.add([[0.0, 1.0]], ["b"], [{}], ["b"])
+
+        assert [second.get_document(row)["id"] for row, _ in second.search([1.0, 0.0], k=2)] == ["a", "b"]
+        first.delete(["b"])
+        assert [row for row, _ in second.search([0.0, 1.0], k=2)] == [0]
+        assert first.stats()["rows"] == 2 and second.ids_matching(None) == ["a"]
+
+    def test_concurrent_writer_processes(self, tmp_path):
+        """Test that appends from concurrent processes neither overlap nor get lost."""
+        context = multiprocessing.get_context("fork")
+        writers = [context.Process(target=append_rows, args=(str(tmp_path), name, 20)) for name in ("w1", "w2")]
+        for process in writers:
+            process.start()
+        for process in writers:
+            process.join(timeout=60)
+        assert all(process.exitcode == 0 for process in writers)
+
+        index = IVFIndex(str(tmp_path))
+        assert index.count == 400 and len(index.row_by_id) == 400
+        for row_id, row in index.row_by_id.items():
+            stored = index.get_document(row)
+            assert stored["id"] == row_id and stored["metadata"]["writer"] == row_id.split("-")[0]
+        assert np.allclose(np.linalg.norm(index._vectors, axis=1), 1.0, atol=1e-5)
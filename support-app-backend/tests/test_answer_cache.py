@@ -0,0 +1,102 @@
+"""
+Tests for the semantic answer cache.
+Uses an in-memory dict in place of the Redis generation counter.
+"""
+import pytest
+
+from app.services import answer_cache as answer_cache_module
+from app.services.answer_cache import SemanticAnswerCache
+
+
+@pytest.fixture
+def memory_cache(monkeypatch):
+    """Replace the Redis helpers with an in-memory store."""
+    store = {}
+
+    async def fake_get(key):
+        return store.get(key)
+
+    async def fake_incr(key):
+        store[key] = int(store.get(key) or 0) + 1
+        return store[key]
+
+    monkeypatch.setattr(answer_cache_module, "cache_get", fake_get)
+    monkeypatch.setattr(answer_cache_module, "cache_incr", fake_incr)
+    return store
+
+
+def make_cache(**kwargs):
+    cache = SemanticAnswerCache(threshold=0.9, ttl=60, max_entries=10, **kwargs)
+    cache.enabled = True
+    return cache
+
+
+SCOPE = SemanticAnswerCache.scope_key(True, True, None)
+
+
+class TestSemanticAnswerCache:
+    """Test similarity lookups, scoping and invalidation."""
+
+    @pytest.mark.asyncio
+    async def test_paraphrase_hit(self, memory_cache):
+        """Test that a close embedding reuses the cached answer."""
+        cache = make_cache()
+        await cache.store([1.0, 0.0, 0.1], SCOPE, "reset my password", {"answer": "Use the portal"})
+
+        hit = await cache.lookup([0.98, 0.02, 0.12], SCOPE)
+        miss = await cache.lookup([0.0, 1.0, 0.0], SCOPE)
+
+        assert hit["result"] == {"answer": "Use the portal"}
+        assert hit["matched_query"] == "reset my password"
+        assert hit["similarity"] > 0.99
+        assert miss is None
+        assert cache.cache_stats()["hit_rate"] == 0.5
+
+    @pytest.mark.asyncio
+    async def test_scope_isolation(self, memory_cache):
+        """Test that answers are not shared across retrieval options."""
+        cache = make_cache()
+        await cache.store([1.0, 0.0], SCOPE, "vpn", {"answer": "a"})
+
+        other_scope = SemanticAnswerCache.scope_key(True, False, "Network")
+        assert await cache.lookup([1.0, 0.0], other_scope) is None
+
+    def test_scope_includes_document_filters(self):
+        """Test that file type and document filters separate scopes, in any order."""
+        scoped = SemanticAnswerCache.scope_key(True, True, "network", "pdf", [5, 4])
+        assert scoped == SemanticAnswerCache.scope_key(True, True, "Network", "pdf", [4, 5, 4])
+        assert scoped != SemanticAnswerCache.scope_key(True, True, "Network", "pdf")
+        assert SemanticAnswerCache.scope_key(True, True, None) == SCOPE
+
+    @pytest.mark.asyncio
+    async def test_returned_result_is_a_copy(self, memory_cache):
+        """Test that callers cannot mutate the cached entry."""
+        cache = make_cache()
+        await cache.store([1.0, 0.0], SCOPE, "vpn", {"answer": "a", "sources": []})
+
+        hit = await cache.lookup([1.0, 0.0], SCOPE)
+        hit["result"]["sources"].append("mutated")
+
+        again = await cache.lookup([1.0, 0.0], SCOPE)
+        assert again["result"]["sources"] == []
+
+    @pytest.mark.asyncio
+    async def test_invalidation_reaches_other_workers(self, memory_cache):
+        """Test that a generation bump on one worker clears another."""
+        worker_a = make_cache()
+        worker_b = make_cache()
+        await worker_b.store([1.0, 0.0], SCOPE, "vpn", {"answer": "stale"})
+
+        await worker_a.invalidate("document ingested")
+
+        assert await worker_b.lookup([1.0, 0.0], SCOPE) is None
+        assert worker_b.cache_stats()["entries"] == 0
+
+    @pytest.mark.asyncio
+    async def test_max_entries(self, memory_cache):
+        """Test that the oldest entries are evicted."""
+        cache = make_cache()
+        cache.max_entries = 2
+        for i in range(3):
+            await cache.store([float(i), 1.0], SCOPE, f"q{i}", {"answer": i})
+        assert cache.cache_stats()["entries"] == 2
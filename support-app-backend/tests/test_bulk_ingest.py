@@ -0,0 +1,271 @@
+"""
+Tests for bulk archive ingestion.
+Archives are built in memory; the database session, embeddings and
+vector store are replaced with fakes.
+"""
+import io
+import os
+import tarfile
+import zipfile
+from types import SimpleNamespace
+import pytest
+
+from app.services import bulk_ingest as bulk_ingest_module
+from app.services.bulk_ingest import ingest_archive, is_archive, iter_archive_members
+from app.services.chunk_dedup import chunk_dedup
+from app.services.parsers import file_sha256
+
+MB = 1024 * 1024
+
+
+def make_zip(path, files):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+
+
+def make_tar(path, files):
+    with tarfile.open(path, "w:gz") as archive:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+
+
+class FakeResult:
+    def __init__(self, ids):
+        self.ids = ids
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.ids
+
+
+class FakeDB:
+    """Assigns increasing ids to inserted documents and remembers their content hashes."""
+
+    def __init__(self):
+        self.inserts = []
+        self.statements = []
+        self.hashes = set()
+        self.next_id = 1
+
+    async def execute(self, statement, params=None):
+        self.statements.append(statement)
+        if params is None:
+            # Only the content hash lookup reads a result
+            return FakeResult(list(self.hashes))
+        self.inserts.append([row["title"] for row in params])
+        self.hashes.update(row["content_hash"] for row in params)
+        ids = list(range(self.next_id, self.next_id + len(params)))
+        self.next_id += len(params)
+        return FakeResult(ids)
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class FakeVectorStore:
+    def __init__(self, fail=False):
+        self.calls = []
+        self.deleted = []
+        self.fail = fail
+
+    def add_embeddings(self, texts, embeddings, metadatas, ids):
+        if self.fail:
+            raise ConnectionError("vector store unavailable")
+        self.calls.append({"ids": ids, "titles": {m["title"] for m in metadatas}})
+
+    def delete(self, ids):
+        self.deleted.extend(ids)
+
+
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+async def no_release(db, doc_id, store, keep_vector_ids=(), keep_references=()):
+    return set()
+
+
+@pytest.fixture
+def pipeline(monkeypatch, tmp_path):
+    """Replace embedding, cache and graph dependencies; keep groups small."""
+    embed_calls = []
+    documents = {}  # title -> stored document, for title lookups
+    updates = []
+
+    async def find_document(db, title):
+        return documents.get(title)
+
+    async def ingest_file(db, path, filename, on_progress=None):
+        assert os.path.exists(path)
+        updates.append(filename)
+        return {"id": documents[filename].id, "status": "updated"}
+
+    class FakeEmbeddings:
+        async def embed_documents(self, texts):
+            embed_calls.append(len(texts))
+            return {"vectors": [[0.0]] * len(texts), "cache_hits": 0, "embedded": len(texts)}
+
+    class FakeAnswerCache:
+        async def invalidate(self, reason):
+            pass
+
+    monkeypatch.setattr(bulk_ingest_module, "embedding_service", FakeEmbeddings())
+    monkeypatch.setattr(bulk_ingest_module, "answer_cache", FakeAnswerCache())
+    monkeypatch.setattr(bulk_ingest_module, "ingest_document_as_nodes", lambda doc, content_length=None: None)
+    monkeypatch.setattr(chunk_dedup, "enabled", False)
+    monkeypatch.setattr(chunk_dedup, "release", no_release)
+    monkeypatch.setattr(bulk_ingest_module.settings, "INGEST_SPOOL_DIR", str(tmp_path / "spool"))
+    monkeypatch.setattr(bulk_ingest_module.settings, "BULK_INGEST_GROUP_CHUNKS", 4)
+    monkeypatch.setattr(bulk_ingest_module, "AsyncSessionLocal", FakeSession)
+    monkeypatch.setattr(bulk_ingest_module, "find_document", find_document)
+    monkeypatch.setattr(bulk_ingest_module, "ingest_file", ingest_file)
+
+    def use_store(store):
+        monkeypatch.setattr(bulk_ingest_module, "vectordb", store)
+        from app.services import ingestion
+        monkeypatch.setattr(ingestion, "vectordb", store)
+        return store
+
+    use_store.embed_calls = embed_calls
+    use_store.documents = documents
+    use_store.updates = updates
+    return use_store
+
+
+def kb_files(count):
+    return {
+        f"kb/article-{i}.md": f"# Article {i}\n{'Reset the VPN client and sign in again. ' * 3}".encode()
+        for i in range(count)
+    }
+
+
+class TestArchiveMembers:
+    """Test streaming unpack of zip and tar archives."""
+
+    @pytest.mark.parametrize("name,writer", [("export.zip", make_zip), ("export.tar.gz", make_tar)])
+    def test_members_extracted_or_skipped(self, tmp_path, name, writer):
+        """Test that supported files are extracted and others are listed as skipped."""
+        archive = tmp_path / name
+        writer(archive, {
+            "kb/vpn.md": b"# VPN\nReconnect",
+            "kb/logo.svg": b"<svg/>",
+            "kb/.DS_Store": b"\0",
+            "kb/big.txt": b"x" * (2 * MB)
+        })
+        work_dir = tmp_path / "work"
+        work_dir.mkdir()
+
+        members = list(iter_archive_members(str(archive), name, str(work_dir), max_bytes=MB))
+
+        reasons = {m.name: m.skip_reason for m in members}
+        assert reasons == {
+            "kb/vpn.md": None,
+            "kb/logo.svg": "unsupported file type",
+            "kb/.DS_Store": "hidden file",
+            "kb/big.txt": "larger than 1 MB"
+        }
+        extracted = [m for m in members if m.path]
+        assert len(extracted) == 1 and str(work_dir) in extracted[0].path
+        with open(extracted[0].path, "rb") as f:
+            assert f.read() == b"# VPN\nReconnect"
+
+    def test_archive_names(self):
+        """Test archive type detection."""
+        assert is_archive("export.ZIP") and is_archive("export.tar.gz") and is_archive("export.tgz")
+        assert not is_archive("guide.pdf")
+
+
+class TestIngestArchive:
+    """Test grouped inserts, shared embedding batches and reporting."""
+
+    @pytest.mark.asyncio
+    async def test_files_grouped_across_inserts_and_embeddings(self, tmp_path, pipeline):
+        """Test that several files share one row insert and one embedding call."""
+        store = pipeline(FakeVectorStore())
+        archive = tmp_path / "export.zip"
+        make_zip(archive, {**kb_files(10), "kb/notes.txt": b"\xff\xfe broken"})
+        db = FakeDB()
+
+        result = await ingest_archive(db, str(archive), "export.zip")
+
+        assert result["documents"] == 10 and result["files"] == 11
+        assert result["skipped_files"] == [{"file": "kb/notes.txt", "reason": "Unable to decode text file as UTF-8"}]
+        # Fewer inserts than documents, each multi-row
+        assert sum(len(rows) for rows in db.inserts) == 10
+        assert len(db.inserts) < 10 and any(len(rows) > 1 for rows in db.inserts)
+        assert any(len(call["titles"]) > 1 for call in store.calls)
+        assert len(pipeline.embed_calls) == len(db.inserts)
+        assert sorted(result["document_ids"]) == list(range(1, 11))
+        assert store.calls[0]["ids"][0].startswith("doc-")
+        for key in ("docs_per_s", "mb_per_s", "elapsed_s", "bytes"):
+            assert key in result
+        assert not list((tmp_path / "spool").iterdir())  # work dir removed
+
+    @pytest.mark.asyncio
+    async def test_same_archive_twice_adds_nothing(self, tmp_path, pipeline):
+        """Test that uploading an archive again skips every file already ingested."""
+        store = pipeline(FakeVectorStore())
+        archive = tmp_path / "export.zip"
+        files = kb_files(5)
+        make_zip(archive, {**files, "kb/copy.md": files["kb/article-0.md"]})
+        db = FakeDB()
+
+        first = await ingest_archive(db, str(archive), "export.zip")
+        indexed = sum(len(call["ids"]) for call in store.calls)
+        second = await ingest_archive(db, str(archive), "export.zip")
+
+        assert first["documents"] == 5
+        # Files are parsed concurrently, so either copy may be the one indexed
+        assert [f["reason"] for f in first["skipped_files"]] == ["already ingested"]
+        assert second["documents"] == 0 and second["document_ids"] == []
+        assert len(second["skipped_files"]) == 6
+        assert sum(len(rows) for rows in db.inserts) == 5
+        assert sum(len(call["ids"]) for call in store.calls) == indexed
+
+    @pytest.mark.asyncio
+    async def test_changed_file_under_known_title_updates_document(self, tmp_path, pipeline):
+        """Test that a changed file already ingested under its path becomes a new version, not a second document."""
+        pipeline(FakeVectorStore())
+        files = kb_files(4)
+        unchanged = tmp_path / "unchanged.md"
+        unchanged.write_bytes(files["kb/article-1.md"])
+        pipeline.documents["kb/article-0.md"] = SimpleNamespace(id=40, content_hash="previous version")
+        pipeline.documents["kb/article-1.md"] = SimpleNamespace(id=41, content_hash=file_sha256(str(unchanged)))
+        archive = tmp_path / "export.zip"
+        make_zip(archive, files)
+        db = FakeDB()
+
+        result = await ingest_archive(db, str(archive), "export.zip")
+
+        assert pipeline.updates == ["kb/article-0.md"]
+        assert result["updated"] == 1 and result["updated_document_ids"] == [40]
+        assert result["skipped_files"] == [{"file": "kb/article-1.md", "reason": "already ingested"}]
+        assert result["documents"] == 2
+        assert sorted(title for rows in db.inserts for title in rows) == ["kb/article-2.md", "kb/article-3.md"]
+
+    @pytest.mark.asyncio
+    async def test_failure_discards_written_documents(self, tmp_path, pipeline):
+        """Test that a failed bulk ingest removes every document it wrote."""
+        store = pipeline(FakeVectorStore(fail=True))
+        archive = tmp_path / "export.tar.gz"
+        make_tar(archive, kb_files(3))
+        db = FakeDB()
+
+        with pytest.raises(ConnectionError):
+            await ingest_archive(db, str(archive), "export.tar.gz")
+
+        deleted_docs = [str(s) for s in db.statements if "DELETE FROM documents" in str(s)]
+        assert len(deleted_docs) == sum(len(rows) for rows in db.inserts) > 0
+        assert store.deleted
@@ -0,0 +1,228 @@
+"""
+Tests for the offline bulk loader.
+Loads text files from a temporary tree; the database (including COPY),
+embeddings and vector store are replaced with fakes.
+"""
+import json
+from types import SimpleNamespace
+import pytest
+
+from app.services import bulk_loader as bulk_loader_module
+from app.services.bulk_loader import BulkLoader, iter_files
+from app.services.chunk_dedup import chunk_dedup
+from app.services.parsers import file_sha256
+
+
+class FakeResult:
+    def __init__(self, values):
+        self.values = values
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.values
+
+
+class FakeDB:
+    """Reserves ids, accepts COPY and answers content-hash lookups."""
+
+    def __init__(self):
+        self.rows = {}  # id -> (title, content_hash)
+        self.next_id = 1
+        self.copies = 0
+        self.commits = 0
+        self.updated = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement, params=None):
+        sql = str(statement)
+        if "nextval" in sql:
+            ids = list(range(self.next_id, self.next_id + params["n"]))
+            self.next_id += params["n"]
+            return FakeResult([(i,) for i in ids])
+        hashes = {content_hash for _, content_hash in self.rows.values()}
+        return FakeResult(sorted(hashes))
+
+    async def connection(self):
+        return self
+
+    async def get_raw_connection(self):
+        return self
+
+    @property
+    def driver_connection(self):
+        return self
+
+    async def copy_records_to_table(self, table, records, columns):
+        assert table == "documents" and columns == ["id", "title", "content", "content_hash"]
+        self.copies += 1
+        for doc_id, title, _, content_hash in records:
+            self.rows[doc_id] = (title, content_hash)
+
+    async def commit(self):
+        self.commits += 1
+
+
+class FakeVectorStore:
+    def __init__(self):
+        self.ids = []
+
+    def add_embeddings(self, texts, embeddings, metadatas, ids):
+        self.ids.extend(ids)
+
+
+async def no_release(db, doc_id, store, keep_vector_ids=(), keep_references=()):
+    return set()
+
+
+async def find_document(db, title):
+    for doc_id, (row_title, content_hash) in db.rows.items():
+        if row_title == title:
+            return SimpleNamespace(id=doc_id, content_hash=content_hash)
+    return None
+
+
+async def update_document(db, path, filename, on_progress=None):
+    """Stands in for ingest_file on a known title: the row takes the new content hash."""
+    doc = await find_document(db, filename)
+    db.rows[doc.id] = (filename, file_sha256(path))
+    db.updated.append(filename)
+    return {"id": doc.id, "status": "updated"}
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    class FakeEmbeddings:
+        async def embed_documents(self, texts):
+            return {"vectors": [[0.0]] * len(texts), "cache_hits": 0, "embedded": len(texts)}
+
+    class FakeAnswerCache:
+        async def invalidate(self, reason):
+            pass
+
+    monkeypatch.setattr(bulk_loader_module, "embedding_service", FakeEmbeddings())
+    monkeypatch.setattr(bulk_loader_module, "answer_cache", FakeAnswerCache())
+    monkeypatch.setattr(chunk_dedup, "enabled", False)
+    monkeypatch.setattr(chunk_dedup, "release", no_release)
+    monkeypatch.setattr(bulk_loader_module, "find_document", find_document)
+    monkeypatch.setattr(bulk_loader_module, "ingest_file", update_document)
+    db = FakeDB()
+    return db, FakeVectorStore()
+
+
+def make_tree(root, count):
+    for i in range(count):
+        folder = root / f"team-{i % 2}"
+        folder.mkdir(exist_ok=True)
+        (folder / f"doc-{i:02d}.md").write_text(f"# Doc {i}\nUnique content {i}")
+
+
+def make_loader(root, checkpoint, db, store, batch_files=3):
+    return BulkLoader(
+        str(root), checkpoint_path=str(checkpoint), batch_files=batch_files,
+        session_factory=lambda: db, store=store
+    )
+
+
+class TestBulkLoader:
+    """Test COPY batches, checkpoints and content-hash skipping."""
+
+    def test_files_in_stable_order(self, tmp_path):
+        """Test that files come in sorted path order without hidden or unsupported ones."""
+        (tmp_path / "b").mkdir()
+        (tmp_path / "b" / "z.md").write_text("z")
+        (tmp_path / "a.txt").write_text("a")
+        (tmp_path / "c.svg").write_text("c")
+        (tmp_path / ".cache").mkdir()
+        (tmp_path / ".cache" / "x.md").write_text("x")
+
+        assert [parts for parts, _ in iter_files(str(tmp_path))] == [("a.txt",), ("b", "z.md")]
+
+    @pytest.mark.asyncio
+    async def test_interrupted_run_resumes(self, tmp_path, fakes):
+        """Test that a second run continues after the checkpoint instead of starting over."""
+        db, store = fakes
+        root = tmp_path / "docs"
+        root.mkdir()
+        make_tree(root, 8)
+        checkpoint = tmp_path / "checkpoint.json"
+
+        first = await make_loader(root, checkpoint, db, store).run(limit=4)
+        assert first["documents"] == 4
+        saved = json.loads(checkpoint.read_text())
+        assert saved["pending"] == [] and saved["last"] is not None
+
+        second = await make_loader(root, checkpoint, db, store).run()
+        assert second["documents"] == 8 and second["duplicates"] == 0
+        assert sorted(title for title, _ in db.rows.values()) == sorted(
+            f"team-{i % 2}/doc-{i:02d}.md" for i in range(8)
+        )
+        assert db.copies == 4  # batches of 3: 3+1, then 3+1
+        assert store.ids[0] == "doc-1-0"
+
+    @pytest.mark.asyncio
+    async def test_known_content_is_skipped(self, tmp_path, fakes):
+        """Test that files whose content hash is already loaded are not loaded again."""
+        db, store = fakes
+        root = tmp_path / "docs"
+        root.mkdir()
+        (root / "a.md").write_text("same text")
+        (root / "b.md").write_text("same text")
+        (root / "c.md").write_text("other text")
+
+        stats = await make_loader(root, tmp_path / "cp.json", db, store).run()
+        assert stats["documents"] == 2 and stats["duplicates"] == 1
+
+        # A fresh checkpoint still skips everything by hash
+        again = await make_loader(root, tmp_path / "cp2.json", db, store).run()
+        assert again["documents"] == 0 and again["duplicates"] == 3
+
+    @pytest.mark.asyncio
+    async def test_changed_file_updates_its_document(self, tmp_path, fakes):
+        """Test that a changed file under a loaded path becomes a new version, not a second document."""
+        db, store = fakes
+        root = tmp_path / "docs"
+        root.mkdir()
+        make_tree(root, 4)
+        await make_loader(root, tmp_path / "cp.json", db, store).run()
+        (root / "team-1" / "doc-01.md").write_text("# Doc 1\nRewritten content")
+
+        stats = await make_loader(root, tmp_path / "cp2.json", db, store).run()
+
+        assert stats["updated"] == 1 and stats["documents"] == 0 and stats["duplicates"] == 3
+        assert db.updated == ["team-1/doc-01.md"] and len(db.rows) == 4
+
+    @pytest.mark.asyncio
+    async def test_interrupted_batch_is_removed(self, tmp_path, fakes, monkeypatch):
+        """Test that documents of a batch that never finished are removed on resume."""
+        db, store = fakes
+        discarded = []
+
+        async def fake_discard(session, doc_id, chunk_count):
+            discarded.append((doc_id, chunk_count))
+
+        monkeypatch.setattr(bulk_loader_module, "discard_document", fake_discard)
+        root = tmp_path / "docs"
+        root.mkdir()
+        checkpoint = tmp_path / "checkpoint.json"
+        checkpoint.write_text(json.dumps({
+            "root": str(root), "last": None, "pending": [[41, 3], [42, 1]], "stats": {}
+        }))
+
+        await make_loader(root, checkpoint, db, store).run()
+
+        assert discarded == [(41, 3), (42, 1)]
+        assert json.loads(checkpoint.read_text())["pending"] == []
+
+    def test_checkpoint_for_other_directory_rejected(self, tmp_path):
+        """Test that a checkpoint cannot be resumed against a different tree."""
+        checkpoint = tmp_path / "checkpoint.json"
+        checkpoint.write_text(json.dumps({"root": "/elsewhere", "last": None, "pending": []}))
+        with pytest.raises(ValueError):
+            BulkLoader(str(tmp_path), checkpoint_path=str(checkpoint))
@@ -0,0 +1,169 @@
+"""
+Tests for near-duplicate chunk detection at ingest.
+Fingerprint lookups are answered by scripted fake sessions and vector
+metadata updates go to a fake store, so no database is needed.
+"""
+import json
+import random
+import pytest
+from types import SimpleNamespace
+
+from app.services.chunk_dedup import (
+    ChunkDeduplicator, fingerprint_bands, match_duplicates, to_signed, to_unsigned
+)
+from app.services.dedup import simhash
+
+DISCLAIMER = (
+    "This guide is provided for internal support staff only. Do not share it with customers. "
+    "Steps may change without notice; always check the current policy before resetting accounts, "
+    "changing permissions or granting access to shared mailboxes."
+)
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.rows
+
+
+class FakeDB:
+    """Answers SELECTs with the scripted results in order; records other statements."""
+
+    def __init__(self, selects):
+        self.selects = list(selects)
+        self.writes = []
+
+    async def execute(self, statement, params=None):
+        if str(statement).startswith("SELECT"):
+            return FakeResult(self.selects.pop(0))
+        self.writes.append(statement)
+
+    async def commit(self):
+        pass
+
+
+class FakeStore:
+    def __init__(self):
+        self.updates = []
+
+    def update_metadata(self, updates, merge=True):
+        self.updates.append((updates, merge))
+
+
+def chunk(text, doc_id, chunk_index=0):
+    return {"text": text, "metadata": {"doc_id": doc_id, "chunk_index": chunk_index, "title": f"doc-{doc_id}.md"}}
+
+
+def reference(ref_id, vector_id, doc_id, chunk_index=0, version=1):
+    return SimpleNamespace(
+        id=ref_id, vector_id=vector_id, doc_id=doc_id, chunk_index=chunk_index, version=version,
+        metadata_json=json.dumps({"doc_id": doc_id, "chunk_index": chunk_index, "title": f"doc-{doc_id}.md"})
+    )
+
+
+class TestFingerprints:
+    """Test band lookup and storage conversions."""
+
+    def test_close_fingerprints_share_a_band(self):
+        """Test that fingerprints within 3 bits always share at least one band."""
+        rng = random.Random(7)
+        for _ in range(200):
+            fingerprint = rng.getrandbits(64)
+            other = fingerprint
+            for bit in rng.sample(range(64), 3):
+                other ^= 1 << bit
+            assert set(enumerate(fingerprint_bands(fingerprint))) & set(enumerate(fingerprint_bands(other)))
+
+    def test_signed_storage_round_trip(self):
+        """Test that fingerprints survive the signed BIGINT column."""
+        for fingerprint in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+            assert -(1 << 63) <= to_signed(fingerprint) < 1 << 63
+            assert to_unsigned(to_signed(fingerprint)) == fingerprint
+
+
+class TestMatchDuplicates:
+    """Test choosing canonical vectors."""
+
+    def test_copies_in_other_documents_match(self):
+        """Test that a reformatted copy from another document matches the indexed chunk."""
+        indexed = [("doc-1-4", 1, simhash(DISCLAIMER))]
+        copy = DISCLAIMER.replace(";", ",").replace("  ", " ").upper()
+
+        assert match_duplicates([simhash(copy)], [2], ["doc-2-0"], indexed, 3) == {0: "doc-1-4"}
+
+    def test_same_document_never_matches(self):
+        """Test that a chunk is not matched to its own document's vectors."""
+        indexed = [("doc-2-0", 2, simhash(DISCLAIMER))]
+        assert match_duplicates([simhash(DISCLAIMER)], [2], ["doc-2-v2-0"], indexed, 3) == {}
+
+    def test_copies_within_a_batch(self):
+        """Test that later chunks of a batch match earlier unique ones, and None is skipped."""
+        fingerprints = [simhash(DISCLAIMER), None, simhash("Reset the VPN token " * 20), simhash(DISCLAIMER)]
+        duplicate_of = match_duplicates(fingerprints, [1, 1, 2, 3], ["doc-1-0", "doc-1-1", "doc-2-0", "doc-3-0"], [], 3)
+        assert duplicate_of == {3: "doc-1-0"}
+
+
+class TestChunkDeduplicator:
+    """Test plans, recording and handing over canonical vectors."""
+
+    @pytest.mark.asyncio
+    async def test_plan_skips_short_chunks(self, monkeypatch):
+        """Test that short chunks are always indexed and long copies are planned as references."""
+        dedup = ChunkDeduplicator()
+        dedup.enabled, dedup.min_chars = True, 100
+
+        async def candidates(db, fingerprints):
+            return [("doc-1-0", 1, simhash(DISCLAIMER)), ("doc-1-1", 1, simhash("Yes"))]
+
+        monkeypatch.setattr(dedup, "_candidates", candidates)
+        chunks = [chunk("Yes", 2, 0), chunk(DISCLAIMER, 2, 1)]
+
+        plan = await dedup.plan(None, chunks, ["doc-2-0", "doc-2-1"])
+
+        assert plan.fingerprints[0] is None
+        assert plan.duplicate_of == {1: "doc-1-0"} and plan.unique == [0]
+        assert dedup.cache_stats()["duplicates"] == 1
+
+    @pytest.mark.asyncio
+    async def test_referenced_vector_handed_to_heir(self):
+        """Test that a released canonical vector still referenced elsewhere changes owner instead of going away."""
+        dedup = ChunkDeduplicator()
+        store = FakeStore()
+        db = FakeDB([
+            [reference(1, "doc-9-0", 5, chunk_index=2)],  # references document 5 makes
+            [SimpleNamespace(vector_id="doc-5-0"), SimpleNamespace(vector_id="doc-5-1")],  # its canonical vectors
+            [reference(2, "doc-5-0", 7, chunk_index=3), reference(3, "doc-5-0", 8)],  # others referencing them
+            [reference(3, "doc-5-0", 8)]  # references left, for metadata
+        ])
+
+        transferred = await dedup.release(db, 5, store)
+
+        assert transferred == {"doc-5-0"}
+        statements = [str(s) for s in db.writes]
+        assert any(s.startswith("UPDATE chunk_fingerprints") for s in statements)
+        assert any(s.startswith("DELETE FROM chunk_fingerprints") for s in statements)  # doc-5-1, unreferenced
+        handed_over, merge = store.updates[0]
+        assert not merge and handed_over == {"doc-5-0": {"doc_id": 7, "chunk_index": 3, "title": "doc-7.md"}}
+        references, merge = store.updates[1]
+        assert merge and references["doc-5-0"] == {"references": [{"doc_id": 8, "title": "doc-8.md"}]}
+        assert references["doc-9-0"] == {"references": []}
+
+    @pytest.mark.asyncio
+    async def test_kept_vectors_and_references_untouched(self):
+        """Test that a document's current vectors and references are not released."""
+        dedup = ChunkDeduplicator()
+        db = FakeDB([
+            [reference(1, "doc-9-0", 5, chunk_index=2, version=2)],
+            [SimpleNamespace(vector_id="doc-5-v2-0")]
+        ])
+
+        transferred = await dedup.release(
+            db, 5, FakeStore(), keep_vector_ids=["doc-5-v2-0", "doc-9-0"], keep_references=[("doc-9-0", 2, 2)]
+        )
+
+        assert transferred == set() and db.writes == []
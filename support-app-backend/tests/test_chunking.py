@@ -0,0 +1,93 @@
+"""
+Tests for the RAG ingestion chunking stage.
+Tests chunk sizing, overlap, and provenance metadata.
+"""
+import pytest
+
+from app.services.chunking import TextChunker, iter_markdown_sections, split_markdown_sections, format_provenance
+
+
+class TestTextChunker:
+    """Test splitting processor segments into chunks."""
+
+    def test_chunks_respect_size(self):
+        """Test that no chunk exceeds the configured size."""
+        chunker = TextChunker(chunk_size=200, chunk_overlap=20)
+        text = " ".join(f"word{i}" for i in range(500))
+        chunks = chunker.split_segments([{"text": text}])
+        assert len(chunks) > 1
+        assert all(len(c["text"]) <= 200 for c in chunks)
+
+    def test_chunks_do_not_cross_pages(self):
+        """Test that each chunk carries the page of its segment."""
+        chunker = TextChunker(chunk_size=100, chunk_overlap=10)
+        segments = [
+            {"text": "alpha " * 40, "page": 1},
+            {"text": "beta " * 40, "page": 2}
+        ]
+        chunks = chunker.split_segments(segments, base_metadata={"doc_id": 7})
+        for chunk in chunks:
+            assert chunk["metadata"]["doc_id"] == 7
+            expected_page = 1 if "alpha" in chunk["text"] else 2
+            assert chunk["metadata"]["page"] == expected_page
+            assert not ("alpha" in chunk["text"] and "beta" in chunk["text"])
+
+    def test_offsets_point_into_document(self):
+        """Test that chunk offsets locate the chunk in the joined text."""
+        chunker = TextChunker(chunk_size=80, chunk_overlap=10)
+        segments = [{"text": "first page text " * 10}, {"text": "second page text " * 10}]
+        full_text = "\n".join(s["text"] for s in segments)
+        for chunk in chunker.split_segments(segments):
+            offset = chunk["metadata"]["offset"]
+            assert full_text[offset:offset + len(chunk["text"])] == chunk["text"]
+
+    def test_chunk_index_and_count(self):
+        """Test chunk numbering metadata."""
+        chunker = TextChunker(chunk_size=50, chunk_overlap=0)
+        chunks = chunker.split_segments([{"text": "lorem ipsum " * 20}])
+        assert [c["metadata"]["chunk_index"] for c in chunks] == list(range(len(chunks)))
+        assert all(c["metadata"]["chunk_count"] == len(chunks) for c in chunks)
+
+    def test_empty_segments_skipped(self):
+        """Test that blank pages produce no chunks."""
+        chunker = TextChunker(chunk_size=100, chunk_overlap=10)
+        assert chunker.split_segments([{"text": "   ", "page": 1}]) == []
+
+    def test_stream_matches_split(self):
+        """Test that chunking in batches gives the same chunks as all at once."""
+        chunker = TextChunker(chunk_size=80, chunk_overlap=10)
+        segments = [{"text": f"page {i} text " * 12, "page": i} for i in range(1, 6)]
+        stream = chunker.stream({"doc_id": 1})
+        streamed = stream.add(segments[:2]) + stream.add(segments[2:])
+        whole = chunker.split_segments(segments, base_metadata={"doc_id": 1})
+        for chunk in whole:
+            del chunk["metadata"]["chunk_count"]
+        assert streamed == whole
+
+    def test_invalid_overlap_rejected(self):
+        """Test that overlap must be smaller than chunk size."""
+        with pytest.raises(ValueError):
+            TextChunker(chunk_size=100, chunk_overlap=100)
+
+
+class TestMarkdownSections:
+    """Test heading-aware segmentation."""
+
+    def test_split_on_headings(self):
+        """Test that markdown headings start new sections."""
+        text = "intro line\n# Reset Password\nstep one\n## Troubleshooting\nstep two"
+        segments = split_markdown_sections(text)
+        assert [s["section"] for s in segments] == [None, "Reset Password", "Troubleshooting"]
+        assert "step one" in segments[1]["text"]
+
+    def test_long_sections_split(self):
+        """Test that max_chars splits a section but keeps its name."""
+        lines = ["# Install"] + ["x" * 40] * 10
+        segments = list(iter_markdown_sections(lines, max_chars=100))
+        assert len(segments) > 1
+        assert all(s["section"] == "Install" and len(s["text"]) <= 100 for s in segments)
+
+    def test_format_provenance(self):
+        """Test human-readable chunk source labels."""
+        label = format_provenance({"title": "guide.pdf", "page": 3})
+        assert label == "guide.pdf, p. 3"
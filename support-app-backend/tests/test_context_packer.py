@@ -0,0 +1,68 @@
+"""
+Tests for token-budgeted context packing and SimHash deduplication.
+"""
+from app.services.context_packer import ContextPacker, estimate_tokens, truncate_to_tokens
+from app.services.dedup import simhash, hamming_distance, is_near_duplicate
+
+RESET = ("To reset your password, open the self-service portal, choose Forgot password, "
+         "and follow the emailed link. The link expires after 30 minutes.")
+RESET_COPY = ("To reset your password, open the self-service portal, choose Forgot password and "
+              "follow the e-mailed link. The link expires after 30 minutes.")
+VPN = ("The VPN client needs the company certificate installed before the first connection. "
+       "Contact the service desk if it is missing.")
+
+
+class TestSimHash:
+    """Test near-duplicate fingerprints."""
+
+    def test_near_copies_are_close(self):
+        """Test that punctuation and spelling variants stay within the threshold."""
+        assert is_near_duplicate(simhash(RESET), simhash(RESET_COPY))
+
+    def test_unrelated_texts_are_far(self):
+        """Test that different passages are not flagged."""
+        assert hamming_distance(simhash(RESET), simhash(VPN)) > 16
+
+    def test_empty_text(self):
+        """Test that text without words has a zero fingerprint."""
+        assert simhash("  --  ") == 0
+
+
+class TestContextPacker:
+    """Test greedy packing under a token budget."""
+
+    def test_duplicates_dropped_keeping_most_relevant(self):
+        """Test that the higher-scored copy of a passage wins."""
+        packer = ContextPacker(token_budget=1000, max_distance=6)
+        packed = packer.pack([
+            {"text": RESET_COPY, "score": 0.2, "id": "copy"},
+            {"text": RESET, "score": 0.9, "id": "original"},
+            {"text": VPN, "score": 0.5, "id": "vpn"}
+        ])
+        assert [p["id"] for p in packed["passages"]] == ["original", "vpn"]
+        assert packed["dropped_duplicates"] == 1
+
+    def test_budget_is_respected(self):
+        """Test that passages past the budget are skipped but smaller ones still fit."""
+        packer = ContextPacker(token_budget=50, max_distance=6)
+        packed = packer.pack([
+            {"text": "a" * 160, "score": 0.9, "id": "fits"},
+            {"text": "long passage " * 20, "score": 0.8, "id": "too-long"},
+            {"text": "short one", "score": 0.1, "id": "small"}
+        ])
+        assert [p["id"] for p in packed["passages"]] == ["fits", "small"]
+        assert packed["tokens"] <= 50
+        assert packed["dropped_over_budget"] == 1
+
+    def test_long_passages_truncated(self):
+        """Test that max_tokens caps a passage before packing."""
+        packer = ContextPacker(token_budget=1000, max_distance=6)
+        packed = packer.pack([{"text": "word " * 400, "score": 1.0, "max_tokens": 20}])
+        assert packed["truncated"] == 1
+        assert packed["passages"][0]["tokens"] <= 20
+        assert packed["passages"][0]["text"].endswith("…")
+
+    def test_truncate_noop_for_short_text(self):
+        """Test that short text is returned unchanged."""
+        assert truncate_to_tokens("short", 10) == "short"
+        assert estimate_tokens("") == 0
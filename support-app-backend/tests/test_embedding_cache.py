@@ -0,0 +1,172 @@
+"""
+Tests for the cached, batched embedding service.
+Uses an in-memory dict in place of Redis and a fake embedding backend.
+"""
+import pytest
+
+from app.services import embedding_cache
+from app.services.embedding_cache import (
+    EmbeddingService, embedding_cache_key, encode_vector, decode_vector
+)
+
+
+class FakeBackend:
+    """Embedding backend that records every batch it receives."""
+
+    model_name = "fake-model"
+
+    def __init__(self):
+        self.batches = []
+        self.queries = []
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        return [[float(len(t)), 1.0, 0.5] for t in texts]
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return [float(len(text)), 0.0, 1.0]
+
+
+@pytest.fixture
+def memory_cache(monkeypatch):
+    """Replace the Redis helpers with an in-memory store."""
+    store = {}
+
+    async def fake_get_many(keys):
+        return [store.get(k) for k in keys]
+
+    async def fake_set_many(items, ttl=300):
+        store.update(items)
+        return True
+
+    async def fake_get(key):
+        return store.get(key)
+
+    async def fake_set(key, value, ttl=300):
+        store[key] = value
+        return True
+
+    monkeypatch.setattr(embedding_cache, "cache_get_many", fake_get_many)
+    monkeypatch.setattr(embedding_cache, "cache_set_many", fake_set_many)
+    monkeypatch.setattr(embedding_cache, "cache_get", fake_get)
+    monkeypatch.setattr(embedding_cache, "cache_set", fake_set)
+    monkeypatch.setattr(embedding_cache, "cache_get_sync", store.get)
+    monkeypatch.setattr(embedding_cache, "cache_set_sync", lambda key, value, ttl=300: store.update({key: value}))
+    return store
+
+
+class TestEmbeddingService:
+    """Test cache lookups and batching."""
+
+    @pytest.mark.asyncio
+    async def test_only_misses_are_embedded(self, memory_cache):
+        """Test that a re-ingest is served entirely from cache."""
+        backend = FakeBackend()
+        service = EmbeddingService(backend=backend)
+
+        first = await service.embed_documents(["reset password", "vpn setup"])
+        second = await service.embed_documents(["reset password", "vpn setup"])
+
+        assert first["embedded"] == 2
+        assert second["embedded"] == 0
+        assert second["cache_hits"] == 2
+        assert second["vectors"] == first["vectors"]
+        assert len(backend.batches) == 1
+
+    @pytest.mark.asyncio
+    async def test_misses_are_batched(self, memory_cache):
+        """Test that misses are split into batch_size calls."""
+        backend = FakeBackend()
+        service = EmbeddingService(backend=backend)
+        service.batch_size = 3
+
+        texts = [f"chunk {i}" for i in range(7)]
+        result = await service.embed_documents(texts)
+
+        assert [len(b) for b in backend.batches] == [3, 3, 1]
+        assert len(result["vectors"]) == 7
+
+    @pytest.mark.asyncio
+    async def test_duplicate_texts_embedded_once(self, memory_cache):
+        """Test that duplicates within one call share an embedding."""
+        backend = FakeBackend()
+        service = EmbeddingService(backend=backend)
+
+        result = await service.embed_documents(["same text", "same  text", "other"])
+
+        assert result["embedded"] == 2
+        assert result["vectors"][0] == result["vectors"][1]
+
+
+class TestQueryEmbeddingCache:
+    """Test the two-level (LRU + Redis) query cache."""
+
+    @pytest.mark.asyncio
+    async def test_local_then_redis_hits(self, memory_cache):
+        """Test that a second worker is served from the shared level."""
+        backend = FakeBackend()
+        worker_a = EmbeddingService(backend=backend)
+        worker_b = EmbeddingService(backend=backend)
+
+        first = await worker_a.embed_query("Reset password")
+        again = await worker_a.embed_query("reset   password")
+        other_worker = await worker_b.embed_query("reset password")
+
+        assert [first["cache"], again["cache"], other_worker["cache"]] == ["miss", "local", "redis"]
+        assert backend.queries == ["Reset password"]
+        stats = worker_a.query_cache_stats()
+        assert stats["hit_rate"] == 0.5
+        assert stats["local_hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_lru_eviction(self, memory_cache):
+        """Test that the in-process level is bounded."""
+        service = EmbeddingService(backend=FakeBackend())
+        service.query_cache_size = 2
+        for query in ["vpn", "printer", "email"]:
+            await service.embed_query(query)
+        assert service.query_cache_stats()["lru_entries"] == 2
+
+    def test_sync_wrapper_shares_lru(self, memory_cache):
+        """Test that the sync LangChain wrapper uses the same LRU."""
+        backend = FakeBackend()
+        service = EmbeddingService(backend=backend)
+        wrapper = embedding_cache.CachedQueryEmbeddings(service)
+
+        wrapper.embed_query("vpn not connecting")
+        wrapper.embed_query("VPN not connecting")
+
+        assert len(backend.queries) == 1
+        assert service.query_cache_stats()["local_hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_sync_wrapper_shares_redis_across_workers(self, memory_cache):
+        """Test that /rag/query's sync path reuses and fills the shared level."""
+        backend = FakeBackend()
+        worker_a = EmbeddingService(backend=backend)
+        worker_b = EmbeddingService(backend=backend)
+
+        embedding_cache.CachedQueryEmbeddings(worker_a).embed_query("Reset password")
+        embedding_cache.CachedQueryEmbeddings(worker_b).embed_query("reset password")
+        async_worker = await EmbeddingService(backend=backend).embed_query("reset  password")
+
+        assert backend.queries == ["Reset password"]
+        assert worker_b.query_cache_stats()["redis_hits"] == 1
+        assert async_worker["cache"] == "redis"
+
+
+class TestCacheKeys:
+    """Test cache key normalization and vector encoding."""
+
+    def test_key_ignores_whitespace_differences(self):
+        """Test that whitespace-only differences map to the same key."""
+        assert embedding_cache_key("reset  my\npassword", "m") == embedding_cache_key("reset my password", "m")
+
+    def test_key_includes_model(self):
+        """Test that different models never share cached vectors."""
+        assert embedding_cache_key("text", "model-a") != embedding_cache_key("text", "model-b")
+
+    def test_vector_round_trip(self):
+        """Test float32 encoding round trip."""
+        assert decode_vector(encode_vector([0.5, -1.25, 2.0])) == [0.5, -1.25, 2.0]
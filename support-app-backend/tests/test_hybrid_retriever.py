@@ -0,0 +1,374 @@
+"""
+Tests for hybrid lexical + vector retrieval.
+Retrieval legs are replaced with fakes, so no database is needed.
+"""
+import asyncio
+import time
+import pytest
+from types import SimpleNamespace
+from langchain_core.documents import Document
+
+from app.services.hybrid_retriever import (
+    HybridRetriever, RetrievalFilters, reciprocal_rank_fusion, build_search_query
+)
+
+
+class TestReciprocalRankFusion:
+    """Test rank fusion scoring."""
+
+    def test_items_in_both_lists_rank_first(self):
+        """Test that agreement between legs beats a single first place."""
+        fused = reciprocal_rank_fusion({
+            "vector": ["a", "b", "c"],
+            "lexical": ["c", "d"]
+        }, k=60)
+        ranking = sorted(fused, key=lambda key: fused[key]["score"], reverse=True)
+        assert ranking[0] == "c"
+        assert fused["c"]["ranks"] == {"vector": 3, "lexical": 1}
+
+    def test_duplicates_within_a_list_count_once(self):
+        """Test that a repeated key keeps its best rank only."""
+        fused = reciprocal_rank_fusion({"vector": ["a", "a"]}, k=60)
+        assert fused["a"]["score"] == pytest.approx(1 / 61)
+
+
+class TestSearchQuery:
+    """Test natural-language to websearch query conversion."""
+
+    def test_terms_are_or_ed(self):
+        """Test that question words become an OR query without punctuation."""
+        assert build_search_query("VPN won't connect?") == "vpn or won't or connect"
+
+    def test_empty_query(self):
+        """Test that punctuation-only input yields no query."""
+        assert build_search_query("?!") == ""
+
+
+class FakeSession:
+    """Stands in for AsyncSessionLocal(); the fake legs never query it."""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeRecordIndex:
+    """Ticket/KB index stand-in; unavailable unless given matches."""
+
+    def __init__(self, matches=None):
+        self.matches = matches
+        self.available = matches is not None
+
+    async def search(self, query_vector, k=5, filter=None):
+        return self.matches or []
+
+
+class FakeTicketCards:
+    """Resolution cards keyed by ticket id; records each batched call."""
+
+    def __init__(self):
+        self.calls = []
+
+    async def get_cards(self, ticket_ids):
+        self.calls.append(list(ticket_ids))
+        return {
+            7: {
+                "root_cause": {"description": "Expired password", "cause_codes": ["AD-01"]},
+                "resolution_steps": [{"step_order": 1, "instructions": "Unlock account", "success_flag": True}]
+            }
+        }
+
+
+class FakeRetriever(HybridRetriever):
+    """Hybrid retriever with canned results for each leg."""
+
+    def __init__(self, ticket_index=None, kb_index=None, **kwargs):
+        super().__init__(
+            rrf_k=60, candidates=10, session_factory=FakeSession,
+            ticket_index=ticket_index or FakeRecordIndex(),
+            kb_index=kb_index or FakeRecordIndex(),
+            ticket_cards=FakeTicketCards(), **kwargs
+        )
+
+    async def search_documents(self, query_vector, limit, search_params=None, filter=None):
+        return [
+            (Document(id="c1", page_content="reset password via portal", metadata={"doc_id": 1}), 0.1),
+            (Document(id="c2", page_content="vpn setup", metadata={"doc_id": 2}), 0.4)
+        ]
+
+    async def search_tickets(self, db, query, limit, category=None):
+        ticket = SimpleNamespace(ticket_id=7, subject="Password reset", description="User locked out")
+        return [(ticket, 0.8)]
+
+    async def search_kb_articles(self, db, query, limit):
+        article = SimpleNamespace(kb_id=3, title="Password Reset Procedure", summary="AD reset", url=None)
+        return [(article, 0.5)]
+
+    async def suggest_categories(self, db, query, limit=3):
+        return [{"category_id": 1, "name": "Windows Desktop", "matches": 4}]
+
+
+class TicketVectorRetriever(FakeRetriever):
+    """Adds a ticket vector leg that ranks ticket 9 above ticket 7."""
+
+    def __init__(self):
+        super().__init__(ticket_index=FakeRecordIndex([{"id": 9}, {"id": 7}]))
+
+    async def search_tickets(self, db, query, limit, category=None):
+        tickets = [
+            SimpleNamespace(ticket_id=8, subject="Password policy", description="Length rules"),
+            SimpleNamespace(ticket_id=7, subject="Password reset", description="User locked out")
+        ]
+        return [(tickets[0], 0.9), (tickets[1], 0.8)]
+
+    async def search_ticket_vectors(self, db, query_vector, limit, category=None):
+        tickets = {
+            9: SimpleNamespace(ticket_id=9, subject="Account locked", description="Too many attempts"),
+            7: SimpleNamespace(ticket_id=7, subject="Password reset", description="User locked out")
+        }
+        matches = await self.ticket_index.search(query_vector, k=limit)
+        return [(tickets[m["id"]], 0.2) for m in matches]
+
+
+class KBVectorRetriever(FakeRetriever):
+    """Adds a KB vector leg returning four articles."""
+
+    def __init__(self):
+        super().__init__(kb_index=FakeRecordIndex([{"id": i} for i in (4, 3, 5, 6)]), kb_top_k=2)
+
+    async def search_kb_vectors(self, db, query_vector, limit):
+        matches = await self.kb_index.search(query_vector, k=limit)
+        return [
+            (SimpleNamespace(kb_id=m["id"], title=f"Article {m['id']}", summary="", url=None), 0.3)
+            for m in matches
+        ]
+
+
+class FilterRecordingRetriever(FakeRetriever):
+    """Records the scope each leg was asked to search."""
+
+    def __init__(self):
+        super().__init__(ticket_index=FakeRecordIndex([{"id": 7}]))
+        self.scopes = {}
+
+    async def search_documents(self, query_vector, limit, search_params=None, filter=None):
+        self.scopes["vector"] = filter
+        return await super().search_documents(query_vector, limit)
+
+    async def search_tickets(self, db, query, limit, category=None):
+        self.scopes["tickets"] = category
+        return await super().search_tickets(db, query, limit)
+
+    async def search_ticket_vectors(self, db, query_vector, limit, category=None):
+        self.scopes["ticket_vectors"] = category
+        return []
+
+
+class ScalarResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+    def __iter__(self):
+        return iter([])
+
+
+class ScriptedDB:
+    """Answers each execute() with the next scripted scalar; records the statements."""
+
+    def __init__(self, *scalars):
+        self.scalars = list(scalars)
+        self.statements = []
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        return ScalarResult(self.scalars.pop(0) if self.scalars else None)
+
+
+class RecordingRecordIndex(FakeRecordIndex):
+    def __init__(self):
+        super().__init__([])
+        self.filters = []
+
+    async def search(self, query_vector, k=5, filter=None):
+        self.filters.append(filter)
+        return []
+
+
+class TestScopedRetrieval:
+    """Test that filters are pushed into each leg's query."""
+
+    def test_document_filter(self):
+        """Test that file type and document ids combine, and deduplicated chunks match by reference."""
+        assert RetrievalFilters().document_filter() is None
+        assert RetrievalFilters(file_type="pdf").document_filter() == {"file_type": {"$eq": "pdf"}}
+        assert RetrievalFilters(category="Network", file_type="pdf", doc_ids=(4,)).document_filter() == {"$and": [
+            {"file_type": {"$eq": "pdf"}},
+            {"$or": [{"doc_id": {"$in": [4]}}, {"references": {"$contains": [{"doc_id": 4}]}}]}
+        ]}
+
+    @pytest.mark.asyncio
+    async def test_filters_reach_every_scoped_leg(self):
+        """Test that documents get a metadata filter and both ticket legs the category."""
+        retriever = FilterRecordingRetriever()
+        await retriever.retrieve("vpn drops", [0.1], filters=RetrievalFilters(category="Network", file_type="pdf"))
+
+        assert retriever.scopes == {
+            "vector": {"file_type": {"$eq": "pdf"}}, "tickets": "Network", "ticket_vectors": "Network"
+        }
+
+    @pytest.mark.asyncio
+    async def test_ticket_vectors_filtered_by_category_id(self):
+        """Test that the category name is resolved and pushed into the ticket vector search."""
+        index = RecordingRecordIndex()
+        retriever = HybridRetriever(ticket_index=index)
+
+        await retriever.search_ticket_vectors(ScriptedDB(3), [0.1], 10, category="Network")
+        assert index.filters == [{"category_id": {"$eq": 3}}]
+
+        assert await retriever.search_ticket_vectors(ScriptedDB(None), [0.1], 10, category="Nope") == []
+        assert len(index.filters) == 1
+
+    @pytest.mark.asyncio
+    async def test_lexical_ticket_leg_joins_category(self):
+        """Test that the full-text ticket query joins the category table only when scoped."""
+        db = ScriptedDB()
+        retriever = HybridRetriever(ticket_index=FakeRecordIndex())
+        await retriever.search_tickets(db, "vpn drops", 10, category="Network")
+        await retriever.search_tickets(db, "vpn drops", 10)
+
+        scoped, unscoped = (str(statement) for statement in db.statements)
+        assert "JOIN ticketcategories" in scoped and "lower(ticketcategories.name)" in scoped
+        assert "ticketcategories" not in unscoped
+
+
+class TestHybridRetriever:
+    """Test that legs are fused into the context builder's shapes."""
+
+    @pytest.mark.asyncio
+    async def test_retrieve_fuses_all_legs(self):
+        """Test that every leg contributes and shapes match the context builder."""
+        retriever = FakeRetriever()
+        result = await retriever.retrieve("reset password", [0.1, 0.2], k=5)
+
+        assert [doc.id for doc, _ in result["documents"]] == ["c1", "c2"]
+        assert result["tickets"][0]["id"] == 7
+        assert result["kb_articles"][0]["title"] == "Password Reset Procedure"
+        assert {entry["source"] for entry in result["ranking"]} == {"document", "ticket", "kb"}
+        assert result["suggested_categories"][0]["name"] == "Windows Desktop"
+        assert set(result["stages"]) == {"vector", "tickets", "kb", "categories", "ticket_cards"}
+        assert result["degraded"] == []
+
+    @pytest.mark.asyncio
+    async def test_disabled_legs_are_skipped(self):
+        """Test that include_tickets/include_kb switch off the lexical legs."""
+        retriever = FakeRetriever()
+        result = await retriever.retrieve("reset password", [0.1], include_tickets=False, include_kb=False)
+
+        assert result["tickets"] == []
+        assert result["kb_articles"] == []
+        assert set(result["stages"]) == {"vector"}
+
+    @pytest.mark.asyncio
+    async def test_k_caps_each_source(self):
+        """Test that at most k items are returned per source."""
+        retriever = FakeRetriever()
+        result = await retriever.retrieve("reset password", [0.1], k=1)
+        assert len(result["documents"]) == 1
+
+    @pytest.mark.asyncio
+    async def test_ticket_vector_leg_fuses_with_lexical(self):
+        """Test that a ticket found by both ticket legs ranks first."""
+        retriever = TicketVectorRetriever()
+        result = await retriever.retrieve("reset password", [0.1], k=5)
+
+        assert result["tickets"][0]["id"] == 7
+        assert {t["id"] for t in result["tickets"]} == {7, 8, 9}
+        assert "ticket_vectors" in result["stages"]
+
+    @pytest.mark.asyncio
+    async def test_tickets_get_resolution_cards_in_one_call(self):
+        """Test that all selected tickets are completed by one batched card lookup."""
+        retriever = TicketVectorRetriever()
+        result = await retriever.retrieve("reset password", [0.1], k=5)
+        tickets = {t["id"]: t for t in result["tickets"]}
+
+        assert len(retriever.ticket_cards.calls) == 1
+        assert sorted(retriever.ticket_cards.calls[0]) == [7, 8, 9]
+        assert tickets[7]["resolution_steps"][0]["instructions"] == "Unlock account"
+        assert tickets[7]["root_cause"]["description"] == "Expired password"
+        assert tickets[9]["resolution_steps"] == [] and tickets[9]["root_cause"] is None
+
+    @pytest.mark.asyncio
+    async def test_kb_vector_leg_is_capped(self):
+        """Test that KB articles from both legs fuse and are capped at kb_top_k."""
+        retriever = KBVectorRetriever()
+        result = await retriever.retrieve("reset password", [0.1], k=5)
+
+        assert [a["id"] for a in result["kb_articles"]] == [3, 4]
+        assert result["kb_articles"][0]["title"] == "Password Reset Procedure"
+        assert "kb_vectors" in result["stages"]
+
+
+class SlowTicketsRetriever(FakeRetriever):
+    """Ticket leg that hangs, KB leg that fails."""
+
+    async def search_tickets(self, db, query, limit, category=None):
+        await asyncio.sleep(5)
+
+    async def search_kb_articles(self, db, query, limit):
+        raise RuntimeError("kb index unavailable")
+
+
+class SleepyRetriever(FakeRetriever):
+    """Every leg takes 0.2s."""
+
+    async def search_documents(self, query_vector, limit, search_params=None, filter=None):
+        await asyncio.sleep(0.2)
+        return []
+
+    async def search_tickets(self, db, query, limit, category=None):
+        await asyncio.sleep(0.2)
+        return []
+
+    async def search_kb_articles(self, db, query, limit):
+        await asyncio.sleep(0.2)
+        return []
+
+    async def suggest_categories(self, db, query, limit=3):
+        await asyncio.sleep(0.2)
+        return []
+
+
+class TestStageFanOut:
+    """Test concurrent stages with per-stage timeouts."""
+
+    @pytest.mark.asyncio
+    async def test_slow_and_failing_stages_degrade(self):
+        """Test that the other sources still come back when one stage hangs."""
+        retriever = SlowTicketsRetriever()
+        retriever.timeouts["tickets"] = 0.05
+
+        result = await retriever.retrieve("reset password", [0.1])
+
+        assert result["stages"]["tickets"]["status"] == "timeout"
+        assert result["stages"]["kb"]["status"] == "error"
+        assert sorted(result["degraded"]) == ["kb", "tickets"]
+        assert len(result["documents"]) == 2
+        assert result["suggested_categories"]
+
+    @pytest.mark.asyncio
+    async def test_stages_run_concurrently(self):
+        """Test that stage latency does not add up."""
+        retriever = SleepyRetriever()
+
+        started = time.perf_counter()
+        result = await retriever.retrieve("reset password", [0.1])
+        elapsed = time.perf_counter() - started
+
+        assert elapsed < 0.6
+        assert all(stage["ms"] >= 150 for stage in result["stages"].values())
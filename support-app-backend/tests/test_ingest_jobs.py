@@ -0,0 +1,665 @@
+"""
+Tests for background ingest jobs and the ingest pipeline.
+The job table, database session and vector store are replaced with fakes,
+so no database is needed.
+"""
+import asyncio
+import json
+import time
+import pytest
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from fastapi import HTTPException
+
+from app.services import ingest_jobs as ingest_jobs_module
+from app.services import ingestion as ingestion_module
+from app.services.ingest_jobs import IngestWorker, is_retryable
+from app.services.chunk_dedup import DedupPlan
+from app.services.ingestion import IngestProgress, ingest_file
+from app.services.parse_pool import ParsePool, ParsePoolError, ParseTimeoutError
+
+
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeQueue:
+    """In-memory stand-in for IngestJobQueue."""
+
+    def __init__(self, jobs=()):
+        self.jobs = {job.id: job for job in jobs}
+        self.progress = []
+        self.heartbeats = 0
+        self.wakeup = asyncio.Event()
+
+    async def claim(self, worker_id):
+        for job in self.jobs.values():
+            if job.status == "queued":
+                job.status = "running"
+                job.attempts += 1
+                job.worker_id = worker_id
+                return job
+        return None
+
+    async def heartbeat(self, job):
+        self.heartbeats += 1
+        return job.status == "running"
+
+    async def record_progress(self, job, progress):
+        if job.status != "running":
+            return False
+        self.progress.append((job.id, progress.to_dict()))
+        return True
+
+    async def complete(self, job, result):
+        if job.status != "running":
+            return False
+        job.status = "succeeded"
+        job.result = result
+        return True
+
+    async def fail(self, job, error, retry_delay=None):
+        if job.status != "running":
+            return False
+        job.error = error
+        job.retry_delay = retry_delay
+        job.status = "failed" if retry_delay is None else "queued"
+        return True
+
+    async def requeue_stale(self):
+        return []
+
+
+def make_job(job_id, tmp_path, attempts=0, max_attempts=3, **kwargs):
+    path = tmp_path / f"{job_id}.txt"
+    path.write_text("VPN setup guide")
+    return SimpleNamespace(
+        id=job_id, filename="guide.txt", file_path=str(path), status="queued",
+        attempts=attempts, max_attempts=max_attempts, document_id=None,
+        progress_json=None, **kwargs
+    )
+
+
+def make_worker(queue, ingest, concurrency=1):
+    worker = IngestWorker(queue, concurrency=concurrency, ingest=ingest, session_factory=FakeSession)
+    worker.retry_backoff = 10.0
+    return worker
+
+
+class TestIngestWorker:
+    """Test job outcomes, retries and cleanup."""
+
+    @pytest.mark.asyncio
+    async def test_success_records_result_and_progress(self, tmp_path):
+        """Test that a finished job stores its result and its spooled file is removed."""
+        job = make_job(1, tmp_path)
+        queue = FakeQueue([job])
+
+        async def ingest(db, path, filename, on_progress=None):
+            progress = IngestProgress()
+            with progress.timed("parse"):
+                progress.counts["chunks"] = 4
+            await on_progress(progress)
+            return {"id": 42, "chunks": 4}
+
+        assert await make_worker(queue, ingest).run_once()
+
+        assert job.status == "succeeded" and job.result == {"id": 42, "chunks": 4}
+        assert queue.progress[0][1]["counts"]["chunks"] == 4
+        assert "parse" in queue.progress[0][1]["stages_ms"]
+        assert not (tmp_path / "1.txt").exists()
+
+    @pytest.mark.asyncio
+    async def test_transient_error_is_retried_with_backoff(self, tmp_path):
+        """Test that a failed attempt is requeued with a doubling delay and keeps its file."""
+        job = make_job(1, tmp_path, attempts=1)
+        queue = FakeQueue([job])
+
+        async def ingest(db, path, filename, on_progress=None):
+            raise ConnectionError("embedding API unavailable")
+
+        assert await make_worker(queue, ingest).run_once()
+
+        assert job.status == "queued"
+        assert job.retry_delay == 20.0  # second attempt
+        assert "embedding API unavailable" in job.error
+        assert (tmp_path / "1.txt").exists()
+
+    @pytest.mark.asyncio
+    async def test_last_attempt_fails_job(self, tmp_path):
+        """Test that a job out of attempts is failed and its file removed."""
+        job = make_job(1, tmp_path, attempts=2, max_attempts=3)
+        queue = FakeQueue([job])
+
+        async def ingest(db, path, filename, on_progress=None):
+            raise ConnectionError("database went away")
+
+        await make_worker(queue, ingest).run_once()
+
+        assert job.status == "failed" and job.retry_delay is None
+        assert not (tmp_path / "1.txt").exists()
+
+    @pytest.mark.asyncio
+    async def test_unparseable_file_is_not_retried(self, tmp_path):
+        """Test that client errors fail on the first attempt with their detail."""
+        job = make_job(1, tmp_path)
+        queue = FakeQueue([job])
+
+        async def ingest(db, path, filename, on_progress=None):
+            raise HTTPException(status_code=400, detail="Error processing PDF file: EOF marker not found")
+
+        await make_worker(queue, ingest).run_once()
+
+        assert job.status == "failed"
+        assert job.error == "Error processing PDF file: EOF marker not found"
+        assert not is_retryable(HTTPException(status_code=400))
+        assert is_retryable(HTTPException(status_code=503))
+
+    @pytest.mark.asyncio
+    async def test_timeout_beside_another_job(self, tmp_path):
+        """Test that a job timing out neither fails a job parsing next to it nor is failed for good."""
+        slow, other = make_job(1, tmp_path), make_job(2, tmp_path)
+        slow.filename = "scan.pdf"
+        queue = FakeQueue([slow, other])
+        pool = ParsePool(workers=2, max_concurrent=4, timeout=20, memory_limit_mb=512)
+
+        async def ingest(db, path, filename, on_progress=None):
+            if filename == "scan.pdf":
+                await pool.run(time.sleep, 30, timeout=1.0)
+            await pool.run(time.sleep, 1.5)
+            return {"id": 7}
+
+        worker = make_worker(queue, ingest, concurrency=2)
+        try:
+            await asyncio.gather(worker.run_once(), worker.run_once())
+        finally:
+            pool.shutdown()
+
+        assert other.status == "succeeded" and pool.stats["recycles"] == 1
+        assert slow.status == "queued" and "longer than 1s" in slow.error
+        assert is_retryable(ParseTimeoutError("slow")) and is_retryable(ParsePoolError("stopped"))
+
+    @pytest.mark.asyncio
+    async def test_partial_document_from_crashed_attempt_is_discarded(self, tmp_path, monkeypatch):
+        """Test that a requeued job removes the document its previous attempt left."""
+        discarded = []
+
+        async def fake_discard(db, doc_id, chunk_count):
+            discarded.append((doc_id, chunk_count))
+
+        monkeypatch.setattr(ingest_jobs_module, "discard_document", fake_discard)
+        job = make_job(1, tmp_path, attempts=1)
+        job.document_id = 17
+        job.progress_json = json.dumps({"counts": {"chunks": 12}})
+        queue = FakeQueue([job])
+
+        async def ingest(db, path, filename, on_progress=None):
+            return {"id": 18}
+
+        await make_worker(queue, ingest).run_once()
+
+        assert discarded == [(17, 12)]
+        assert job.status == "succeeded"
+
+    @pytest.mark.asyncio
+    async def test_heartbeat_while_silent(self, tmp_path):
+        """Test that a job reporting no progress (e.g. waiting on a title lock) still shows it is alive."""
+        job = make_job(1, tmp_path)
+        queue = FakeQueue([job])
+
+        async def ingest(db, path, filename, on_progress=None):
+            await asyncio.sleep(0.1)
+            return {"id": 42}
+
+        worker = make_worker(queue, ingest)
+        worker.heartbeat_interval = 0.02
+        await worker.run_once()
+
+        assert job.status == "succeeded" and queue.heartbeats >= 2
+
+    @pytest.mark.asyncio
+    async def test_requeued_job_is_left_to_its_new_claim(self, tmp_path):
+        """Test that a worker whose job was requeued as stale stops writing and keeps the file."""
+        job = make_job(1, tmp_path)
+        queue = FakeQueue([job])
+        reached = []
+
+        async def ingest(db, path, filename, on_progress=None):
+            job.status = "queued"  # requeue_stale ran elsewhere
+            await on_progress(IngestProgress())
+            reached.append(True)
+            return {"id": 42}
+
+        worker = make_worker(queue, ingest)
+        await worker.run_once()
+
+        assert not reached and job.status == "queued" and queue.progress == []
+        assert worker.stats["lost"] == 1 and (tmp_path / "1.txt").exists()
+
+    @pytest.mark.asyncio
+    async def test_outcome_of_requeued_job_is_dropped(self, tmp_path):
+        """Test that a finished attempt does not complete a job that was requeued meanwhile."""
+        job = make_job(1, tmp_path)
+        queue = FakeQueue([job])
+
+        async def ingest(db, path, filename, on_progress=None):
+            job.status = "queued"
+            return {"id": 42}
+
+        worker = make_worker(queue, ingest)
+        await worker.run_once()
+
+        assert job.status == "queued" and not hasattr(job, "result")
+        assert worker.stats == {**worker.stats, "succeeded": 1, "lost": 1}
+        assert (tmp_path / "1.txt").exists()
+
+    @pytest.mark.asyncio
+    async def test_background_tasks_drain_queue(self, tmp_path):
+        """Test that started workers process queued jobs concurrently."""
+        jobs = [make_job(i, tmp_path) for i in range(1, 5)]
+        queue = FakeQueue(jobs)
+        running = []
+        peak = []
+
+        async def ingest(db, path, filename, on_progress=None):
+            running.append(path)
+            peak.append(len(running))
+            await asyncio.sleep(0.05)
+            running.remove(path)
+            return {}
+
+        worker = make_worker(queue, ingest, concurrency=2)
+        worker.poll_interval = 0.01
+        worker.start()
+        try:
+            for _ in range(100):
+                if all(job.status == "succeeded" for job in jobs):
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await worker.stop()
+
+        assert all(job.status == "succeeded" for job in jobs)
+        assert max(peak) == 2
+
+
+class TestIngestProgress:
+    """Test stage timing."""
+
+    def test_stage_durations_accumulate(self):
+        """Test that repeated stages add up and the current stage is tracked."""
+        progress = IngestProgress()
+        for _ in range(3):
+            with progress.timed("embed"):
+                pass
+        with progress.timed("index"):
+            assert progress.stage == "index"
+        data = progress.to_dict()
+        assert set(data["stages_ms"]) == {"embed", "index"}
+        assert data["stages_ms"]["embed"] >= 0
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def scalars(self):
+        return self
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+    def all(self):
+        return self.rows
+
+
+class FakeDB:
+    """Records statements; assigns an id to the added document and finds `existing` by title."""
+
+    def __init__(self, existing=None):
+        self.existing = existing
+        self.statements = []
+        self.rollbacks = 0
+
+    def add(self, obj):
+        obj.id = 5
+
+    async def commit(self):
+        pass
+
+    async def refresh(self, obj):
+        pass
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        return FakeResult([self.existing] if self.existing is not None else [])
+
+    def updates(self):
+        return [s.compile().params for s in self.statements if str(s).startswith("UPDATE documents")]
+
+    def stored_values(self):
+        """Values of the last UPDATE of the documents row"""
+        return self.updates()[-1]
+
+    def staged_content(self):
+        """Text appended to staged_content, batch by batch"""
+        return "".join(values.get("staged_content_1", "") for values in self.updates())
+
+
+class VersionedDB(FakeDB):
+    """FakeDB whose `existing` document takes the values of each completed update."""
+
+    async def execute(self, statement):
+        result = await super().execute(statement)
+        values = statement.compile().params if str(statement).startswith("UPDATE documents") else {}
+        if "version" in values:
+            for key in ("version", "content_hash", "chunks_json"):
+                setattr(self.existing, key, values[key])
+        return result
+
+
+class BulkLoadedDB(VersionedDB):
+    """VersionedDB whose `existing` document is found only under its own title, or by a path ending in it."""
+
+    async def execute(self, statement):
+        sql = str(statement)
+        if not sql.startswith("SELECT"):
+            return await super().execute(statement)
+        self.statements.append(statement)
+        if "LIKE" in sql:
+            return FakeResult([self.existing.title])
+        found = self.existing.title in statement.compile().params.values()
+        return FakeResult([self.existing] if found else [])
+
+
+class FakeVectorStore:
+    def __init__(self, fail=False):
+        self.ids = []
+        self.deleted = []
+        self.kept = None
+        self.metadata = {}
+        self.fail = fail
+
+    def add_embeddings(self, texts, embeddings, metadatas, ids):
+        if self.fail:
+            raise ConnectionError("vector store unavailable")
+        self.ids.extend(ids)
+
+    def delete(self, ids):
+        self.deleted.extend(ids)
+
+    def delete_by_filter(self, filter, keep_ids=()):
+        self.filter = filter
+        self.kept = list(keep_ids)
+
+    def update_metadata(self, updates, merge=True):
+        self.metadata.update(updates)
+
+
+class FakeDedup:
+    """Marks chunks containing duplicate_text as near-duplicates of vector doc-1-0."""
+
+    def __init__(self):
+        self.duplicate_text = None
+        self.released = []
+
+    async def plan(self, db, chunks, vector_ids, version=1):
+        plan = DedupPlan(chunks, vector_ids, version, fingerprints=[None] * len(chunks))
+        if self.duplicate_text:
+            plan.duplicate_of = {i: "doc-1-0" for i, chunk in enumerate(chunks) if self.duplicate_text in chunk["text"]}
+        return plan
+
+    async def record(self, db, plan, store):
+        pass
+
+    async def release(self, db, doc_id, store, keep_vector_ids=(), keep_references=()):
+        self.released.append((doc_id, sorted(keep_vector_ids), sorted(keep_references)))
+        return set()
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """Replace the embedding, cache, dedup and graph dependencies of ingest_file."""
+    class FakeEmbeddings:
+        async def embed_documents(self, texts):
+            return {"vectors": [[0.0]] * len(texts), "cache_hits": 0, "embedded": len(texts)}
+
+    class FakeAnswerCache:
+        async def invalidate(self, reason):
+            pass
+
+    monkeypatch.setattr(ingestion_module, "embedding_service", FakeEmbeddings())
+    monkeypatch.setattr(ingestion_module, "answer_cache", FakeAnswerCache())
+    monkeypatch.setattr(ingestion_module, "ingest_document_as_nodes", lambda doc, content_length=None: None)
+    # In-process stand-in for the advisory lock
+    locks = defaultdict(asyncio.Lock)
+
+    @asynccontextmanager
+    async def title_lock(title):
+        async with locks[title]:
+            yield
+
+    monkeypatch.setattr(ingestion_module, "title_lock", title_lock)
+    dedup = FakeDedup()
+    monkeypatch.setattr(ingestion_module, "chunk_dedup", dedup)
+
+    def use_store(store):
+        monkeypatch.setattr(ingestion_module, "vectordb", store)
+        return store
+
+    use_store.dedup = dedup
+    return use_store
+
+
+class TestIngestFile:
+    """Test the ingest pipeline run by workers."""
+
+    @pytest.mark.asyncio
+    async def test_chunks_indexed_with_document_ids(self, tmp_path, pipeline):
+        """Test that chunks are indexed under deterministic ids and stages are timed."""
+        store = pipeline(FakeVectorStore())
+        path = tmp_path / "guide.md"
+        path.write_text("# VPN\n" + "Open the client and sign in. " * 100)
+        reports = []
+
+        async def on_progress(progress):
+            reports.append(progress.to_dict())
+
+        result = await ingest_file(FakeDB(), str(path), "guide.md", on_progress=on_progress)
+
+        assert result["id"] == 5 and result["chunks"] == len(store.ids) > 1
+        assert store.ids[0] == "doc-5-0"
+        assert {"store", "parse", "chunk", "embed", "index", "graph"} <= set(result["stages_ms"])
+        assert reports[-1]["stage"] is None and reports[-1]["counts"]["chunks"] == result["chunks"]
+
+    @pytest.mark.asyncio
+    async def test_failure_discards_document(self, tmp_path, pipeline):
+        """Test that a failed ingest removes its vectors and document row."""
+        store = pipeline(FakeVectorStore(fail=True))
+        path = tmp_path / "guide.txt"
+        path.write_text("Restart the router. " * 10)
+        db = FakeDB()
+
+        with pytest.raises(ConnectionError):
+            await ingest_file(db, str(path), "guide.txt")
+
+        assert db.rollbacks == 1
+        assert store.deleted == ["doc-5-0"]
+        assert "DELETE FROM documents" in str(db.statements[-1])
+
+
+GUIDE = "# VPN\nOpen the client and sign in.\n# Printer\nAdd the printer by IP.\n# Email\nCheck the mail server.\n"
+
+
+class TestDocumentVersions:
+    """Test re-ingesting a file under a known name."""
+
+    async def ingest_first_version(self, tmp_path, pipeline):
+        store = pipeline(FakeVectorStore())
+        path = tmp_path / "guide.md"
+        path.write_text(GUIDE)
+        db = FakeDB()
+        await ingest_file(db, str(path), "guide.md")
+        return SimpleNamespace(
+            id=5, title="guide.md", version=1, content=GUIDE,
+            content_hash=ingestion_module.file_sha256(str(path)),
+            chunks_json=db.stored_values()["chunks_json"]
+        ), store
+
+    @pytest.mark.asyncio
+    async def test_unchanged_file_is_skipped(self, tmp_path, pipeline):
+        """Test that the same file again indexes nothing."""
+        doc, _ = await self.ingest_first_version(tmp_path, pipeline)
+        store = pipeline(FakeVectorStore())
+
+        result = await ingest_file(FakeDB(existing=doc), str(tmp_path / "guide.md"), "guide.md")
+
+        assert result["status"] == "unchanged" and result["chunks"] == 3
+        assert store.ids == []
+
+    @pytest.mark.asyncio
+    async def test_only_changed_chunks_reindexed(self, tmp_path, pipeline):
+        """Test that an edit re-indexes the changed chunk and deletes the superseded ones."""
+        doc, _ = await self.ingest_first_version(tmp_path, pipeline)
+        store = pipeline(FakeVectorStore())
+        path = tmp_path / "guide.md"
+        path.write_text(GUIDE.replace("by IP", "by hostname"))
+        db = FakeDB(existing=doc)
+
+        result = await ingest_file(db, str(path), "guide.md")
+
+        assert result["status"] == "updated" and result["version"] == 2
+        assert result["chunks"] == 3 and result["chunks_indexed"] == 1
+        assert store.ids == ["doc-5-v2-1"]
+        assert store.filter == {"doc_id": {"$eq": 5}}
+        assert store.kept == ["doc-5-0", "doc-5-v2-1", "doc-5-2"]
+        stored = db.stored_values()
+        assert stored["version"] == 2 and stored["staged_content"] is None
+        assert "content=documents.staged_content" in str(db.statements[-1])
+        assert "by hostname" in db.staged_content() and len(db.updates()) > 2
+        assert [entry[1] for entry in json.loads(stored["chunks_json"])] == [1, 2, 1]
+
+    @pytest.mark.asyncio
+    async def test_moved_chunks_keep_their_vectors(self, tmp_path, pipeline):
+        """Test that a section inserted at the top re-indexes only that section."""
+        doc, _ = await self.ingest_first_version(tmp_path, pipeline)
+        store = pipeline(FakeVectorStore())
+        path = tmp_path / "guide.md"
+        path.write_text("# Wi-Fi\nForget the network and rejoin.\n" + GUIDE)
+        db = FakeDB(existing=doc)
+
+        result = await ingest_file(db, str(path), "guide.md")
+
+        assert result["chunks"] == 4 and result["chunks_indexed"] == 1
+        assert store.ids == ["doc-5-v2-0"]
+        assert store.kept == ["doc-5-v2-0", "doc-5-0", "doc-5-1", "doc-5-2"]
+        assert {vector_id: m["chunk_index"] for vector_id, m in store.metadata.items()} == {
+            "doc-5-0": 1, "doc-5-1": 2, "doc-5-2": 3
+        }
+        manifest = json.loads(db.stored_values()["chunks_json"])
+        assert [entry[1:] for entry in manifest] == [[2], [1, 0], [1, 1], [1, 2]]
+
+        # Removing the section again moves the chunks back to where their vectors were written
+        doc = SimpleNamespace(**{**vars(doc), "version": 2, "content_hash": "v2", "chunks_json": json.dumps(manifest)})
+        path.write_text(GUIDE)
+        store = pipeline(FakeVectorStore())
+        db = FakeDB(existing=doc)
+
+        result = await ingest_file(db, str(path), "guide.md")
+
+        assert result["chunks_indexed"] == 0 and store.ids == []
+        assert store.kept == ["doc-5-0", "doc-5-1", "doc-5-2"]
+        assert [entry[1:] for entry in json.loads(db.stored_values()["chunks_json"])] == [[1], [1], [1]]
+
+    @pytest.mark.asyncio
+    async def test_concurrent_updates_get_their_own_versions(self, tmp_path, pipeline):
+        """Test that two uploads of one name at once become consecutive versions."""
+        doc, _ = await self.ingest_first_version(tmp_path, pipeline)
+        store = pipeline(FakeVectorStore())
+        db = VersionedDB(existing=doc)
+        paths = []
+        for i, edit in enumerate([("by IP", "by hostname"), ("mail server", "SMTP server")]):
+            paths.append(tmp_path / f"upload-{i}.md")
+            paths[-1].write_text(GUIDE.replace(*edit))
+
+        results = await asyncio.gather(*[ingest_file(db, str(path), "guide.md") for path in paths])
+
+        assert sorted(result["version"] for result in results) == [2, 3]
+        assert doc.version == 3 and len(store.ids) == len(set(store.ids)) == 3
+        assert {vector_id.split("-")[2] for vector_id in store.ids} == {"v2", "v3"}
+
+    @pytest.mark.asyncio
+    async def test_file_name_and_bulk_path_are_one_document(self, tmp_path, pipeline):
+        """Test that an upload updates the document bulk loaded under a path, and a path the uploaded one."""
+        doc, _ = await self.ingest_first_version(tmp_path, pipeline)
+        pipeline(FakeVectorStore())
+        path = tmp_path / "guide.md"
+        path.write_text(GUIDE.replace("by IP", "by hostname"))
+        doc.title = "kb/guide.md"
+        db = BulkLoadedDB(existing=doc)
+
+        result = await ingest_file(db, str(path), "guide.md")
+
+        assert result["status"] == "updated" and result["title"] == "kb/guide.md"
+        assert db.stored_values()["title"] == "kb/guide.md"
+
+        # A bulk load of the path finds a document uploaded under the file name, and takes the path
+        doc.title = "guide.md"
+        path.write_text(GUIDE.replace("mail server", "SMTP server"))
+
+        result = await ingest_file(db, str(path), "kb/guide.md")
+
+        assert result["status"] == "updated" and result["version"] == 3
+        assert db.stored_values()["title"] == "kb/guide.md"
+
+    @pytest.mark.asyncio
+    async def test_failed_update_keeps_previous_version(self, tmp_path, pipeline):
+        """Test that a failed update removes only its own vectors, not the document."""
+        doc, _ = await self.ingest_first_version(tmp_path, pipeline)
+        store = pipeline(FakeVectorStore(fail=True))
+        path = tmp_path / "guide.md"
+        path.write_text(GUIDE + "# Wi-Fi\nForget the network and rejoin.\n")
+        db = FakeDB(existing=doc)
+
+        with pytest.raises(ConnectionError):
+            await ingest_file(db, str(path), "guide.md")
+
+        assert store.deleted == ["doc-5-v2-3"] and store.kept is None
+        assert not any(str(s).startswith("DELETE FROM documents") for s in db.statements)
+        assert not any("version" in values for values in db.updates())
+        assert db.stored_values()["staged_content"] is None
+
+    @pytest.mark.asyncio
+    async def test_near_duplicate_chunks_reference_canonical(self, tmp_path, pipeline):
+        """Test that a near-duplicate chunk is not indexed and is kept through updates."""
+        store = pipeline(FakeVectorStore())
+        pipeline.dedup.duplicate_text = "Add the printer"
+        path = tmp_path / "guide.md"
+        path.write_text(GUIDE)
+        db = FakeDB()
+
+        result = await ingest_file(db, str(path), "guide.md")
+
+        assert result["duplicate_chunks"] == 1 and result["chunks_indexed"] == 2
+        assert store.ids == ["doc-5-0", "doc-5-2"]
+        manifest = json.loads(db.stored_values()["chunks_json"])
+        assert manifest[1][2] == "doc-1-0"
+
+        # Updating another section keeps the reference and its canonical vector
+        doc = SimpleNamespace(id=5, title="guide.md", version=1, content=GUIDE, content_hash="old",
+                              chunks_json=json.dumps(manifest))
+        path.write_text(GUIDE.replace("mail server", "SMTP server"))
+        store = pipeline(FakeVectorStore())
+        await ingest_file(FakeDB(existing=doc), str(path), "guide.md")
+
+        assert store.ids == ["doc-5-v2-2"]
+        assert store.kept == ["doc-5-0", "doc-1-0", "doc-5-v2-2"]
+        assert pipeline.dedup.released[-1][2] == [("doc-1-0", 1, 1)]
@@ -0,0 +1,152 @@
+"""
+Tests for cached, concurrency-limited OCR.
+tesseract is not called: the parse pool is replaced with a fake that runs
+the fingerprint in-process and counts OCR runs, and Redis with a dict.
+"""
+import asyncio
+import pytest
+from PIL import Image, ImageDraw
+
+from app.services import ocr_cache as ocr_cache_module
+from app.services import parsers
+from app.services.ocr_cache import OCRService
+
+
+class FakePool:
+    """Runs image_fingerprint for real; parse_image returns canned text."""
+
+    timeout = 30
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.ocr_runs = 0
+        self.active = 0
+        self.max_active = 0
+
+    async def run(self, func, *args, timeout=None):
+        if func is parsers.image_fingerprint:
+            return func(*args)
+        self.ocr_runs += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            return {
+                "text": "Error 0x80070005: Access denied",
+                "image_format": "PNG", "image_width": 200, "image_height": 60,
+                "image_mode": "RGB", "ocr_downscaled": False
+            }
+        finally:
+            self.active -= 1
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    store = {}
+
+    async def fake_get(key):
+        return store.get(key)
+
+    async def fake_set_many(items, ttl):
+        store.update(items)
+
+    monkeypatch.setattr(ocr_cache_module, "cache_get", fake_get)
+    monkeypatch.setattr(ocr_cache_module, "cache_set_many", fake_set_many)
+    return store
+
+
+def screenshot(path, text="Access denied", **save_options):
+    image = Image.new("RGB", (200, 60), "white")
+    ImageDraw.Draw(image).text((10, 20), text, fill="black")
+    image.save(path, **save_options)
+    return str(path)
+
+
+class TestOCRCache:
+    """Test file and pixel cache hits and the OCR concurrency limit."""
+
+    @pytest.mark.asyncio
+    async def test_same_file_is_ocrd_once(self, tmp_path, redis):
+        """Test that a second upload of the same file is served from the file-hash key."""
+        pool = FakePool()
+        service = OCRService(pool=pool)
+        path = screenshot(tmp_path / "a.png")
+
+        first = await service.extract(path)
+        second = await service.extract(path)
+
+        assert first["ocr_cache"] == "miss" and second["ocr_cache"] == "file"
+        assert second["text"] == first["text"]
+        assert pool.ocr_runs == 1
+        assert service.cache_stats()["hit_rate"] == 0.5
+
+    @pytest.mark.asyncio
+    async def test_resaved_screenshot_hits_pixel_key(self, tmp_path, redis):
+        """Test that the same pixels in different file bytes are not OCR'd again."""
+        pool = FakePool()
+        service = OCRService(pool=pool)
+        original = screenshot(tmp_path / "a.png", compress_level=1)
+        resaved = screenshot(tmp_path / "b.png", compress_level=9)
+        assert parsers.file_sha256(original) != parsers.file_sha256(resaved)
+
+        await service.extract(original)
+        result = await service.extract(resaved)
+
+        assert result["ocr_cache"] == "pixels" and pool.ocr_runs == 1
+        # The new file bytes are remembered too
+        assert (await service.extract(resaved))["ocr_cache"] == "file"
+
+    @pytest.mark.asyncio
+    async def test_different_text_is_not_a_hit(self, tmp_path, redis):
+        """Test that dialogs differing in one character get their own OCR run."""
+        pool = FakePool()
+        service = OCRService(pool=pool)
+
+        await service.extract(screenshot(tmp_path / "a.png", text="Error 0x80070005"))
+        result = await service.extract(screenshot(tmp_path / "b.png", text="Error 0x80070006"))
+
+        assert result["ocr_cache"] == "miss" and pool.ocr_runs == 2
+
+    @pytest.mark.asyncio
+    async def test_concurrent_ocr_is_limited(self, tmp_path, redis):
+        """Test that no more than max_concurrent images are OCR'd at once."""
+        pool = FakePool(delay=0.02)
+        service = OCRService(pool=pool, max_concurrent=2)
+        paths = [screenshot(tmp_path / f"{i}.png", text=f"Dialog {i}") for i in range(6)]
+
+        await asyncio.gather(*[service.extract(path) for path in paths])
+
+        assert pool.ocr_runs == 6 and pool.max_active == 2
+
+    @pytest.mark.asyncio
+    async def test_cache_disabled(self, tmp_path, redis):
+        """Test that with the cache off every image is OCR'd and nothing is stored."""
+        pool = FakePool()
+        service = OCRService(pool=pool)
+        service.cache_enabled = False
+        path = screenshot(tmp_path / "a.png")
+
+        await service.extract(path)
+        await service.extract(path)
+
+        assert pool.ocr_runs == 2 and redis == {}
+
+
+class TestPrepareForOCR:
+    """Test downscaling and binarization before tesseract."""
+
+    def test_large_image_downscaled_and_binarized(self):
+        """Test that an oversized image is reduced to two gray levels within the limit."""
+        image = Image.new("RGB", (4000, 1000), (230, 230, 230))
+        ImageDraw.Draw(image).rectangle((100, 100, 2000, 600), fill=(40, 40, 40))
+
+        prepared, downscaled = parsers.prepare_for_ocr(image, max_dimension=1000)
+
+        assert downscaled and max(prepared.size) == 1000 and prepared.mode == "L"
+        assert set(prepared.getdata()) == {0, 255}
+
+    def test_small_image_untouched(self):
+        """Test that images within the limit are passed through unchanged."""
+        image = Image.new("RGB", (800, 600), "white")
+        prepared, downscaled = parsers.prepare_for_ocr(image, max_dimension=1000)
+        assert prepared is image and not downscaled
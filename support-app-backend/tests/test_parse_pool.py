@@ -0,0 +1,188 @@
+"""
+Tests for document parsing in the process pool and streamed processing.
+Runs real worker processes; PDFs and workbooks are generated in memory.
+"""
+import asyncio
+import io
+import os
+import time
+import pytest
+import PyPDF2
+import openpyxl
+from fastapi import HTTPException
+
+from app.services import document_processors
+from app.services.document_processors import DocxProcessor, PDFProcessor, ExcelProcessor, TextProcessor, spool_upload
+from app.services.parse_pool import ParsePool, ParsePoolError, ParseTimeoutError, ParseMemoryError
+
+
+class FakeUpload:
+    """Minimal UploadFile stand-in."""
+
+    def __init__(self, filename, content):
+        self.filename = filename
+        self.file = io.BytesIO(content)
+
+
+def make_pdf(pages):
+    writer = PyPDF2.PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=200)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def make_workbook(sheets):
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for name, rows in sheets.items():
+        worksheet = workbook.create_sheet(name)
+        for row in rows:
+            worksheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def pool():
+    pool = ParsePool(workers=2, max_concurrent=4, timeout=30, memory_limit_mb=512)
+    yield pool
+    pool.shutdown()
+
+
+class TestParsePool:
+    """Test limits enforced by the pool."""
+
+    @pytest.mark.asyncio
+    async def test_timeout_recycles_pool(self, pool):
+        """Test that a stuck parse fails at the deadline and the pool keeps working."""
+        started = time.perf_counter()
+        with pytest.raises(ParseTimeoutError):
+            await pool.run(time.sleep, 30, timeout=1.0)
+
+        assert time.perf_counter() - started < 10
+        assert pool.stats["recycles"] == 1
+        assert await pool.run(sum, [1, 2, 3]) == 6
+
+    @pytest.mark.asyncio
+    async def test_timeout_does_not_fail_other_parses(self, pool):
+        """Test that parses killed or cancelled by another file's recycle are resubmitted."""
+        stuck = pool.run(time.sleep, 30, timeout=1.0)
+        running = pool.run(time.sleep, 1.5, timeout=20)
+        queued = pool.run(sum, [1, 2, 3], timeout=20)  # both workers busy
+
+        results = await asyncio.gather(stuck, running, queued, return_exceptions=True)
+
+        assert isinstance(results[0], ParseTimeoutError)
+        assert results[1:] == [None, 6]
+        assert pool.stats["recycles"] == 1 and pool.stats["resubmits"] >= 1
+
+    @pytest.mark.asyncio
+    async def test_memory_limit(self, pool):
+        """Test that a worker cannot allocate past its address-space limit."""
+        with pytest.raises(ParseMemoryError):
+            await pool.run(bytearray, 2 * 1024 ** 3)
+        assert await pool.run(len, "still alive") == 11
+
+
+class TestPDFPageRanges:
+    """Test that large PDFs are split into page ranges."""
+
+    @pytest.mark.asyncio
+    async def test_pages_are_extracted_in_ranges(self, pool, monkeypatch):
+        """Test that every page comes back once, in order, across ranges."""
+        monkeypatch.setattr(document_processors, "parse_pool", pool)
+        monkeypatch.setattr(document_processors.settings, "PARSE_PDF_PAGES_PER_TASK", 2)
+
+        result = await PDFProcessor().process(FakeUpload("manual.pdf", make_pdf(5)))
+
+        assert result["metadata"]["pages"] == 5
+        assert [segment["page"] for segment in result["segments"]] == [1, 2, 3, 4, 5]
+        assert pool.stats["tasks"] == 4  # page count + 3 ranges
+
+
+class TestStreamedProcessing:
+    """Test that spooled uploads are read back in batches."""
+
+    @pytest.mark.asyncio
+    async def test_spool_copies_upload(self):
+        """Test that the spooled file holds the upload and keeps its extension."""
+        path = await spool_upload(FakeUpload("notes.TXT", b"x" * 3_000_000))
+        try:
+            assert path.endswith(".txt")
+            assert os.path.getsize(path) == 3_000_000
+        finally:
+            os.unlink(path)
+
+    @pytest.mark.asyncio
+    async def test_pdf_streams_in_waves(self, pool, monkeypatch):
+        """Test that page ranges are yielded one wave at a time."""
+        monkeypatch.setattr(document_processors, "parse_pool", pool)
+        monkeypatch.setattr(document_processors.settings, "PARSE_PDF_PAGES_PER_TASK", 1)
+        path = await spool_upload(FakeUpload("manual.pdf", make_pdf(6)))
+        try:
+            processor = PDFProcessor()
+            batches = [batch async for batch in processor.stream(path)]
+        finally:
+            os.unlink(path)
+
+        assert [[segment["page"] for segment in batch] for batch in batches] == [[1, 2, 3, 4], [5, 6]]
+        assert processor.metadata == {"file_type": "pdf", "pages": 6}
+
+    @pytest.mark.asyncio
+    async def test_excel_streams_by_sheet(self, pool, monkeypatch):
+        """Test that each sheet is a batch and row totals are filled in at the end."""
+        monkeypatch.setattr(document_processors, "parse_pool", pool)
+        content = make_workbook({
+            "Errors": [["code", "fix"], ["E1", "Restart"], [None, None], ["E2", "Reinstall"]],
+            "Contacts": [["team", "email"], ["IT", "it@example.com"]]
+        })
+
+        result = await ExcelProcessor().process(FakeUpload("codes.xlsx", content))
+
+        assert [segment["sheet"] for segment in result["segments"]] == ["Errors", "Contacts"]
+        assert result["segments"][0]["text"].startswith("=== Sheet: Errors ===")
+        assert result["metadata"]["total_rows"] == 5
+        assert result["metadata"]["sheet_names"] == "Errors, Contacts"
+
+    @pytest.mark.asyncio
+    async def test_large_text_is_batched(self, monkeypatch):
+        """Test that a long text file is yielded in several bounded batches."""
+        monkeypatch.setattr(document_processors, "TEXT_BATCH_CHARS", 1000)
+        lines = [f"# Section {i}\n" + "word " * 100 for i in range(20)]
+        path = await spool_upload(FakeUpload("guide.md", "\n".join(lines).encode("utf-8")))
+        try:
+            batches = [batch async for batch in TextProcessor().stream(path)]
+        finally:
+            os.unlink(path)
+
+        assert len(batches) > 1
+        sections = [segment["section"] for batch in batches for segment in batch]
+        assert sections == [f"Section {i}" for i in range(20)]
+
+    @pytest.mark.asyncio
+    async def test_invalid_utf8_is_rejected(self):
+        """Test that undecodable text is a 400, as before streaming."""
+        with pytest.raises(HTTPException) as exc_info:
+            await TextProcessor().process(FakeUpload("notes.txt", b"\xff\xfe\xfa"))
+        assert exc_info.value.status_code == 400
+
+    @pytest.mark.asyncio
+    async def test_pool_failures_are_not_client_errors(self, monkeypatch):
+        """Test that pool failures propagate and only content errors become a 400."""
+        async def broken_pool(*args, **kwargs):
+            raise ParsePoolError("Parser process stopped unexpectedly")
+
+        async def corrupt_file(*args, **kwargs):
+            raise ValueError("File is not a zip file")
+
+        monkeypatch.setattr(document_processors.parse_pool, "run", broken_pool)
+        with pytest.raises(ParsePoolError):
+            await DocxProcessor().process_path("guide.docx")
+
+        monkeypatch.setattr(document_processors.parse_pool, "run", corrupt_file)
+        with pytest.raises(HTTPException) as exc_info:
+            await DocxProcessor().process_path("guide.docx")
+        assert exc_info.value.status_code == 400
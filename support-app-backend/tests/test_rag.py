@@ -3,6 +3,7 @@
 Tests for RAG router endpoints.
 Tests document ingestion and query processing.
 """
+import asyncio
 import pytest
 from httpx import AsyncClient
 
@@ -55,3 +56,32 @@ class TestDocumentIngestion:
         response = await client.get("/rag/stats")
         # Endpoint may not exist
         assert response.status_code in [200, 404]
+
+
+class TestLoopMonitor:
+    """Test event loop lag reporting."""
+    
+    @pytest.mark.asyncio
+    async def test_loop_stats_endpoint(self, client: AsyncClient):
+        """Test that loop lag statistics are exposed."""
+        response = await client.get("/rag/loop-stats")
+        assert response.status_code == 200
+        data = response.json()
+        assert "max_lag_ms" in data
+        assert "samples" in data
+    
+    @pytest.mark.asyncio
+    async def test_blocking_call_is_measured(self):
+        """Test that a blocking call on the loop shows up as lag."""
+        import time
+        from app.services.loop_monitor import LoopLagMonitor
+        
+        monitor = LoopLagMonitor(interval=0.01)
+        started = time.perf_counter()
+        monitor.start()
+        await asyncio.sleep(0.02)
+        time.sleep(0.1)  # Deliberately block the event loop
+        await asyncio.sleep(0.03)
+        await monitor.stop()
+        
+        assert monitor.max_lag_since(started) >= 0.05
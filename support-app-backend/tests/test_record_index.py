@@ -0,0 +1,171 @@
+"""
+Tests for the closed-ticket and KB article vector indexes.
+Uses a local ANN store in a temp dir with fake embeddings, so no database
+or Vertex AI is needed.
+"""
+import pytest
+from datetime import datetime
+from types import SimpleNamespace
+
+from app.services import vectorstore
+from app.services.ann_index import LocalANNVectorStore
+from app.services.record_index import TicketIndex, KBIndex, KB_CONTENT_MAX_CHARS
+
+
+class FakeEmbeddings:
+    """Deterministic embeddings: one-hot-ish vectors per keyword."""
+
+    words = ["password", "vpn", "printer", "email"]
+
+    def _embed(self, text):
+        text = text.lower()
+        return [1.0 if w in text else 0.01 for w in self.words]
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class FakeEmbedder:
+    """Stands in for the cached embedding service."""
+
+    def __init__(self):
+        self.backend = FakeEmbeddings()
+
+    async def embed_documents(self, texts):
+        return {"vectors": self.backend.embed_documents(texts), "cache_hits": 0, "embedded": len(texts)}
+
+
+class SharedHNSWStore(vectorstore.IndexedFilterPGVector):
+    """
+    A PGVector collection sharing one HNSW index with many document chunks:
+    the scan yields ef_search rows of the whole table, filtered afterwards,
+    unless iterative scan continues it.
+    """
+
+    def __init__(self, documents=200):
+        self.quantization, self.iterative_scan, self._iterative_scan_supported = "none", "strict_order", True
+        self.table = [({"collection": "docs"}, 0.1) for _ in range(documents)]
+
+    def add_ticket(self, ticket_id, category_id):
+        self.table.append(({"collection": "tickets", "record_id": ticket_id, "category_id": category_id}, 0.5))
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None):
+        values = vectorstore._search_settings.values or {}
+        scanned = sorted(self.table, key=lambda row: row[1])
+        if not values.get("hnsw.iterative_scan"):
+            scanned = scanned[:values.get("hnsw.ef_search", vectorstore.DEFAULT_EF_SEARCH)]
+        wanted = {"collection": "tickets", **(filter or {})}
+        matches = [(m, d) for m, d in scanned if all(m.get(key) == value for key, value in wanted.items())]
+        return [(SimpleNamespace(metadata=m), d) for m, d in matches[:k]]
+
+
+def make_ticket(ticket_id, subject, category_id=1, steps=(), causes=()):
+    return SimpleNamespace(
+        ticket_id=ticket_id,
+        subject=subject,
+        description=f"{subject} reported by user",
+        category_id=category_id,
+        status="Closed",
+        closed_at=datetime(2025, 1, 2),
+        root_causes=[SimpleNamespace(description=c) for c in causes],
+        resolution_steps=[SimpleNamespace(step_order=i, instructions=s) for i, s in steps]
+    )
+
+
+@pytest.fixture
+def index(tmp_path):
+    store = LocalANNVectorStore(FakeEmbeddings(), index_dir=str(tmp_path))
+    return TicketIndex("tickets", id_prefix="ticket", store=store, embedder=FakeEmbedder())
+
+
+async def add(index, ticket):
+    await index.upsert(ticket.ticket_id, index.build_text(ticket), index.build_metadata(ticket))
+
+
+class TestTicketText:
+    """Test the text embedded for a ticket."""
+
+    def test_includes_causes_and_ordered_steps(self):
+        """Test that root causes and steps (in step order) are embedded."""
+        ticket = make_ticket(
+            1, "VPN drops",
+            steps=[(2, "Reinstall client"), (1, "Check certificate")],
+            causes=["Expired certificate"]
+        )
+        text = TicketIndex.build_text(ticket)
+
+        assert "Root causes: Expired certificate" in text
+        assert text.index("1. Check certificate") < text.index("2. Reinstall client")
+
+
+class TestKBText:
+    """Test the text embedded for a KB article."""
+
+    def test_title_summary_and_capped_content(self):
+        """Test that long article content is cut before embedding."""
+        article = SimpleNamespace(kb_id=3, title="VPN Setup", summary="Install the client", content="x" * 10000, version=2)
+        text = KBIndex.build_text(article)
+
+        assert text.startswith("Title: VPN Setup\nSummary: Install the client\n")
+        assert text.count("x") == KB_CONTENT_MAX_CHARS
+        assert KBIndex.build_metadata(article) == {"record_id": 3, "title": "VPN Setup", "version": 2}
+
+
+class TestTicketIndex:
+    """Test upsert, search and removal."""
+
+    @pytest.mark.asyncio
+    async def test_search_returns_ticket_ids(self, index):
+        """Test that the nearest closed ticket comes back by its ticket id."""
+        await add(index, make_ticket(1, "Password expired"))
+        await add(index, make_ticket(2, "VPN drops"))
+
+        matches = await index.search(FakeEmbeddings().embed_query("vpn"), k=2)
+        assert matches[0]["id"] == 2
+        assert matches[0]["distance"] < matches[1]["distance"]
+
+    @pytest.mark.asyncio
+    async def test_upsert_replaces_and_remove_deletes(self, index):
+        """Test that re-indexing keeps one vector per ticket and removal drops it."""
+        await add(index, make_ticket(1, "Password expired"))
+        await add(index, make_ticket(1, "Printer jam"))
+
+        matches = await index.search(FakeEmbeddings().embed_query("printer"), k=5)
+        assert [m["id"] for m in matches] == [1]
+        assert matches[0]["metadata"]["subject"] == "Printer jam"
+
+        await index.remove([1])
+        assert await index.search(FakeEmbeddings().embed_query("printer"), k=5) == []
+
+    @pytest.mark.asyncio
+    async def test_category_filter(self, index):
+        """Test that search can be limited to one category."""
+        await add(index, make_ticket(1, "VPN drops", category_id=1))
+        await add(index, make_ticket(2, "VPN slow", category_id=2))
+
+        matches = await index.search(FakeEmbeddings().embed_query("vpn"), k=5, filter={"category_id": 2})
+        assert [m["id"] for m in matches] == [2]
+
+    @pytest.mark.asyncio
+    async def test_unavailable_index_is_a_no_op(self):
+        """Test that a missing store returns nothing instead of failing."""
+        index = TicketIndex("tickets", id_prefix="ticket", store=None, embedder=FakeEmbedder())
+        assert await index.search([1.0, 0.0], k=3) == []
+        assert await index.index_record(1) is False
+
+    @pytest.mark.asyncio
+    async def test_filtered_search_behind_shared_hnsw_index_fills_k(self, monkeypatch):
+        """Test that a small filtered collection still returns k rows when the index is mostly other rows."""
+        monkeypatch.setattr(vectorstore.settings, "PGVECTOR_EF_SEARCH", 0)
+        monkeypatch.setattr(vectorstore.settings, "PGVECTOR_PROBES", 0)
+        store = SharedHNSWStore()
+        for ticket_id in range(1, 11):
+            store.add_ticket(ticket_id, category_id=ticket_id % 2)
+        index = TicketIndex("tickets", id_prefix="ticket", store=store, embedder=FakeEmbedder())
+
+        matches = await index.search([0.1], k=5, filter={"category_id": 1})
+
+        assert [m["id"] for m in matches] == [1, 3, 5, 7, 9]
@@ -0,0 +1,110 @@
+"""
+Tests for CPU-only reranking.
+Uses the lexical scorer (no model weights needed) and fake scorers.
+"""
+import pytest
+from langchain_core.documents import Document
+
+from app.services.reranker import LexicalScorer, Reranker
+from tests.test_hybrid_retriever import FakeRetriever
+
+
+class CountingScorer:
+    """Scores by passage length and records the size of each batch."""
+
+    name = "counting"
+
+    def __init__(self):
+        self.batches = []
+
+    def score_batch(self, query, passages):
+        self.batches.append(len(passages))
+        return [float(len(p)) for p in passages]
+
+
+class TestLexicalScorer:
+    """Test the weight-free fallback scorer."""
+
+    def test_relevant_passage_scores_higher(self):
+        """Test that term overlap and phrase order raise the score."""
+        scorer = LexicalScorer(avg_length=20)
+        query = "reset vpn password"
+        relevant = scorer.score(query, "To reset the VPN password open the self-service portal.")
+        partial = scorer.score(query, "The VPN client needs version 5 or later.")
+        unrelated = scorer.score(query, "Printer drivers are installed from the software center.")
+
+        assert relevant > partial > unrelated == 0.0
+
+    def test_stopword_only_query(self):
+        """Test that a query without content words scores zero."""
+        assert LexicalScorer().score("how do I", "How do I reset my password") == 0.0
+
+
+class TestReranker:
+    """Test batching, caching and top-n selection."""
+
+    @pytest.mark.asyncio
+    async def test_batches_and_cache(self):
+        """Test that misses are scored in batches and repeats come from the cache."""
+        scorer = CountingScorer()
+        reranker = Reranker(scorer=scorer, batch_size=4, workers=2)
+        passages = [f"passage {'x' * i}" for i in range(10)]
+
+        first = await reranker.rerank("query", passages, top_n=3)
+        second = await reranker.rerank("query", passages, top_n=3)
+
+        assert sorted(scorer.batches) == [2, 4, 4]
+        assert first == second
+        assert [i for i, _ in first] == [9, 8, 7]
+        assert reranker.cache_stats()["hit_rate"] == 0.5
+
+    @pytest.mark.asyncio
+    async def test_cache_is_bounded(self):
+        """Test that the score cache evicts the oldest pairs."""
+        reranker = Reranker(scorer=CountingScorer(), cache_size=5)
+        await reranker.score("query", [str(i) for i in range(8)])
+        assert reranker.cache_stats()["entries"] == 5
+
+
+class ManyDocumentsRetriever(FakeRetriever):
+    """Vector leg returning ten chunks; only c7 mentions the query."""
+
+    async def search_documents(self, query_vector, limit, search_params=None, filter=None):
+        self.document_limit = limit
+        docs = [
+            (Document(id=f"c{i}", page_content=f"unrelated chunk number {i}", metadata={"doc_id": i}), 0.1 * i)
+            for i in range(10)
+        ]
+        docs[7] = (Document(id="c7", page_content="reset password via the portal", metadata={"doc_id": 7}), 0.7)
+        return docs
+
+
+class TestRetrieverRerank:
+    """Test the rerank stage inside hybrid retrieval."""
+
+    @pytest.mark.asyncio
+    async def test_rerank_overfetches_and_keeps_top_k(self):
+        """Test that the reranker sees extra candidates and picks the relevant one."""
+        reranker = Reranker(scorer=LexicalScorer())
+        reranker.enabled = True
+        reranker.candidates = 50
+        retriever = ManyDocumentsRetriever(reranker=reranker)
+
+        result = await retriever.retrieve("reset password", [0.1], k=3)
+
+        assert retriever.document_limit == 50
+        assert result["documents"][0][0].id == "c7"
+        assert len(result["documents"]) == len(result["document_scores"]) == 3
+        assert result["stages"]["rerank"] == {"status": "ok", "count": 10, "ms": result["stages"]["rerank"]["ms"]}
+
+    @pytest.mark.asyncio
+    async def test_disabled_rerank_keeps_fused_order(self):
+        """Test that without reranking the first k fused documents are kept."""
+        reranker = Reranker(scorer=LexicalScorer())
+        reranker.enabled = False
+        retriever = ManyDocumentsRetriever(reranker=reranker)
+
+        result = await retriever.retrieve("reset password", [0.1], k=3)
+
+        assert [doc.id for doc, _ in result["documents"]] == ["c0", "c1", "c2"]
+        assert "rerank" not in result["stages"]
@@ -0,0 +1,153 @@
+"""
+Tests for SSE streaming of enhanced RAG answers.
+Tests the event sequence and that middleware passes the stream through.
+"""
+import asyncio
+import gzip
+import json
+import pytest
+import threading
+from types import SimpleNamespace
+from langchain_core.documents import Document
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from app.middleware.compression import StreamingGZipMiddleware
+from app.middleware.logging import LoggingMiddleware
+from app.services import enhanced_rag
+from app.services.answer_cache import SemanticAnswerCache
+
+
+async def call_asgi(app, path):
+    """Run one GET request through an ASGI app and collect the sent messages."""
+    messages = []
+    scope = {
+        "type": "http", "method": "GET", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "", "scheme": "http", "http_version": "1.1",
+        "headers": [(b"accept-encoding", b"gzip")], "client": ("test", 1), "server": ("test", 80)
+    }
+
+    async def receive():
+        await asyncio.sleep(1)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages
+
+
+def build_app():
+    async def events(request):
+        async def stream():
+            for i in range(3):
+                yield f"event: token\ndata: {i}\n\n"
+                await asyncio.sleep(0.01)
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    async def large(request):
+        return JSONResponse({"text": "x" * 5000})
+
+    app = Starlette(routes=[Route("/events", events), Route("/large", large)])
+    app.add_middleware(StreamingGZipMiddleware, minimum_size=10)
+    app.add_middleware(LoggingMiddleware)
+    return app
+
+
+class TestMiddlewarePassthrough:
+    """Test that GZip and logging middleware do not buffer SSE."""
+
+    @pytest.mark.asyncio
+    async def test_event_stream_is_not_compressed(self):
+        """Test that each SSE frame reaches the client as its own body message."""
+        messages = await call_asgi(build_app(), "/events")
+        start = messages[0]
+        headers = dict(start["headers"])
+        bodies = [m["body"] for m in messages[1:] if m.get("body")]
+
+        assert b"content-encoding" not in headers
+        assert len(bodies) == 3
+        assert bodies[0] == b"event: token\ndata: 0\n\n"
+
+    @pytest.mark.asyncio
+    async def test_other_responses_still_compressed(self):
+        """Test that regular JSON responses keep gzip compression."""
+        messages = await call_asgi(build_app(), "/large")
+        headers = dict(messages[0]["headers"])
+        body = b"".join(m.get("body", b"") for m in messages[1:])
+
+        assert headers[b"content-encoding"] == b"gzip"
+        assert json.loads(gzip.decompress(body))["text"] == "x" * 5000
+
+
+class FakeStreamingModel:
+    """Gemini stand-in that streams a fixed answer in chunks."""
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        assert stream
+        return iter([SimpleNamespace(text="Open the "), SimpleNamespace(text="password portal.")])
+
+
+@pytest.fixture
+def streaming_service(monkeypatch):
+    """The global service with fake model, embeddings and retrieval."""
+    service = enhanced_rag.enhanced_rag_service
+    cache = SemanticAnswerCache()
+    cache.enabled = False
+
+    async def fake_embed_query(query):
+        return {"vector": [0.1, 0.2], "cache": "miss", "ms": 1.0}
+
+    async def fake_retrieve(query, query_vector, include_tickets=True, include_kb=True, k=5, search_params=None, filters=None):
+        return {
+            "documents": [(Document(page_content="Reset via portal", metadata={"doc_id": 1}), 0.1)],
+            "document_scores": [0.016],
+            "tickets": [],
+            "kb_articles": [{"id": 3, "title": "Password Reset", "summary": "Use the portal"}],
+            "suggested_categories": [],
+            "ranking": [],
+            "stages": {"vector": {"status": "ok", "count": 1, "ms": 2.0}},
+            "degraded": []
+        }
+
+    monkeypatch.setattr(service, "model", FakeStreamingModel())
+    monkeypatch.setattr(enhanced_rag, "vectordb", object())
+    monkeypatch.setattr(enhanced_rag, "qa_chain", object())
+    monkeypatch.setattr(enhanced_rag, "answer_cache", cache)
+    monkeypatch.setattr(enhanced_rag.embedding_service, "embed_query", fake_embed_query)
+    monkeypatch.setattr(enhanced_rag.hybrid_retriever, "retrieve", fake_retrieve)
+    return service
+
+
+class TestStreamWithContext:
+    """Test the streamed event sequence."""
+
+    @pytest.mark.asyncio
+    async def test_sources_then_tokens_then_done(self, streaming_service):
+        """Test that sources arrive before any token and done closes the stream."""
+        events = [e async for e in streaming_service.stream_with_context("reset password")]
+
+        assert [e["event"] for e in events] == ["sources", "token", "token", "done"]
+        assert events[0]["data"]["sources"]["kb_articles"][0]["title"] == "Password Reset"
+        assert "".join(e["data"]["text"] for e in events if e["event"] == "token") == "Open the password portal."
+        assert events[-1]["data"]["timings"]["first_token_ms"] > 0
+        assert events[-1]["data"]["context_packing"]["packed_tokens"] > 0
+
+    @pytest.mark.asyncio
+    async def test_fallback_chain_runs_on_vector_executor(self, streaming_service, monkeypatch):
+        """Test that the basic RAG fallback shares the bounded vector executor."""
+        threads = []
+
+        def invoke(inputs):
+            threads.append(threading.current_thread().name)
+            return {"result": "Use the portal."}
+
+        monkeypatch.setattr(streaming_service, "model", None)
+        monkeypatch.setattr(enhanced_rag, "qa_chain", SimpleNamespace(invoke=invoke))
+
+        events = [e async for e in streaming_service.stream_with_context("reset password")]
+
+        assert [e["data"]["text"] for e in events if e["event"] == "token"] == ["Use the portal."]
+        assert threads[0].startswith("vector-search")
@@ -0,0 +1,125 @@
+"""
+Tests for batched, cached ticket resolution cards.
+The session and Redis helpers are replaced with fakes, so no database or
+Redis is needed.
+"""
+import pytest
+from types import SimpleNamespace
+
+from app.services import ticket_cards as ticket_cards_module
+from app.services.ticket_cards import TicketCardLoader
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.rows
+
+
+class FakeSession:
+    """Returns steps for the first query and root causes for the second."""
+
+    def __init__(self):
+        self.statements = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        if len(self.statements) == 1:
+            return FakeResult([
+                SimpleNamespace(ticket_id=7, step_order=1, instructions="Unlock account", success_flag=True),
+                SimpleNamespace(ticket_id=7, step_order=2, instructions="Reset password", success_flag=True),
+                SimpleNamespace(ticket_id=9, step_order=1, instructions="Reinstall VPN", success_flag=False)
+            ])
+        return FakeResult([
+            SimpleNamespace(ticket_id=7, cause_code="AD-01", description="Expired password"),
+            SimpleNamespace(ticket_id=9, cause_code="NET-04", description=None)
+        ])
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """Dict-backed replacements for the Redis helpers."""
+    store = {}
+
+    async def fake_get_many(keys):
+        return [store.get(key) for key in keys]
+
+    async def fake_set_many(items, ttl=300):
+        store.update(items)
+        return True
+
+    async def fake_delete(key):
+        store.pop(key, None)
+        return True
+
+    monkeypatch.setattr(ticket_cards_module, "cache_get_many", fake_get_many)
+    monkeypatch.setattr(ticket_cards_module, "cache_set_many", fake_set_many)
+    monkeypatch.setattr(ticket_cards_module, "cache_delete", fake_delete)
+    return store
+
+
+class TestTicketCardLoader:
+    """Test batching and caching of resolution cards."""
+
+    @pytest.mark.asyncio
+    async def test_cards_load_with_two_queries(self, fake_redis):
+        """Test that steps and causes for every ticket come from two queries."""
+        sessions = []
+
+        def session_factory():
+            sessions.append(FakeSession())
+            return sessions[-1]
+
+        loader = TicketCardLoader(session_factory=session_factory)
+        cards = await loader.get_cards([7, 9, 11])
+
+        assert len(sessions) == 1 and len(sessions[0].statements) == 2
+        assert [s["instructions"] for s in cards[7]["resolution_steps"]] == ["Unlock account", "Reset password"]
+        assert cards[7]["root_cause"]["description"] == "Expired password"
+        assert cards[9]["root_cause"]["description"] == "NET-04"
+        assert cards[11] == {"root_cause": None, "resolution_steps": []}
+
+    @pytest.mark.asyncio
+    async def test_repeat_hits_skip_the_database(self, fake_redis):
+        """Test that cached cards are served without opening a session."""
+        sessions = []
+
+        def session_factory():
+            sessions.append(FakeSession())
+            return sessions[-1]
+
+        loader = TicketCardLoader(session_factory=session_factory)
+        await loader.get_cards([7, 9])
+        cards = await loader.get_cards([7, 9])
+
+        assert len(sessions) == 1
+        assert cards[9]["resolution_steps"][0]["instructions"] == "Reinstall VPN"
+        assert loader.cache_stats()["hit_rate"] == 0.5
+
+    @pytest.mark.asyncio
+    async def test_invalidate_reloads(self, fake_redis):
+        """Test that an invalidated card is loaded again."""
+        sessions = []
+
+        def session_factory():
+            sessions.append(FakeSession())
+            return sessions[-1]
+
+        loader = TicketCardLoader(session_factory=session_factory)
+        await loader.get_cards([7, 9])
+        await loader.invalidate(7)
+        await loader.invalidate(9)
+        await loader.get_cards([7, 9])
+
+        assert len(sessions) == 2
@@ -0,0 +1,405 @@
+"""
+Tests for the PGVector ANN index builds and per-query search settings.
+SQL goes to a scripted fake connection, so no database is needed.
+"""
+import asyncio
+import pytest
+from types import SimpleNamespace
+from langchain_postgres import PGVector
+
+from app.config import settings
+from app.services import vectorstore
+from app.services.vector_index import (
+    BUILD_INDEX_NAME, INDEX_NAME, VectorIndexManager, index_expression, index_statement, ivfflat_lists
+)
+
+
+class FakeResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.value
+
+
+class FakeConnection:
+    """Answers the catalog queries of a build; records every statement."""
+
+    def __init__(self, column_type="vector", dimensions=(768,), rows=25000, locked=True):
+        self.column_type = column_type
+        self.dimensions = list(dimensions)
+        self.rows = rows
+        self.locked = locked
+        self.statements = []
+        self.closed = False
+
+    async def execution_options(self, **options):
+        self.options = options
+        return self
+
+    async def execute(self, statement, params=None):
+        sql = str(statement)
+        self.statements.append(sql)
+        if "pg_try_advisory_lock" in sql:
+            return FakeResult(self.locked)
+        if "format_type" in sql:
+            return FakeResult(self.column_type)
+        if "vector_dims" in sql:
+            return FakeResult(self.dimensions)
+        if "count(*)" in sql:
+            return FakeResult(self.rows)
+        return FakeResult(None)
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeEngine:
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def connect(self):
+        return self.conn
+
+
+async def build(manager, **options):
+    await manager.start_build(**options)
+    await manager._task
+    return manager.last_build
+
+
+class TestBuildOptions:
+    """Test defaults, validation and the generated DDL."""
+
+    def test_hnsw_validation(self):
+        """Test that ef_construction below 2 * m and unknown types are rejected."""
+        manager = VectorIndexManager(db_engine=FakeEngine(None))
+        assert manager.build_options(index_type="hnsw", m=8, ef_construction=16)["m"] == 8
+        with pytest.raises(ValueError):
+            manager.build_options(index_type="hnsw", m=32, ef_construction=40)
+        with pytest.raises(ValueError):
+            manager.build_options(index_type="diskann")
+
+    def test_ivfflat_lists(self):
+        """Test pgvector's list-count guideline on both sides of 1M rows."""
+        assert ivfflat_lists(500) == 1
+        assert ivfflat_lists(100_000) == 100
+        assert ivfflat_lists(4_000_000) == 2000
+
+    def test_index_statement(self):
+        """Test that the index uses the cosine operator class PGVector searches with."""
+        sql = index_statement(INDEX_NAME, {"index_type": "hnsw", "m": 16, "ef_construction": 64})
+        assert "USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)" in sql
+        assert sql.startswith("CREATE INDEX CONCURRENTLY")
+
+    def test_quantized_index_statement(self):
+        """Test that quantized builds index the halfvec / binary expression."""
+        options = {"index_type": "hnsw", "m": 16, "ef_construction": 64, "dimensions": 256}
+        sql = index_statement(INDEX_NAME, {**options, "quantization": "halfvec"})
+        assert "USING hnsw ((embedding::halfvec(256)) halfvec_cosine_ops)" in sql
+        sql = index_statement(INDEX_NAME, {**options, "quantization": "binary"})
+        assert "USING hnsw ((binary_quantize(embedding)::bit(256)) bit_hamming_ops)" in sql
+
+
+class TestVectorIndexManager:
+    """Test background builds against a fake connection."""
+
+    @pytest.mark.asyncio
+    async def test_rebuild_swaps_indexes(self):
+        """Test that the column gets a dimension, and the new index replaces the old one."""
+        conn = FakeConnection()
+        manager = VectorIndexManager(db_engine=FakeEngine(conn))
+
+        result = await build(manager, index_type="ivfflat")
+
+        assert result["status"] == "completed" and result["lists"] == 25 and result["dimensions"] == 768
+        assert conn.options == {"isolation_level": "AUTOCOMMIT"}
+        ddl = [s for s in conn.statements if not s.startswith("SELECT")]
+        assert ddl == [
+            "ALTER TABLE langchain_pg_embedding ALTER COLUMN embedding TYPE vector(768)",
+            f"DROP INDEX CONCURRENTLY IF EXISTS {BUILD_INDEX_NAME}",
+            index_statement(BUILD_INDEX_NAME, {"index_type": "ivfflat", "lists": 25}),
+            f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}",
+            f"ALTER INDEX {BUILD_INDEX_NAME} RENAME TO {INDEX_NAME}",
+        ]
+        assert "pg_advisory_unlock" in conn.statements[-1] and conn.closed
+
+    @pytest.mark.asyncio
+    async def test_mixed_dimensions_fail(self):
+        """Test that a table holding embeddings of several sizes is reported, not indexed."""
+        conn = FakeConnection(dimensions=(768, 1536))
+        manager = VectorIndexManager(db_engine=FakeEngine(conn))
+
+        result = await build(manager)
+
+        assert result["status"] == "failed" and "different dimensions" in result["error"]
+        assert not any("CREATE INDEX" in s for s in conn.statements) and conn.closed
+
+    @pytest.mark.asyncio
+    async def test_build_already_running(self):
+        """Test that a build held by another worker is refused."""
+        conn = FakeConnection(column_type="vector(768)", locked=False)
+        manager = VectorIndexManager(db_engine=FakeEngine(conn))
+
+        with pytest.raises(RuntimeError):
+            await manager.start_build()
+        assert conn.closed and manager.last_build is None
+
+    @pytest.mark.asyncio
+    async def test_truncation_needs_confirmation(self, monkeypatch):
+        """Test that cutting stored vectors to EMBEDDING_DIMENSIONS requires truncate."""
+        monkeypatch.setattr(settings, "EMBEDDING_DIMENSIONS", 256)
+        conn = FakeConnection(column_type="vector(768)")
+
+        result = await build(VectorIndexManager(db_engine=FakeEngine(conn)))
+
+        assert result["status"] == "failed" and "truncate=true" in result["error"]
+        assert not any(s.startswith(("ALTER", "CREATE")) for s in conn.statements)
+
+    @pytest.mark.asyncio
+    async def test_truncate_and_quantize(self, monkeypatch):
+        """Test that stored vectors are cut in place and the index is built quantized."""
+        monkeypatch.setattr(settings, "EMBEDDING_DIMENSIONS", 256)
+        monkeypatch.setattr(settings, "PGVECTOR_QUANTIZATION", "halfvec")
+        conn = FakeConnection(column_type="vector(768)")
+
+        result = await build(VectorIndexManager(db_engine=FakeEngine(conn)), truncate=True)
+
+        assert result["status"] == "completed" and result["dimensions"] == 256
+        assert (
+            "ALTER TABLE langchain_pg_embedding ALTER COLUMN embedding TYPE vector(256) "
+            "USING subvector(embedding, 1, 256)::vector(256)"
+        ) in conn.statements
+        assert any("(embedding::halfvec(256)) halfvec_cosine_ops" in s for s in conn.statements)
+
+    @pytest.mark.asyncio
+    async def test_dimensions_cannot_grow(self, monkeypatch):
+        """Test that EMBEDDING_DIMENSIONS above the stored size is refused."""
+        monkeypatch.setattr(settings, "EMBEDDING_DIMENSIONS", 1024)
+        conn = FakeConnection(column_type="vector(768)")
+
+        result = await build(VectorIndexManager(db_engine=FakeEngine(conn)), truncate=True)
+
+        assert result["status"] == "failed" and "re-ingest" in result["error"]
+
+
+class FakePGVector(PGVector):
+    """A PGVector that records the search settings in effect during a search."""
+
+    def __init__(self):
+        self.seen = []
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        self.seen.append(getattr(vectorstore._search_settings, "values", None))
+        return []
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.sql = []
+
+    def exec_driver_sql(self, sql):
+        self.sql.append(sql)
+
+
+class TestSearchSettings:
+    """Test per-query ef_search / probes."""
+
+    def test_pgvector_settings_applied_for_one_search(self, monkeypatch):
+        """Test that settings are SET LOCAL for the search only, and ef_search is at least k."""
+        monkeypatch.setattr(vectorstore.settings, "PGVECTOR_PROBES", 10)
+        store = FakePGVector()
+
+        vectorstore.similarity_search_with_params(store, [0.1], k=50, ef_search=20)
+
+        assert store.seen == [{"hnsw.ef_search": 50, "ivfflat.probes": 10}]
+        vectorstore._search_settings.values = store.seen[0]
+        conn = RecordingConnection()
+        vectorstore._apply_search_settings(None, None, conn)
+        assert conn.sql == ["SET LOCAL hnsw.ef_search = 50", "SET LOCAL ivfflat.probes = 10"]
+
+        vectorstore._search_settings.values = None
+        vectorstore._apply_search_settings(None, None, conn)
+        assert len(conn.sql) == 2
+
+    @pytest.mark.asyncio
+    async def test_settings_do_not_leak_between_threads(self, monkeypatch):
+        """Test that concurrent searches on the executor see only their own settings."""
+        monkeypatch.setattr(vectorstore.settings, "PGVECTOR_EF_SEARCH", 0)
+        monkeypatch.setattr(vectorstore.settings, "PGVECTOR_PROBES", 0)
+        store = FakePGVector()
+
+        await asyncio.gather(*[
+            vectorstore.run_in_vector_executor(vectorstore.similarity_search_with_params, store, [0.1], k=5, ef_search=ef)
+            for ef in (100, 200, None)
+        ])
+
+        assert sorted(store.seen, key=str) == sorted(
+            [{"hnsw.ef_search": 100}, {"hnsw.ef_search": 200}, {"hnsw.ef_search": 40}], key=str
+        )
+
+    def test_ef_search_covers_k_by_default(self, monkeypatch):
+        """Test that a search for more rows than pgvector's default ef_search raises it."""
+        monkeypatch.setattr(vectorstore.settings, "PGVECTOR_EF_SEARCH", 0)
+        monkeypatch.setattr(vectorstore.settings, "PGVECTOR_PROBES", 0)
+        store = FakePGVector()
+
+        vectorstore.similarity_search_with_params(store, [0.1], k=50)
+
+        assert store.seen == [{"hnsw.ef_search": 50}]
+
+    @pytest.mark.parametrize("version, expected", [("0.8.0", "strict_order"), ("0.7.4", None)])
+    def test_iterative_scan_on_pgvector_0_8(self, monkeypatch, version, expected):
+        """Test that hnsw.iterative_scan is set only when the server supports it, checked once."""
+        monkeypatch.setattr(vectorstore.settings, "PGVECTOR_PROBES", 0)
+        queries = []
+
+        class VersionSession:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, statement):
+                queries.append(str(statement))
+                return SimpleNamespace(scalar=lambda: version)
+
+        seen = []
+        monkeypatch.setattr(
+            vectorstore.IndexedFilterPGVector, "similarity_search_with_score_by_vector",
+            lambda self, embedding, k=4, filter=None: seen.append(vectorstore._search_settings.values) or []
+        )
+        store = vectorstore.IndexedFilterPGVector.__new__(vectorstore.IndexedFilterPGVector)
+        store.quantization, store.iterative_scan, store._iterative_scan_supported = "none", "strict_order", None
+        store._make_sync_session = VersionSession
+
+        for _ in range(2):
+            vectorstore.similarity_search_with_params(store, [0.1], k=5, filter={"file_type": "pdf"})
+
+        assert len(queries) == 1 and "pg_extension" in queries[0]
+        assert seen[-1].get("hnsw.iterative_scan") == expected
+        if expected:
+            vectorstore._search_settings.values = seen[-1]
+            conn = RecordingConnection()
+            vectorstore._apply_search_settings(None, None, conn)
+            vectorstore._search_settings.values = None
+            assert "SET LOCAL hnsw.iterative_scan = strict_order" in conn.sql
+
+    def test_unknown_iterative_scan_rejected(self):
+        """Test that a mistyped PGVECTOR_ITERATIVE_SCAN fails at construction."""
+        with pytest.raises(ValueError):
+            vectorstore.IndexedFilterPGVector(embeddings=None, iterative_scan="ordered")
+
+    def test_local_index_uses_probes_as_nprobe(self):
+        """Test that the local backend maps probes onto its IVF nprobe."""
+        calls = []
+
+        class LocalStore:
+            def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, nprobe=None):
+                calls.append(nprobe)
+                return []
+
+        vectorstore.similarity_search_with_params(LocalStore(), [0.1], k=5, probes=32)
+        assert calls == [32]
+
+
+class TestMetadataFilterPushdown:
+    """Test that metadata filters compile to GIN-indexable JSONB containment."""
+
+    @staticmethod
+    def compile(filter):
+        from langchain_postgres.vectorstores import _get_embedding_collection_store
+        from sqlalchemy.dialects import postgresql
+
+        store = vectorstore.IndexedFilterPGVector.__new__(vectorstore.IndexedFilterPGVector)
+        store.EmbeddingStore, _ = _get_embedding_collection_store()
+        store.use_jsonb = True
+        compiled = store._create_filter_clause(filter).compile(dialect=postgresql.dialect())
+        return str(compiled), list(compiled.params.values())
+
+    def test_eq_in_and_contains_use_containment(self):
+        """Test that $eq, $in and $contains become cmetadata @> conditions."""
+        sql, params = self.compile({"$and": [
+            {"file_type": {"$eq": "pdf"}},
+            {"$or": [{"doc_id": {"$in": [4, 5]}}, {"references": {"$contains": [{"doc_id": 4}]}}]}
+        ]})
+        assert sql.count("cmetadata @>") == 4 and "jsonb_path_match" not in sql
+        assert params == [{"file_type": "pdf"}, {"doc_id": 4}, {"doc_id": 5}, {"references": [{"doc_id": 4}]}]
+
+    def test_other_operators_unchanged(self):
+        """Test that range operators still use PGVector's own translation."""
+        sql, _ = self.compile({"page": {"$gt": 3}})
+        assert "jsonb_path_match" in sql
+
+
+class TestQuantizedStorage:
+    """Test dimension truncation and quantized search with exact rescoring."""
+
+    @staticmethod
+    def store(quantization="none", dimensions=0, rescore_factor=4):
+        from langchain_postgres.vectorstores import _get_embedding_collection_store
+
+        store = vectorstore.IndexedFilterPGVector.__new__(vectorstore.IndexedFilterPGVector)
+        store.EmbeddingStore, _ = _get_embedding_collection_store()
+        store.quantization, store.dimensions, store.rescore_factor = quantization, dimensions, rescore_factor
+        store.iterative_scan = "off"
+        return store
+
+    def test_truncate_embedding(self):
+        """Test that only the leading dimensions are kept, and 0 keeps all."""
+        assert vectorstore.truncate_embedding([0.1, 0.2, 0.3], 2) == [0.1, 0.2]
+        assert vectorstore.truncate_embedding([0.1, 0.2, 0.3], 0) == [0.1, 0.2, 0.3]
+
+    def test_writes_and_queries_are_truncated(self, monkeypatch):
+        """Test that stored and query vectors are cut to the same dimensions."""
+        seen = []
+        monkeypatch.setattr(PGVector, "add_embeddings", lambda self, texts, embeddings, **kw: seen.append(embeddings))
+        monkeypatch.setattr(
+            PGVector, "similarity_search_with_score_by_vector",
+            lambda self, embedding, k=4, filter=None: seen.append(embedding) or []
+        )
+        store = self.store(dimensions=2)
+
+        store.add_embeddings(["a"], [[0.1, 0.2, 0.3]], metadatas=[{}])
+        store.similarity_search_with_score_by_vector([0.4, 0.5, 0.6], k=3)
+
+        assert seen == [[[0.1, 0.2]], [0.4, 0.5]]
+
+    @pytest.mark.parametrize("quantization", ["halfvec", "binary"])
+    def test_search_orders_by_indexed_expression(self, quantization):
+        """Test that the candidate ORDER BY is the expression the index is built on."""
+        from sqlalchemy.dialects import postgresql
+
+        store = self.store(quantization)
+        sql = str(store._quantized_distance([0.1] * 256).compile(dialect=postgresql.dialect()))
+        if quantization == "halfvec":
+            assert sql.startswith("CAST(langchain_pg_embedding.embedding AS HALFVEC(256)) <=>")
+            assert "embedding::halfvec(256)" in index_expression(quantization, 256)
+        else:
+            assert sql.startswith("CAST(binary_quantize(langchain_pg_embedding.embedding) AS BIT(256)) <~>")
+            assert "binary_quantize(embedding)::bit(256)" in index_expression(quantization, 256)
+
+    def test_ef_search_covers_rescore_candidates(self, monkeypatch):
+        """Test that HNSW is asked for every candidate that will be rescored."""
+        seen = []
+        store = self.store("binary", rescore_factor=10)
+        monkeypatch.setattr(
+            vectorstore.IndexedFilterPGVector, "similarity_search_with_score_by_vector",
+            lambda self, embedding, k=4, filter=None: seen.append(vectorstore._search_settings.values) or []
+        )
+
+        vectorstore.similarity_search_with_params(store, [0.1], k=5, ef_search=40)
+
+        assert seen == [{"hnsw.ef_search": 50}]
+
+    def test_unknown_quantization_rejected(self):
+        """Test that a mistyped PGVECTOR_QUANTIZATION fails at construction."""
+        with pytest.raises(ValueError):
+            vectorstore.IndexedFilterPGVector(embeddings=None, quantization="int8")